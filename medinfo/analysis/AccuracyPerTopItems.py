@@ -11,6 +11,7 @@ import time;
 import json;
 from optparse import OptionParser
 from cStringIO import StringIO;
+import numpy as np;
 import pylab;
 from medinfo.db.Model import columnFromModelList;
 from medinfo.common.Const import COMMENT_TAG, VALUE_DELIM;
@@ -31,24 +32,24 @@ class AccuracyPerTopItems(BaseAnalysis):
 
     def __call__(self, inputFile, colOutcome, metricsByScoreCol, maxItems):
         scoreCols = metricsByScoreCol.keys();
-        scoreModels = self.parseScoreModelsFromFile(inputFile, colOutcome, scoreCols);
+        (outcomes, scoresById) = self.parseScoreColumns(inputFile, colOutcome=colOutcome, colScore=str.join(VALUE_DELIM, scoreCols));
         
         # Count up total number of items and positive outcomes
-        nPositive = sum([scoreModel[colOutcome] for scoreModel in scoreModels]);    # Assumes outcome labels are 0 and 1 for negative and positive, respectively
-        nItems = len(scoreModels);
+        nPositive = int(np.sum(outcomes));    # Assumes outcome labels are 0 and 1 for negative and positive, respectively
+        nItems = len(outcomes);
         
         # Prepare result dictionaries to populate
         resultDicts = [{"ItemsConsidered": i+1} for i in xrange(maxItems)];
         
         for colScore in scoreCols:
-            # Sort by each score column in descending order
-            scoreModels.sort(key=lambda model: model[colScore], reverse=True);
+            # Sort by each score column in descending order (stable, so ties stay in file order)
+            iSorted = np.argsort(-scoresById[colScore], kind="mergesort");
+            topOutcomes = outcomes[iSorted[:maxItems]];
             
             nPositiveFound = 0;
             for i in xrange(maxItems):
                 nConsidered = i+1;
-                scoreModel = scoreModels[i];
-                if scoreModel[colOutcome] == OUTCOME_PRESENT:
+                if topOutcomes[i] == OUTCOME_PRESENT:
                     nPositiveFound += 1;
                 
                 # Should be able to derive various (accuracy) statistics of interest based on these counts
@@ -156,6 +157,7 @@ class AccuracyPerTopItems(BaseAnalysis):
         parser.add_option("-c", "--cycleLineStyle",  dest="cycleLineStyle",  action="store_true", help="If set, will reuse colors, but vary line-styles for multiple plots.  Default is cycle through colors only.");
         parser.add_option("-m", "--maxItems",  dest="maxItems",  help="If set, maximum number of top items to consider in the accuracy plots");
         parser.add_option("-o", "--colOutcome",  dest="colOutcome", help="Name of column to look for outcome values.");
+        parser.add_option("--cacheColumns",  dest="cacheColumns", action="store_true",  help="If set, will cache the parsed score columns next to the input file, so repeated analyses of the same file can skip parsing the text.");
         parser.add_option("-x", "--axes",  dest="axes", help="Comma-separated list of colon-separated metrics to plot.  For example, recall:score1,precision:score2 will plot recall vs. top items scored by score 1 and precision vs. top items scored by score2.");
 
         (options, args) = parser.parse_args(argv[1:])
@@ -169,6 +171,7 @@ class AccuracyPerTopItems(BaseAnalysis):
             inputFile = stdOpen(inputFilename);
 
             maxItems = int(options.maxItems);
+            self.scoreFileReader.cacheColumns = options.cacheColumns;
             
             # Parse out the metrics to plot and score columns to sort by
             metricsByScoreCol = dict();
@@ -9,6 +9,7 @@ from optparse import OptionParser
 from cStringIO import StringIO;
 from math import sqrt;
 from datetime import timedelta;
+import numpy as np;
 
 from medinfo.common.Const import COMMENT_TAG, VALUE_DELIM;
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -21,12 +22,36 @@ from Util import log;
 from Const import OUTCOME_ABSENT, OUTCOME_PRESENT, OUTCOME_IN_QUERY;
 from Const import NEGATIVE_OUTCOME_STRS;
 
+from ScoreFileReader import ScoreFileReader, OUTCOME_COLUMN, FLOAT_COLUMN;
+
+# Score column derived from the P-Fisher and OR columns when not included in the file directly
+DERIVED_P_FISHER_NEG_LOG = "P-Fisher-NegLog";
+DERIVED_P_FISHER_SOURCE_HEADERS = ("P-Fisher", "OR");
+
+def pFisherNegLog(pFisher, oddsRatio):
+    """Signed log of Fisher exact test P-values, same as the "P-Fisher-NegLog" of StatsUtil.ContingencyStats.
+    Negative log10(p) where the odds ratio > 1, otherwise log10(p), so sorting in descending order brings
+    the most significant positive associations to the top.  P-values of 0 map to the max float magnitude.
+    Accepts scalars or arrays.
+    """
+    pFisher = np.asarray(pFisher, dtype=float);
+    oddsRatio = np.asarray(oddsRatio, dtype=float);
+    logP = np.where(pFisher > 0.0, np.log10(np.where(pFisher > 0.0, pFisher, 1.0)), -sys.float_info.max);
+    return np.where(oddsRatio > 1.0, -logP, logP);
+
+def checkDerivedPFisherSource(headers):
+    """Raise a ValueError if the columns needed to derive P-Fisher-NegLog are missing"""
+    missingHeaders = [header for header in DERIVED_P_FISHER_SOURCE_HEADERS if header not in headers];
+    if len(missingHeaders) > 0:
+        raise ValueError("No %s column, and cannot derive it without column(s): %s" % (DERIVED_P_FISHER_NEG_LOG, str.join(", ", missingHeaders)) );
 
 class BaseAnalysis:
     connFactory = None;
+    scoreFileReader = None;
 
     def __init__(self):
         self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
+        self.scoreFileReader = ScoreFileReader();   # Set cacheColumns to reuse parsed score columns across analyses
 
     def parseScoreFile(self, inputFile, delim=None, colOutcome=None, colScore=None):
         """Parse the contents of the give input file
@@ -34,60 +59,59 @@ class BaseAnalysis:
         Expect (1st) column represents an outcome label (see NEGATIVE_OUTCOME_STRS) for acceptable labels.
         Expect (2nd) column represents a (list of) numerical score(s) to predict the outcome.
            If above provided as strings instead of column index numbers, then will interpret as header columns
+        Returns lists of values.  See parseScoreColumns for NumPy arrays instead.
+        """
+        (outcomes, scoresById) = self.parseScoreColumns(inputFile, delim, colOutcome, colScore);
+        outcomes = outcomes.tolist();
+        for scoreId, scores in scoresById.items():
+            scoresById[scoreId] = scores.tolist();
+        return (outcomes, scoresById);
+
+    def parseScoreColumns(self, inputFile, delim=None, colOutcome=None, colScore=None):
+        """Columnar variant of parseScoreFile.  Only parses the outcome and score columns,
+        returning an array of outcome values and a dictionary keyed by score column names
+        with values equal to matching arrays of scores.
+        """
+        reader = self.scoreFileReader;
+        if delim is not None and delim != reader.delim:
+            reader = ScoreFileReader(delim, reader.chunkSize, reader.cacheColumns);
+        headers = reader.readHeader(inputFile);
+        (outcomeHeader, scoreHeaders) = self.resolveScoreColumns(headers, colOutcome, colScore);
+
+        typeByHeader = dict();
+        for scoreHeader in scoreHeaders:
+            if scoreHeader in headers:
+                typeByHeader[scoreHeader] = FLOAT_COLUMN;
+            else:   # Derived P-Fisher-NegLog
+                checkDerivedPFisherSource(headers);
+                for sourceHeader in DERIVED_P_FISHER_SOURCE_HEADERS:
+                    typeByHeader[sourceHeader] = FLOAT_COLUMN;
+        typeByHeader[outcomeHeader] = OUTCOME_COLUMN;
+        columns = reader.readColumns(inputFile, headers, typeByHeader);
+
+        scoresById = dict();
+        for scoreHeader in scoreHeaders:
+            if scoreHeader in headers:
+                scoresById[scoreHeader] = columns[scoreHeader];
+            else:
+                scoresById[scoreHeader] = pFisherNegLog(columns["P-Fisher"], columns["OR"]);
+        return (columns[outcomeHeader], scoresById);
+
+    def resolveScoreColumns(self, headers, colOutcome=None, colScore=None):
+        """Translate the outcome column and (comma-separated list of) score columns,
+        specified by header names or indexes, into header names.
+        Default to first and second columns.
         """
-        if delim is None:   delim = '\t';   # Default to tab-delimited
-
-        headerLine = None;
-        for line in inputFile:
-            line = line.strip();
-            if not line.startswith(COMMENT_TAG):   # Ignore comment lines
-                headerLine = line;
-                break;
-        # Parse out the header line columns
-        headers = headerLine.split(delim);
-        iColByHeader = dict();
-        for iCol, header in enumerate(headers):
-            iColByHeader[header] = iCol;
-
-        # Default to first and second columns
         if colOutcome is None:  colOutcome = headers[0];
         if colScore is None:    colScore = headers[1];
-
-        # Translate column headers into indexes or names as needed
-        iColOutcome = None;
-        if colOutcome in iColByHeader:
-            iColOutcome = iColByHeader[colOutcome];
-        else:   # Otherwise assume a numerical index
-            iColOutcome = int(colOutcome);
-        
-        iColScoreList = list();
+        outcomeHeader = self.scoreFileReader.resolveColumn(headers, colOutcome);
+        scoreHeaders = list();
         for colScoreValue in colScore.split(VALUE_DELIM):
-            if colScoreValue in iColByHeader:
-                iColScoreList.append(iColByHeader[colScoreValue]);
-            else:   # Otherwise assume a numerical index
-                iColScoreList.append(int(colScoreValue));
-        
-        # Accumulating data into list of outcome values, then a dictionary keyed by score column names and values equal to matching lists of scores
-        outcomes = list();
-        scoresById = dict();
-        for iColScore in iColScoreList:
-            scoreHeader = headers[iColScore];
-            scoresById[scoreHeader] = list();
-        for line in inputFile:
-            line = line.strip();
-            if not line.startswith(COMMENT_TAG):   # Ignore comment lines
-                # General data line
-                chunks = line.split(delim);
-                outcome = OUTCOME_PRESENT;
-                if chunks[iColOutcome] in NEGATIVE_OUTCOME_STRS:
-                    outcome = OUTCOME_ABSENT;    # Assume all other strings represent a positive outcome
-                outcomes.append(outcome);
-                
-                for iColScore in iColScoreList:
-                    scoreHeader = headers[iColScore];
-                    score = float(chunks[iColScore]);
-                    scoresById[scoreHeader].append(score);
-        return (outcomes, scoresById);
+            if colScoreValue == DERIVED_P_FISHER_NEG_LOG and colScoreValue not in headers:
+                scoreHeaders.append(colScoreValue);
+            else:
+                scoreHeaders.append(self.scoreFileReader.resolveColumn(headers, colScoreValue));
+        return (outcomeHeader, scoreHeaders);
 
     def parseScoreModelsFromFile(self, inputFile, colOutcome=None, scoreCols=None):
         """Structured variant of above.  Assume named columns and just return combined dictionary / RowItemModels
@@ -103,16 +127,10 @@ class BaseAnalysis:
 
 
 
-            # Temporary hack to get P-Fisher-NegLog into dataset
-            import math;
-            if scoreCols is not None and "P-Fisher-NegLog" in scoreCols:
-                p = float(scoreModel["P-Fisher"]);
-                logP = -sys.float_info.max;
-                if p > 0.0:
-                    logP = math.log(p,10);
-                if scoreModel["OR"] > 1.0:
-                    logP *= -1;
-                scoreModel["P-Fisher-NegLog"] = logP;
+            # Derive P-Fisher-NegLog if not already in the dataset
+            if scoreCols is not None and DERIVED_P_FISHER_NEG_LOG in scoreCols and DERIVED_P_FISHER_NEG_LOG not in scoreModel:
+                checkDerivedPFisherSource(scoreModel);
+                scoreModel[DERIVED_P_FISHER_NEG_LOG] = float(pFisherNegLog(scoreModel["P-Fisher"], scoreModel["OR"]));
 
             if scoreCols is not None:
                 for colScore in scoreCols:
@@ -12,6 +12,7 @@ import time;
 from optparse import OptionParser
 from cStringIO import StringIO;
 import json;
+import numpy as np;
 from scipy.stats import chi2;
 from medinfo.db.Model import columnFromModelList;
 from medinfo.common.Const import COMMENT_TAG;
@@ -30,7 +31,7 @@ class CalibrationPlot(BaseAnalysis):
         return ("scoreMin","scoreMax", "totalInstances","observedOutcomes", "predictedOutcomes", "observedRate", "predictedRate");
 
     def __call__(self, inputFile, nBins, colScore=None):
-        (outcomes, scoresById) = self.parseScoreFile(inputFile);
+        (outcomes, scoresById) = self.parseScoreColumns(inputFile);
         if colScore is None:
             colScore = scoresById.keys()[0];    # Arbitrarily select the first score column found
         scores = scoresById[colScore];
@@ -49,7 +50,7 @@ class CalibrationPlot(BaseAnalysis):
         """
         results = [];
         
-        data = [(score,outcome) for (outcome, score) in zip(outcomes,scores)];  # Repackage into single list of 2-ples to facilitate sorting
+        data = zip(np.asarray(scores).tolist(), np.asarray(outcomes).tolist());  # Repackage into single list of 2-ples to facilitate sorting
 
         data.sort();
         nData = len(data);
@@ -154,6 +155,7 @@ class CalibrationPlot(BaseAnalysis):
         parser = OptionParser(usage=usageStr)
         parser.add_option("-b", "--bins",  dest="nBins",  default=10,    help="Number of bins to separate scores into, defaults to deciles (10)");
         parser.add_option("-f", "--figure",  dest="figure",  help="If set, will also try to auto-generate an example figure and store to a file here");
+        parser.add_option("--cacheColumns",  dest="cacheColumns", action="store_true",  help="If set, will cache the parsed score columns next to the input file, so repeated analyses of the same file can skip parsing the text.");
 
         (options, args) = parser.parse_args(argv[1:])
 
@@ -162,6 +164,7 @@ class CalibrationPlot(BaseAnalysis):
         if len(args) > 1:
             inputFilename = args[0];
             inputFile = stdOpen(inputFilename);
+            self.scoreFileReader.cacheColumns = options.cacheColumns;
             
             # Run the actual analysis
             analysisResults = self(inputFile, int(options.nBins));
@@ -9,6 +9,8 @@ import os.path;
 import time;
 import math;
 import json;
+import tempfile;
+from array import array;
 from optparse import OptionParser
 from cStringIO import StringIO;
 import numpy as np;
@@ -23,9 +25,14 @@ from medinfo.db.Model import RowItemModel;
 from Util import log;
 
 from BaseAnalysis import BaseAnalysis;
+from ScoreFileReader import OUTCOME_COLUMN, FLOAT_COLUMN;
 
 CONFIDENCE_INTERVAL = 0.95;
 
+# Max number of examples to buffer in memory when streaming AUC components,
+#   before spilling a sorted run of counts by score to a temporary file
+MAX_STREAM_BUFFER_SIZE = 1000000;
+
 class ROCPlot(BaseAnalysis):
     """Convenience class to consolidate construction of Receiver Operating Characteristic
     data, figures, and summary statistics.
@@ -38,7 +45,7 @@ class ROCPlot(BaseAnalysis):
         self.logScores = False;
 
     def __call__(self, inputFile, colOutcome=None, colScore=None, options=None):
-        (outcomes, scoresById) = self.parseScoreFile(inputFile, colOutcome=colOutcome, colScore=colScore);
+        (outcomes, scoresById) = self.parseScoreColumns(inputFile, colOutcome=colOutcome, colScore=colScore);
         analysisResultsByScoreId = dict();
         summaryData = dict();
         for scoreId, scores in scoresById.iteritems():
@@ -139,23 +146,59 @@ class ROCPlot(BaseAnalysis):
         pChi2 = scipy.stats.chi_contingency(ct, correction=False)[1];   # 0.0648
         pYatesChi2 = scipy.stats.chi_contingency(ct, correction=True)[1];   # 0.0877
         pFisher = scipy.stats.fisher_exact(ct)[1];  # 0.0725
+
+        Rather than checking every negative x positive pair, sort the scores once and count
+        by rank (Mann-Whitney U statistic): each positive example is correct for every negative
+        example with a lower score, and half correct for every negative example with an equal score.
         """
-        pairsCorrect = 0.0;
-        pairsChecked = 0;
-        
-        for (outcome0,score0) in zip(outcomes,scores):
-            if outcome0 == 0:    # Negative example
-                for (outcome1,score1) in zip(outcomes,scores):
-                    if outcome1 != 0:   # Positive example
-                        pairsChecked += 1;
-                        if score1 > score0:
-                            pairsCorrect += 1;
-                        elif score1 == score0:
-                            pairsCorrect += 0.5;
-        
-        return (pairsCorrect, pairsChecked);
+        counts = countsByScore(outcomes, scores);
+        return aucComponentsFromCounts(counts["positiveCount"], counts["negativeCount"]);
     aucComponents = staticmethod(aucComponents);
 
+    def aucComponentsStream(outcomeScorePairs, maxBufferSize=None):
+        """Streaming variant of aucComponents for score data too large to hold in memory.
+        Takes any iterable of (outcome, score) pairs (e.g., a generator over the lines of a score file)
+        and returns the same (pairsCorrect, pairsChecked) tuple.
+        """
+        accumulator = AUCComponentsAccumulator(maxBufferSize);
+        for (outcome, score) in outcomeScorePairs:
+            accumulator.add(outcome, score);
+        return accumulator.components();
+    aucComponentsStream = staticmethod(aucComponentsStream);
+
+    def streamAUCSummary(self, inputFile, colOutcome=None, colScore=None, options=None):
+        """Single pass over the score file to calculate just the ROC AUC components for each score column,
+        without holding the scores in memory or generating the ROC curve points.
+        Returns summaryData in the same format as rocCurve (without bootstrap confidence intervals).
+        """
+        reader = self.scoreFileReader;
+        headers = reader.readHeader(inputFile);
+        (outcomeHeader, scoreHeaders) = self.resolveScoreColumns(headers, colOutcome, colScore);
+        typeByHeader = dict([(scoreHeader, FLOAT_COLUMN) for scoreHeader in scoreHeaders]);
+        typeByHeader[outcomeHeader] = OUTCOME_COLUMN;
+
+        accumulators = [AUCComponentsAccumulator() for scoreHeader in scoreHeaders];
+        for columns in reader.iterChunks(inputFile, headers, typeByHeader):
+            for accumulator, scoreHeader in zip(accumulators, scoreHeaders):
+                scores = columns[scoreHeader];
+                if self.logScores:
+                    scores = np.log(scores);
+                accumulator.addArrays(columns[outcomeHeader], scores);
+
+        summaryData = dict();
+        for scoreId, accumulator in zip(scoreHeaders, accumulators):
+            (pairsCorrect, pairsChecked) = accumulator.components();
+            cStat = float("nan");   # Undefined without both positive and negative examples
+            if pairsChecked > 0:
+                cStat = pairsCorrect / pairsChecked;
+            summaryData["%s.ROC-AUC" % scoreId] = cStat;
+            summaryData["%s.c-statistic" % scoreId] = cStat;
+            summaryData["%s.pairsCorrect" % scoreId] = pairsCorrect;
+            summaryData["%s.pairsChecked" % scoreId] = pairsChecked;
+        if options is not None:
+            self.addContingencyStatistics(summaryData, dict.fromkeys(scoreHeaders), options);
+        return summaryData;
+
     def aucScore(outcomes, scores):
         """Calculate ROC AUC score.  Use internal functions to remove library dependencies as necessary, 
         but much slower implementation.
@@ -277,6 +320,8 @@ class ROCPlot(BaseAnalysis):
         parser.add_option("-c", "--contingencyStats", dest="contingencyStats", help="Comma-separated list of contingency stat IDs (see medinfo.common.StatsUtil.ContingencyStats) to calculate for different scoring methods against the specified base scoring method.  For example, 'P-Fisher,P-YatesChi2'");
         parser.add_option("-l", "--logScores",  dest="logScores", action="store_true",  help="If set, will do analysis on the natural log / ln of the scores, which can help accomodate extremely large or small scores that disrupt result with loss of numerical precision");
         parser.add_option("-o", "--colOutcome",  dest="colOutcome", help="Index of column to expect outcome values in.  Defaults to 0.  Can specify a string to identify a column header.");
+        parser.add_option("-a", "--aucOnly",  dest="aucOnly", action="store_true",  help="If set, will only calculate the ROC AUC (and contingency) summary stats in a single streaming pass over the input, without generating ROC curve points, bootstrap samples or figures.  Use for score files too large to hold in memory.");
+        parser.add_option("--cacheColumns",  dest="cacheColumns", action="store_true",  help="If set, will cache the parsed score columns next to the input file, so repeated analyses of the same file can skip parsing the text.");
         parser.add_option("-s", "--colScore",  dest="colScore", help="Index of column to expect score values in.  Defaults to 1.  Can specify strings and comma-separated lists to plot multiple curves.");
 
         (options, args) = parser.parse_args(argv[1:])
@@ -288,12 +333,17 @@ class ROCPlot(BaseAnalysis):
             inputFile = stdOpen(inputFilename);
 
             self.logScores = options.logScores;
+            self.scoreFileReader.cacheColumns = options.cacheColumns;
             
             # Run the actual analysis
-            (analysisResultsByScoreId, summaryData) = self(inputFile, options.colOutcome, options.colScore, options);
+            if options.aucOnly:
+                analysisResultsByScoreId = dict();
+                summaryData = self.streamAUCSummary(inputFile, options.colOutcome, options.colScore, options);
+            else:
+                (analysisResultsByScoreId, summaryData) = self(inputFile, options.colOutcome, options.colScore, options);
             
             # Generate plot figure
-            if options.figure is not None:
+            if options.figure is not None and not options.aucOnly:
                 rcParams = None;
                 if options.rcParams is not None:
                     rcParams = json.loads(options.rcParams);
@@ -320,6 +370,123 @@ class ROCPlot(BaseAnalysis):
         timer = time.time() - timer;
         log.info("%.3f seconds to complete",timer);
 
+def aucComponentsFromCounts(positiveCounts, negativeCounts):
+    """Given counts of positive and negative examples for each distinct score, in ascending score order,
+    calculate the (pairsCorrect, pairsChecked) AUC components by the Mann-Whitney U statistic.
+    """
+    positiveCounts = np.asarray(positiveCounts, dtype=float);
+    negativeCounts = np.asarray(negativeCounts, dtype=float);
+    negativesBelow = np.cumsum(negativeCounts) - negativeCounts;   # Negative examples with strictly lower scores
+    pairsCorrect = float(np.sum(positiveCounts * (negativesBelow + 0.5 * negativeCounts)));
+    pairsChecked = int(positiveCounts.sum()) * int(negativeCounts.sum());
+    return (pairsCorrect, pairsChecked);
+
+class AUCComponentsAccumulator:
+    """Accumulate (outcome, score) examples to calculate AUC components
+    (see ROCPlot.aucComponents) without holding all of the examples in memory.
+
+    Examples are buffered in compact arrays.  When the buffer reaches maxBufferSize examples,
+    it is collapsed into a sorted run of positive and negative counts by distinct score and spilled
+    to a temporary file.  Calculating the components merges the sorted runs back in blocks of scores.
+    """
+    def __init__(self, maxBufferSize=None):
+        if maxBufferSize is None:
+            maxBufferSize = MAX_STREAM_BUFFER_SIZE;
+        self.maxBufferSize = maxBufferSize;
+        self.outcomeBuffer = array("b");
+        self.scoreBuffer = array("d");
+        self.runs = list(); # Sorted (score, negativeCount, positiveCount) records, spilled to memory mapped temporary files
+
+    def add(self, outcome, score):
+        self.outcomeBuffer.append(outcome != 0);
+        self.scoreBuffer.append(score);
+        if len(self.scoreBuffer) >= self.maxBufferSize:
+            self.spillBuffer();
+
+    def addArrays(self, outcomes, scores):
+        """Vectorized variant of add for a chunk of examples at a time.
+        Chunks share the same buffer, so the examples held in memory stay bounded by maxBufferSize
+        no matter how many (small) chunks are added.
+        """
+        outcomes = (np.asarray(outcomes) != 0).astype(np.int8);
+        scores = np.asarray(scores, dtype=float);
+        iStart = 0;
+        while iStart < len(scores):
+            iEnd = iStart + (self.maxBufferSize - len(self.scoreBuffer));
+            self.outcomeBuffer.fromstring(outcomes[iStart:iEnd].tostring());
+            self.scoreBuffer.fromstring(scores[iStart:iEnd].tostring());
+            if len(self.scoreBuffer) >= self.maxBufferSize:
+                self.spillBuffer();
+            iStart = iEnd;
+
+    def spillBuffer(self):
+        """Collapse the buffered examples into a sorted run of counts by score and write it out to a temporary file"""
+        if len(self.scoreBuffer) > 0:
+            outcomes = np.frombuffer(self.outcomeBuffer, dtype=np.int8);
+            scores = np.frombuffer(self.scoreBuffer, dtype=float);
+            self.runs.append(spillRun(countsByScore(outcomes, scores)));
+        self.outcomeBuffer = array("b");
+        self.scoreBuffer = array("d");
+
+    def components(self):
+        """Merge the sorted runs in blocks of scores to calculate (pairsCorrect, pairsChecked).
+        Each block takes everything up to the smallest last score in the next block from each run,
+        so all examples with equal scores are always counted together in the same block.
+        """
+        runs = list(self.runs);
+        if len(self.scoreBuffer) > 0:
+            runs.append(countsByScore(np.frombuffer(self.outcomeBuffer, dtype=np.int8), np.frombuffer(self.scoreBuffer, dtype=float)));
+        blockSize = max(1, self.maxBufferSize // max(1, len(runs)));
+
+        pairsCorrect = 0.0;
+        (negativesBelow, totalPositives) = (0, 0);
+        positions = [0] * len(runs);
+        while True:
+            activeRuns = [iRun for iRun, run in enumerate(runs) if positions[iRun] < len(run)];
+            if len(activeRuns) == 0:
+                break;
+            cutoff = min(runs[iRun]["score"][min(positions[iRun] + blockSize, len(runs[iRun])) - 1] for iRun in activeRuns);
+            blockRecords = list();
+            for iRun in activeRuns:
+                block = runs[iRun][positions[iRun]:positions[iRun] + blockSize];
+                nRecords = np.searchsorted(block["score"], cutoff, side="right");
+                blockRecords.append(block[:nRecords]);
+                positions[iRun] += nRecords;
+            blockRecords = np.concatenate(blockRecords);
+
+            # Combine counts for equal scores across runs
+            (distinctScores, iDistinctScores) = np.unique(blockRecords["score"], return_inverse=True);
+            negativeCounts = np.bincount(iDistinctScores, weights=blockRecords["negativeCount"], minlength=len(distinctScores));
+            positiveCounts = np.bincount(iDistinctScores, weights=blockRecords["positiveCount"], minlength=len(distinctScores));
+            (blockPairsCorrect, blockPairsChecked) = aucComponentsFromCounts(positiveCounts, negativeCounts);
+            pairsCorrect += blockPairsCorrect + float(positiveCounts.sum()) * negativesBelow;
+            negativesBelow += int(negativeCounts.sum());
+            totalPositives += int(positiveCounts.sum());
+        return (pairsCorrect, totalPositives * negativesBelow);
+
+# Record format for sorted runs of counts by distinct score
+SCORE_COUNTS_DTYPE = np.dtype([("score", float), ("negativeCount", np.int64), ("positiveCount", np.int64)]);
+
+def countsByScore(outcomes, scores):
+    """Collapse examples into a sorted array of (score, negativeCount, positiveCount) records"""
+    outcomes = np.asarray(outcomes);
+    (distinctScores, iDistinctScores) = np.unique(np.asarray(scores, dtype=float), return_inverse=True);
+    isPositive = (outcomes != 0);
+    counts = np.empty(len(distinctScores), dtype=SCORE_COUNTS_DTYPE);
+    counts["score"] = distinctScores;
+    counts["negativeCount"] = np.bincount(iDistinctScores[~isPositive], minlength=len(distinctScores));
+    counts["positiveCount"] = np.bincount(iDistinctScores[isPositive], minlength=len(distinctScores));
+    return counts;
+
+def spillRun(counts):
+    """Write the counts out to a temporary file, returning a read-only memory map of them"""
+    if len(counts) == 0:    # Cannot memory map an empty file
+        return counts;
+    runFile = tempfile.TemporaryFile();
+    counts.tofile(runFile);
+    runFile.flush();
+    return np.memmap(runFile, dtype=SCORE_COUNTS_DTYPE, mode="r", shape=(len(counts),));
+
 if __name__ == "__main__":
     instance = ROCPlot();
     instance.main(sys.argv);
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Columnar reader for (tab-delimited) score / outcome files, such as the output of
+RecommendationClassificationAnalysis or OutcomePredictionAnalysis.
+
+Rather than splitting every line into Python lists and dictionaries,
+parse only the requested columns, in chunks, into typed NumPy arrays.
+Optionally cache the parsed columns as .npy files in a directory next to
+the source file, so repeated analyses of the same (multi-GB) file can
+memory map the columns instead of parsing the text again.
+"""
+
+import sys, os;
+import json;
+import numpy as np;
+import pandas as pd;
+from medinfo.common.Const import COMMENT_TAG;
+from Util import log;
+
+from Const import OUTCOME_ABSENT, OUTCOME_PRESENT;
+from Const import NEGATIVE_OUTCOME_STRS;
+
+# Column types to parse into
+OUTCOME_COLUMN = "outcome";   # Outcome labels (see NEGATIVE_OUTCOME_STRS) parsed into OUTCOME_ABSENT / OUTCOME_PRESENT codes
+FLOAT_COLUMN = "float";   # Numerical values.  Raise ValueError on any unparseable values (e.g., None), as float() would
+TEXT_COLUMN = "text";
+
+# Default number of rows to parse at a time
+DEFAULT_CHUNK_SIZE = 100000;
+
+# Text values that float() parses as NaN, so not counted as unparseable
+NAN_STRS = ("nan","+nan","-nan");
+
+# Suffix of the directory next to a source file to cache parsed columns in
+CACHE_DIR_SUFFIX = ".columns";
+CACHE_META_FILENAME = "meta.json";
+
+class ScoreFileReader:
+    """Read selected columns of a score file into NumPy arrays.
+
+    Expects a header line of column names (after any comment lines).
+    Columns can be specified by header name or by (0-based) column index.
+    """
+    def __init__(self, delim=None, chunkSize=None, cacheColumns=False):
+        if delim is None:   delim = "\t";   # Default to tab-delimited
+        if chunkSize is None:   chunkSize = DEFAULT_CHUNK_SIZE;
+        self.delim = delim;
+        self.chunkSize = chunkSize;
+        self.cacheColumns = cacheColumns;   # Whether to cache parsed columns next to the source file
+
+    def readHeader(self, inputFile):
+        """Read past any comment lines to the header line and return the list of column names.
+        Uses readline rather than iterating over the file, so the file position is left
+        exactly at the first data line.
+        """
+        line = inputFile.readline();
+        while line and line.strip().startswith(COMMENT_TAG):
+            line = inputFile.readline();
+        return line.strip().split(self.delim);
+
+    def resolveColumn(self, headers, col):
+        """Translate a column header name or index into the header name"""
+        if col in headers:
+            return col;
+        return headers[int(col)];   # Otherwise assume a numerical index
+
+    def iterChunks(self, inputFile, headers, typeByHeader):
+        """Generator over chunks of the data lines of inputFile (positioned after the header line),
+        yielding a dictionary of arrays for each chunk, keyed by the header names in typeByHeader.
+        """
+        usecols = [header for header in headers if header in typeByHeader];
+        dtype = dict();
+        for header in usecols:
+            if typeByHeader[header] != FLOAT_COLUMN:
+                dtype[header] = str;
+        # Not the pandas comment option, which would cut off data lines at any COMMENT_TAG, not just skip comment lines
+        reader = \
+            pd.read_csv \
+            (   CommentLineFilter(inputFile), sep=self.delim, header=None, names=headers, usecols=usecols, dtype=dtype,
+                na_filter=False, skipinitialspace=True, chunksize=self.chunkSize,
+            );
+        for chunk in reader:
+            chunk = self.dropBlankRows(chunk);
+            arrays = dict();
+            for header in usecols:
+                arrays[header] = self.convertColumn(chunk[header], typeByHeader[header]);
+            yield arrays;
+
+    def dropBlankRows(self, chunk):
+        """Drop rows that are blank (e.g., whitespace only lines)"""
+        isBlank = np.ones(len(chunk), dtype=bool);
+        for header in chunk.columns:
+            if chunk[header].dtype != object:
+                return chunk;   # Parsed as numbers, so no blank values in the column
+            isBlank &= (chunk[header].str.strip() == "").values;
+        if isBlank.any():
+            chunk = chunk[~isBlank];
+        return chunk;
+
+    def convertColumn(self, values, colType):
+        """Convert a pandas Series of the raw column values into an array of the given column type"""
+        if colType == OUTCOME_COLUMN:
+            isNegative = values.str.strip().isin(NEGATIVE_OUTCOME_STRS).values;
+            return np.where(isNegative, OUTCOME_ABSENT, OUTCOME_PRESENT).astype(np.int8);
+        elif colType == FLOAT_COLUMN:
+            array = pd.to_numeric(values, errors="coerce").values.astype(float);
+            isInvalid = np.isnan(array) & ~values.astype(str).str.strip().str.lower().isin(NAN_STRS).values;
+            if isInvalid.any():
+                iRow = np.flatnonzero(isInvalid)[0];
+                raise ValueError("Unparseable value '%s' in column %s, data line %d, of %d unparseable values" % (values.iloc[iRow], values.name, values.index[iRow]+1, isInvalid.sum()) );
+            return array;
+        else:
+            return values.str.strip().values.astype(str);
+
+    def readColumns(self, inputFile, headers, typeByHeader):
+        """Read the full columns of inputFile (positioned after the header line),
+        returning a dictionary of arrays keyed by the header names in typeByHeader.
+        If caching is enabled and inputFile is a named file, load the columns from the cache when current,
+        otherwise parse them and save them to the cache for next time.
+        """
+        sourcePath = getattr(inputFile, "name", None);
+        if not self.cacheColumns or sourcePath is None or not os.path.isfile(sourcePath):
+            return self.parseColumns(inputFile, headers, typeByHeader);
+
+        columnCache = ColumnCache(sourcePath, headers);
+        arrays = columnCache.load(typeByHeader);
+        if arrays is None:
+            arrays = self.parseColumns(inputFile, headers, typeByHeader);
+            columnCache.save(arrays, typeByHeader);
+        return arrays;
+
+    def parseColumns(self, inputFile, headers, typeByHeader):
+        arraysByHeader = dict([(header, list()) for header in typeByHeader]);
+        for arrays in self.iterChunks(inputFile, headers, typeByHeader):
+            for header, array in arrays.iteritems():
+                arraysByHeader[header].append(array);
+        result = dict();
+        for header, arrays in arraysByHeader.iteritems():
+            if len(arrays) > 0:
+                result[header] = np.concatenate(arrays);
+            else:   # No data lines
+                result[header] = self.convertColumn(pd.Series([], dtype=object), typeByHeader[header]);
+        return result;
+
+class CommentLineFilter:
+    """File-like wrapper around an input file, passing through only the lines that are not comments
+    (starting with COMMENT_TAG, after any leading whitespace), as the line by line parsers skip them.
+    Reads in blocks, only checking individual lines in blocks that contain a COMMENT_TAG at all.
+    """
+    def __init__(self, inputFile):
+        self.inputFile = inputFile;
+        self.remainder = "";    # Partial last line from the prior block
+
+    def read(self, size=-1):
+        while True:
+            block = self.inputFile.read(size);
+            if not block:   # End of file
+                text = self.remainder;
+                self.remainder = "";
+                return self.filterLines(text);
+            block = self.remainder + block;
+            iLastLine = block.rfind("\n") + 1;
+            self.remainder = block[iLastLine:];
+            text = self.filterLines(block[:iLastLine]);
+            if text:    # Empty string would indicate end of file, so keep reading if all comments or no complete line yet
+                return text;
+
+    def __iter__(self):
+        for line in self.inputFile:
+            if not line.lstrip().startswith(COMMENT_TAG):
+                yield line;
+
+    def filterLines(self, text):
+        if COMMENT_TAG not in text:
+            return text;
+        return str.join("", [line for line in text.splitlines(True) if not line.lstrip().startswith(COMMENT_TAG)]);
+
+class ColumnCache:
+    """Directory of parsed columns saved as .npy files next to a source file.
+    Invalidated whenever the source file size or modification time changes.
+    """
+    def __init__(self, sourcePath, headers):
+        self.sourcePath = sourcePath;
+        self.headers = headers;
+        self.cacheDir = sourcePath + CACHE_DIR_SUFFIX;
+
+    def sourceSignature(self):
+        sourceStat = os.stat(self.sourcePath);
+        return {"size": sourceStat.st_size, "mtime": sourceStat.st_mtime, "headers": self.headers};
+
+    def columnPath(self, header, colType):
+        # Identify columns by index rather than by header, which may not be a valid filename
+        return os.path.join(self.cacheDir, "%d.%s.npy" % (self.headers.index(header), colType));
+
+    def isCurrent(self):
+        metaPath = os.path.join(self.cacheDir, CACHE_META_FILENAME);
+        if not os.path.isfile(metaPath):
+            return False;
+        metaFile = open(metaPath);
+        try:
+            return json.load(metaFile) == json.loads(json.dumps(self.sourceSignature()));
+        finally:
+            metaFile.close();
+
+    def load(self, typeByHeader):
+        """Memory map the cached columns, or return None if any are missing or the cache is out of date"""
+        if not self.isCurrent():
+            return None;
+        arrays = dict();
+        for header, colType in typeByHeader.iteritems():
+            columnPath = self.columnPath(header, colType);
+            if not os.path.isfile(columnPath):
+                return None;
+            arrays[header] = np.load(columnPath, mmap_mode="r");
+        log.debug("Loaded cached columns from %s" % self.cacheDir);
+        return arrays;
+
+    def save(self, arrays, typeByHeader):
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir);
+        if not self.isCurrent():
+            # Source file changed, clear out any prior cached columns
+            for filename in os.listdir(self.cacheDir):
+                os.remove(os.path.join(self.cacheDir, filename));
+        for header, colType in typeByHeader.iteritems():
+            # Write to a temporary file then rename, so never leave a partially written column
+            columnPath = self.columnPath(header, colType);
+            tempFile = open(columnPath + ".tmp", "wb");
+            try:
+                np.save(tempFile, arrays[header]);
+            finally:
+                tempFile.close();
+            os.rename(columnPath + ".tmp", columnPath);
+        metaFile = open(os.path.join(self.cacheDir, CACHE_META_FILENAME), "w");
+        try:
+            json.dump(self.sourceSignature(), metaFile);
+        finally:
+            metaFile.close();
@@ -5,13 +5,16 @@ import sys, os
 from cStringIO import StringIO
 import unittest
 
+import numpy as np;
+from sklearn.metrics import roc_auc_score;
+
 from Const import RUNNER_VERBOSITY;
 from Util import log;
 
 from medinfo.common.test.Util import MedInfoTestCase;
 from medinfo.db.Model import RowItemModel;
 
-from medinfo.analysis.ROCPlot import ROCPlot;
+from medinfo.analysis.ROCPlot import ROCPlot, AUCComponentsAccumulator;
 
 from Util import BaseTestAnalysis;
 
@@ -139,6 +142,108 @@ outcome\tscore\tscore2
         self.verifyJSONData( expectedStatsByNameByScoreId, jsonData );
         #self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
 
+    def test_aucComponents(self):
+        # Compare rank based calculation against directly checking every negative x positive pair,
+        #   with plenty of tied scores, including ties across positive and negative examples
+        rng = np.random.RandomState(123456789);
+        outcomes = rng.randint(0,2,500);
+        scores = np.round(rng.rand(500) + 0.5*outcomes, 1);
+
+        expectedPairsCorrect = 0.0;
+        expectedPairsChecked = 0;
+        for (outcome0,score0) in zip(outcomes,scores):
+            if outcome0 == 0:
+                for (outcome1,score1) in zip(outcomes,scores):
+                    if outcome1 != 0:
+                        expectedPairsChecked += 1;
+                        if score1 > score0:
+                            expectedPairsCorrect += 1;
+                        elif score1 == score0:
+                            expectedPairsCorrect += 0.5;
+
+        (pairsCorrect, pairsChecked) = ROCPlot.aucComponents(outcomes, scores);
+        self.assertEqual(expectedPairsCorrect, pairsCorrect);
+        self.assertEqual(expectedPairsChecked, pairsChecked);
+        self.assertAlmostEqual(roc_auc_score(outcomes, scores), pairsCorrect/pairsChecked, 10);
+
+        # Streaming variant with a small buffer to force spilling to (and merging back) sorted runs
+        for maxBufferSize in (None, 3):
+            (pairsCorrect, pairsChecked) = ROCPlot.aucComponentsStream(zip(outcomes, scores), maxBufferSize);
+            self.assertEqual(expectedPairsCorrect, pairsCorrect);
+            self.assertEqual(expectedPairsChecked, pairsChecked);
+
+        # Or adding chunks of arrays at a time
+        accumulator = AUCComponentsAccumulator(50);
+        for iStart in xrange(0, len(outcomes), 30):
+            accumulator.addArrays(outcomes[iStart:iStart+30], scores[iStart:iStart+30]);
+        self.assertEqual((expectedPairsCorrect, expectedPairsChecked), accumulator.components());
+
+    def test_aucComponentsBoundedMemory(self):
+        # Many small chunks should still be spilled once they add up to the buffer size,
+        #   rather than each being held in memory as its own run
+        rng = np.random.RandomState(123456789);
+        maxBufferSize = 1000;
+        accumulator = AUCComponentsAccumulator(maxBufferSize);
+        (allOutcomes, allScores) = (list(), list());
+        for iChunk in xrange(50):
+            outcomes = rng.randint(0,2,500);
+            scores = rng.rand(500) + 0.5*outcomes;
+            accumulator.addArrays(outcomes, scores);
+            allOutcomes.extend(outcomes);
+            allScores.extend(scores);
+
+            recordsInMemory = len(accumulator.scoreBuffer);
+            for run in accumulator.runs:
+                if not isinstance(run, np.memmap):
+                    recordsInMemory += len(run);
+            self.assertTrue(recordsInMemory < maxBufferSize);
+
+        (pairsCorrect, pairsChecked) = accumulator.components();
+        self.assertAlmostEqual(roc_auc_score(allOutcomes, allScores), pairsCorrect/pairsChecked, 10);
+
+    def test_aucOnly(self):
+        # Single streaming pass just for AUC summary stats should match the full analysis
+        inputFileStr = \
+"""outcome\tscore\tscore2
+0\t0.01\t1
+0\t0.11\t6
+1\t0.12\t7
+0\t0.22\t10
+1\t0.22\t9
+1\t0.23\t8
+0\t0.23\t7
+1\t0.33\t11
+"""
+        sys.stdin = StringIO(inputFileStr);
+        sys.stdout = StringIO();
+        argv = ["ROCPlot.py","-n","10","-s","score,score2","-b","score","-c","P-Fisher","-","-"];
+        self.analyzer.main(argv);
+        expectedData = self.extractJSONComment(StringIO(sys.stdout.getvalue()));
+
+        sys.stdin = StringIO(inputFileStr);
+        sys.stdout = StringIO();
+        argv = ["ROCPlot.py","-a","-s","score,score2","-b","score","-c","P-Fisher","-","-"];
+        self.analyzer.main(argv);
+        jsonData = self.extractJSONComment(StringIO(sys.stdout.getvalue()));
+
+        for scoreId in ("score","score2"):
+            for statName in ("ROC-AUC","pairsCorrect","pairsChecked","P-Fisher.score"):
+                dataKey = "%s.%s" % (scoreId, statName);
+                self.assertAlmostEquals( expectedData[dataKey], jsonData[dataKey], 5);
+
+    def test_aucOnlySingleOutcome(self):
+        # c-statistic is undefined without both positive and negative examples
+        inputFileStr = \
+"""outcome\tscore
+1\t0.01
+1\t0.11
+1\t0.12
+"""
+        summaryData = self.analyzer.streamAUCSummary(StringIO(inputFileStr), "outcome", "score");
+        self.assertEqual(0, summaryData["score.pairsChecked"]);
+        self.assertTrue(np.isnan(summaryData["score.ROC-AUC"]));
+        self.assertTrue(np.isnan(summaryData["score.c-statistic"]));
+
     def verifyJSONData( self, expectedStatsByNameByScoreId, jsonData ):
         """Pull out JSON data components and verify equals where expected"""
 
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+from cStringIO import StringIO
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np;
+
+from Const import RUNNER_VERBOSITY;
+from Util import log;
+
+from medinfo.analysis.ScoreFileReader import ScoreFileReader, OUTCOME_COLUMN, FLOAT_COLUMN, TEXT_COLUMN, CACHE_DIR_SUFFIX;
+from medinfo.analysis.BaseAnalysis import BaseAnalysis;
+
+from Util import BaseTestAnalysis;
+
+class TestScoreFileReader(BaseTestAnalysis):
+    def setUp(self):
+        """Prepare state for test cases"""
+        BaseTestAnalysis.setUp(self);
+        self.tempDir = tempfile.mkdtemp();
+
+        self.inputFileStr = \
+            """# Comment header to ignore
+            outcome\tscore\tlabel\tscore2
+            0\t0.01\tA\t1
+            True\t0.02\tB\t2
+            # Interior comment line to ignore
+            -1\t0.03\tC#3\tnan
+            False\t0.04\tD\t4
+            1\t0.05\tE\t5
+            """;
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        shutil.rmtree(self.tempDir);
+        BaseTestAnalysis.tearDown(self);
+
+    def test_readColumns(self):
+        typeByHeader = {"outcome": OUTCOME_COLUMN, "score2": FLOAT_COLUMN, "label": TEXT_COLUMN};
+        for chunkSize in (None, 2):
+            reader = ScoreFileReader(chunkSize=chunkSize);
+            inputFile = StringIO(self.inputFileStr);
+            headers = reader.readHeader(inputFile);
+            self.assertEqual(["outcome","score","label","score2"], headers);
+            self.assertEqual("score2", reader.resolveColumn(headers, "3"));
+
+            columns = reader.readColumns(inputFile, headers, typeByHeader);
+            self.assertEqual(set(typeByHeader.keys()), set(columns.keys()));  # Only parse requested columns
+            self.assertEqual([0,1,0,0,1], columns["outcome"].tolist());
+            self.assertEqual(["A","B","C#3","D","E"], columns["label"].tolist());  # Only whole comment lines skipped, not text after a comment tag
+            self.assertTrue(np.isnan(columns["score2"][2]));
+            self.assertEqual([1.0,2.0,4.0,5.0], columns["score2"][[0,1,3,4]].tolist());
+
+        # Unparseable score values are an error, rather than silently treated as missing
+        reader = ScoreFileReader();
+        inputFile = StringIO(self.inputFileStr.replace("\tnan", "\tNone"));
+        headers = reader.readHeader(inputFile);
+        self.assertRaises(ValueError, reader.readColumns, inputFile, headers, typeByHeader);
+
+    def test_derivedPFisherNegLog(self):
+        # Columnar and row model parsing should derive the same signed log P-value from the P-Fisher and OR columns
+        inputFileStr = "outcome\tP-Fisher\tOR\n0\t0.01\t2.0\n1\t0.001\t0.5\n1\t0.0\t3.0\n";
+        expectedScores = [2.0, -3.0, sys.float_info.max];
+        analyzer = BaseAnalysis();
+
+        (outcomes, scoresById) = analyzer.parseScoreColumns(StringIO(inputFileStr), colOutcome="outcome", colScore="P-Fisher-NegLog");
+        for expected, score in zip(expectedScores, scoresById["P-Fisher-NegLog"]):
+            self.assertAlmostEqual(expected, score, 10);
+        scoreModels = analyzer.parseScoreModelsFromFile(StringIO(inputFileStr), scoreCols=["P-Fisher-NegLog"]);
+        for expected, scoreModel in zip(expectedScores, scoreModels):
+            self.assertAlmostEqual(expected, scoreModel["P-Fisher-NegLog"], 10);
+
+        # An existing P-Fisher-NegLog column is used as is
+        inputFileStr = "outcome\tP-Fisher\tOR\tP-Fisher-NegLog\n0\t0.01\t2.0\t7.0\n";
+        (outcomes, scoresById) = analyzer.parseScoreColumns(StringIO(inputFileStr), colOutcome="outcome", colScore="P-Fisher-NegLog");
+        self.assertEqual([7.0], scoresById["P-Fisher-NegLog"].tolist());
+        scoreModels = analyzer.parseScoreModelsFromFile(StringIO(inputFileStr), scoreCols=["P-Fisher-NegLog"]);
+        self.assertEqual(7.0, scoreModels[0]["P-Fisher-NegLog"]);
+
+        # Cannot derive without the source columns
+        inputFileStr = "outcome\tP-Fisher\n0\t0.01\n";
+        self.assertRaises(ValueError, analyzer.parseScoreColumns, StringIO(inputFileStr), None, "outcome", "P-Fisher-NegLog");
+        self.assertRaises(ValueError, analyzer.parseScoreModelsFromFile, StringIO(inputFileStr), None, ["P-Fisher-NegLog"]);
+
+    def test_cacheColumns(self):
+        inputFilename = os.path.join(self.tempDir, "scores.tab");
+        inputFile = open(inputFilename, "w");
+        inputFile.write(self.inputFileStr);
+        inputFile.close();
+
+        reader = ScoreFileReader(cacheColumns=True);
+        typeByHeader = {"outcome": OUTCOME_COLUMN, "score": FLOAT_COLUMN};
+
+        inputFile = open(inputFilename);
+        headers = reader.readHeader(inputFile);
+        expectedColumns = reader.readColumns(inputFile, headers, typeByHeader);
+        inputFile.close();
+        self.assertTrue(os.path.isdir(inputFilename + CACHE_DIR_SUFFIX));
+
+        # Second pass loads the memory mapped columns rather than parsing the file
+        inputFile = open(inputFilename);
+        headers = reader.readHeader(inputFile);
+        columns = reader.readColumns(inputFile, headers, typeByHeader);
+        inputFile.close();
+        for header in typeByHeader:
+            self.assertTrue(isinstance(columns[header], np.memmap));
+            self.assertEqual(expectedColumns[header].tolist(), columns[header].tolist());
+
+        # Changing the source file invalidates the cache
+        time.sleep(0.01);
+        inputFile = open(inputFilename, "a");
+        inputFile.write("1\t0.06\tF\t6\n");
+        inputFile.close();
+        inputFile = open(inputFilename);
+        headers = reader.readHeader(inputFile);
+        columns = reader.readColumns(inputFile, headers, typeByHeader);
+        inputFile.close();
+        self.assertFalse(isinstance(columns["score"], np.memmap));
+        self.assertEqual([0.01,0.02,0.03,0.04,0.05,0.06], columns["score"].tolist());
+
+def suite():
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestScoreFileReader));
+
+    return suite;
+
+if __name__=="__main__":
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
@@ -3,6 +3,7 @@ import sys, os
 import json
 import time;
 import math;
+from bisect import bisect_left, bisect_right;
 from datetime import datetime;
 from optparse import OptionParser
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -26,6 +27,7 @@ class AnalysisOptions:
         self.endDate = None;
         self.bufferFile = None;
         self.deltaSecondsOptions = None;    # Seconds values / suffixes to look for count fields to update
+        self.incremental = False;   # Only query patients with new (not yet analyzed) items, count only pairs involving those, and update cached item / patient counts by deltas
 
 class AssociationAnalysis:
     """Pre-Computation module to sort through data on patient clinical items
@@ -109,10 +111,21 @@ class AssociationAnalysis:
             # Keep an in memory buffer of the updates to be done so can stall and submit them
             #   to the database in batch to minimize inefficient DB hits
             updateBuffer = self.makeUpdateBuffer();
+
+            # Incremental refresh only looks at patients with new items, and only counts pairs involving new items
+            patientItemsIter = None;
+            updateAssociationsBuffer = None;
+            if analysisOptions.incremental:
+                patientItemsIter = self.queryNewPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn);
+                updateAssociationsBuffer = self.updateNewItemAssociationsBuffer;
+            else:
+                patientItemsIter = self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn);
+                updateAssociationsBuffer = self.updateItemAssociationsBuffer;
+
             log.info("Main patient item query...")
-            for iPatient, patientItemList in enumerate(self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn)):
+            for iPatient, patientItemList in enumerate(patientItemsIter):
                 log.debug("Calculate associations for Patient %d's %d patient items. %d associations in buffer." % (iPatient, len(patientItemList), updateBuffer["nAssociations"]) );
-                self.updateItemAssociationsBuffer(patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
+                updateAssociationsBuffer(patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
                 if self.readyForIntervalCommit(iPatient, updateBuffer, analysisOptions):
                     log.info("Commit after %s patients" % (iPatient+1) );
                     self.persistUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, analysisOptions, iPatient, conn=conn);  # Periodically commit update buffer
@@ -125,6 +138,23 @@ class AssociationAnalysis:
             conn.close();
         # progress.PrintStatus();
 
+    def analyzePatientItemsToBuffer(self, analysisOptions, updateBuffer=None):
+        """Variant of analyzePatientItems that just accumulates the association increments
+        into an in memory updateBuffer and returns it, rather than persisting them to the
+        database or buffer files.  For callers that manage their own persistence (e.g., DecayingWindows).
+        """
+        progress = ProgressDots();
+        conn = self.connFactory.connection();
+        try:
+            linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
+            if updateBuffer is None:
+                updateBuffer = self.makeUpdateBuffer();
+            for iPatient, patientItemList in enumerate(self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn)):
+                self.updateItemAssociationsBuffer(patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
+        finally:
+            conn.close();
+        return updateBuffer;
+
     def queryPatientItemsPerPatient(self, analysisOptions, progress=None, conn=None):
         """Query the database for an ordered list of patient clinical items,
         in the order in which they occurred.
@@ -208,6 +238,43 @@ class AssociationAnalysis:
         if not extConn:
             conn.close();
 
+    def queryNewPatientIds(self, analysisOptions, conn=None):
+        """Query for the IDs of patients with any new (not yet analyzed) items,
+        within any patient ID / date filters of the analysisOptions.
+        The analyze_date marks serve as each patient's high-water mark of what has already been analyzed,
+        so this (with a partial index on unanalyzed items) avoids touching patients with no new data.
+        """
+        query = SQLQuery();
+        query.addSelect("distinct pi.patient_id");
+        query.addFrom("patient_item as pi");
+        query.addFrom("clinical_item as ci");
+        query.addWhere("pi.clinical_item_id = ci.clinical_item_id");
+        query.addWhere("ci.analysis_status <> 0");
+        query.addWhere("pi.analyze_date is null");
+        if analysisOptions.patientIds:
+            query.addWhereIn("pi.patient_id", analysisOptions.patientIds );
+        if analysisOptions.startDate is not None:
+            query.addWhereOp("pi.item_date",">=", analysisOptions.startDate);
+        if analysisOptions.endDate is not None:
+            query.addWhereOp("pi.item_date","<", analysisOptions.endDate);
+        query.addOrderBy("pi.patient_id");
+
+        return [row[0] for row in DBUtil.execute(query, conn=conn)];
+
+    def queryNewPatientItemsPerPatient(self, analysisOptions, progress=None, conn=None):
+        """Variant of queryPatientItemsPerPatient that only yields the item lists
+        for patients with new items to analyze (see queryNewPatientIds).
+        """
+        newPatientIds = self.queryNewPatientIds(analysisOptions, conn=conn);
+        log.info("%d patients with new items to analyze" % len(newPatientIds) );
+        if len(newPatientIds) < 1:
+            return iter([]);
+
+        newPatientOptions = AnalysisOptions();
+        newPatientOptions.__dict__.update(analysisOptions.__dict__);
+        newPatientOptions.patientIds = newPatientIds;
+        return self.queryPatientItemsPerPatient(newPatientOptions, progress=progress, conn=conn);
+
     def updateItemAssociationsBuffer(self, patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId=None,  progress=None):
         """Given a list of data on patient clinical items,
         ordered by item event date, increment information in the
@@ -269,6 +336,97 @@ class AssociationAnalysis:
             updateBuffer["analyzedPatientItemIds"] = set();
         updateBuffer["analyzedPatientItemIds"].update(newlyAnalyzedPatientItemIdSet);
 
+    def updateNewItemAssociationsBuffer(self, patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId=None, progress=None):
+        """Equivalent to updateItemAssociationsBuffer, but only visits the item pairs that
+        involve at least one new (not yet analyzed) item, rather than every pair in the patient's timeline.
+        Cost is then proportional to (new items x timeline length) instead of (timeline length squared),
+        as for an incremental refresh where most of each patient's items were analyzed before.
+
+        The isNew (first occurrence) flags that updateItemAssociationsBuffer tracks by
+        visiting all preceding pairs are instead looked up from the date sorted timeline.
+        In visiting order (item1 position, then item2 position), the first acceptable pair for an
+        item ID pair (A,B) is the first occurrence of A with the first occurrence of B on or after that date
+        (any later occurrence of A is no earlier in time, so can pair with no earlier B).
+
+        Also tracks in the updateBuffer the number of patients being analyzed for the first time
+        (newPatientCount), to allow delta updates of the cached analyzed patient count.
+        Not tracked if date filters apply, as then cannot tell from the (filtered) items
+        whether the patient had any items analyzed before.
+        """
+        nItems = len(patientItemList);
+        itemDates = [patientItem["item_date"] for patientItem in patientItemList];
+        isNewItem = [patientItem["analyze_date"] is None for patientItem in patientItemList];
+
+        # Positions (and respective dates) of each clinical item in the timeline, overall and by encounter
+        positionsByItemId = dict();
+        positionsByItemEncounterId = dict();
+        for position, patientItem in enumerate(patientItemList):
+            for (key, positionsByKey) in [(patientItem["clinical_item_id"], positionsByItemId), ((patientItem["clinical_item_id"], patientItem["encounter_id"]), positionsByItemEncounterId)]:
+                if key not in positionsByKey:
+                    positionsByKey[key] = ([], []);
+                positionsByKey[key][0].append(position);
+                positionsByKey[key][1].append(itemDates[position]);
+
+        def firstPositionOnOrAfter(positionsDates, itemDate):
+            (positions, dates) = positionsDates;
+            index = bisect_left(dates, itemDate);
+            if index < len(positions):
+                return positions[index];
+            return None;
+
+        firstPairByKeyPair = dict();
+        def firstPair(key1, key2, positionsByKey):
+            if (key1, key2) not in firstPairByKeyPair:
+                position1 = positionsByKey[key1][0][0];
+                firstPairByKeyPair[(key1, key2)] = (position1, firstPositionOnOrAfter(positionsByKey[key2], itemDates[position1]));
+            return firstPairByKeyPair[(key1, key2)];
+
+        newlyAnalyzedPatientItemIdSet = set();
+        isNewPatient = True;   # Whether no items for this patient were analyzed before
+        for position1 in xrange(nItems):
+            if not isNewItem[position1]:
+                isNewPatient = False;
+                continue;
+
+            # Pairs with the new item first, and pairs with a previously analyzed item first (new-new pairs already covered)
+            itemDate = itemDates[position1];
+            pairPositions = [(position1, position2) for position2 in xrange(bisect_left(itemDates, itemDate), nItems)];
+            pairPositions.extend([(position0, position1) for position0 in xrange(bisect_right(itemDates, itemDate)) if not isNewItem[position0]]);
+
+            for (iItem1, iItem2) in pairPositions:
+                patientItem1 = patientItemList[iItem1];
+                patientItem2 = patientItemList[iItem2];
+                if not self.acceptableClinicalItemPair(patientItem1, patientItem2, linkedItemIdsByBaseId):
+                    continue;
+                itemId1 = patientItem1["clinical_item_id"];
+                itemId2 = patientItem2["clinical_item_id"];
+
+                isNewSubsequentItem = (iItem2 == firstPositionOnOrAfter(positionsByItemId[itemId2], itemDates[iItem1]));
+                isNewPair = ((iItem1, iItem2) == firstPair(itemId1, itemId2, positionsByItemId));
+                isNewPairWithinEncounter = False;
+                if patientItem1["encounter_id"] == patientItem2["encounter_id"]:
+                    encounterId = patientItem1["encounter_id"];
+                    isNewPairWithinEncounter = ((iItem1, iItem2) == firstPair((itemId1, encounterId), (itemId2, encounterId), positionsByItemEncounterId));
+
+                self.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, analysisOptions );
+
+                for patientItem in (patientItem1, patientItem2):
+                    if patientItem["analyze_date"] is None:
+                        newlyAnalyzedPatientItemIdSet.add(patientItem["patient_item_id"]);
+
+            if progress is not None:
+                progress.Update();
+
+        if "analyzedPatientItemIds" not in updateBuffer:
+            updateBuffer["analyzedPatientItemIds"] = set();
+        updateBuffer["analyzedPatientItemIds"].update(newlyAnalyzedPatientItemIdSet);
+
+        if analysisOptions.startDate is None and analysisOptions.endDate is None:
+            if "newPatientCount" not in updateBuffer:
+                updateBuffer["newPatientCount"] = 0;
+            if isNewPatient and len(newlyAnalyzedPatientItemIdSet) > 0:
+                updateBuffer["newPatientCount"] += 1;
+
     def updateClinicalItemAssociationBuffer(self, patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, analysisOptions=None, itemIdPair=None):
         """Identify and record in the updateBuffer which statistics on associations
         between the two clinical items based on the new piece of observed item pair evidence given.
@@ -383,7 +541,7 @@ class AssociationAnalysis:
     def persistUpdateBuffer(self, updateBuffer, linkedItemIdsByBaseId, analysisOptions, iPatient=None, conn=None):
         if analysisOptions.bufferFile is None:
             linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
-            self.commitUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, conn=conn)
+            self.commitUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, conn=conn, incremental=analysisOptions.incremental)
         else:
             bufferFilename = "%s.%s.json.gz" % (analysisOptions.bufferFile, iPatient);    # Modify filename with which patient done so far, in case saving several sequential results
             self.saveBufferToFile(bufferFilename, updateBuffer);
@@ -431,10 +589,13 @@ class AssociationAnalysis:
         self.commitUpdateBuffer(updateBuffer,linkedItemIdsByBaseId, conn=conn);
 
 
-    def commitUpdateBuffer(self, updateBuffer, linkedItemIdsByBaseId, conn=None):
+    def commitUpdateBuffer(self, updateBuffer, linkedItemIdsByBaseId, conn=None, incremental=False):
         """Take data accumulated in updateBuffer from prior update methods and
         commit them as incremental changes to the database.
         Clear buffer thereafter.
+
+        If incremental, then apply the same increments to the cached clinical item counts
+        (and analyzed patient count) rather than clearing those caches to force full recounts later.
         """
         extConn = conn is not None;
         if not extConn:
@@ -504,9 +665,14 @@ class AssociationAnalysis:
                         conn=conn
                     );
 
-            # Flag that any cached association metrics will be out of date
-            self.dataManager.clearCacheData("analyzedPatientCount");
-            self.dataManager.clearCacheData("clinicalItemCountsUpdated");
+            if incremental:
+                # Apply deltas to cached association metrics
+                self.dataManager.incrementClinicalItemCounts(updateBuffer.get("incrementDataByItemIdPair",{}), conn=conn);
+                self.dataManager.incrementAnalyzedPatientCount(updateBuffer.get("newPatientCount"), conn=conn);
+            else:
+                # Flag that any cached association metrics will be out of date
+                self.dataManager.clearCacheData("analyzedPatientCount");
+                self.dataManager.clearCacheData("clinicalItemCountsUpdated");
 
             # Database commit
             conn.commit();
@@ -592,6 +758,7 @@ class AssociationAnalysis:
         parser.add_option("-p", "--patientsPerCommit", dest="patientsPerCommit", help="If provided, will commit incremental analysis results to the database after every p patients.  If not set, will just wait until full analysis to commit all (will keep more in memory, and will lose progress if script aborted during mid-execution).  Beware that large values are more efficient, but requires more runtime memory which can exceed memory limits.")
         parser.add_option("-a", "--associationsPerCommit", dest="associationsPerCommit", help="If provided, will commit incremental analysis results to the database when accrue this many association items.  Can help to avoid allowing accrual of too much buffered items whose runtime memory will exceed the 32bit 2GB program limit. 1M seems to just fit within 7.5GB memory (assuming 64-bit Python). Running batches of 3000 patients with ~3000 possible clinical items yields ~5M associations requiring ~25GB memory for learning then ~45GB memory to reload and commit a buffer file.")
         parser.add_option("-u", "--itemsPerUpdate", dest="itemsPerUpdate", help="If provided, when updating patient_item analyze_dates, will only update this many items at a time to avoid overloading MySQL query. (e.g., 10,000)")
+        parser.add_option("-I", "--incremental", dest="incremental", action="store_true", help="If set, only analyze patients with new (not yet analyzed) items, only counting item pairs that involve those new items, and update cached clinical item and patient counts by deltas rather than full recounts. Intended for periodic (e.g., nightly) model refreshes. Patient ID arguments and date filters are optional in this mode.")
         parser.add_option("-b", "--bufferFile", dest="bufferFile", help="If provided, send buffer to output file rather than commiting to database. If patientIds arguments and idFile parameter are blank, then instead read in bufferFile from this filename (prefix) and commit to database.")
         (options, args) = parser.parse_args(argv[1:])
 
@@ -614,7 +781,9 @@ class AssociationAnalysis:
         if options.itemsPerUpdate is not None:
             self.itemsPerUpdate = int(options.itemsPerUpdate);
 
-        if analysisOptions.bufferFile is not None and not analysisOptions.patientIds:
+        analysisOptions.incremental = options.incremental is not None;
+
+        if analysisOptions.bufferFile is not None and not analysisOptions.patientIds and not analysisOptions.incremental:
             # Have a previously generated result buffer file and not trying to train on any patientID subset.
             # Just commit buffer file directly to database
             self.commitUpdateBufferFromFile(analysisOptions.bufferFile);
@@ -631,7 +800,7 @@ class AssociationAnalysis:
                 timeTuple = time.strptime(options.endDate, DATE_FORMAT);
                 analysisOptions.endDate = datetime(*timeTuple[0:3]);
 
-            if len(analysisOptions.patientIds) < 1 and analysisOptions.startDate is None and analysisOptions.endDate is None:
+            if len(analysisOptions.patientIds) < 1 and analysisOptions.startDate is None and analysisOptions.endDate is None and not analysisOptions.incremental:
                 # Disallow running without specifying some kind of filter
                 parser.print_help();
                 sys.exit(-1)
@@ -122,6 +122,64 @@ class DataManager:
                 conn.close();
 
 
+    def incrementClinicalItemCounts(self, incrementDataByItemIdPair, conn=None):
+        """Incremental alternative to updateClinicalItemCounts.  Given the association
+        increments about to be committed (keyed by str(itemIdPair), as in AssociationAnalysis update buffers),
+        apply the "diagonal" (item with itself) increments directly to the clinical_item summary counts.
+
+        Only done if the counts are currently up to date ("clinicalItemCountsUpdated" cached),
+        otherwise leave them for a full recount by updateClinicalItemCounts.
+        """
+        extConn = True;
+        if conn is None:
+            conn = self.connFactory.connection();
+            extConn = False;
+        try:
+            if self.getCacheData("clinicalItemCountsUpdated",conn=conn) is None:
+                return;
+
+            countFieldPairs = [("item_count","count_0"), ("patient_count","patient_count_0"), ("encounter_count","encounter_count_0")];
+            for itemIdPairStr, incrementData in incrementDataByItemIdPair.iteritems():
+                (itemId1, itemId2) = eval(str(itemIdPairStr));
+                if itemId1 != itemId2:
+                    continue;
+                if self.maxClinicalItemId is not None and itemId1 >= self.maxClinicalItemId:
+                    continue;   # Restrict to (test) data, consistent with updateClinicalItemCounts
+                query = ["update clinical_item set"];
+                params = [];
+                for (itemCountField, associationField) in countFieldPairs:
+                    if incrementData.get(associationField):
+                        query.append("%(col)s = %(col)s + %(p)s" % {"col": itemCountField, "p": DBUtil.SQL_PLACEHOLDER});
+                        query.append(",");
+                        params.append(incrementData[associationField]);
+                if len(params) > 0:
+                    query.pop();    # Drop extra comma at end of list
+                    query.append("where clinical_item_id = %s" % DBUtil.SQL_PLACEHOLDER);
+                    params.append(itemId1);
+                    DBUtil.execute(str.join(" ", query), params, conn=conn);
+        finally:
+            if not extConn:
+                conn.close();
+
+    def incrementAnalyzedPatientCount(self, newPatientCount, conn=None):
+        """Incremental update of the cached "analyzedPatientCount" by the number of newly analyzed patients.
+        If newPatientCount is None (unknown), just clear the cache to force a recount when next needed.
+        """
+        extConn = True;
+        if conn is None:
+            conn = self.connFactory.connection();
+            extConn = False;
+        try:
+            if newPatientCount is None:
+                self.clearCacheData("analyzedPatientCount",conn=conn);
+                return;
+            dataStr = self.getCacheData("analyzedPatientCount",conn=conn);
+            if dataStr is not None and newPatientCount > 0:
+                self.setCacheData("analyzedPatientCount", str(float(dataStr)+newPatientCount), conn=conn);
+        finally:
+            if not extConn:
+                conn.close();
+
     def loadClinicalItemBaseCountByItemId(self, countPrefix=None, acceptCache=True, conn=None):
         """Helper query to get the baseline analyzed item counts for all of the clinical items
         If countPrefix is provided, can use alternative total item counts instead of the default item_count,
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""In memory buffer of clinical_item_association increments for DecayingWindows.
+
+Rather than multiplying every accrued count by the decay factor after each delta
+(a rewrite of every association record / buffer entry each time),
+keep a global decay epoch and store the counts scaled by decay^-epoch.
+Decaying is then just incrementing the epoch, and new increments are added in scaled by decay^-epoch.
+True values are only materialized (scaled back by decay^epoch) when ready to commit.
+
+Counts are kept in a compact 2D array (item pair rows x count field columns)
+rather than nested dictionaries per item pair.
+"""
+
+import numpy as np;
+
+from Util import log;
+
+# Once the scale factor (decay^-epoch) exceeds this, fold it back into the stored values
+#   and reset the epoch, to avoid floating point overflow over very many decay steps
+MAX_DECAY_SCALE = 1e100;
+
+INITIAL_CAPACITY = 1024;
+
+class DecayingCountBuffer:
+    def __init__(self, decay, decayAllFields=True):
+        """decay - Scalar to decay all counts by on each decay step.
+            May be 0 (e.g., window length of 1), to just discard the accrued counts on each step.
+        decayAllFields - If set, decay every increment field (including time_diff_sum fields).
+            Otherwise, only decay the count fields, consistent with DecayingWindows.standardDecay.
+        """
+        self.decay = decay;
+        self.decayAllFields = decayAllFields;
+        self.epoch = 0;
+
+        self.rowByItemIdPair = dict();  # Keyed by the same str(itemIdPair) keys as AssociationAnalysis update buffers
+        self.colByField = dict();
+        self.itemIdPairs = list();
+        self.fields = list();
+        self.isDecayedCol = np.zeros(0, dtype=bool);
+        self.scaledCounts = np.zeros((INITIAL_CAPACITY, 0));
+        self.analyzedPatientItemIds = set();
+
+    def nAssociations(self):
+        return len(self.itemIdPairs);
+
+    def isDecayedField(self, field):
+        return self.decayAllFields or "count_" in field;
+
+    def decayStep(self):
+        """Decay all accrued counts by one step. O(1) apart from the occasional rescale."""
+        if self.decay == 0:
+            # No scale factor can represent decaying to nothing, so just clear the decayed counts
+            self.scaledCounts[:,self.isDecayedCol] = 0.0;
+            return;
+        self.epoch += 1;
+        if self.decay ** -self.epoch > MAX_DECAY_SCALE:
+            self.rescale();
+
+    def rescale(self):
+        """Fold the current decay scale into the stored values and reset the epoch"""
+        self.scaledCounts[:,self.isDecayedCol] *= self.decay ** self.epoch;
+        self.epoch = 0;
+
+    def addUpdateBuffer(self, updateBuffer):
+        """Add in the increments accrued in an AssociationAnalysis updateBuffer (e.g., for one delta),
+        with respect to the current decay epoch.
+        """
+        rows = list();
+        cols = list();
+        increments = list();
+        for itemIdPair, incrementData in updateBuffer.get("incrementDataByItemIdPair",{}).iteritems():
+            row = self.rowByItemIdPair.get(itemIdPair);
+            if row is None:
+                row = self.addRow(itemIdPair);
+            for field, increment in incrementData.iteritems():
+                col = self.colByField.get(field);
+                if col is None:
+                    col = self.addColumn(field);
+                rows.append(row);
+                cols.append(col);
+                increments.append(increment);
+
+        if len(rows) > 0:
+            cols = np.array(cols);
+            scale = np.where(self.isDecayedCol[cols], self.decay ** -self.epoch, 1.0);
+            np.add.at(self.scaledCounts, (np.array(rows), cols), np.array(increments, dtype=float) * scale);
+
+        self.analyzedPatientItemIds.update(updateBuffer.get("analyzedPatientItemIds",()));
+
+    def addRow(self, itemIdPair):
+        row = len(self.itemIdPairs);
+        if row >= self.scaledCounts.shape[0]:
+            # Out of space, double the capacity to amortize copying
+            self.scaledCounts = np.concatenate([self.scaledCounts, np.zeros(self.scaledCounts.shape)]);
+        self.rowByItemIdPair[itemIdPair] = row;
+        self.itemIdPairs.append(itemIdPair);
+        return row;
+
+    def addColumn(self, field):
+        col = len(self.fields);
+        self.colByField[field] = col;
+        self.fields.append(field);
+        self.isDecayedCol = np.append(self.isDecayedCol, self.isDecayedField(field));
+        self.scaledCounts = np.concatenate([self.scaledCounts, np.zeros((self.scaledCounts.shape[0],1))], axis=1);
+        return col;
+
+    def materializeUpdateBuffer(self):
+        """Produce an AssociationAnalysis style updateBuffer with the true (decayed) values,
+        ready for AssociationAnalysis.commitUpdateBuffer.
+        """
+        nRows = len(self.itemIdPairs);
+        scale = np.where(self.isDecayedCol, self.decay ** self.epoch, 1.0);
+        counts = (self.scaledCounts[:nRows] * scale).tolist();
+
+        incrementDataByItemIdPair = dict();
+        for itemIdPair, rowCounts in zip(self.itemIdPairs, counts):
+            # Omit the fields never incremented for this pair (zero placeholders in the 2D array)
+            incrementDataByItemIdPair[itemIdPair] = dict([(field, count) for (field, count) in zip(self.fields, rowCounts) if count != 0]);
+
+        updateBuffer = dict();
+        updateBuffer["nAssociations"] = nRows;
+        updateBuffer["incrementDataByItemIdPair"] = incrementDataByItemIdPair;
+        updateBuffer["analyzedPatientItemIds"] = set(self.analyzedPatientItemIds);
+        log.debug("Materialized %d associations at decay epoch %d" % (nRows, self.epoch) );
+        return updateBuffer;
+
+    def clear(self):
+        """Reset to an empty buffer, e.g., after committing the materialized values"""
+        DecayingCountBuffer.__init__(self, self.decay, self.decayAllFields);
@@ -41,10 +41,15 @@ from medinfo.cpoe.Env import DATE_FORMAT
 from medinfo.db import DBUtil
 from medinfo.cpoe.test import TestAssociationAnalysis
 from medinfo.cpoe import AssociationAnalysis
+from medinfo.cpoe.DecayingCountBuffer import DecayingCountBuffer
 from medinfo.cpoe.test.Const import RUNNER_VERBOSITY
 from medinfo.cpoe.Const import DELTA_NAME_BY_SECONDS, SECONDS_PER_DAY;
 from Util import log;
 
+# Commit the accrued counts to the database when accrue this many association items, unless otherwise specified.
+#	1M seems to just fit within 7.5GB memory (see AssociationAnalysis --associationsPerCommit).
+DEFAULT_ASSOCIATIONS_PER_COMMIT = 1000000;
+
 class DecayAnalysisOptions:
 	"""Simple struct to pass filter parameters on which records to do analysis on"""
 	def __init__(self):
@@ -54,9 +59,10 @@ class DecayAnalysisOptions:
 		self.patientIds = None
 		self.decay = None
 		self.delta = timedelta(weeks=4)
-		self.associationsPerCommit = None
+		self.associationsPerCommit = DEFAULT_ASSOCIATIONS_PER_COMMIT	# Commit accrued counts in batches so memory stays bounded. If None, keep all in memory until the end, trading memory for fewer database decay updates. Not used in bufferMode
 		self.itemsPerUpdate = None
-		self.outputFile = None
+		self.bufferMode = False	# If set, decay all accrued fields (including time difference sums), but leave any counts already in the database undecayed
+		self.outputFile = None	# Deprecated, buffer files are no longer written. If set, same as bufferMode
 		self.skipLargerCountWindows = True;	# If set, then won't try to update association count fields longer than the given delta time, since will never be a different number than the next largest interval count and just consumes extra memory
 
 
@@ -68,7 +74,9 @@ class DecayingWindows:
 		self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
 		self.decayCount = 0
 
-	def standardDecay (self, decayAnalysisOptions):
+	def standardDecay (self, decayAnalysisOptions, nDecays=1):
+		"""Decay all of the counts in the database, nDecays times over, with a single pass update"""
+		decay = decayAnalysisOptions.decay ** nDecays
 		conn = self.connFactory.connection()
 		prefixes = ['', 'patient_', 'encounter_']
 		times = ['0', '3600', '7200', '21600', '43200', '86400', '172800', '345600', '604800', '1209600', '2592000', '7776000', '15552000', '31536000', '63072000', '126144000', 'any']
@@ -80,7 +88,7 @@ class DecayingWindows:
 			for prefix in prefixes:
 				for time in times:
 					fieldName = prefix + "count_" + str(time)
-					fields.append(fieldName + '=' + fieldName + "*" + str(decayAnalysisOptions.decay))
+					fields.append(fieldName + '=' + fieldName + "*" + repr(decay))
 
 			"""log.debug("starting to drop indices");
 			sqlQuery = "ALTER TABLE clinical_item_association drop CONSTRAINT clinical_item_association_pkey;"
@@ -132,9 +140,16 @@ class DecayingWindows:
 		if decayAnalysisOptions.decay is None:
 			decayAnalysisOptions.decay = 1-(1.0/decayAnalysisOptions.windowLength) #decay rate = (1 - (1/c)), where c = window length
 
-		currentBuffer = None;	# In memory buffer if using temp files. Otherwise, use the database as the data cache
-		if decayAnalysisOptions.outputFile is not None:
-			currentBuffer = dict();
+		# Accrue the decayed counts in memory, where each decay step is just an epoch increment rather than a rewrite of every count.
+		# In buffer mode, decay all of the accrued fields, but leave any counts already in the database as is.
+		# Otherwise, only decay count fields (as standardDecay does), and decay the counts already in the database
+		#	with a single update per commit by the total of the decay steps since the last commit.
+		isBufferMode = decayAnalysisOptions.bufferMode or decayAnalysisOptions.outputFile is not None;
+		countBuffer = DecayingCountBuffer(decayAnalysisOptions.decay, decayAllFields=isBufferMode)
+		nPendingDecays = 0;	# Decay steps not yet applied to the counts in the database
+
+		instance = AssociationAnalysis.AssociationAnalysis()
+		instance.itemsPerUpdate = decayAnalysisOptions.itemsPerUpdate
 
 		#####
 		# Step one delta (e.g., month) at a time until end date
@@ -148,26 +163,13 @@ class DecayingWindows:
 			log.debug(currentItemStart);
 			log.debug(currentItemEnd);
 
-			instance = AssociationAnalysis.AssociationAnalysis()
-			analysisOptions = AssociationAnalysis.AnalysisOptions()
-
-			if decayAnalysisOptions.outputFile is not None:
-				analysisOptions.bufferFile = decayAnalysisOptions.outputFile
-
 			# Decay any existing stats before learn new ones to increment
-			if currentBuffer is None:
-				self.standardDecay(decayAnalysisOptions)
-			else:
-				log.debug("buffer decay");
-				currentBuffer = instance.bufferDecay(currentBuffer, decayAnalysisOptions.decay)
+			countBuffer.decayStep()
+			nPendingDecays += 1
 			self.decayCount +=1
 
 			#Add in a new delta worth of training
-			instance.associationsPerCommit = decayAnalysisOptions.associationsPerCommit
-			instance.itemsPerUpdate = decayAnalysisOptions.itemsPerUpdate
-			log.debug(instance.associationsPerCommit);
-			log.debug(instance.itemsPerUpdate);
-
+			analysisOptions = AssociationAnalysis.AnalysisOptions()
 			analysisOptions.patientIds = decayAnalysisOptions.patientIds
 			analysisOptions.startDate = currentItemStart;
 			analysisOptions.endDate = currentItemEnd
@@ -191,38 +193,40 @@ class DecayingWindows:
 			log.debug("starting new delta");
 			log.debug(analysisOptions.startDate);
 			log.debug(analysisOptions.endDate);
-			instance.analyzePatientItems(analysisOptions) #if an outputFile has been set, it will automatically output buffer to the file
+			deltaBuffer = instance.analyzePatientItemsToBuffer(analysisOptions)
+			countBuffer.addUpdateBuffer(deltaBuffer)
+			del deltaBuffer
 			log.debug("finished new delta");
 
-			# if you have been doing everything in memory, then load the latest buffer from Analysis Options and merge it with your current buffer
-			if currentBuffer is not None:
-				bufferOneDelta = instance.loadUpdateBufferFromFile(decayAnalysisOptions.outputFile)
-				currentBuffer = instance.mergeBuffers(currentBuffer, bufferOneDelta)
-				log.debug("finished merge");
+			# Commit early if accrued too many associations to keep in memory
+			if not isBufferMode and decayAnalysisOptions.associationsPerCommit is not None and countBuffer.nAssociations() > decayAnalysisOptions.associationsPerCommit:
+				self.commitCountBuffer(instance, countBuffer, nPendingDecays, decayAnalysisOptions)
+				nPendingDecays = 0
 
 			#Increment dates to next four weeks
 			currentItemStart = currentItemEnd
 			currentItemEnd = currentItemStart + decayAnalysisOptions.delta
 
 		log.debug("Total number of decays: " + str(self.decayCount) );
-		
-		# Commit to database if have been doing everything in memory. (If not, then have already been commiting to database incrementally)
-		if currentBuffer is not None:
-			finalCommitBufferFileName = "finalCommitBuffer.txt"
-
-			if os.path.exists(decayAnalysisOptions.outputFile):
-				os.remove(decayAnalysisOptions.outputFile)
 
-			instance.saveBufferToFile(finalCommitBufferFileName, currentBuffer)
-			del currentBuffer #deleting the buffer to save memory, because commitUpdateBufferFromFile will need the memory equivalent of one new buffer
-			instance.commitUpdateBufferFromFile(str(finalCommitBufferFileName))
-
-			# Comment out if want the file to remain so can commit separetely or for debugging
-			if os.path.exists(finalCommitBufferFileName):
-				os.remove(finalCommitBufferFileName)
+		if isBufferMode:
+			nPendingDecays = 0;	# Buffer mode does not decay prior database counts
+		self.commitCountBuffer(instance, countBuffer, nPendingDecays, decayAnalysisOptions)
 
 		log.debug("finished process");
 
+	def commitCountBuffer(self, instance, countBuffer, nPendingDecays, decayAnalysisOptions):
+		"""Apply any pending decay steps to the counts in the database,
+		then materialize the true values of the accrued counts and add them in.
+		"""
+		if nPendingDecays > 0:
+			self.standardDecay(decayAnalysisOptions, nPendingDecays)
+		updateBuffer = countBuffer.materializeUpdateBuffer()
+		countBuffer.clear()
+		linkedItemIdsByBaseId = instance.dataManager.loadLinkedItemIdsByBaseId()
+		instance.commitUpdateBuffer(updateBuffer, linkedItemIdsByBaseId)
+		log.debug("finished commit");
+
 	def main (self, argv):
 		"""Main method, callable from command line"""
 		usageStr =  "usage: %prog [options] <patientIds>\n"+\
@@ -233,9 +237,10 @@ class DecayingWindows:
 		parser.add_option("-e", "--endDate", dest="endDate", metavar="<endDate>",  help="Date string (e.g., 2011-12-15), must be provided, will stop analysis on items occuring before this date.");
 		parser.add_option("-w", "--window", type="int", dest="window", metavar="<window>",  help="Window integer (e.g., 36), (unit is deltas, i.e. a window of 36 and a delta of 4 weeks means that after 36 x4 weeks, the data is decayed ~1/e ~ 0.37). More precisely, the window x delta is how long it will take for the data to decay to 38 percent of its original worth. Higher delta means it takes longer to decay. This number must be provided.");
 		parser.add_option("-d", "--delta", type="int", dest="delta", metavar="<delta>",  help="Delta integer (e.g., 4), (unit of time is weeks, defaults to 4 weeks), define in what increments do you want to read in the data. After each increment/delta, it performs a decay.");
-		parser.add_option("-a", "--associationsPerCommit", type="int", dest="associationsPerCommit", help="If provided, will commit incremental analysis results to the database when accrue this many association items.  Can help to avoid allowing accrual of too much buffered items whose runtime memory will exceed the 32bit 2GB program limit.")
+		parser.add_option("-a", "--associationsPerCommit", type="int", dest="associationsPerCommit", help="Commit incremental analysis results to the database when accrue this many association items (default %s).  Counts are accrued in memory until then, so larger values use more memory, but need fewer updates to decay the counts already in the database.  Ignored in buffer mode, which keeps all counts in memory until the end." % DEFAULT_ASSOCIATIONS_PER_COMMIT)
 		parser.add_option("-u", "--itemsPerUpdate", type="int", dest="itemsPerUpdate", help="If provided, when updating patient_item analyze_dates, will only update this many items at a time to avoid overloading MySQL query.")
-		parser.add_option("-o", "--outputFile", dest="outputFile", help="If provided, send buffer to output file rather than commiting to database")
+		parser.add_option("-b", "--bufferMode", dest="bufferMode", action="store_true", help="If set, decay all accrued fields (including time difference sums), but leave any counts already in the database undecayed. Counts are accrued in memory in either mode.")
+		parser.add_option("-o", "--outputFile", dest="outputFile", help="Deprecated, no buffer file is written anymore. If provided, same as --bufferMode.")
 		(options, args) = parser.parse_args(argv[1:])
 
 		decayAnalysisOptions = DecayAnalysisOptions()
@@ -255,8 +260,8 @@ class DecayingWindows:
 		if options.delta != None:
 			decayAnalysisOptions.delta = timedelta(weeks=(options.delta)) #length of one decay item
 
-		if options.outputFile is not None:
-			decayAnalysisOptions.outputFile = options.outputFile
+		if options.bufferMode or options.outputFile is not None:
+			decayAnalysisOptions.bufferMode = True
 
 		#set patientIds based on either a file input or args
 		decayAnalysisOptions.patientIds = list()
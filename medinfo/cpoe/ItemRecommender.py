@@ -12,6 +12,8 @@ from optparse import OptionParser;
 import json;
 import urlparse;
 import math;
+import copy;
+import numpy as np;
 from datetime import datetime, timedelta;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -37,6 +39,9 @@ DEFAULT_DERIVED_STATS = ["baselineFreq","conditionalFreq","freqRatio"];
 # Test value for total patient count when simulating calculations for unit test
 SIMULATED_PATIENT_COUNT = 3000.0;
 
+# Initial number of candidate items to allocate space for when incrementally scoring
+INITIAL_SCORER_CAPACITY = 1024;
+
 class RecommenderQuery:
     """Simple struct to pass query parameters
     """
@@ -221,6 +226,12 @@ class BaseItemRecommender:
             if not extConn:
                 conn.close();
 
+    def incrementalScorer(self, query, conn=None):
+        """Scorer object that can incrementally maintain recommendation scores as query items are added one at a time.
+        Return None if not supported by the recommender, so callers should rerun the recommender for each query instead.
+        """
+        return None;
+
     def isItemRecommendable(clinicalItemId, queryItemIds, recQuery, categoryIdByItemId):
         """Decide if the next clinical item could even possibly appear
         in the recommendation list.  (Because if not, no point in trying to
@@ -420,72 +431,10 @@ class BaseItemRecommender:
             aggregateResult["nB"] = componentResultsById.values()[0]["nB"];
             aggregateResult["N"] = componentResultsById.values()[0]["N"];
 
-            if query.aggregationMethod in ("weighted","unweighted"):
-                # Standard (weighted) average of component scores
-                aggregateResult["sum(nAB*weight)"] = 0.0;
-                aggregateResult["sum(nA*weight)"] = 0.0;
-                aggregateResult["sum(weight)"] = 0.0;
-
-                for componentId, component in componentResultsById.iteritems():
-                    component["weight"] = 1.0;
-                    if query.aggregationMethod == "weighted":
-                        # Weighted scaling of scores inversely proportional to the query item frequency,
-                        #   so less common (and thus more specific) query items are paid more attention to in the aggregate recommendations
-                        #   Though should beware this may give disproportionate weight to unusually rare query items
-                    	component["weight"] = 1.0 / component["nA"];
-
-                    aggregateResult["sum(nAB*weight)"] += (component["nAB"] * component["weight"]);
-                    aggregateResult["sum(nA*weight)"] += (component["nA"] * component["weight"]);
-                    aggregateResult["sum(weight)"] += component["weight"];
-
-            	aggregateResult["nAB"] = aggregateResult["sum(nAB*weight)"] / aggregateResult["sum(weight)"];   # Complete the weighted average score calculation
-            	aggregateResult["nA"] = aggregateResult["sum(nA*weight)"] / aggregateResult["sum(weight)"];
-
-            elif query.aggregationMethod in ("NaiveBayes"):
-                # Naive Bayes products
-                aggregateResult["product(nAB/nB)"] = 1.0;
-                aggregateResult["product(nA/N)"] = 1.0;
-
-                for componentId, component in componentResultsById.iteritems():
-                    nAB_ = max(component["nAB"],DEGENERATE_VALUE_ADJUSTMENT);   # Small adjustment to avoid zero value that will wipe out all information in product
-                    nA_ = max(component["nA"],DEGENERATE_VALUE_ADJUSTMENT); # Similar check should not be necessary
-                    aggregateResult["product(nAB/nB)"] *= nAB_ / component["nB"];
-                    aggregateResult["product(nA/N)"] *= nA_ / component["N"];
-
-                aggregateResult["nAB"] = aggregateResult["product(nAB/nB)"] * aggregateResult["nB"]
-                aggregateResult["nA"] = aggregateResult["product(nA/N)"] * aggregateResult["N"];
-
-            elif query.aggregationMethod in ("SerialBayes"):
-                # "Serial" Bayes method with NaiveBayes assumption,
-                #   but past Post-Test Odds based on Pre-Test Odds and successive products of Positive Likelihood Ratios
-                """
-                # Direct calculation approach
-                preTestProbB = float(aggregateResult["nB"]) / aggregateResult["N"];
-                preTestOddsB = preTestProbB / (1.0-preTestProbB);
-
-                productLR = 1.0;
-                for componentId, component in componentResultsById.iteritems():
-                    contStats = ContingencyStats( component["nAB"], component["nA"], component["nB"], component["N"] );
-                    contStats.normalize(truncateNegativeValues=True);
-                    productLR *= contStats["LR+"];
-
-                postTestOddsB = preTestOddsB * productLR;
-                postTestProbB = postTestOddsB / (1+postTestOddsB);
-
-                aggregateResult["nAB"] = postTestProbB*100.0;
-                aggregateResult["nA"] = 100.0;  # Arbitrary selection?  Could have done weighted average of component nAs?
-                """
-                aggregateResult["Product(nAB/nB)"] = 1.0;
-                aggregateResult["Product((nA-nAB)/(N-nB))"] = 1.0;
-
-                for componentId, component in componentResultsById.iteritems():
-                    nAB_ = max(component["nAB"],DEGENERATE_VALUE_ADJUSTMENT);   # Small adjustment to avoid zero value that will wipe out all information in product
-                    nA_ = component["nA"];
-                    aggregateResult["Product(nAB/nB)"] *= nAB_ / component["nB"];
-                    aggregateResult["Product((nA-nAB)/(N-nB))"] *= (nA_-nAB_) / (component["N"]-component["nB"]);
-
-                aggregateResult["nAB"] = aggregateResult["Product(nAB/nB)"] * aggregateResult["nB"];
-                aggregateResult["nA"] = aggregateResult["Product((nA-nAB)/(N-nB))"] * (aggregateResult["N"]-aggregateResult["nB"]) + aggregateResult["nAB"];
+            BaseItemRecommender.initAggregateStats(aggregateResult, query);
+            for componentId, component in componentResultsById.iteritems():
+                BaseItemRecommender.addAggregateComponent(aggregateResult, component, query);
+            BaseItemRecommender.completeAggregateStats(aggregateResult, query);
 
         # Populate derived statistics that may be used as scoring measures
         BaseItemRecommender.populateDerivedStats(aggregateResult, statIds);
@@ -493,6 +442,101 @@ class BaseItemRecommender:
 
     populateAggregateStats = staticmethod(populateAggregateStats);
 
+    def initAggregateStats(aggregateResult, query):
+        """Initialize the running sums / products used to aggregate component results
+        by the query.aggregationMethod.  See populateAggregateStats.
+        """
+        if query.aggregationMethod in ("weighted","unweighted"):
+            # Standard (weighted) average of component scores
+            aggregateResult["sum(nAB*weight)"] = 0.0;
+            aggregateResult["sum(nA*weight)"] = 0.0;
+            aggregateResult["sum(weight)"] = 0.0;
+        elif query.aggregationMethod in ("NaiveBayes"):
+            # Naive Bayes products
+            aggregateResult["product(nAB/nB)"] = 1.0;
+            aggregateResult["product(nA/N)"] = 1.0;
+        elif query.aggregationMethod in ("SerialBayes"):
+            # "Serial" Bayes method with NaiveBayes assumption,
+            #   but past Post-Test Odds based on Pre-Test Odds and successive products of Positive Likelihood Ratios
+            aggregateResult["Product(nAB/nB)"] = 1.0;
+            aggregateResult["Product((nA-nAB)/(N-nB))"] = 1.0;
+
+    initAggregateStats = staticmethod(initAggregateStats);
+
+    def addAggregateComponent(aggregateResult, component, query):
+        """Accumulate one more component result into the running sums / products of the aggregate result.
+        Since only need the running values, can keep adding components (e.g., as query items accumulate)
+        without revisiting the prior ones.
+        """
+        if query.aggregationMethod in ("weighted","unweighted"):
+            component["weight"] = 1.0;
+            if query.aggregationMethod == "weighted":
+                # Weighted scaling of scores inversely proportional to the query item frequency,
+                #   so less common (and thus more specific) query items are paid more attention to in the aggregate recommendations
+                #   Though should beware this may give disproportionate weight to unusually rare query items
+                component["weight"] = 1.0 / component["nA"];
+
+            aggregateResult["sum(nAB*weight)"] += (component["nAB"] * component["weight"]);
+            aggregateResult["sum(nA*weight)"] += (component["nA"] * component["weight"]);
+            aggregateResult["sum(weight)"] += component["weight"];
+
+        elif query.aggregationMethod in ("NaiveBayes"):
+            nAB_ = max(component["nAB"],DEGENERATE_VALUE_ADJUSTMENT);   # Small adjustment to avoid zero value that will wipe out all information in product
+            nA_ = max(component["nA"],DEGENERATE_VALUE_ADJUSTMENT); # Similar check should not be necessary
+            aggregateResult["product(nAB/nB)"] *= nAB_ / component["nB"];
+            aggregateResult["product(nA/N)"] *= nA_ / component["N"];
+
+        elif query.aggregationMethod in ("SerialBayes"):
+            """
+            # Direct calculation approach
+            preTestProbB = float(aggregateResult["nB"]) / aggregateResult["N"];
+            preTestOddsB = preTestProbB / (1.0-preTestProbB);
+
+            productLR = 1.0;
+            for componentId, component in componentResultsById.iteritems():
+                contStats = ContingencyStats( component["nAB"], component["nA"], component["nB"], component["N"] );
+                contStats.normalize(truncateNegativeValues=True);
+                productLR *= contStats["LR+"];
+
+            postTestOddsB = preTestOddsB * productLR;
+            postTestProbB = postTestOddsB / (1+postTestOddsB);
+
+            aggregateResult["nAB"] = postTestProbB*100.0;
+            aggregateResult["nA"] = 100.0;  # Arbitrary selection?  Could have done weighted average of component nAs?
+            """
+            nAB_ = max(component["nAB"],DEGENERATE_VALUE_ADJUSTMENT);   # Small adjustment to avoid zero value that will wipe out all information in product
+            nA_ = component["nA"];
+            aggregateResult["Product(nAB/nB)"] *= nAB_ / component["nB"];
+            aggregateResult["Product((nA-nAB)/(N-nB))"] *= (nA_-nAB_) / (component["N"]-component["nB"]);
+
+    addAggregateComponent = staticmethod(addAggregateComponent);
+
+    def completeAggregateStats(aggregateResult, query):
+        """Complete the aggregate nAB and nA estimates from the running sums / products"""
+        if query.aggregationMethod in ("weighted","unweighted"):
+            aggregateResult["nAB"] = aggregateResult["sum(nAB*weight)"] / aggregateResult["sum(weight)"];   # Complete the weighted average score calculation
+            aggregateResult["nA"] = aggregateResult["sum(nA*weight)"] / aggregateResult["sum(weight)"];
+        elif query.aggregationMethod in ("NaiveBayes"):
+            aggregateResult["nAB"] = aggregateResult["product(nAB/nB)"] * aggregateResult["nB"]
+            aggregateResult["nA"] = aggregateResult["product(nA/N)"] * aggregateResult["N"];
+        elif query.aggregationMethod in ("SerialBayes"):
+            aggregateResult["nAB"] = aggregateResult["Product(nAB/nB)"] * aggregateResult["nB"];
+            aggregateResult["nA"] = aggregateResult["Product((nA-nAB)/(N-nB))"] * (aggregateResult["N"]-aggregateResult["nB"]) + aggregateResult["nAB"];
+
+    completeAggregateStats = staticmethod(completeAggregateStats);
+
+
+    def isResultFilteredByQuery(aggregateResult, query):
+        """Look for value filters in the query that exclude the (populated) aggregate result"""
+        for (fieldOp, value) in query.fieldFilters.iteritems():
+            if value is not None:
+                field = fieldOp[:-1];
+                op = fieldOp[-1];
+                if (aggregateResult[field] < value and op == "<") or (aggregateResult[field] > value and op == ">"):
+                    return True;
+        return False;
+
+    isResultFilteredByQuery = staticmethod(isResultFilteredByQuery);
 
     def filterAggregateResultsByQuery( self, aggregateResultsByItemId, query ):
         """Filter down the total collection of aggregateResultsByItemId into
@@ -508,17 +552,7 @@ class BaseItemRecommender:
             #   to enable subsequent sorting and filtering
             self.populateAggregateStats(aggregateResult, query);
 
-            # Look for value filters
-            excludeResult = False;
-            for (fieldOp, value) in query.fieldFilters.iteritems():
-                if value is not None:
-                    field = fieldOp[:-1];
-                    op = fieldOp[-1];
-                    if (aggregateResult[field] < value and op == "<") or (aggregateResult[field] > value and op == ">"):
-                        excludeResult = True;
-                        break;  # Don't need to look anymore
-
-            if not excludeResult:
+            if not self.isResultFilteredByQuery(aggregateResult, query):
                 aggregateResultsWithScore.append( (aggregateResult[query.sortField], aggregateResult) );
 
         aggregateResultsWithScore.sort();
@@ -562,30 +596,7 @@ class ItemAssociationRecommender(BaseItemRecommender):
             extConn = False;
 
         try:
-            # Determine sorting / scoring field based on time limit parameters
-            countField = "count_any";
-            if query.timeDeltaMax is not None:
-                timeDeltaSeconds = (query.timeDeltaMax.days*SECONDS_PER_DAY + query.timeDeltaMax.seconds);
-                countField = "count_%d" % timeDeltaSeconds;
-            countField = query.countPrefix+countField;
-
-            sqlQuery = SQLQuery();
-            sqlQuery.addSelect("cia."+query.sourceCol()+"");
-            sqlQuery.addSelect("cia."+query.targetCol()+"");
-            sqlQuery.addSelect("cia."+query.countPrefix+"count_0");
-            sqlQuery.addSelect("cia."+countField );
-            sqlQuery.addFrom("clinical_item_association as cia");
-            sqlQuery.addWhere("count_any > 0"); # Don't bother pulling no association counts (even better if these sparse records were not stored in the first place)
-
-            # Test / Debug case, want to put an artificial limit on items recommended
-            if query.maxRecommendedId is not None:
-                sqlQuery.addWhere("cia."+query.targetCol()+" <= %s" % query.maxRecommendedId );
-
-            # Caller may want to filter recommendations to exclude certain category of items
-            if query.excludeCategoryIds:
-                sqlQuery.addFrom("clinical_item as ci");
-                sqlQuery.addWhere("cia."+query.targetCol()+" = ci.clinical_item_id");
-                sqlQuery.addWhereNotIn("ci.clinical_item_category_id", query.excludeCategoryIds );
+            sqlQuery = self.associationSQLQuery(query);
 
             if default:
                 # Just query for most common items overall, no particular associations / key item priming
@@ -617,12 +628,7 @@ class ItemAssociationRecommender(BaseItemRecommender):
                 # Special case of an empty query set, just look for the most commonly used items in general
                 return self( query, default=True, conn=conn );
             else:
-                # Determine sorting / scoring field based on time limit parameters
-                countField = "count_any";
-                if query.timeDeltaMax is not None:
-                    timeDeltaSeconds = (query.timeDeltaMax.days*SECONDS_PER_DAY + query.timeDeltaMax.seconds);
-                    countField = "count_%d" % timeDeltaSeconds;
-                countField = query.countPrefix+countField;
+                countField = self.associationCountField(query);
 
                 #if query.limit is not None:
                     # Don't need to return whole data table?  Maybe just get enough to fulfill query quantity?
@@ -645,6 +651,44 @@ class ItemAssociationRecommender(BaseItemRecommender):
             if not extConn:
                 conn.close();
 
+    def associationCountField(self, query):
+        """Determine sorting / scoring field based on time limit parameters"""
+        countField = "count_any";
+        if query.timeDeltaMax is not None:
+            timeDeltaSeconds = (query.timeDeltaMax.days*SECONDS_PER_DAY + query.timeDeltaMax.seconds);
+            countField = "count_%d" % timeDeltaSeconds;
+        countField = query.countPrefix+countField;
+        return countField;
+
+    def associationSQLQuery(self, query):
+        """Base SQL query for the association counts from query (source) items to recommended (target) items"""
+        countField = self.associationCountField(query);
+
+        sqlQuery = SQLQuery();
+        sqlQuery.addSelect("cia."+query.sourceCol()+"");
+        sqlQuery.addSelect("cia."+query.targetCol()+"");
+        sqlQuery.addSelect("cia."+query.countPrefix+"count_0");
+        sqlQuery.addSelect("cia."+countField );
+        sqlQuery.addFrom("clinical_item_association as cia");
+        sqlQuery.addWhere("count_any > 0"); # Don't bother pulling no association counts (even better if these sparse records were not stored in the first place)
+
+        # Test / Debug case, want to put an artificial limit on items recommended
+        if query.maxRecommendedId is not None:
+            sqlQuery.addWhere("cia."+query.targetCol()+" <= %s" % query.maxRecommendedId );
+
+        # Caller may want to filter recommendations to exclude certain category of items
+        if query.excludeCategoryIds:
+            sqlQuery.addFrom("clinical_item as ci");
+            sqlQuery.addWhere("cia."+query.targetCol()+" = ci.clinical_item_id");
+            sqlQuery.addWhereNotIn("ci.clinical_item_category_id", query.excludeCategoryIds );
+        return sqlQuery;
+
+    def incrementalScorer(self, query, conn=None):
+        """Scorer that keeps the aggregate recommendation stats for a growing query item set,
+        to find the rank of specific items without rerunning the full recommender query (see IncrementalAssociationScorer).
+        """
+        return IncrementalAssociationScorer(self, query, conn=conn);
+
     def loadResultModels( self, query, sqlQuery, conn ):
         """Query for the results from the SQL query, but if the dataCache is set on this instance,
         see if this can be retrieved/stored from there as well, to minimize repetitive database hits.
@@ -914,6 +958,133 @@ class ItemAssociationRecommender(BaseItemRecommender):
         timer = time.time() - timer;
         log.info("%.3f seconds to complete",timer);
 
+class IncrementalAssociationScorer:
+    """Maintain the aggregate recommendation stats of an ItemAssociationRecommender
+    for a query item set that grows one item at a time (e.g., serially reviewing a patient's orders).
+
+    Rerunning the full recommender for each new query item reloads and reaggregates the component results
+    of every query item so far, then sorts every candidate item.  Instead, keep the running sums / products
+    per candidate item (see BaseItemRecommender.addAggregateComponent), so adding a query item
+    only updates the candidates associated with it.  The rank of a specific item is then found
+    by counting the candidates with a better score, without sorting them all.
+    Candidates tied in score with the item do not count against its rank.
+    """
+    def __init__(self, recommender, query, conn=None):
+        self.recommender = recommender;
+        self.query = copy.copy(query);
+        self.conn = conn;
+
+        self.countField = recommender.associationCountField(query);
+        self.sqlQuery = recommender.associationSQLQuery(query);
+        self.dataCache = dict();    # Local cache of association results if the recommender is not already caching
+
+        self.reset();
+
+    def reset(self):
+        """Start over with an empty query item set (e.g., for the next patient)"""
+        self.queryItemIds = set();
+        self.rowByItemId = dict();
+        self.aggregateResults = list(); # Running aggregate stats for each candidate item row
+        self.scores = np.zeros(INITIAL_SCORER_CAPACITY);
+        self.isQueryItem = np.zeros(INITIAL_SCORER_CAPACITY, dtype=bool); # Candidates that have since been added to the query set
+        self.isFiltered = np.zeros(INITIAL_SCORER_CAPACITY, dtype=bool);  # Candidates excluded by query field filters
+
+    def nRows(self):
+        return len(self.aggregateResults);
+
+    def hasResults(self):
+        """Whether any association results found for the current query items.
+        If not, the recommender would instead return default recommendations, which are not incrementally scored here.
+        """
+        return not self.isQueryItem[:self.nRows()].all();
+
+    def addQueryItem(self, queryItemId):
+        """Add one more item to the query set, updating the aggregate stats for the items associated with it"""
+        if queryItemId in self.queryItemIds:
+            return;
+        self.queryItemIds.add(queryItemId);
+
+        updatedRows = set();
+        for component in self.loadComponentResults(queryItemId):
+            targetItemId = component[self.query.targetCol()];
+            row = self.rowByItemId.get(targetItemId);
+            if row is None:
+                row = self.addRow(targetItemId, component);
+            BaseItemRecommender.addAggregateComponent(self.aggregateResults[row], component, self.query);
+            updatedRows.add(row);
+
+        if not self.query.targetItemIds and queryItemId in self.rowByItemId:
+            # Query items generally have no reason to be in recommended set
+            self.isQueryItem[self.rowByItemId[queryItemId]] = True;
+
+        for row in updatedRows:
+            self.updateScore(row);
+
+    def loadComponentResults(self, queryItemId):
+        """Association results from the given query item to each target item, with core association counts populated"""
+        itemQuery = copy.copy(self.query);
+        itemQuery.queryItemIds = set([queryItemId]);
+
+        dataManager = self.recommender.dataManager;
+        origDataCache = dataManager.dataCache;
+        if origDataCache is None:
+            # Reuse the same loaded associations for every query item, rather than querying the database for each
+            dataManager.dataCache = self.dataCache;
+        try:
+            resultModels = self.recommender.loadResultModels(itemQuery, self.sqlQuery, conn=self.conn);
+            if len(resultModels) > 0:
+                self.recommender.populateResultCounts(resultModels, itemQuery, self.countField, conn=self.conn);
+        finally:
+            dataManager.dataCache = origDataCache;
+        return resultModels;
+
+    def addRow(self, itemId, component):
+        row = self.nRows();
+        if row >= len(self.scores):
+            # Out of space, double the capacity to amortize copying
+            self.scores = np.concatenate([self.scores, np.zeros(len(self.scores))]);
+            self.isQueryItem = np.concatenate([self.isQueryItem, np.zeros(len(self.isQueryItem), dtype=bool)]);
+            self.isFiltered = np.concatenate([self.isFiltered, np.zeros(len(self.isFiltered), dtype=bool)]);
+
+        # Baseline counts should be identical across components
+        aggregateResult = RowItemModel();
+        aggregateResult["clinical_item_id"] = itemId;
+        aggregateResult["nB"] = component["nB"];
+        aggregateResult["N"] = component["N"];
+        BaseItemRecommender.initAggregateStats(aggregateResult, self.query);
+
+        self.rowByItemId[itemId] = row;
+        self.aggregateResults.append(aggregateResult);
+        self.isQueryItem[row] = (not self.query.targetItemIds and itemId in self.queryItemIds);
+        return row;
+
+    def updateScore(self, row):
+        """Recalculate the score for a candidate item row from its running aggregate stats"""
+        aggregateResult = RowItemModel(self.aggregateResults[row]);   # Copy, so derived stats are freshly calculated
+        BaseItemRecommender.completeAggregateStats(aggregateResult, self.query);
+        BaseItemRecommender.populateAggregateStats(aggregateResult, self.query);
+        self.scores[row] = aggregateResult["score"];
+        self.isFiltered[row] = BaseItemRecommender.isResultFilteredByQuery(aggregateResult, self.query);
+
+    def itemRank(self, itemId):
+        """Return 2-ple (rank, score) for the item as would be found by scanning down the full recommended list:
+        the item's position in the list (starting at 1) and its score,
+        or the length of the list and None if the item is not in the list.
+        """
+        nRows = self.nRows();
+        isCandidate = ~(self.isQueryItem[:nRows] | self.isFiltered[:nRows]);
+        row = self.rowByItemId.get(itemId);
+        if row is None or not isCandidate[row]:
+            return (int(isCandidate.sum()), None);
+
+        score = self.scores[row];
+        candidateScores = self.scores[:nRows][isCandidate];
+        if self.query.sortReverse:
+            numBetter = (candidateScores > score).sum();
+        else:
+            numBetter = (candidateScores < score).sum();
+        return (int(numBetter)+1, float(score));
+
 class BaselineFrequencyRecommender(ItemAssociationRecommender):
     """Concrete implementation class for item (e.g., order) recommendation.
     Simple default recommender that just recomds items
@@ -922,6 +1093,9 @@ class BaselineFrequencyRecommender(ItemAssociationRecommender):
     def __call__(self, query, conn=None):
         return ItemAssociationRecommender.__call__(self,query,default=True,conn=conn);
 
+    def incrementalScorer(self, query, conn=None):
+        return None;    # Recommendations do not depend on query items
+
 class RandomItemRecommender(BaseItemRecommender):
     """Absolute baseline for comparison.
     Recommender that just randomly scores and recommends items regardless of input.
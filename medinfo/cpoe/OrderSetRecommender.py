@@ -10,6 +10,8 @@ from optparse import OptionParser;
 import json;
 import urlparse;
 import math;
+import numpy as np;
+import scipy.sparse;
 from datetime import datetime, timedelta;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -60,6 +62,16 @@ class OrderSetRecommender(BaseItemRecommender):
         self.itemIdsByOrderSetId = None;
         self.orderSetIdsByItemId = None;
 
+        # Compiled order set x item incidence matrix and vectors aligned to its rows / columns
+        self.orderSetIds = None;
+        self.itemIds = None;
+        self.colByItemId = None;
+        self.incidenceMatrix = None;
+        self.orderSetSizes = None;
+        self.orderSetCounts = None;
+        self.categoryIds = None;
+        self.isCandidateItem = None;
+
     def initItemLookups(self, query):
         """Load lookup info and save into local member variables for reuse later
         so don't have to do wasteful repeat DB lookups for serial queries
@@ -97,43 +109,129 @@ class OrderSetRecommender(BaseItemRecommender):
             if self.isItemRecommendable(itemId, emptyQuerySet, query, self.categoryIdByItemId):
                 self.candidateItemIds.add(itemId);
 
+        self.initIncidenceMatrix();
+
+    def initIncidenceMatrix(self):
+        """Compile the order set membership lookups into a sparse (order sets x items) incidence matrix,
+        so order set weights and item scores for a query are just two sparse matrix products
+        rather than repeated set intersections for every order set and item pair.
+        Columns are all of the items in any order set, in item ID order.
+        """
+        self.orderSetIds = sorted(self.itemIdsByOrderSetId.keys());
+        self.itemIds = np.array(sorted(self.orderSetIdsByItemId.keys()), dtype=np.int64);
+        self.colByItemId = dict([(itemId, col) for (col, itemId) in enumerate(self.itemIds.tolist())]);
+
+        rows = list();
+        cols = list();
+        for row, orderSetId in enumerate(self.orderSetIds):
+            for itemId in self.itemIdsByOrderSetId[orderSetId]:
+                rows.append(row);
+                cols.append(self.colByItemId[itemId]);
+        self.incidenceMatrix = \
+            scipy.sparse.csr_matrix \
+            (   (np.ones(len(rows)), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+                shape=(len(self.orderSetIds), len(self.itemIds)),
+            );
+        self.orderSetSizes = np.asarray(self.incidenceMatrix.sum(axis=1)).ravel();
+        self.orderSetCounts = np.asarray(self.incidenceMatrix.sum(axis=0)).ravel();
+
+        # Items without a recognized category are never recommendable, so the placeholder category does not matter
+        self.categoryIds = np.array([self.categoryIdByItemId.get(itemId, 0) for itemId in self.itemIds], dtype=np.int64);
+        self.isCandidateItem = np.in1d(self.itemIds, np.array(list(self.candidateItemIds), dtype=np.int64));
+
     def __call__(self, query):
         # Given query items, lookup existing order sets to find and score related items
+        return self.recommendBatch([query])[0];
+
+    def recommendBatch(self, queries):
+        """Score a batch of queries (e.g., many patients' query item sets) at once.
+        Query item indicators for all of the queries are stacked into one sparse matrix,
+        so the order set weights and then the item scores for all queries come from one sparse matrix product each.
+        Returns a list of recommendedData lists, one for each query.
+        """
+        if len(queries) < 1:
+            return [];
 
         # Load item lookup information
         if self.itemsById is None:
-            self.initItemLookups(query);
+            self.initItemLookups(queries[0]);
+
+        # Query x item indicator matrix, only counting query items that are in any order set
+        queryItemCountByIdList = list();
+        rows = list();
+        cols = list();
+        for iQuery, query in enumerate(queries):
+            queryItemCountById = self.queryItemCountById(query);
+            queryItemCountByIdList.append(queryItemCountById);
+            for itemId in queryItemCountById:
+                if itemId in self.colByItemId:
+                    rows.append(iQuery);
+                    cols.append(self.colByItemId[itemId]);
+        queryMatrix = \
+            scipy.sparse.csr_matrix \
+            (   (np.ones(len(rows)), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+                shape=(len(queries), len(self.itemIds)),
+            );
+
+        # Primary execution.  Apply queries to generate scored relationship to each order set.
+        orderSetWeightMatrix = self.estimateOrderSetWeightMatrix(queryMatrix);
+
+        # Composite scores for items by weighted sum of P(item|OrderSet) across the order sets
+        itemWeightMatrix = orderSetWeightMatrix * (1.0 / np.maximum(self.orderSetSizes, 1.0));
+        scoreMatrix = np.asarray(self.incidenceMatrix.T.dot(itemWeightMatrix.T)).T;
 
-        # Adapt query into dictionary format
+        recommendedDataList = list();
+        for iQuery, query in enumerate(queries):
+            weightByOrderSetId = dict(zip(self.orderSetIds, orderSetWeightMatrix[iQuery].tolist()));
+            recommendedDataList.append(self.rankedItemModels(query, queryItemCountByIdList[iQuery], weightByOrderSetId, scoreMatrix[iQuery]));
+        return recommendedDataList;
+
+    def queryItemCountById(self, query):
+        """Adapt query into dictionary format"""
         queryItemCountById = query.queryItemIds;
         if not isinstance(queryItemCountById, dict):    # Not a dictionary, probably a one dimensional list/set, then just add counts of 1
             itemIds = queryItemCountById;
             queryItemCountById = dict();
             for itemId in itemIds:
                 queryItemCountById[itemId] = 1;
+        return queryItemCountById;
+
+    def estimateOrderSetWeightMatrix(self, queryMatrix):
+        """Matrix equivalent of estimateOrderSetWeights for a (queries x items) indicator matrix.
+        Returns a dense (queries x order sets) matrix of P(OrderSet|queryItems) estimates.
+        """
+        numQueryItemsInOrderSet = np.asarray(queryMatrix.dot(self.incidenceMatrix.T).todense(), dtype=float);
+        numQueryItemsInAnyOrderSet = np.asarray(queryMatrix.sum(axis=1), dtype=float).ravel();
 
-        # Primary execution.  Apply query to generate scored relationship to each order set.
-        weightByOrderSetId = self.estimateOrderSetWeights(queryItemCountById, self.itemIdsByOrderSetId, self.orderSetIdsByItemId);
+        # Blank query or otherwise searching for things we have no data.
+        # Treat as if effectively querying for all possible query items equally
+        isBlankQuery = (numQueryItemsInAnyOrderSet < 1);
+        numQueryItemsInOrderSet[isBlankQuery] = self.orderSetSizes;
+        numQueryItemsInAnyOrderSet[isBlankQuery] = len(self.itemIds);
 
-        # Composite scores for (recommendable) items by taking weighted average across the top items for each topic
-        recScoreByItemId = dict();
-        for itemId in self.candidateItemIds:
-            if self.isItemRecommendable(itemId, queryItemCountById, query, self.categoryIdByItemId):
-                recScoreByItemId[itemId] = 0.0;
-        for orderSetId, orderSetWeight in weightByOrderSetId.iteritems():
-            for itemId in recScoreByItemId.keys():
-                itemWeight = self.itemOrderSetWeight(itemId, orderSetId, self.itemIdsByOrderSetId);
-                recScoreByItemId[itemId] += orderSetWeight*itemWeight;
+        return numQueryItemsInOrderSet / np.maximum(numQueryItemsInAnyOrderSet, 1.0)[:,np.newaxis];
 
-        # Build 2-pls with lists to sort by score
-        recommendedData = list();
-        numItemsInAnyOrderSet = len(self.orderSetIdsByItemId);
-        for itemId, totalItemWeight in recScoreByItemId.iteritems():
-            tfidf = 0.0;
+    def candidateMask(self, query, queryItemCountById):
+        """Boolean vector over the item columns for which items are recommendable for the query"""
+        isCandidate = self.isCandidateItem & ~np.in1d(self.itemIds, np.array(list(queryItemCountById), dtype=np.int64));
+        if query.excludeItemIds:
+            isCandidate &= ~np.in1d(self.itemIds, np.array(list(query.excludeItemIds), dtype=np.int64));
+        if query.excludeCategoryIds:
+            isCandidate &= ~np.in1d(self.categoryIds, np.array(list(query.excludeCategoryIds), dtype=np.int64));
+        return isCandidate;
+
+    def rankedItemModels(self, query, queryItemCountById, weightByOrderSetId, totalItemWeights):
+        """Build 2-pls for the candidate items of a query, sorted by score (then item ID) in descending order"""
+        columns = np.flatnonzero(self.candidateMask(query, queryItemCountById));
+        itemIds = self.itemIds[columns];
+        totalItemWeights = totalItemWeights[columns];
 
-            if itemId in self.orderSetIdsByItemId:
-                numOrderSetsWithItem = len(self.orderSetIdsByItemId[itemId]);
-                tfidf = totalItemWeight * numItemsInAnyOrderSet / numOrderSetsWithItem;    # Scale TF*IDF score based on baseline order set counts to prioritize disproportionately common items
+        # Scale TF*IDF score based on baseline order set counts to prioritize disproportionately common items
+        numItemsInAnyOrderSet = len(self.itemIds);
+        tfidfs = totalItemWeights * numItemsInAnyOrderSet / self.orderSetCounts[columns];
+
+        recommendedData = list();
+        for itemId, totalItemWeight, tfidf in zip(itemIds.tolist(), totalItemWeights.tolist(), tfidfs.tolist()):
             itemModel = \
                 {   "totalItemWeight": totalItemWeight, "tf": totalItemWeight, "PPV": totalItemWeight, "P(item|query)": totalItemWeight, "P(B|A)": totalItemWeight,
                     "tfidf": tfidf, "lift": tfidf, "interest": tfidf, "P(item|query)/P(item)": tfidf, "P(B|A)/P(B)": tfidf,
@@ -11,6 +11,7 @@ from optparse import OptionParser
 from cStringIO import StringIO;
 from datetime import timedelta;
 from pprint import pprint;
+import numpy as np;
 
 from medinfo.common.Const import COMMENT_TAG, NULL_STRING;
 from medinfo.common.Util import stdOpen, ProgressDots, loadJSONDict;
@@ -22,12 +23,46 @@ from Util import log;
 
 DEFAULT_TOPIC_ITEM_COUNT = 100; # When using or printing out topic information, number of top scored items to consider
 BUFFER_UPDATE_SIZE = 100000;   # Number of document Bag-of-Words to keep in memory before performing model updates.
+CORPUS_FILE_EXT = ".mm";    # Extension for corpus files serialized in (gensim) Matrix Market format
+
+class ItemVocabulary(dict):
+    """Sparse id2word translation for topic models.
+    Models expect a word for every possible item ID up to the maximum, and judge vocabulary size
+    by the maximum ID key or the length of this mapping.  Rather than populating an entry
+    for every ID from 0 to the maximum, only store the words (descriptions) for the items of interest,
+    translate any other ID in range to a default word, and report the length of the full ID range.
+    """
+    def __init__(self, wordById, numTerms):
+        dict.__init__(self, wordById);
+        self.numTerms = numTerms;
+        if numTerms > 0 and (numTerms-1) not in self:
+            self[numTerms-1] = self.defaultWord(numTerms-1);    # Models look for the maximum ID key
+
+    def defaultWord(self, itemId):
+        return str(itemId);  # Default to just the same as the ID string
+
+    def __missing__(self, itemId):
+        if 0 <= itemId < self.numTerms:
+            return self.defaultWord(itemId);
+        raise KeyError(itemId);
+
+    def __len__(self):
+        return self.numTerms;
+
+class ItemIdVocabulary(ItemVocabulary):
+    """Translate item IDs to themselves, to report raw IDs from the models instead of descriptions"""
+    def __init__(self, numTerms):
+        ItemVocabulary.__init__(self, {}, numTerms);
+
+    def defaultWord(self, itemId):
+        return itemId;
 
 class TopicModel:
     def __init__(self):
         self.model = None;   # Means to provide output feedback to caller for debugging purposes
         self.docCountByWordId = None;
         self.randomState = None;   # Allow caller to set initial (fixed) random_state to facilitate consistent unit/regression testing. E.g., numpy.random.RandomState(10)
+        self.numWorkers = None; # Number of worker processes for buildMulticoreModel.  Defaults to the gensim default (number of cores - 1)
 
     def buildModel(self, corpusBOWGenerator, numTopics):
         """Build topic model from corpus (interpret as generator over contents)
@@ -40,13 +75,7 @@ class TopicModel:
         """
         # Load dictionary to translate item IDs to descriptions
         itemsById = DBUtil.loadTableAsDict("clinical_item");
-        id2word = dict();   # Models expect a pair for every possible item ID, and judges vocabulary size by length of this dictionary rather than the maximum ID values.  That means have to populate all of the empty ones as well.
-        maxId = max(itemsById.iterkeys());
-        for itemId in xrange(maxId+1):
-            description = str(itemId);  # Default to just the same as the ID string
-            if itemId in itemsById:
-                description = itemsById[itemId]["description"];
-            id2word[itemId] = description;
+        id2word = self.itemVocabulary(itemsById);
 
         # Stream in progressive updates from corpus generator so don't have to load all into memory
         # Do a batch of many at a time, otherwise very slow to increment one at a time
@@ -75,6 +104,72 @@ class TopicModel:
         return (self.model, self.docCountByWordId);
 
 
+    def buildMulticoreModel(self, corpusBOWGenerator, numTopics, corpusFilename):
+        """Build topic model from a corpus serialized to file, with multiple worker processes.
+
+        Serialize the corpus generator contents once into corpusFilename (Matrix Market format),
+        or if corpusBOWGenerator is None, assume corpusFilename was already serialized before.
+        Models then stream (repeatedly) through the corpus from disk with bounded memory,
+        rather than buffering documents for incremental updates.
+        LDA models are trained with gensim's multicore workers.  HDP models have no multicore
+        implementation, so just stream through the serialized corpus in a single process.
+
+        Return (model, docCountByWordId);
+        """
+        import gensim;  # Only import external module as needed
+        if corpusBOWGenerator is not None:
+            gensim.corpora.MmCorpus.serialize(corpusFilename, corpusBOWGenerator);
+        corpus = gensim.corpora.MmCorpus(corpusFilename);
+
+        self.docCountByWordId = self.countDocumentsByWordId(corpus);
+
+        # Only need descriptions for the items actually in the corpus
+        itemsById = DBUtil.loadTableAsDict("clinical_item");
+        id2word = self.itemVocabulary(itemsById, self.docCountByWordId);
+
+        if numTopics < 1:
+            self.model = gensim.models.hdpmodel.HdpModel( corpus, id2word=id2word, random_state=self.randomState );
+        else:
+            self.model = gensim.models.LdaMulticore( corpus, id2word=id2word, num_topics=numTopics, workers=self.numWorkers, random_state=self.randomState );
+        return (self.model, self.docCountByWordId);
+
+    def countDocumentsByWordId(self, corpus):
+        """Count the number of documents each word (item) ID occurs in,
+        with vectorized bincounts over sparse matrix chunks of the corpus.
+        Return as a docCountByWordId dictionary, with the None key counting all documents.
+        """
+        from gensim import matutils, utils;  # Only import external module as needed
+        docCounts = np.zeros(0, dtype=np.int64);
+        nDocs = 0;
+        for documents in utils.grouper(corpus, BUFFER_UPDATE_SIZE):
+            chunkMatrix = matutils.corpus2csc(documents).tocsc();  # Words x documents, one column of (nonzero) word indices for each document
+            chunkCounts = np.bincount(chunkMatrix.indices);
+            if len(chunkCounts) > len(docCounts):
+                docCounts = np.concatenate([docCounts, np.zeros(len(chunkCounts)-len(docCounts), dtype=np.int64)]);
+            docCounts[:len(chunkCounts)] += chunkCounts;
+            nDocs += len(documents);
+
+        docCountByWordId = {None: nDocs};   # Use None key to represent count of all documents
+        wordIds = np.flatnonzero(docCounts);
+        docCountByWordId.update(zip(wordIds.tolist(), docCounts[wordIds].tolist()));
+        return docCountByWordId;
+
+    def itemVocabulary(self, itemsById, wordIds=None):
+        """Sparse id2word translation of item IDs to descriptions, for the (non-negative) item IDs given
+        (default all items), with the vocabulary ranging up to the maximum clinical item ID.
+        """
+        if wordIds is None:
+            wordIds = itemsById.iterkeys();
+        wordById = dict();
+        maxId = max([itemId for itemId in itemsById.iterkeys()] + [-1]);
+        for itemId in wordIds:
+            if itemId is not None and itemId >= 0:
+                wordById[itemId] = str(itemId);
+                if itemId in itemsById:
+                    wordById[itemId] = itemsById[itemId]["description"];
+                maxId = max(maxId, itemId);
+        return ItemVocabulary(wordById, maxId+1);
+
     def updateModel(self, model, docBuffer, id2word, numTopics):
         """Update the given model object with the document buffer.
         If the model does not yet exist,
@@ -110,14 +205,12 @@ class TopicModel:
         """
         # Use raw IDs instead of word translation
         id2word = model.id2word;
-        id2id = dict();
-        for id in id2word:
-            id2id[id] = id;
-        model.id2word = id2id;
+        model.id2word = ItemIdVocabulary(len(id2word));
 
         import gensim; # External import as needed
         if isinstance(model, gensim.models.HdpModel):   # Has different topic API for no good reason
-            topics = model.show_topics(num_topics=-1, num_words=itemsPerCluster, formatted=False);
+            # Does not take num_topics=-1 to mean all topics (just returns none), so ask for all (m_T) of them explicitly
+            topics = model.show_topics(num_topics=model.m_T, num_words=itemsPerCluster, formatted=False);
             for topicId, topicItems in topics:
                 #for (itemId, itemWeight) in topicItems:  # 2-ple order is also reversed for no good reason
                 #    print topicId, itemDescr, itemWeight;
@@ -227,6 +320,8 @@ class TopicModel:
         parser = OptionParser(usage=usageStr)
         parser.add_option("-n", "--numTopics",  dest="numTopics", help="Numbers of topics to model.  Specify 0 to use non-parameteric Hierarchical Dirichlet Process model instead.");
         parser.add_option("-i", "--itemsPerCluster",  dest="itemsPerCluster", default=DEFAULT_TOPIC_ITEM_COUNT, help="Specify number of top topic words to store in an additional tab-delimited file with the top N words for each topic by score, as well as the total docCountByWordId.");
+        parser.add_option("-w", "--workers",  dest="workers", help="If set, number of worker processes to train an LDA model with.  Serializes the input corpus into a Matrix Market file to stream model training from, rather than buffering documents in memory.  Input file can also be a previously serialized corpus file (%s extension)." % CORPUS_FILE_EXT);
+        parser.add_option("-c", "--corpusFile",  dest="corpusFile", help="With the workers option, name of the file to serialize the input corpus to.  Defaults to the output file name with %s extension." % CORPUS_FILE_EXT);
 
         (options, args) = parser.parse_args(argv[1:])
 
@@ -240,13 +335,24 @@ class TopicModel:
             if len(args) > 1:
                 outputFilename = args[1];
 
-            corpusBOWGenerator = self.jsonGeneratorFromFile(stdOpen(inputFilename));
-
             # Parse some options
             numTopics = int(options.numTopics);
 
             # Main Model construction
-            (model, docCountByWordId) = self.buildModel(corpusBOWGenerator, numTopics);
+            if options.workers is not None:
+                self.numWorkers = int(options.workers);
+                if inputFilename.endswith(CORPUS_FILE_EXT):
+                    # Already serialized corpus, stream directly from it
+                    (model, docCountByWordId) = self.buildMulticoreModel(None, numTopics, inputFilename);
+                else:
+                    corpusFilename = options.corpusFile;
+                    if corpusFilename is None:
+                        corpusFilename = outputFilename + CORPUS_FILE_EXT;
+                    corpusBOWGenerator = self.jsonGeneratorFromFile(stdOpen(inputFilename));
+                    (model, docCountByWordId) = self.buildMulticoreModel(corpusBOWGenerator, numTopics, corpusFilename);
+            else:
+                corpusBOWGenerator = self.jsonGeneratorFromFile(stdOpen(inputFilename));
+                (model, docCountByWordId) = self.buildModel(corpusBOWGenerator, numTopics);
 
             # Save in binary format for reuse later
             model.save(outputFilename);
@@ -10,6 +10,7 @@ from optparse import OptionParser;
 import json;
 import urlparse;
 import math;
+import numpy as np;
 from datetime import datetime, timedelta;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -45,74 +46,169 @@ class TopicModelRecommender(BaseItemRecommender):
         self.categoryIdByItemId = None;
         self.candidateItemIds = None;
         self.weightByItemIdByTopicId = None;
-    
+
+        # Cached model weight parameters in array form for vectorized scoring (see initWeightMatrix)
+        self.weightMatrixItemsPerCluster = None;
+        self.topicIds = None;   # Topic ID for each row of the weight matrix
+        self.rowByTopicId = None;
+        self.itemIds = None;    # Candidate item ID for each column of the weight matrix
+        self.columnByItemId = None;
+        self.categoryIds = None;    # Category ID for each column
+        self.weightMatrix = None;   # Topic x candidate item weights
+        self.idfVector = None;  # Inverse document frequency (overall / item document count) for each column
+
     def initItemLookups(self, query):
         self.itemsById = DBUtil.loadTableAsDict("clinical_item");
         self.categoryIdByItemId = dict();
         for itemId, item in self.itemsById.iteritems():
             self.categoryIdByItemId[itemId] = item["clinical_item_category_id"];
+        # Any item with a known category is a candidate.  Query specific exclusions are applied
+        #   per query (see candidateMask), so the cached candidates can be shared across queries.
         self.candidateItemIds = set();
-        emptyQuerySet = set();
         for itemId in self.docCountByWordId.keys():
-            if self.isItemRecommendable(itemId, emptyQuerySet, query, self.categoryIdByItemId):
+            if itemId in self.categoryIdByItemId:
                 self.candidateItemIds.add(itemId);
-    
-    def __call__(self, query):
-        # Given query items, use model to find related topics with relationship scores
 
-        # Load item category lookup information
+    def initWeightMatrix(self, query):
+        """Precompute the model topic-item weights into a (dense) topic x candidate item matrix,
+        so scoring a query is a vector-matrix product instead of nested lookups per topic and item.
+        Recompute if a different number of itemsPerCluster is requested.
+        """
         if self.itemsById is None:
             self.initItemLookups(query);
+        if self.weightMatrix is not None and self.weightMatrixItemsPerCluster == query.itemsPerCluster:
+            return;
+
+        self.weightByItemIdByTopicId = self.modeler.generateWeightByItemIdByTopicId(self.model, query.itemsPerCluster);
+        self.weightMatrixItemsPerCluster = query.itemsPerCluster;
+
+        self.itemIds = np.array(sorted(self.candidateItemIds), dtype=np.int64);
+        self.columnByItemId = dict([(itemId, column) for (column, itemId) in enumerate(self.itemIds)]);
+        self.categoryIds = np.array([self.categoryIdByItemId[itemId] for itemId in self.itemIds], dtype=np.int64);
+        self.topicIds = sorted(self.weightByItemIdByTopicId.keys());
+        self.rowByTopicId = dict([(topicId, row) for (row, topicId) in enumerate(self.topicIds)]);
 
-        # Load model weight parameters once to save time on serial queries
-        if self.weightByItemIdByTopicId is None:
-            self.weightByItemIdByTopicId = self.modeler.generateWeightByItemIdByTopicId(self.model, query.itemsPerCluster);
+        self.weightMatrix = np.zeros((len(self.topicIds), len(self.itemIds)));
+        for topicId, weightByItemId in self.weightByItemIdByTopicId.iteritems():
+            row = self.rowByTopicId[topicId];
+            for itemId, itemWeight in weightByItemId.iteritems():
+                if itemId in self.columnByItemId:
+                    self.weightMatrix[row, self.columnByItemId[itemId]] = itemWeight;
 
-        # Adapt query into bag-of-words format
+        # Scale TF*IDF score based on baseline document counts to prioritize disproportionately common items
+        docCounts = np.array([self.docCountByWordId.get(itemId, 0.0) for itemId in self.itemIds], dtype=float);
+        self.idfVector = np.zeros(len(self.itemIds));
+        hasDocCount = (docCounts > 0.0);
+        self.idfVector[hasDocCount] = self.docCountByWordId[None] / docCounts[hasDocCount];
+
+    def queryItemCountById(self, query):
+        """Adapt query items into a dictionary of item counts"""
         queryItemCountById = query.queryItemIds;
         if not isinstance(queryItemCountById, dict):    # Not a dictionary, probably a one dimensional list/set, then just add counts of 1
             itemIds = queryItemCountById;
             queryItemCountById = dict();
             for itemId in itemIds:
                 queryItemCountById[itemId] = 1;
+        return queryItemCountById;
+
+    def weightByTopicId(self, query, queryItemCountById):
+        """Primary model execute.  Apply to query to generate scored relationship to each "topic" """
         observedIds = set();
         queryBag = list(self.modeler.itemCountByIdToBagOfWords(queryItemCountById, observedIds, self.itemsById, query.excludeCategoryIds));
-
-        # Primary model execute.  Apply to query to generate scored relationship to each "topic"
         topicWeights = self.model[queryBag];
         weightByTopicId = dict();
         for (topicId, topicWeight) in topicWeights:
             weightByTopicId[topicId] = topicWeight;
+        return weightByTopicId;
 
-        # Composite scores for (recommendable) items by taking weighted average across the top items for each topic
-        recScoreByItemId = dict();
-        for itemId in self.candidateItemIds:
-            if self.isItemRecommendable(itemId, queryItemCountById, query, self.categoryIdByItemId):
-                recScoreByItemId[itemId] = 0.0;
+    def topicWeightVector(self, query, weightByTopicId):
+        """Topic weights aligned to the weight matrix rows, ignoring topics with tiny contribution"""
+        topicWeightVector = np.zeros(len(self.topicIds));
         for topicId, topicWeight in weightByTopicId.iteritems():
-            if topicWeight > query.minClusterWeight:    # Ignore topics with tiny contribution
-                weightByItemId = self.weightByItemIdByTopicId[topicId];
-                for itemId in recScoreByItemId.keys():
-                    itemWeight = 0.0;
-                    if itemId in weightByItemId:
-                        itemWeight = weightByItemId[itemId];
-                    recScoreByItemId[itemId] += topicWeight*itemWeight;
-
-        # Build 2-pls with lists to sort by score
+            if topicWeight > query.minClusterWeight:
+                topicWeightVector[self.rowByTopicId[topicId]] = topicWeight;
+        return topicWeightVector;
+
+    def candidateMask(self, query, queryItemCountById):
+        """Boolean mask over the weight matrix columns for items recommendable for this query"""
+        isCandidate = ~np.in1d(self.itemIds, np.array(list(queryItemCountById), dtype=np.int64));
+        if query.excludeItemIds is not None:
+            isCandidate &= ~np.in1d(self.itemIds, np.array(list(query.excludeItemIds), dtype=np.int64));
+        if query.excludeCategoryIds is not None:
+            isCandidate &= ~np.in1d(self.categoryIds, np.array(list(query.excludeCategoryIds), dtype=np.int64));
+        return isCandidate;
+
+    def __call__(self, query):
+        # Given query items, use model to find related topics with relationship scores
+        return self.recommendBatch([query])[0];
+
+    def recommendBatch(self, queries):
+        """Score a batch of queries (e.g., patients) at once.  Topic weights for all of the
+        queries are stacked into one matrix, so all of the item scores come from a single matrix product.
+        Queries are grouped by itemsPerCluster, since each value needs its own weight matrix.
+        Returns a list of recommendedData lists, one for each query (in the same order).
+        """
+        queryIndexesByItemsPerCluster = dict();
+        for iQuery, query in enumerate(queries):
+            if query.itemsPerCluster not in queryIndexesByItemsPerCluster:
+                queryIndexesByItemsPerCluster[query.itemsPerCluster] = list();
+            queryIndexesByItemsPerCluster[query.itemsPerCluster].append(iQuery);
+
+        recommendedDataList = [None] * len(queries);
+        for queryIndexes in queryIndexesByItemsPerCluster.itervalues():
+            groupQueries = [queries[iQuery] for iQuery in queryIndexes];
+            for iQuery, recommendedData in zip(queryIndexes, self.recommendGroup(groupQueries)):
+                recommendedDataList[iQuery] = recommendedData;
+        return recommendedDataList;
+
+    def recommendGroup(self, queries):
+        """Score a batch of queries that all use the same itemsPerCluster (see recommendBatch)"""
+        self.initWeightMatrix(queries[0]);
+
+        queryItemCountByIdList = list();
+        weightByTopicIdList = list();
+        topicWeightMatrix = np.zeros((len(queries), len(self.topicIds)));
+        for iQuery, query in enumerate(queries):
+            queryItemCountById = self.queryItemCountById(query);
+            weightByTopicId = self.weightByTopicId(query, queryItemCountById);
+            topicWeightMatrix[iQuery] = self.topicWeightVector(query, weightByTopicId);
+            queryItemCountByIdList.append(queryItemCountById);
+            weightByTopicIdList.append(weightByTopicId);
+
+        # Composite scores for items by taking weighted average across the top items for each topic
+        scoreMatrix = np.dot(topicWeightMatrix, self.weightMatrix);
+
+        recommendedDataList = list();
+        for iQuery, query in enumerate(queries):
+            recommendedDataList.append(self.rankedItemModels(query, queryItemCountByIdList[iQuery], weightByTopicIdList[iQuery], scoreMatrix[iQuery]));
+        return recommendedDataList;
+
+    def rankedItemModels(self, query, queryItemCountById, weightByTopicId, totalItemWeights):
+        """Sort the candidate items by the query's sortField score (descending) and build result models for them.
+        Returns all of the candidate items, regardless of any query limit, so callers can apply
+        their own filters before taking the top results.
+        """
+        tfidfs = totalItemWeights * self.idfVector;
+        scoresByField = \
+            {   "totalItemWeight": totalItemWeights, "tf": totalItemWeights, "PPV": totalItemWeights, "P(item|query)": totalItemWeights, "P(B|A)": totalItemWeights,
+                "tfidf": tfidfs, "lift": tfidfs, "interest": tfidfs, "P(item|query)/P(item)": tfidfs, "P(B|A)/P(B)": tfidfs,
+            };
+        scores = scoresByField[query.sortField];
+
+        columns = np.flatnonzero(self.candidateMask(query, queryItemCountById));
+        columns = columns[np.argsort(-scores[columns], kind="mergesort")];
+
         recommendedData = list();
-        for itemId, totalItemWeight in recScoreByItemId.iteritems():
-            tfidf = 0.0;
-            if itemId in self.docCountByWordId and self.docCountByWordId[itemId] > 0.0:
-                tfidf = totalItemWeight * self.docCountByWordId[None] / self.docCountByWordId[itemId];    # Scale TF*IDF score based on baseline document counts to prioritize disproportionately common items
+        numSelectedTopics = len(weightByTopicId);
+        for column, totalItemWeight, tfidf in zip(columns, totalItemWeights[columns].tolist(), tfidfs[columns].tolist()):
             itemModel = \
                 {   "totalItemWeight": totalItemWeight, "tf": totalItemWeight, "PPV": totalItemWeight, "P(item|query)": totalItemWeight, "P(B|A)": totalItemWeight,
                     "tfidf": tfidf, "lift": tfidf, "interest": tfidf, "P(item|query)/P(item)": tfidf, "P(B|A)/P(B)": tfidf,
-                    "clinical_item_id": itemId,
-                    "weightByTopicId": weightByTopicId, "numSelectedTopics": len(weightByTopicId),  # Duplicate for each item, but persist here to enable retrieve by caller
+                    "clinical_item_id": int(self.itemIds[column]),
+                    "weightByTopicId": weightByTopicId, "numSelectedTopics": numSelectedTopics,  # Duplicate for each item, but persist here to enable retrieve by caller
                 };
             itemModel["score"] = itemModel[query.sortField];
             recommendedData.append(itemModel);
-        recommendedData.sort( RowItemFieldComparator("score"), reverse=True);
         return recommendedData;
 
     def main(self, argv):
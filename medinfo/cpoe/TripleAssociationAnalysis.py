@@ -2,6 +2,7 @@
 import sys, os
 import time;
 import math;
+from bisect import bisect_left, bisect_right;
 from datetime import datetime;
 from optparse import OptionParser
 from medinfo.common.Util import stdOpen, ProgressDots;
@@ -12,10 +13,42 @@ from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList
 from AssociationAnalysis import AssociationAnalysis, AnalysisOptions;
 from DataManager import DataManager;
 
-from Const import DELTA_NAME_BY_SECONDS;
+from Const import DELTA_NAME_BY_SECONDS, SECONDS_PER_DAY;
 
 from Util import log;
 
+# Reference time point to convert item dates into integer seconds
+EPOCH = datetime(1970,1,1);
+
+class ItemDateIndex:
+    """Date sorted occurrences of an item in a patient's timeline, with the dates as integer seconds
+    and prefix sums of the seconds (and squares) to aggregate time differences over ranges of occurrences.
+    Expects patient items to be appended in date order.
+    """
+    def __init__(self):
+        self.patientItems = list();
+        self.seconds = list();
+        self.secondsSums = [0];
+        self.secondsSquaresSums = [0];
+
+    def append(self, patientItem):
+        timeDelta = patientItem["item_date"] - EPOCH;
+        itemSeconds = timeDelta.days*SECONDS_PER_DAY + timeDelta.seconds;
+        self.patientItems.append(patientItem);
+        self.seconds.append(itemSeconds);
+        self.secondsSums.append(self.secondsSums[-1] + itemSeconds);
+        self.secondsSquaresSums.append(self.secondsSquaresSums[-1] + itemSeconds**2);
+
+    def firstOnOrAfter(self, itemSeconds):
+        """Index of the first occurrence on or after the given time (or the length if none)"""
+        return bisect_left(self.seconds, itemSeconds);
+
+    def firstSecondsOnOrAfter(self, itemSeconds):
+        index = self.firstOnOrAfter(itemSeconds);
+        if index < len(self.seconds):
+            return self.seconds[index];
+        return None;
+
 class TripleAssociationAnalysis(AssociationAnalysis):
     """Pre-Computation module to sort through data on patient clinical items
     (orders, lab results, problem list entries, etc.) and aggregate
@@ -25,6 +58,7 @@ class TripleAssociationAnalysis(AssociationAnalysis):
     (e.g., B1 = Admit Patient, B2 = Discharge Patient, B' = Re-Admission)
     Will increment association statistics for all items Ai leading to virtual item B',
     where B2 is used as the time point for B', and only count cases where the time sequence Ai->B1->B2 is observed.
+    Can look for many such sequence definitions (virtual items) in one pass through the patient data.
     """
     connFactory = None; # Allow specification of alternative DB connection source
 
@@ -46,12 +80,23 @@ class TripleAssociationAnalysis(AssociationAnalysis):
         caller's responsibility to be careful not to repeat this analysis redundantly
         and generating duplicated statistics.
         """
+        self.analyzePatientItemsBatch(patientIds, [(itemIdSequence, virtualItemId)]);
+
+    def analyzePatientItemsBatch(self, patientIds, sequenceDefinitions):
+        """Batch version of analyzePatientItems for a list of (itemIdSequence, virtualItemId) definitions.
+        Queries and streams through each patient's items only once, accruing the
+        association increments for all of the virtual items into one shared buffer,
+        so defining many virtual items costs one pass through the patient_item data.
+
+        If patientIds is None, then analyze all patients.
+        """
         progress = ProgressDots();
         conn = self.connFactory.connection();
         try:
             # Preload lookup data to facilitate rapid checks and filters later
             linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
-            self.verifyVirtualItemLinked(itemIdSequence, virtualItemId, linkedItemIdsByBaseId, conn=conn);
+            for (itemIdSequence, virtualItemId) in sequenceDefinitions:
+                self.verifyVirtualItemLinked(itemIdSequence, virtualItemId, linkedItemIdsByBaseId, conn=conn);
 
             # Keep an in memory buffer of the updates to be done so can stall and submit them
             #   to the database in batch to minimize inefficient DB hits
@@ -61,7 +106,7 @@ class TripleAssociationAnalysis(AssociationAnalysis):
             analysisOptions.patientIds = patientIds;
             for iPatient, patientItemList in enumerate(self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn)):
                 log.debug("Calculate associations for Patient %d's %d patient items" % (iPatient, len(patientItemList)) );
-                self.updateItemAssociationsBuffer(itemIdSequence, virtualItemId, patientItemList, updateBuffer, linkedItemIdsByBaseId, progress=progress);
+                self.updateItemAssociationsBufferBatch(sequenceDefinitions, patientItemList, updateBuffer, linkedItemIdsByBaseId, progress=progress);
                 # Periodically send a quick arbitrary query to DB, otherwise connection may get recycled because DB thinks timeout with no interaction
                 DBUtil.execute("select 1+1", conn=conn);
             log.info("Final commit");
@@ -80,68 +125,137 @@ class TripleAssociationAnalysis(AssociationAnalysis):
         in the itemIdSequence.  If a triple sequence is found, then mark the end point as
         a virtualItem instance for counting associations.
         """
-        # Keep track of which items to mark as newly analyzed
-        newlyAnalyzedPatientItemIdSet = set();
+        self.updateItemAssociationsBufferBatch([(itemIdSequence, virtualItemId)], patientItemList, updateBuffer, linkedItemIdsByBaseId, progress=progress);
 
-        # Keep track of which subsequent items have been analyzed, so we don't count further duplicates (just the first ones found)
-        subsequentItemIds = set();
-        # Keep track of all item pairs encountered to avoid counting patient level duplicates
-        encounterIdPairsByItemIdPair = dict();
+    def updateItemAssociationsBufferBatch(self, sequenceDefinitions, patientItemList, updateBuffer, linkedItemIdsByBaseId=None, progress=None):
+        """Batch version of updateItemAssociationsBuffer for a list of (itemIdSequence, virtualItemId) definitions.
+        Indexes the patient's items by clinical item (and encounter) once, then uses those
+        sorted date indexes to find the triple sequences for each definition.
+        """
+        if linkedItemIdsByBaseId is None:
+            linkedItemIdsByBaseId = dict();
 
-        # Track where the mid-sequence items occur for easy comparison later
-        midSequenceItemDates = set();
+        itemDateIndexByKey = dict();    # Keyed by clinical_item_id and by (clinical_item_id, encounter_id)
         for patientItem in patientItemList:
-            if patientItem["clinical_item_id"] == itemIdSequence[0]:
-                midSequenceItemDates.add(patientItem["item_date"]);
-        endSequenceItemsByPatientItemId = dict();
-
-        # Main nested loop to look for associations
-        for iItem1, patientItem1 in enumerate(patientItemList):
-            subsequentItemIds.clear();
-
-            for iItem2, patientItem2 in enumerate(patientItemList):
-                itemIdPair = (patientItem1["clinical_item_id"], virtualItemId);
-                encounterIdPair = (patientItem1["encounter_id"], patientItem2["encounter_id"]);
-
-                # Verify is not a previously linked item pair, in which case no meaningful asssociation stats to calculate
-                #   and that the item dates are in non-negative direction
-                isPairToAnalyze = self.acceptableClinicalItemPair(patientItem1, patientItem2, linkedItemIdsByBaseId);
-                if isPairToAnalyze and self.isTripleSequence(patientItem1, patientItem2, midSequenceItemDates, itemIdSequence):
-                    # Record the stat update
-                    isNewSubsequentItem = virtualItemId not in subsequentItemIds;   # Track repeats
-                    isNewPair = itemIdPair not in encounterIdPairsByItemIdPair; # Pair ever seen for this patient
-                    isNewPairWithinEncounter = (encounterIdPair[0]==encounterIdPair[-1]) and (isNewPair or encounterIdPair not in encounterIdPairsByItemIdPair[itemIdPair]);    # Pair ever seen for a common encounter combination
-
-                    self.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, itemIdPair=itemIdPair );
-
-                    subsequentItemIds.add(virtualItemId);
-                    endSequenceItemsByPatientItemId[patientItem2["patient_item_id"]] = patientItem2;
-
-                    if itemIdPair not in encounterIdPairsByItemIdPair:
-                        encounterIdPairsByItemIdPair[itemIdPair] = set();
-                    encounterIdPairsByItemIdPair[itemIdPair].add(encounterIdPair);
-
-            # Update progress meter if available
-            if progress is not None:
-                progress.Update();
+            for key in (patientItem["clinical_item_id"], (patientItem["clinical_item_id"], patientItem["encounter_id"])):
+                if key not in itemDateIndexByKey:
+                    itemDateIndexByKey[key] = ItemDateIndex();
+                itemDateIndexByKey[key].append(patientItem);
 
-        # Separate pass to get virtual item baseline counts.  Cannot be done directly, since the virtual items do not actually exist in the raw data
-        subsequentItemIds.clear();
-        for iItem1, patientItem1 in enumerate(endSequenceItemsByPatientItemId.itervalues()):
-            for iItem2, patientItem2 in enumerate(endSequenceItemsByPatientItemId.itervalues()):
-                itemIdPair = (virtualItemId, virtualItemId);
-                encounterIdPair = (patientItem1["encounter_id"], patientItem2["encounter_id"]);
+        for (itemIdSequence, virtualItemId) in sequenceDefinitions:
+            self.updateVirtualItemAssociationsBuffer(itemIdSequence, virtualItemId, itemDateIndexByKey, updateBuffer, linkedItemIdsByBaseId);
 
-                isNewSubsequentItem = virtualItemId not in subsequentItemIds;   # Track repeats
-                isNewPair = itemIdPair not in encounterIdPairsByItemIdPair; # Pair ever seen for this patient
-                isNewPairWithinEncounter = (encounterIdPair[0]==encounterIdPair[-1]) and (isNewPair or encounterIdPair not in encounterIdPairsByItemIdPair[itemIdPair]);
+        # Update progress meter if available
+        if progress is not None:
+            for patientItem in patientItemList:
+                progress.Update();
 
-                self.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, itemIdPair=itemIdPair );
+    def updateVirtualItemAssociationsBuffer(self, itemIdSequence, virtualItemId, itemDateIndexByKey, updateBuffer, linkedItemIdsByBaseId):
+        """Increment associations from every item A to the virtualItemId, for each end item of the
+        itemIdSequence that occurs on or after a mid-sequence item that occurs on or after A.
 
-                subsequentItemIds.add(virtualItemId);
-                if itemIdPair not in encounterIdPairsByItemIdPair:
-                    encounterIdPairsByItemIdPair[itemIdPair] = set();
-                encounterIdPairsByItemIdPair[itemIdPair].add(encounterIdPair);
+        Rather than checking every item pair, for each occurrence of an item A, the earliest mid-sequence item
+        on or after it determines that every end item from then on completes a triple sequence,
+        which are aggregated over that range of the sorted end item dates.
+        Later occurrences of A can only complete a subset of those,
+        so the first occurrence that completes any (in a common encounter or not)
+        is the one to count for the patient (or encounter) level counts.
+        """
+        midItemId = itemIdSequence[0];
+        endItemId = itemIdSequence[-1];
+        if midItemId not in itemDateIndexByKey or endItemId not in itemDateIndexByKey:
+            return; # Cannot be any triple sequences for this patient
+        midIndex = itemDateIndexByKey[midItemId];
+        endIndex = itemDateIndexByKey[endItemId];
+
+        firstTripleSeconds = None;  # Earliest mid-sequence item time point that completes a triple sequence
+        for (itemId1, itemIndex1) in itemDateIndexByKey.iteritems():
+            if not isinstance(itemId1, (int,long)) or not self.acceptableClinicalItemIdPair(itemId1, endItemId, linkedItemIdsByBaseId):
+                continue;   # Skip the (item, encounter) indexes and previously linked items
+            itemIdPair = (itemId1, virtualItemId);
+            isNewPair = True;
+            for iItem1, patientItem1 in enumerate(itemIndex1.patientItems):
+                midSeconds = midIndex.firstSecondsOnOrAfter(itemIndex1.seconds[iItem1]);
+                if midSeconds is None:
+                    break;
+                iEnd = endIndex.firstOnOrAfter(midSeconds);
+                if iEnd >= len(endIndex.seconds):
+                    break;
+
+                if firstTripleSeconds is None or midSeconds < firstTripleSeconds:
+                    firstTripleSeconds = midSeconds;
+                self.updateAssociationRangeBuffer(itemIdPair, itemIndex1.seconds[iItem1], endIndex, iEnd, len(endIndex.seconds), [""], updateBuffer);
+                if isNewPair:   # Patient level count for just the first triple sequence
+                    self.updateAssociationRangeBuffer(itemIdPair, itemIndex1.seconds[iItem1], endIndex, iEnd, iEnd+1, ["patient_"], updateBuffer);
+                    isNewPair = False;
+
+            # Encounter level counts for the first triple sequence within each encounter
+            for iItem1, patientItem1 in enumerate(itemIndex1.patientItems):
+                encounterId = patientItem1["encounter_id"];
+                encounterIndex1 = itemDateIndexByKey[(itemId1, encounterId)];
+                if encounterIndex1.patientItems[0] is not patientItem1 or (endItemId, encounterId) not in itemDateIndexByKey:
+                    continue;   # Only need the first occurrence of the item in each encounter
+                midSeconds = midIndex.firstSecondsOnOrAfter(encounterIndex1.seconds[0]);
+                if midSeconds is None:
+                    continue;
+                endEncounterIndex = itemDateIndexByKey[(endItemId, encounterId)];
+                iEnd = endEncounterIndex.firstOnOrAfter(midSeconds);
+                if iEnd < len(endEncounterIndex.seconds):
+                    self.updateAssociationRangeBuffer(itemIdPair, encounterIndex1.seconds[0], endEncounterIndex, iEnd, iEnd+1, ["encounter_"], updateBuffer);
+
+        if firstTripleSeconds is None:
+            return; # No triple sequences found
+
+        # Virtual item baseline counts.  Cannot be done directly, since the virtual items do not actually exist in the raw data.
+        #   Count every forward pair of the end items that completed triple sequences,
+        #   with single patient and encounter level counts (of each item with itself).
+        itemIdPair = (virtualItemId, virtualItemId);
+        iFirstEnd = endIndex.firstOnOrAfter(firstTripleSeconds);
+        for iEnd in xrange(iFirstEnd, len(endIndex.seconds)):
+            endSeconds = endIndex.seconds[iEnd];
+            self.updateAssociationRangeBuffer(itemIdPair, endSeconds, endIndex, endIndex.firstOnOrAfter(endSeconds), len(endIndex.seconds), [""], updateBuffer);
+            if iEnd == iFirstEnd:
+                self.updateAssociationRangeBuffer(itemIdPair, endSeconds, endIndex, iEnd, iEnd+1, ["patient_"], updateBuffer);
+
+            encounterId = endIndex.patientItems[iEnd]["encounter_id"];
+            endEncounterIndex = itemDateIndexByKey[(endItemId, encounterId)];
+            iEncounterEnd = endEncounterIndex.firstOnOrAfter(firstTripleSeconds);
+            if endEncounterIndex.patientItems[iEncounterEnd] is endIndex.patientItems[iEnd]:
+                self.updateAssociationRangeBuffer(itemIdPair, endSeconds, endEncounterIndex, iEncounterEnd, iEncounterEnd+1, ["encounter_"], updateBuffer);
+
+    def updateAssociationRangeBuffer(self, itemIdPair, itemSeconds, itemDateIndex, start, stop, countPrefixes, updateBuffer):
+        """Aggregate equivalent of updateClinicalItemAssociationBuffer for all of the pairs from an item
+        at itemSeconds to each of the items in the itemDateIndex range [start, stop) (all on or after itemSeconds),
+        for each of the given countPrefixes.
+        """
+        nPairs = stop - start;
+        if nPairs < 1:
+            return;
+        secondsSum = itemDateIndex.secondsSums[stop] - itemDateIndex.secondsSums[start];
+        secondsSquaresSum = itemDateIndex.secondsSquaresSums[stop] - itemDateIndex.secondsSquaresSums[start];
+        timeDiffSum = secondsSum - nPairs*itemSeconds;
+        timeDiffSumSquares = secondsSquaresSum - 2*itemSeconds*secondsSum + nPairs*itemSeconds**2;
+
+        if "incrementDataByItemIdPair" not in updateBuffer:
+            updateBuffer["incrementDataByItemIdPair"] = dict();
+            updateBuffer["nAssociations"] = 0;
+        if str(itemIdPair) not in updateBuffer["incrementDataByItemIdPair"]:
+            updateBuffer["incrementDataByItemIdPair"][str(itemIdPair)] = dict();
+            updateBuffer["nAssociations"] += 1;
+        incrementData = updateBuffer["incrementDataByItemIdPair"][str(itemIdPair)];
+
+        increments = [("count_any", nPairs), ("time_diff_sum", timeDiffSum), ("time_diff_sum_squares", timeDiffSumSquares)];
+        for secondsOption in DELTA_NAME_BY_SECONDS.iterkeys():
+            nWithinDelta = bisect_right(itemDateIndex.seconds, itemSeconds+secondsOption, start, stop) - start;
+            if nWithinDelta > 0:
+                increments.append(("count_%d" % secondsOption, nWithinDelta));
+
+        for countPrefix in countPrefixes:
+            for (field, increment) in increments:
+                countField = countPrefix+field;
+                if countField not in incrementData:
+                    incrementData[countField] = 0;
+                incrementData[countField] += increment;
 
     def verifyVirtualItemLinked(self, itemIdSequence, virtualItemId, linkedItemIdsByBaseId, conn=None):
         """Verify links exist from the virtualItemId to those in the itemIdSequence.
@@ -169,54 +283,40 @@ class TripleAssociationAnalysis(AssociationAnalysis):
             if not extConn:
                 conn.close();
 
-    def isTripleSequence(self, patientItem1, patientItem2, midSequenceItemDates, itemIdSequence):
-        """Assess whether the pair of items represents an acceptable triple sequence.
-        Is so if end point matches the end of the itemIdSequence, and there exists a mid-sequence
-        item in the intervening time, as previously tracked by the midSequenceItemDates.
-
-        Assume previous check has already confirmed that the item pairs are not previously linked,
-        and that there is a non-negative / forward direction in the relationship
-        """
-        itemId1 = patientItem1["clinical_item_id"]
-        itemId2 = patientItem2["clinical_item_id"]
-
-        isAcceptable = True;
-        isAcceptable = isAcceptable and itemId2 == itemIdSequence[-1];
-
-        foundMidSequenceDate = False;
-        for midDate in midSequenceItemDates:
-            if patientItem1["item_date"] <= midDate and midDate <= patientItem2["item_date"]:
-                foundMidSequenceDate = True;
-                break;  # Don't need to keep looking
-        isAcceptable = isAcceptable and foundMidSequenceDate;
-        return isAcceptable;
-
     def main(self, argv):
         """Main method, callable from command line"""
-        usageStr =  "usage: %prog [options] <patientIds>\n"+\
-                    "   <patientIds>    Patient ID file, or comma-separated list of patient IDs.\n"
+        usageStr =  "usage: %prog [options] [<patientIds>]\n"+\
+                    "   <patientIds>    Patient ID file, or comma-separated list of patient IDs. Leave blank to analyze all patients.\n"
         parser = OptionParser(usage=usageStr)
-        parser.add_option("-s", "--itemIdSequence", dest="itemIdSequence", help="Comma-separated sequence of item IDs to look for as representing the end of a triple of interest.")
-        parser.add_option("-v", "--virtualItemId", dest="virtualItemId", help="ID of virtual clinical item to record against if find a specified triple.")
+        parser.add_option("-s", "--itemIdSequence", dest="itemIdSequences", action="append", help="Comma-separated sequence of item IDs to look for as representing the end of a triple of interest. Repeat the option (with respective -v options) to look for several sequences in one pass through the patient data.")
+        parser.add_option("-v", "--virtualItemId", dest="virtualItemIds", action="append", help="ID of virtual clinical item to record against if find a specified triple. Repeat in the same order as the -s options.")
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
 
-        patientIds = set();
-        patientIdsParam = args[0];
-        try:
-            # Try to open patient IDs as a file
-            patientIdFile = stdOpen(patientIdsParam);
-            patientIds.update( patientIdFile.read().split() );
-        except IOError:
-            # Unable to open as a filename, then interpret as simple comma-separated list
-            patientIds.update(patientIdsParam.split(","));
-
-        itemIdSequence = [int(idStr) for idStr in options.itemIdSequence.split(",")];
-        virtualItemId = int(options.virtualItemId);
-
-        self.analyzePatientItems(patientIds, itemIdSequence, virtualItemId);
+        patientIds = None;
+        if len(args) > 0:
+            patientIds = set();
+            patientIdsParam = args[0];
+            try:
+                # Try to open patient IDs as a file
+                patientIdFile = stdOpen(patientIdsParam);
+                patientIds.update( patientIdFile.read().split() );
+            except IOError:
+                # Unable to open as a filename, then interpret as simple comma-separated list
+                patientIds.update(patientIdsParam.split(","));
+
+        if options.itemIdSequences is None or options.virtualItemIds is None or len(options.itemIdSequences) != len(options.virtualItemIds):
+            parser.print_help();
+            sys.exit(-1);
+
+        sequenceDefinitions = list();
+        for (itemIdSequenceStr, virtualItemIdStr) in zip(options.itemIdSequences, options.virtualItemIds):
+            itemIdSequence = [int(idStr) for idStr in itemIdSequenceStr.split(",")];
+            sequenceDefinitions.append( (itemIdSequence, int(virtualItemIdStr)) );
+
+        self.analyzePatientItemsBatch(patientIds, sequenceDefinitions);
 
         timer = time.time() - timer;
         log.info("%.3f seconds to complete",timer);
@@ -5,6 +5,10 @@ Base Analysis module to assess results of recommenders / predictors.
 
 import sys, os
 import time;
+import itertools;
+import collections;
+import multiprocessing;
+import multiprocessing.util;
 from optparse import OptionParser
 from cStringIO import StringIO;
 from math import sqrt;
@@ -29,6 +33,29 @@ for recClass in RECOMMENDER_CLASS_LIST:
 
 from medinfo.cpoe.Const import AGGREGATOR_OPTIONS;
 
+# Number of patient records to hand to a worker process at a time when evaluating patients in parallel
+PARALLEL_CHUNK_SIZE = 10;
+
+# Analyzer instance, analysis query and connection for the current parallel evaluation.
+#   Set before forking worker processes, so each worker inherits the preloaded recommender / model (copy-on-write)
+#   rather than having them pickled and sent for every patient.
+_evaluationState = None;
+
+def _initEvaluationWorker():
+    """Worker process initializer.  Open a separate database connection for each worker,
+    as connections cannot be shared across processes.  Closed when the worker exits after the pool is closed.
+    """
+    global _evaluationState;
+    (analyzer, analysisQuery, conn) = _evaluationState;
+    conn = analyzer.connFactory.connection();
+    multiprocessing.util.Finalize(None, conn.close, exitpriority=10);
+    _evaluationState = (analyzer, analysisQuery, conn);
+
+def _evaluatePatient(patientItemData):
+    """Worker function, module-level so multiprocessing can pickle it."""
+    (analyzer, analysisQuery, conn) = _evaluationState;
+    return analyzer.analyzePatient(patientItemData, analysisQuery, conn);
+
 class AnalysisQuery:
     """Simple struct to pass query parameters
     """
@@ -94,6 +121,7 @@ class BaseCPOEAnalysis:
     def __init__(self):
         self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
         self.dataManager = DataManager();
+        self.numProcesses = 1;  # Number of worker processes to evaluate patients with.  If >1, see evaluatePatients
 
     def isItemRecommendable(self, clinicalItemId, queryItemCountById, recQuery, categoryIdByItemId):
         """Decide if the next clinical item could even possibly appear
@@ -101,3 +129,64 @@ class BaseCPOEAnalysis:
         test recommender against it).
         """
         return ItemAssociationRecommender.isItemRecommendable(clinicalItemId, queryItemCountById, recQuery, categoryIdByItemId);
+
+    def analyzePatient(self, patientItemData, analysisQuery, conn):
+        """Analyze one patient's prepared item data (from PreparePatientItems.loadPatientItemData)
+        into a result stats row, or return None if the patient should be skipped.
+        Subclasses should override to use evaluatePatients.
+        Should only depend on the patient data and state preloaded before evaluation starts,
+        since may be called in a separate (forked) worker process.
+        """
+        raise NotImplementedError("Abstract base class method.  Sub-class should override.");
+
+    def evaluatePatients(self, patientItemDataIter, analysisQuery, progress=None, conn=None):
+        """Generator over 2-ples (patientItemData, resultsStatData) from applying analyzePatient
+        to each of the prepared patient records, in the same order as patientItemDataIter.
+
+        If self.numProcesses > 1, the patient records are streamed to a pool of worker processes
+        that each hold (a fork-shared copy of) this analyzer, the analysisQuery and its preloaded recommender / model,
+        and their own database connection.  Per patient work is independent, so results are identical to serial evaluation.
+        Only the first record is read before starting the workers, so any lookup data the producer
+        preloads (e.g., PreparePatientItems.categoryIdByItemId) is shared with them as well.
+        """
+        if self.numProcesses <= 1:
+            for patientItemData in patientItemDataIter:
+                resultsStatData = self.analyzePatient(patientItemData, analysisQuery, conn);
+                if progress is not None:
+                    progress.Update();
+                yield (patientItemData, resultsStatData);
+            return;
+
+        patientItemDataIter = iter(patientItemDataIter);
+        try:
+            firstPatientItemData = patientItemDataIter.next();
+        except StopIteration:
+            return; # No patient data to evaluate
+        patientItemDataIter = itertools.chain([firstPatientItemData], patientItemDataIter);
+
+        # Keep the records handed out to the workers to yield back with their (in order) results.
+        #   Records are produced from the pool's task handler thread, and a deque is safe to append / pop across threads.
+        pendingPatientItemData = collections.deque();
+        def producePatientItemData():
+            for patientItemData in patientItemDataIter:
+                pendingPatientItemData.append(patientItemData);
+                yield patientItemData;
+
+        global _evaluationState;
+        _evaluationState = (self, analysisQuery, None);
+        pool = multiprocessing.Pool(self.numProcesses, initializer=_initEvaluationWorker);
+        completed = False;
+        try:
+            for resultsStatData in pool.imap(_evaluatePatient, producePatientItemData(), PARALLEL_CHUNK_SIZE):
+                patientItemData = pendingPatientItemData.popleft();
+                if progress is not None:
+                    progress.Update();
+                yield (patientItemData, resultsStatData);
+            completed = True;
+        finally:
+            if completed:
+                pool.close();   # Let the workers exit normally, so they close their database connections
+            else:
+                pool.terminate();   # Error or abandoned generator. Connections are dropped as the worker processes are killed
+            pool.join();
+            _evaluationState = None;
@@ -6,6 +6,7 @@ and evaluate using RecommendationClassificationAnalysis framework.
 
 import sys, os
 import time;
+import copy;
 import json;
 from optparse import OptionParser
 from cStringIO import StringIO;
@@ -24,14 +25,17 @@ from Util import log;
 from RecommendationClassificationAnalysis import RecommendationClassificationAnalysis;
 from BaseCPOEAnalysis import AnalysisQuery;
 from PreparePatientItems import PreparePatientItems;
+from PreparedPatientItemStore import openPreparedPatientItemFile;
 from RecommendationClassificationAnalysis import RecommendationClassificationAnalysis;
 
 DEFAULT_RECOMMENDED_ITEM_COUNT = 10;    # When doing validation calculations, number of items to recommend when calculating precision and recall
 DEFAULT_SORT_FIELD = "P(B|A)";
+DEFAULT_BATCH_SIZE = 100;   # Number of patients to score with the recommender at once
 
 class OrderSetRecommenderClassificationAnalysis(RecommendationClassificationAnalysis):
     def __init__(self):
         RecommendationClassificationAnalysis.__init__(self);
+        self.batchSize = DEFAULT_BATCH_SIZE;
 
     def __call__(self, analysisQuery):
         """Go through the validation file to test use of the model towards predicting verify items.
@@ -42,19 +46,28 @@ class OrderSetRecommenderClassificationAnalysis(RecommendationClassificationAnal
         for itemId, orderSetIds in analysisQuery.recommender.orderSetIdsByItemId.iteritems():
             orderSetCountByItemId[itemId] = len(orderSetIds);
 
+        # Score patients in batches, so the recommender can score all of their query sets together
         preparer = PreparePatientItems();
-        # progress = ProgressDots(50,1,"Patients");
+        patientItemDataList = list();
         for patientItemData in preparer.loadPatientItemData(analysisQuery):
-            patientId = patientItemData["patient_id"];
-            analysisResults = \
-                self.analyzePatientItems \
-                (   patientItemData,
-                    analysisQuery,
-                    analysisQuery.baseRecQuery,
-                    patientId,
-                    analysisQuery.recommender,
-                );
-
+            patientItemDataList.append(patientItemData);
+            if len(patientItemDataList) >= self.batchSize:
+                for resultsStatData in self.analyzeBatch(patientItemDataList, analysisQuery, orderSetCountByItemId):
+                    yield resultsStatData;
+                patientItemDataList = list();
+        for resultsStatData in self.analyzeBatch(patientItemDataList, analysisQuery, orderSetCountByItemId):
+            yield resultsStatData;
+
+    def analyzeBatch(self, patientItemDataList, analysisQuery, orderSetCountByItemId):
+        """Generator over the result stats for a batch of patient item data"""
+        analysisResultsList = \
+            self.analyzePatientItemsBatch \
+            (   patientItemDataList,
+                analysisQuery,
+                analysisQuery.baseRecQuery,
+                analysisQuery.recommender,
+            );
+        for patientItemData, analysisResults in zip(patientItemDataList, analysisResultsList):
             if analysisResults is not None:
                 (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
                 # Start aggregating and calculating result stats
@@ -62,33 +75,49 @@ class OrderSetRecommenderClassificationAnalysis(RecommendationClassificationAnal
                 if "baseItemId" in patientItemData:
                     analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
                 yield resultsStatData;
-            # progress.Update();
-        # progress.PrintStatus();
 
     def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
         to produce the relevant verify and recommendation item ID sets for comparison
         """
-        if "queryItemCountById" not in patientItemData:
-            # Apparently not able to find / extract relevant data, so skip this record
-            return None;
-        queryItemCountById = patientItemData["queryItemCountById"];
-        verifyItemCountById = patientItemData["verifyItemCountById"];
+        return self.analyzePatientItemsBatch([patientItemData], analysisQuery, recQuery, recommender)[0];
 
-        recQuery.queryItemIds = queryItemCountById; # Have option to use as dictionary, but will also function as key set
-        # recQuery.limit = analysisQuery.numRecommendations;
+    def analyzePatientItemsBatch(self, patientItemDataList, analysisQuery, recQuery, recommender):
+        """Batch version of analyzePatientItems, querying the recommender for all of the given patients at once.
+        Returns a list of analysis results (or None for patients to skip) in the same order as patientItemDataList.
+        """
+        patientQueries = list();
+        for patientItemData in patientItemDataList:
+            if "queryItemCountById" not in patientItemData:
+                # Apparently not able to find / extract relevant data, so skip this record
+                continue;
+            patientQuery = copy.copy(recQuery);   # Separate copy per patient, since querying all at once
+            patientQuery.queryItemIds = patientItemData["queryItemCountById"]; # Have option to use as dictionary, but will also function as key set
+            # patientQuery.limit = analysisQuery.numRecommendations;
+            patientQueries.append(patientQuery);
 
         # Query for recommended orders / items
-        recommendedData = recommender( recQuery );
-
-        # Distill down to just the set of recommended item IDs
-        recommendedItemIds = set();
-        for i, recommendationModel in enumerate(recommendedData):
-            if i >= analysisQuery.numRecommendations:
-                break;
-            recommendedItemIds.add(recommendationModel["clinical_item_id"]);
-        return (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData);
+        recommendedDataList = recommender.recommendBatch( patientQueries );
+
+        analysisResultsList = list();
+        recommendedDataIter = iter(recommendedDataList);
+        for patientItemData in patientItemDataList:
+            if "queryItemCountById" not in patientItemData:
+                analysisResultsList.append(None);
+                continue;
+            queryItemCountById = patientItemData["queryItemCountById"];
+            verifyItemCountById = patientItemData["verifyItemCountById"];
+            recommendedData = recommendedDataIter.next();
+
+            # Distill down to just the set of recommended item IDs
+            recommendedItemIds = set();
+            for i, recommendationModel in enumerate(recommendedData):
+                if i >= analysisQuery.numRecommendations:
+                    break;
+                recommendedItemIds.add(recommendationModel["clinical_item_id"]);
+            analysisResultsList.append( (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) );
+        return analysisResultsList;
 
     def calculateResultStats( self, patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, baseCountByItemId, recQuery, recommendedData ):
         resultsStatData = RecommendationClassificationAnalysis.calculateResultStats( self, patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, baseCountByItemId, recQuery, recommendedData );
@@ -118,7 +147,7 @@ class OrderSetRecommenderClassificationAnalysis(RecommendationClassificationAnal
         timer = time.time();
         if len(args) >= 1:
             query = AnalysisQuery();
-            query.preparedPatientItemFile = stdOpen(args[0]);
+            query.preparedPatientItemFile = openPreparedPatientItemFile(args[0]);
             query.recommender = OrderSetRecommender();
             query.baseRecQuery = RecommenderQuery();
             if options.excludeCategoryIds is not None:
@@ -34,6 +34,7 @@ from Util import log;
 
 from BaseCPOEAnalysis import AnalysisQuery;
 from PreparePatientItems import PreparePatientItems;
+from PreparedPatientItemStore import openPreparedPatientItemFile;
 from RecommendationClassificationAnalysis import RecommendationClassificationAnalysis;
 
 # When doing validation calculations, number of items to recommend when calculating precision and recall
@@ -59,46 +60,56 @@ class OrderSetUsageAnalysis(RecommendationClassificationAnalysis):
         try:
             conn = DBUtil.connection();
 
+            # Pre-cache order set item data, so parallel workers share it rather than each reloading it
+            if self.supportRecommender.itemIdsByOrderSetId is None:
+                self.supportRecommender.initItemLookups(analysisQuery.baseRecQuery);
+
             preparer = PreparePatientItems();
             progress = ProgressDots(50,1,"Patients");
-            for patientItemData in preparer.loadPatientItemData(analysisQuery):
-                patientId = patientItemData["patient_id"];
-                analysisResults = \
-                    self.analyzePatientItems \
-                    (   patientItemData,
-                        analysisQuery,
-                        analysisQuery.baseRecQuery,
-                        patientId,
-                        analysisQuery.recommender,
-                        conn=conn
-                    );
-                if analysisResults is not None:
-                    (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData, orderSetItemData) = analysisResults;  # Unpack results
-
-                    # Start aggregating and calculating result stats
-                    resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, self.supportRecommender.patientCountByItemId, analysisQuery.baseRecQuery, recommendedData );
-                    resultsStatData["usedOrderSetIds"] = orderSetItemData["allUsedOrderSetIds"];
-                    resultsStatData["numUsedOrderSets"] = len(orderSetItemData["allUsedOrderSetIds"]);
-                    resultsStatData["numUsedOrderSetItems"] = len(orderSetItemData["allUsedOrderSetItemIds"]);
-                    resultsStatData["numAvailableOrderSetItems"] = len(orderSetItemData["allAvailableOrderSetItemIds"]);
-                    resultsStatData["numRecommendableUsedOrderSetItems"] = len(orderSetItemData["recommendableUsedOrderSetItemIds"]);
-                    resultsStatData["numRecommendableAvailableOrderSetItems"] = len(orderSetItemData["recommendableAvailableOrderSetItemIds"]);
-                    resultsStatData["numRecommendableQueryItems"] = len(orderSetItemData["recommendableQueryItemIds"]);
-                    resultsStatData["numRecommendableVerifyItems"] = len(orderSetItemData["recommendableVerifyItemIds"]);
-                    resultsStatData["numRecommendableQueryVerifyItems"] = len(orderSetItemData["recommendableQueryItemIds"] | orderSetItemData["recommendableVerifyItemIds"]);  # Union of two sets
-                    resultsStatData["orderSetItemUsageRate"] = 0.0;
-                    if resultsStatData["numAvailableOrderSetItems"] > 0:
-                        resultsStatData["orderSetItemUsageRate"] = float(resultsStatData["numUsedOrderSetItems"]) / resultsStatData["numAvailableOrderSetItems"];
-                    resultsStatData["recommendableQueryVerifyItemFromOrderSetRate"] = 0.0;
-                    if resultsStatData["numRecommendableQueryVerifyItems"] > 0:
-                        resultsStatData["recommendableQueryVerifyItemFromOrderSetRate"] = float(resultsStatData["numRecommendableUsedOrderSetItems"]) / resultsStatData["numRecommendableQueryVerifyItems"];
+            patientItemDataIter = preparer.loadPatientItemData(analysisQuery);
+            for patientItemData, resultsStatData in self.evaluatePatients(patientItemDataIter, analysisQuery, progress, conn=conn):
+                if resultsStatData is not None:
                     yield resultsStatData;
-                progress.Update();
             # progress.PrintStatus();
         finally:
             if not extConn:
                 conn.close();
 
+    def analyzePatient(self, patientItemData, analysisQuery, conn):
+        """Assess order set usage for one test patient.  Returns None if no relevant data for the patient.
+        """
+        analysisResults = \
+            self.analyzePatientItems \
+            (   patientItemData,
+                analysisQuery,
+                analysisQuery.baseRecQuery,
+                patientItemData["patient_id"],
+                analysisQuery.recommender,
+                conn=conn
+            );
+        if analysisResults is None:
+            return None;
+        (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData, orderSetItemData) = analysisResults;  # Unpack results
+
+        # Start aggregating and calculating result stats
+        resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, self.supportRecommender.patientCountByItemId, analysisQuery.baseRecQuery, recommendedData );
+        resultsStatData["usedOrderSetIds"] = orderSetItemData["allUsedOrderSetIds"];
+        resultsStatData["numUsedOrderSets"] = len(orderSetItemData["allUsedOrderSetIds"]);
+        resultsStatData["numUsedOrderSetItems"] = len(orderSetItemData["allUsedOrderSetItemIds"]);
+        resultsStatData["numAvailableOrderSetItems"] = len(orderSetItemData["allAvailableOrderSetItemIds"]);
+        resultsStatData["numRecommendableUsedOrderSetItems"] = len(orderSetItemData["recommendableUsedOrderSetItemIds"]);
+        resultsStatData["numRecommendableAvailableOrderSetItems"] = len(orderSetItemData["recommendableAvailableOrderSetItemIds"]);
+        resultsStatData["numRecommendableQueryItems"] = len(orderSetItemData["recommendableQueryItemIds"]);
+        resultsStatData["numRecommendableVerifyItems"] = len(orderSetItemData["recommendableVerifyItemIds"]);
+        resultsStatData["numRecommendableQueryVerifyItems"] = len(orderSetItemData["recommendableQueryItemIds"] | orderSetItemData["recommendableVerifyItemIds"]);  # Union of two sets
+        resultsStatData["orderSetItemUsageRate"] = 0.0;
+        if resultsStatData["numAvailableOrderSetItems"] > 0:
+            resultsStatData["orderSetItemUsageRate"] = float(resultsStatData["numUsedOrderSetItems"]) / resultsStatData["numAvailableOrderSetItems"];
+        resultsStatData["recommendableQueryVerifyItemFromOrderSetRate"] = 0.0;
+        if resultsStatData["numRecommendableQueryVerifyItems"] > 0:
+            resultsStatData["recommendableQueryVerifyItemFromOrderSetRate"] = float(resultsStatData["numRecommendableUsedOrderSetItems"]) / resultsStatData["numRecommendableQueryVerifyItems"];
+        return resultsStatData;
+
     def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, conn):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
@@ -273,13 +284,14 @@ class OrderSetUsageAnalysis(RecommendationClassificationAnalysis):
         parser.add_option("-r", "--numRecs",   dest="numRecs",  default=DEFAULT_RECOMMENDED_ITEM_COUNT, help="Number of orders / items to recommend for comparison against the verification set, sorted in prevalence order.  If skip or set <1, then will use all order set items found.");
         parser.add_option("-O", "--numRecsByOrderSet",   dest="numRecsByOrderSet", action="store_true", help="If set, then look for an order_set_id column to find the key order set that triggered the evaluation time point to determine number of recommendations to consider.");
         parser.add_option("-s", "--sortField",  dest="sortField",  default=DEFAULT_SORT_FIELD, help="Allow overriding of default sort field when returning ranked results (patient_count, name, description, etc.)");
+        parser.add_option("-j", "--numProcesses",  dest="numProcesses",  help="Number of worker processes to evaluate test patients in parallel with.  Defaults to 1 for serial evaluation.");
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
         if len(args) >= 1:
             query = AnalysisQuery();
-            query.preparedPatientItemFile = stdOpen(args[0]);
+            query.preparedPatientItemFile = openPreparedPatientItemFile(args[0]);
             query.recommender = OrderSetRecommender();
             query.baseRecQuery = RecommenderQuery();
             # Default exclusions if none specified
@@ -289,6 +301,9 @@ class OrderSetUsageAnalysis(RecommendationClassificationAnalysis):
             query.numRecommendations = int(options.numRecs);
             query.numRecsByOrderSet = options.numRecsByOrderSet;
 
+            if options.numProcesses is not None:
+                self.numProcesses = int(options.numProcesses);
+
             # Run the actual analysis
             analysisResults = self(query);
 
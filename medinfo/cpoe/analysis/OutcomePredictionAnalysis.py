@@ -32,6 +32,7 @@ from Util import log;
 from BaseCPOEAnalysis import BaseCPOEAnalysis;
 from BaseCPOEAnalysis import RECOMMENDER_CLASS_LIST, RECOMMENDER_CLASS_BY_NAME, AnalysisQuery;
 from PreparePatientItems import PreparePatientItems;
+from PreparedPatientItemStore import openPreparedPatientItemFile;
 
 from medinfo.analysis.Const import OUTCOME_IN_QUERY;
 
@@ -53,42 +54,16 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
             extConn = False;
 
         try:
-            # Recommender to test with
-            recommender = analysisQuery.recommender;
-
-            # Start building basic recommendation query to use for testing
-            recQuery = analysisQuery.baseRecQuery;
-
             # Start building results data
             resultsStatDataList = list();
             # progress = ProgressDots(50,1,"Patients");
 
             # Query for all of the order / item data for the test patients.  Load one patient's data at a time
             preparer = PreparePatientItems();
-            for patientItemData in preparer.loadPatientItemData(analysisQuery, conn=conn):
-                patientId = patientItemData["patient_id"];
-                (queryItemCountById, scoreByOutcomeId, existsByOutcomeId) = \
-                    self.analyzePatientItems \
-                    (   analysisQuery,
-                        recQuery,
-                        patientId,
-                        patientItemData,
-                        recommender,
-                        conn=conn
-                    );
-
-                if existsByOutcomeId is not None:
-                    # Verify that at least one of the labels is not trivial with the outcome occuring during the query period
-                    nonTrivialOutcomeExists = False;
-                    for outcomeResult in existsByOutcomeId.itervalues():
-                        if outcomeResult != OUTCOME_IN_QUERY:
-                            nonTrivialOutcomeExists = True;
-                    if not analysisQuery.skipIfOutcomeInQuery or nonTrivialOutcomeExists:
-                        # Start aggregating and calculating result stats
-                        resultsStatData = self.prepareResultStats( patientId, queryItemCountById, scoreByOutcomeId, existsByOutcomeId);
-                        resultsStatDataList.append(resultsStatData);
-
-                # progress.Update();
+            patientItemDataIter = preparer.loadPatientItemData(analysisQuery, conn=conn);
+            for patientItemData, resultsStatData in self.evaluatePatients(patientItemDataIter, analysisQuery, conn=conn):
+                if resultsStatData is not None:
+                    resultsStatDataList.append(resultsStatData);
 
             # progress.PrintStatus();
 
@@ -98,6 +73,34 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
             if not extConn:
                 conn.close();
 
+    def analyzePatient(self, patientItemData, analysisQuery, conn):
+        """Score the outcomes for one test patient.  Returns None if no relevant data for the patient,
+        or if skipping patients whose outcomes all occur during the query period.
+        """
+        patientId = patientItemData["patient_id"];
+        (queryItemCountById, scoreByOutcomeId, existsByOutcomeId) = \
+            self.analyzePatientItems \
+            (   analysisQuery,
+                analysisQuery.baseRecQuery,
+                patientId,
+                patientItemData,
+                analysisQuery.recommender,
+                conn=conn
+            );
+        if existsByOutcomeId is None:
+            return None;
+
+        # Verify that at least one of the labels is not trivial with the outcome occuring during the query period
+        nonTrivialOutcomeExists = False;
+        for outcomeResult in existsByOutcomeId.itervalues():
+            if outcomeResult != OUTCOME_IN_QUERY:
+                nonTrivialOutcomeExists = True;
+        if analysisQuery.skipIfOutcomeInQuery and not nonTrivialOutcomeExists:
+            return None;
+
+        # Start aggregating and calculating result stats
+        return self.prepareResultStats( patientId, queryItemCountById, scoreByOutcomeId, existsByOutcomeId);
+
     def analyzePatientItems(self, analysisQuery, recQuery, patientId, patientItemData, recommender, conn):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
@@ -207,6 +210,7 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
         parser.add_option("-a", "--aggregationMethod",  dest="aggregationMethod",  help="Aggregation method to use for recommendations based off multiple query items.  Options: %s." % list(AGGREGATOR_OPTIONS) );
         parser.add_option("-s", "--skipIfOutcomeInQuery",  dest="skipIfOutcomeInQuery",  action="store_true", help="If set, will skip patients where the outcome item occurs during the query period since that would defy the point of predicting the outcome.");
         parser.add_option("-m", "--maxRecommendedId",  dest="maxRecommendedId",  help="Specify a maximum ID value to accept for recommended items.  More used to limit output in test cases");
+        parser.add_option("-j", "--numProcesses",  dest="numProcesses",  help="Number of worker processes to evaluate test patients in parallel with.  Defaults to 1 for serial evaluation.");
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
@@ -220,7 +224,7 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
             query.baseRecQuery = RecommenderQuery();
             if options.preparedPatientItemFile:
                 # Don't reconstruct validation data through database, just read off validation file
-                query.preparedPatientItemFile = stdOpen(args[0]);
+                query.preparedPatientItemFile = openPreparedPatientItemFile(args[0]);
             else:
 
                 patientIdsParam = args[0];
@@ -260,6 +264,9 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
             if options.skipIfOutcomeInQuery is not None:
                 query.skipIfOutcomeInQuery = options.skipIfOutcomeInQuery;
 
+            if options.numProcesses is not None:
+                self.numProcesses = int(options.numProcesses);
+
             # Run the actual analysis
             analysisResults = self(query);
 
@@ -32,6 +32,7 @@ from medinfo.analysis.Const import NEGATIVE_OUTCOME_STRS;
 
 from BaseCPOEAnalysis import AnalysisQuery;
 from BaseCPOEAnalysis import BaseCPOEAnalysis;
+from PreparedPatientItemStore import PreparedPatientItemStore, isPreparedPatientItemStore, openPreparedPatientItemFile;
 
 class PreparePatientItems(BaseCPOEAnalysis):
     def __init__(self):
@@ -77,6 +78,10 @@ class PreparePatientItems(BaseCPOEAnalysis):
                 # Parse through the patient's item list and run a query to get the top recommended IDs for comparison
                 for patientItemData in self.extractPatientItemData(analysisQuery, analysisQuery.baseRecQuery, patientId, patientItemList, self.categoryIdByItemId):
                     yield patientItemData;
+        elif isinstance(analysisQuery.preparedPatientItemFile, PreparedPatientItemStore):
+            # Binary format store provided, just read the arrays, no parsing needed
+            for patientItemData in analysisQuery.preparedPatientItemFile.iterPatientItemData(analysisQuery):
+                yield patientItemData;
         else:
             # File provided, apparently data loaded before, just read/parse off file instead
             for patientItemData in self.parsePreparedResultFile(analysisQuery.preparedPatientItemFile, analysisQuery):
@@ -344,6 +349,12 @@ class PreparePatientItems(BaseCPOEAnalysis):
         to facilitate subsequent analysis.  Implemented as a generator over matrix rows to stream through data
         incHeaders:    Whether to include a header label row with result
         """
+        if isPreparedPatientItemStore(inputFilename):
+            # Binary format store, convert from the stored arrays rather than parsing text
+            for resultRow in self.convertStoreToFeatureMatrix(PreparedPatientItemStore(inputFilename), incHeaders):
+                yield resultRow;
+            return;
+
         inputFileFactory = FileFactory(inputFilename);
 
         itemColumnHeaders = ["queryItemCountByIdJSON", "verifyItemCountByIdJSON"];
@@ -415,6 +426,27 @@ class PreparePatientItems(BaseCPOEAnalysis):
         inputFile.close();
         # prog.printStatus();
 
+    def convertStoreToFeatureMatrix(self, store, incHeaders=True):
+        """Equivalent of convertResultsFileToFeatureMatrix for a binary PreparedPatientItemStore,
+        building the item columns from sparse matrices of the stored item count arrays, a chunk of rows at a time.
+        """
+        sections = store.sections();
+        baseHeaders = [header for header in store.headers if not header.endswith("JSON")];
+        allItemIds = store.itemIds(sections);
+
+        if incHeaders:
+            yield baseHeaders + [str(itemId) for itemId in allItemIds];
+
+        prog = ProgressDots(total=store.nRows);
+        for rows in store.iterRowChunks():
+            (itemMatrix, itemIds) = store.itemMatrix(sections, rows, allItemIds);
+            itemCounts = itemMatrix.toarray().tolist();
+            for row, rowItemCounts in zip(rows, itemCounts):
+                resultRow = [store.columnValue(header, row) for header in baseHeaders];
+                resultRow.extend(rowItemCounts);
+                yield resultRow;
+                prog.update();
+        # prog.printStatus();
 
     def convertResultsFileToBagOfWordsCorpus(self, inputFile, queryItems=True, verifyItems=True, outcomeItems=True, excludeCategoryIds=None):
         """Convert results file from primary prepare patient items script into a (sparse) "bag of words"
@@ -425,11 +457,20 @@ class PreparePatientItems(BaseCPOEAnalysis):
         verifyItems: Whether to include verify items in the results
         incHeaders: Whether to include a header label row with result
         excludeCategoryIds: IDs of item categories that should be excluded / skipped during conversion
+
+        inputFile may also be a binary PreparedPatientItemStore, in which case the item counts are read
+        directly from its arrays rather than parsed from JSON text.
         """
         itemsById = DBUtil.loadTableAsDict("clinical_item");
 
+        rowIter = None;
+        if isinstance(inputFile, PreparedPatientItemStore):
+            rowIter = inputFile.iterPatientItemData();
+        else:
+            rowIter = TabDictReader(inputFile);
+
         prog = ProgressDots();
-        for inputDict in TabDictReader(inputFile):
+        for inputDict in rowIter:
             resultRow = list();
             observedIds = set();
             if outcomeItems:
@@ -444,13 +485,13 @@ class PreparePatientItems(BaseCPOEAnalysis):
             totalCountById = dict();
             if queryItems:
                 # Iterate through query items
-                itemCountById = loadJSONDict(inputDict["queryItemCountByIdJSON"], int, int);
+                itemCountById = self.rowItemCountById(inputDict, "queryItemCountById");
                 for itemId, itemCount in itemCountById.iteritems():
                     if itemId not in totalCountById:
                         totalCountById[itemId] = 0;
                     totalCountById[itemId] += itemCount;
             if verifyItems:
-                itemCountById = loadJSONDict(inputDict["verifyItemCountByIdJSON"], int, int);
+                itemCountById = self.rowItemCountById(inputDict, "verifyItemCountById");
                 for itemId, itemCount in itemCountById.iteritems():
                     if itemId not in totalCountById:
                         totalCountById[itemId] = 0;
@@ -462,6 +503,12 @@ class PreparePatientItems(BaseCPOEAnalysis):
         inputFile.close();
         # prog.printStatus();
 
+    def rowItemCountById(self, inputDict, key):
+        """Item count dictionary from a prepared result row, parsing it from the JSON text column if not already parsed"""
+        if key in inputDict:
+            return inputDict[key];
+        return loadJSONDict(inputDict[key+"JSON"], int, int);
+
     def itemCountByIdToBagOfWords(self, itemCountById, observedIds=None, itemsById=None, excludeCategoryIds=None ):
         """Return 2-ple (itemId, count) representation of item IDs, but filter out those in excluded set,
         or whose category looked up via itemsById is already observed previously or so far.
@@ -503,6 +550,7 @@ class PreparePatientItems(BaseCPOEAnalysis):
         parser.add_option("-M", "--featureMatrixConvert",  dest="featureMatrixConvert", action="store_true", help="If set, will ignore earlier parameters, and interpret inputFile as a prepared patient item result file and then output it back in a sparse 'feature matrix' format with a column for each clinical item and 0/1 for the binary presence of each item for each patient in the query OR verify item sets.");
         parser.add_option("-B", "--bagOfWordsConvert",  dest="bagOfWordsConvert", help="If set, instead interpret inputFile as a prepared patient item result file and then output it back in a sparse 'bag of words' format compatible with GenSim.  List of 2-ples (itemId, itemCount).  Given binary labels, counts will just be 0 or 1 for the presence of each item for each patient.  Include parameter characters 'q' and 'v' to specify which (or both) query and verify item sets to include. Include 'o' character to also include any outcome items.");
         parser.add_option("-X", "--excludeCategoryIds",  dest="excludeCategoryIds", help="For conversion, exclude / skip any items who fall under one of the comma-separated category Ids.  For extraction, will use default item and category exclusions regardless of this parameter.");
+        parser.add_option("-F", "--binaryFormat",  dest="binaryFormat", action="store_true", help="If set, save the prepared results into outputFile as a directory of binary (NumPy) arrays, rather than as tab-delimited text.  Such prepared result directories can be used as the inputFile for the conversions above or for subsequent analysis scripts, without reparsing the text.");
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
@@ -511,7 +559,7 @@ class PreparePatientItems(BaseCPOEAnalysis):
             if options.bagOfWordsConvert is not None:
                 # Convert results file into bag of words (sparse matrix) corpus format
                 inputFilename = args[0];
-                inputFile = stdOpen(inputFilename);
+                inputFile = openPreparedPatientItemFile(inputFilename);
 
                 # Format the results for output
                 outputFilename = None;
@@ -613,15 +661,21 @@ class PreparePatientItems(BaseCPOEAnalysis):
                 outputFilename = None;
                 if len(args) > 1:
                     outputFilename = args[1];
-                outputFile = stdOpen(outputFilename,"w");
 
-                print >> outputFile, COMMENT_TAG, json.dumps({"argv":argv});    # Print comment line with analysis arguments to allow for deconstruction later
+                colNames = self.resultHeaders(query);
+                if options.binaryFormat:
+                    # Save into binary format store directory instead of text
+                    store = PreparedPatientItemStore(outputFilename);
+                    store.save(resultsGenerator, colNames);
+                else:
+                    outputFile = stdOpen(outputFilename,"w");
 
-                formatter = TextResultsFormatter( outputFile );
+                    print >> outputFile, COMMENT_TAG, json.dumps({"argv":argv});    # Print comment line with analysis arguments to allow for deconstruction later
 
-                colNames = self.resultHeaders(query);
-                formatter.formatTuple( colNames );    # Insert a mock record to get a header / label row
-                formatter.formatResultDicts( resultsGenerator, colNames );
+                    formatter = TextResultsFormatter( outputFile );
+
+                    formatter.formatTuple( colNames );    # Insert a mock record to get a header / label row
+                    formatter.formatResultDicts( resultsGenerator, colNames );
 
         else:
             parser.print_help()
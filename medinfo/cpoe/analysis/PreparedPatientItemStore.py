@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+"""
+Binary, random access format for the prepared patient item results of PreparePatientItems.
+
+Rather than text rows embedding JSON dictionary strings of item counts
+(which every downstream analysis has to reparse), save a directory of NumPy arrays:
+- Compressed sparse row (CSR) arrays of item IDs and counts for each item count section
+  (e.g., queryItemCountById, verifyItemCountById), with row pointers into them for each result row
+- Typed arrays for the other columns (patient IDs, base item dates, outcome labels, etc.),
+  with null masks for the integer and text columns (dates use NaT for nulls)
+- A sorted row index by patient ID
+
+The arrays can be memory mapped, read in chunks or by patient,
+and converted directly into scipy sparse matrices or gensim style bag of words corpora.
+"""
+
+import sys, os;
+import time;
+import json;
+import shutil;
+from optparse import OptionParser;
+import numpy as np;
+import scipy.sparse;
+from medinfo.common.Util import stdOpen, ProgressDots;
+from Util import log;
+
+STORE_META_FILENAME = "meta.json";
+STORE_FORMAT_VERSION = 2;
+
+# Default number of rows to read at a time when streaming through the whole store
+DEFAULT_CHUNK_SIZE = 10000;
+
+# Standard column order of PreparePatientItems.resultHeaders, to order columns found in records by
+STANDARD_HEADERS = \
+    [   "patient_id",
+        "queryItemCountByIdJSON",
+        "verifyItemCountByIdJSON",
+        "baseItemId",
+        "baseItemDate",
+        "queryStartTime",
+        "queryEndTime",
+        "verifyEndTime",
+        "order_set_id",
+    ];
+
+# Column types, following the parsing conventions of PreparePatientItems.parsePreparedResultFile
+ITEM_COUNT_COLUMN = "items";   # Item count dictionaries (JSON columns in the text format)
+INT_COLUMN = "int";   # IDs and outcome labels
+DATETIME_COLUMN = "datetime";
+TEXT_COLUMN = "text";
+
+def columnType(header):
+    """Type to store a prepared result column as, based on its header"""
+    if header.endswith("JSON"):
+        return ITEM_COUNT_COLUMN;
+    elif header.startswith("outcome.") or header.endswith("id") or header.endswith("Id"):
+        return INT_COLUMN;
+    elif header.endswith("Date") or header.endswith("Time"):
+        return DATETIME_COLUMN;
+    else:
+        return TEXT_COLUMN;
+
+def isPreparedPatientItemStore(filename):
+    """Whether the filename (possibly a file object) represents a prepared patient item store directory"""
+    return isinstance(filename, basestring) and os.path.isfile(os.path.join(filename, STORE_META_FILENAME));
+
+def openPreparedPatientItemFile(filename):
+    """Open a prepared patient item result input, whether a binary store directory or a (text) file"""
+    if isPreparedPatientItemStore(filename):
+        return PreparedPatientItemStore(filename);
+    return stdOpen(filename);
+
+def gatherRows(indptr, rows):
+    """Given CSR row pointers and a selection of rows, return the (indptr, positions) of
+    the CSR representation of just those rows, where positions are the indexes of the
+    selected entries in the original data arrays.
+    """
+    starts = indptr[rows];
+    lengths = indptr[rows+1] - starts;
+    subIndptr = np.zeros(len(rows)+1, dtype=np.int64);
+    np.cumsum(lengths, out=subIndptr[1:]);
+    positions = np.repeat(starts - subIndptr[:-1], lengths) + np.arange(subIndptr[-1]);
+    return (subIndptr, positions);
+
+class ArrayFileWriter:
+    """Write a one dimensional .npy array file a chunk of values at a time, without holding all of the values in memory.
+    The values are spooled to a raw temporary file, then copied behind the .npy header once the final length is known.
+    """
+    def __init__(self, filename, dtype):
+        self.filename = filename;
+        self.dtype = np.dtype(dtype);
+        self.length = 0;
+        self.spoolFile = open(filename + ".part", "wb");
+
+    def append(self, values):
+        array = np.asarray(values, dtype=self.dtype);
+        array.tofile(self.spoolFile);
+        self.length += len(array);
+
+    def close(self):
+        self.spoolFile.close();
+        spoolFile = open(self.spoolFile.name, "rb");
+        outFile = open(self.filename, "wb");
+        try:
+            header = {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (self.length,)};
+            np.lib.format.write_array_header_1_0(outFile, header);
+            shutil.copyfileobj(spoolFile, outFile);
+        finally:
+            outFile.close();
+            spoolFile.close();
+        os.remove(self.spoolFile.name);
+
+class TextArrayFileWriter:
+    """Equivalent of ArrayFileWriter for text values.  The fixed width string type is not known until all
+    of the values are seen, so spool them as (escaped) lines of text, then convert them a chunk at a time.
+    """
+    def __init__(self, filename):
+        self.filename = filename;
+        self.width = 1;
+        self.spoolFile = open(filename + ".txt.part", "w");
+
+    def append(self, values):
+        for value in values:
+            self.width = max(self.width, len(value));
+            print >> self.spoolFile, value.encode("string_escape");
+
+    def close(self):
+        self.spoolFile.close();
+        writer = ArrayFileWriter(self.filename, "S%d" % self.width);
+        spoolFile = open(self.spoolFile.name);
+        try:
+            values = list();
+            for line in spoolFile:
+                values.append(line[:-1].decode("string_escape"));
+                if len(values) >= DEFAULT_CHUNK_SIZE:
+                    writer.append(values);
+                    values = list();
+            writer.append(values);
+        finally:
+            spoolFile.close();
+        writer.close();
+        os.remove(self.spoolFile.name);
+
+class PreparedPatientItemStore:
+    """Directory of NumPy arrays representing the rows of prepared patient item data.
+
+    Each row corresponds to one patientItemData record as yielded by PreparePatientItems
+    (or parsed back by parsePreparedResultFile), so multiple rows can exist for a patient
+    (e.g., one per order set used).
+    """
+    def __init__(self, path):
+        self.path = path;
+        self.headers = None;
+        self.nRows = 0;
+        self.columns = None;    # Arrays of values by header for the non-item columns
+        self.nullMasks = None;  # Boolean arrays by header for the integer and text columns, marking null values
+        self.indptrBySection = None;    # CSR arrays by section name (e.g., queryItemCountById)
+        self.itemIdsBySection = None;
+        self.countsBySection = None;
+        self.patientOrder = None;   # Row indexes sorted by patient ID
+        self.sortedPatientIds = None;
+        if isPreparedPatientItemStore(path):
+            self.load();
+
+    def arrayPath(self, header, suffix):
+        # Identify columns by index rather than by header, which may not be a valid filename
+        return os.path.join(self.path, "%d.%s.npy" % (self.headers.index(header), suffix));
+
+    def sections(self):
+        """Names of the item count sections, e.g., queryItemCountById, verifyItemCountById"""
+        return [header[:-len("JSON")] for header in self.headers if columnType(header) == ITEM_COUNT_COLUMN];
+
+    def outcomeIds(self):
+        return [int(header[len("outcome."):]) for header in self.headers if header.startswith("outcome.")];
+
+    def save(self, patientItemDataIter, headers=None, chunkSize=None):
+        """Stream through the patientItemData records and save them into the store directory.
+        headers - Result columns to save, as per PreparePatientItems.resultHeaders.
+            If not provided, take the columns present in the first record.
+        chunkSize - Number of records to collect before appending them to the array files (default DEFAULT_CHUNK_SIZE),
+            so memory use does not grow with the total number of records.
+        """
+        if chunkSize is None:   chunkSize = DEFAULT_CHUNK_SIZE;
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path);
+        for filename in os.listdir(self.path):
+            # Clear out any prior store contents
+            if filename == STORE_META_FILENAME or filename.endswith(".npy") or filename.endswith(".part"):
+                os.remove(os.path.join(self.path, filename));
+
+        writersByHeader = None;
+        records = list();
+        nRows = 0;
+        prog = ProgressDots();
+        for patientItemData in patientItemDataIter:
+            if writersByHeader is None:
+                if headers is None:
+                    headers = self.recordHeaders(patientItemData);
+                writersByHeader = self.openColumnWriters(headers);
+            records.append(patientItemData);
+            if len(records) >= chunkSize:
+                self.writeRecords(writersByHeader, records);
+                records = list();
+            nRows += 1;
+            prog.update();
+        # prog.printStatus();
+
+        if writersByHeader is None:
+            # No records.  Still save the (empty) columns
+            writersByHeader = self.openColumnWriters(headers or ["patient_id"]);
+        self.writeRecords(writersByHeader, records);
+        for writers in writersByHeader.itervalues():
+            for writer in writers:
+                writer.close();
+
+        patientIds = np.zeros(0, dtype=np.int64);
+        if "patient_id" in self.headers:
+            patientIds = np.load(self.arrayPath("patient_id", INT_COLUMN), mmap_mode="r");
+        np.save(os.path.join(self.path, "patientOrder.npy"), np.argsort(patientIds, kind="mergesort"));
+
+        # Write the meta data last, so an interrupted save is not mistaken for a complete store
+        metaFile = open(os.path.join(self.path, STORE_META_FILENAME), "w");
+        try:
+            json.dump({"version": STORE_FORMAT_VERSION, "nRows": nRows, "headers": self.headers}, metaFile);
+        finally:
+            metaFile.close();
+        log.debug("Saved %d prepared patient item rows to %s" % (nRows, self.path));
+
+        self.load();
+
+    def openColumnWriters(self, headers):
+        """Prepare array file writers for each column, keyed by header"""
+        self.headers = list(headers);
+        writersByHeader = dict();
+        for header in self.headers:
+            colType = columnType(header);
+            if colType == ITEM_COUNT_COLUMN:
+                indptrWriter = ArrayFileWriter(self.arrayPath(header, "indptr"), np.int64);
+                indptrWriter.append([0]);
+                writersByHeader[header] = (indptrWriter, ArrayFileWriter(self.arrayPath(header, "itemIds"), np.int64), ArrayFileWriter(self.arrayPath(header, "counts"), np.int64));
+            elif colType == INT_COLUMN:
+                writersByHeader[header] = (ArrayFileWriter(self.arrayPath(header, colType), np.int64), ArrayFileWriter(self.arrayPath(header, "null"), bool));
+            elif colType == DATETIME_COLUMN:
+                writersByHeader[header] = (ArrayFileWriter(self.arrayPath(header, colType), "datetime64[us]"),);   # None values stored as NaT
+            else:
+                writersByHeader[header] = (TextArrayFileWriter(self.arrayPath(header, colType)), ArrayFileWriter(self.arrayPath(header, "null"), bool));
+        return writersByHeader;
+
+    def writeRecords(self, writersByHeader, records):
+        """Append the column values of a chunk of patientItemData records to the array file writers"""
+        for header in self.headers:
+            colType = columnType(header);
+            if colType == ITEM_COUNT_COLUMN:
+                (indptrWriter, itemIdsWriter, countsWriter) = writersByHeader[header];
+                section = header[:-len("JSON")];
+                indptr = list();
+                itemIds = list();
+                counts = list();
+                for patientItemData in records:
+                    itemCountById = patientItemData[section];
+                    for itemId in sorted(itemCountById):
+                        itemIds.append(itemId);
+                        counts.append(itemCountById[itemId]);
+                    indptr.append(itemIdsWriter.length + len(itemIds));
+                indptrWriter.append(indptr);
+                itemIdsWriter.append(itemIds);
+                countsWriter.append(counts);
+            elif colType == DATETIME_COLUMN:
+                writersByHeader[header][0].append([patientItemData[header] for patientItemData in records]);
+            else:
+                (valueWriter, nullWriter) = writersByHeader[header];
+                values = [patientItemData[header] for patientItemData in records];
+                isNull = [value is None for value in values];
+                if colType == INT_COLUMN:
+                    valueWriter.append([value is not None and value or 0 for value in values]);
+                else:
+                    valueWriter.append([value is not None and str(value) or "" for value in values]);
+                nullWriter.append(isNull);
+
+    def recordHeaders(self, patientItemData):
+        """Result columns represented in a patientItemData record,
+        in the standard PreparePatientItems order, then any others, then the outcome columns.
+        """
+        headers = list();
+        for key, value in patientItemData.iteritems():
+            if isinstance(value, dict):
+                if key.endswith("ItemCountById"):
+                    headers.append(key + "JSON");
+            elif not key.endswith("JSON"):
+                headers.append(key);
+        def headerOrder(header):
+            if header in STANDARD_HEADERS:
+                return (0, STANDARD_HEADERS.index(header), header);
+            return (header.startswith("outcome.") and 2 or 1, 0, header);
+        headers.sort(key=headerOrder);
+        return headers;
+
+    def load(self, mmapMode="r"):
+        """Load (memory map) the store's arrays"""
+        metaFile = open(os.path.join(self.path, STORE_META_FILENAME));
+        try:
+            meta = json.load(metaFile);
+        finally:
+            metaFile.close();
+        if meta["version"] != STORE_FORMAT_VERSION:
+            raise ValueError("Unsupported prepared patient item store version %s: %s" % (meta["version"], self.path));
+        self.headers = [str(header) for header in meta["headers"]];
+        self.nRows = meta["nRows"];
+
+        self.columns = dict();
+        self.nullMasks = dict();
+        self.indptrBySection = dict();
+        self.itemIdsBySection = dict();
+        self.countsBySection = dict();
+        for header in self.headers:
+            colType = columnType(header);
+            if colType == ITEM_COUNT_COLUMN:
+                section = header[:-len("JSON")];
+                self.indptrBySection[section] = np.load(self.arrayPath(header, "indptr"), mmap_mode=mmapMode);
+                self.itemIdsBySection[section] = np.load(self.arrayPath(header, "itemIds"), mmap_mode=mmapMode);
+                self.countsBySection[section] = np.load(self.arrayPath(header, "counts"), mmap_mode=mmapMode);
+            else:
+                self.columns[header] = np.load(self.arrayPath(header, colType), mmap_mode=mmapMode);
+                if colType != DATETIME_COLUMN:
+                    self.nullMasks[header] = np.load(self.arrayPath(header, "null"), mmap_mode=mmapMode);
+
+        self.patientOrder = np.load(os.path.join(self.path, "patientOrder.npy"), mmap_mode=mmapMode);
+        self.sortedPatientIds = None;
+
+    def close(self):
+        """Release the (memory mapped) arrays"""
+        self.columns = None;
+        self.nullMasks = None;
+        self.indptrBySection = None;
+        self.itemIdsBySection = None;
+        self.countsBySection = None;
+        self.patientOrder = None;
+        self.sortedPatientIds = None;
+
+    def columnValue(self, header, row):
+        """Value of a (non-item) column for the given row, with None for nulls"""
+        if header in self.nullMasks and self.nullMasks[header][row]:
+            return None;
+        return self.columns[header][row].item();  # Also converts NaT dates into None
+
+    def itemCountById(self, section, row):
+        indptr = self.indptrBySection[section];
+        (start, stop) = (indptr[row], indptr[row+1]);
+        return dict(zip(self.itemIdsBySection[section][start:stop].tolist(), self.countsBySection[section][start:stop].tolist()));
+
+    def patientItemData(self, row):
+        """Reconstruct the patientItemData record for the given row,
+        equivalent to what parsePreparedResultFile would produce from the text format.
+        The JSON columns are regenerated from the item counts as PreparePatientItems formats them,
+        so they have the same content, but not necessarily the same formatting as an original text file.
+        """
+        patientItemData = dict();
+        existsByOutcomeId = None;
+        for header in self.headers:
+            if columnType(header) == ITEM_COUNT_COLUMN:
+                section = header[:-len("JSON")];
+                patientItemData[section] = self.itemCountById(section, row);
+                patientItemData[header] = json.dumps(patientItemData[section]);
+            else:
+                value = self.columnValue(header, row);
+                patientItemData[header] = value;
+                if header.startswith("outcome."):
+                    if existsByOutcomeId is None:
+                        existsByOutcomeId = dict();
+                    existsByOutcomeId[int(header[len("outcome."):])] = value;
+        if existsByOutcomeId is not None:
+            patientItemData["existsByOutcomeId"] = existsByOutcomeId;
+        return patientItemData;
+
+    def iterPatientItemData(self, analysisQuery=None, rows=None):
+        """Generator over the patientItemData records for the given rows (default all).
+        If an analysisQuery is provided, add the store's outcome IDs to its target items, like parsePreparedResultFile.
+        """
+        if analysisQuery is not None:
+            analysisQuery.baseRecQuery.targetItemIds.update(self.outcomeIds());
+        if rows is None:
+            rows = xrange(self.nRows);
+        for row in rows:
+            yield self.patientItemData(row);
+
+    def iterRowChunks(self, chunkSize=None):
+        """Generator over arrays of consecutive row indexes, to stream through the store in chunks"""
+        if chunkSize is None:   chunkSize = DEFAULT_CHUNK_SIZE;
+        for start in xrange(0, self.nRows, chunkSize):
+            yield np.arange(start, min(start+chunkSize, self.nRows));
+
+    def patientRows(self, patientId):
+        """Row indexes (in order) of the records for the given patient"""
+        if self.sortedPatientIds is None:
+            self.sortedPatientIds = np.asarray(self.columns["patient_id"])[self.patientOrder];
+        start = np.searchsorted(self.sortedPatientIds, patientId, side="left");
+        stop = np.searchsorted(self.sortedPatientIds, patientId, side="right");
+        return np.sort(self.patientOrder[start:stop]);
+
+    def itemIds(self, sections=None):
+        """Sorted unique item IDs occurring in the given sections (default all)"""
+        if sections is None:    sections = self.sections();
+        itemIds = [np.unique(self.itemIdsBySection[section]) for section in sections];
+        if len(itemIds) < 1:
+            return np.zeros(0, dtype=np.int64);
+        return np.unique(np.concatenate(itemIds));
+
+    def itemMatrix(self, sections=None, rows=None, itemIds=None):
+        """Sparse matrix (rows x itemIds) of item counts, summed across the given sections.
+        sections - Item count sections to include (default all).
+        rows - Row indexes to include (default all).
+        itemIds - Sorted item IDs to use as the matrix columns.  Defaults to all items in the sections.
+            Items not in the list are omitted.
+        Returns 2-ple (csr_matrix, itemIds)
+        """
+        if sections is None:    sections = self.sections();
+        if rows is None:
+            rows = np.arange(self.nRows);
+        rows = np.asarray(rows, dtype=np.int64);
+        if itemIds is None:
+            itemIds = self.itemIds(sections);
+        itemIds = np.asarray(itemIds, dtype=np.int64);
+
+        matrix = scipy.sparse.csr_matrix((len(rows), len(itemIds)), dtype=np.int64);
+        for section in sections:
+            (indptr, positions) = gatherRows(self.indptrBySection[section], rows);
+            sectionItemIds = self.itemIdsBySection[section][positions];
+            cols = np.searchsorted(itemIds, sectionItemIds);
+            isColumn = (cols < len(itemIds));
+            isColumn[isColumn] = (itemIds[cols[isColumn]] == sectionItemIds[isColumn]);
+            matrixRows = np.repeat(np.arange(len(rows)), np.diff(indptr));
+            matrix = matrix + \
+                scipy.sparse.coo_matrix \
+                (   (self.countsBySection[section][positions][isColumn], (matrixRows[isColumn], cols[isColumn])),
+                    shape=(len(rows), len(itemIds)),
+                ).tocsr();
+        return (matrix, itemIds);
+
+    def bagOfWordsCorpus(self, sections=None, chunkSize=None):
+        """Generator over gensim style bag of words lists of 2-ples (itemId, count) for each row,
+        summing counts across the given sections (default all).
+        Unlike PreparePatientItems.convertResultsFileToBagOfWordsCorpus, no category or outcome based filtering.
+        """
+        itemIds = self.itemIds(sections);
+        for rows in self.iterRowChunks(chunkSize):
+            (matrix, itemIds) = self.itemMatrix(sections, rows, itemIds);
+            for i in xrange(matrix.shape[0]):
+                (start, stop) = (matrix.indptr[i], matrix.indptr[i+1]);
+                yield zip(itemIds[matrix.indices[start:stop]].tolist(), matrix.data[start:stop].tolist());
+
+    def main(self, argv):
+        """Main method, callable from command line"""
+        usageStr =  "usage: %prog [options] <inputFile> <outputDir>\n"+\
+                    "   <inputFile>    Tab-delimited prepared patient item result file from PreparePatientItems to convert.\n"+\
+                    "   <outputDir>    Directory to save the binary prepared patient item store to.\n"
+        parser = OptionParser(usage=usageStr)
+        (options, args) = parser.parse_args(argv[1:])
+
+        log.info("Starting: "+str.join(" ", argv))
+        timer = time.time();
+        if len(args) > 1:
+            from PreparePatientItems import PreparePatientItems;  # Import here to avoid circular module dependency
+            preparer = PreparePatientItems();
+            inputFile = stdOpen(args[0]);
+            self.path = args[1];
+            self.save(preparer.parsePreparedResultFile(inputFile));
+        else:
+            parser.print_help()
+            sys.exit(-1)
+
+        timer = time.time() - timer;
+        log.info("%.3f seconds to complete",timer);
+
+if __name__ == "__main__":
+    instance = PreparedPatientItemStore(None);
+    instance.main(sys.argv);
@@ -33,6 +33,7 @@ from BaseCPOEAnalysis import RECOMMENDER_CLASS_LIST, RECOMMENDER_CLASS_BY_NAME,
 from BaseCPOEAnalysis import AGGREGATOR_OPTIONS;
 
 from PreparePatientItems import PreparePatientItems;
+from PreparedPatientItemStore import openPreparedPatientItemFile;
 
 class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
     """Driver class to review given patient data and run sample recommendation queries against
@@ -51,43 +52,20 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
 
         try:
             # Preload some lookup data to facilitate subsequent checks
-            baseCountByItemId = self.dataManager.loadClinicalItemBaseCountByItemId(conn=conn);
-
-            # Recommender to test with
-            recommender = analysisQuery.recommender;
-
-            # Start building basic recommendation query to use for testing
-            recQuery = analysisQuery.baseRecQuery;
+            self.baseCountByItemId = self.dataManager.loadClinicalItemBaseCountByItemId(conn=conn);
 
             # Start building results data
             resultsStatDataList = list();
             progress = ProgressDots(50,1,"Patients");
 
             # Query for all of the order / item data for the test patients.  Load one patient's data at a time
-            preparer = PreparePatientItems();
-            for patientItemData in preparer.loadPatientItemData(analysisQuery, conn=conn):
-                patientId = patientItemData["patient_id"];
-
-                analysisResults = \
-                    self.analyzePatientItems \
-                    (   patientItemData,
-                        analysisQuery,
-                        recQuery,
-                        patientId,
-                        recommender,
-                        preparer,
-                        conn=conn
-                    );
-
-                if analysisResults is not None:
-                    (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
-                    # Start aggregating and calculating result stats
-                    resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, baseCountByItemId, recQuery, recommendedData );
+            self.preparer = PreparePatientItems();
+            patientItemDataIter = self.preparer.loadPatientItemData(analysisQuery, conn=conn);
+            for patientItemData, resultsStatData in self.evaluatePatients(patientItemDataIter, analysisQuery, progress, conn=conn):
+                if resultsStatData is not None:
                     if "baseItemId" in patientItemData:
                         analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
                     resultsStatDataList.append(resultsStatData);
-
-                progress.Update();
             # progress.PrintStatus();
 
             return resultsStatDataList;
@@ -97,6 +75,26 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
                 conn.close();
 
 
+    def analyzePatient(self, patientItemData, analysisQuery, conn):
+        """Run the recommender query for one test patient and calculate the comparison stats
+        against the patient's verify items.  Returns None if no relevant data for the patient.
+        """
+        analysisResults = \
+            self.analyzePatientItems \
+            (   patientItemData,
+                analysisQuery,
+                analysisQuery.baseRecQuery,
+                patientItemData["patient_id"],
+                analysisQuery.recommender,
+                self.preparer,
+                conn=conn
+            );
+        if analysisResults is None:
+            return None;
+        (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
+        # Start aggregating and calculating result stats
+        return self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, self.baseCountByItemId, analysisQuery.baseRecQuery, recommendedData );
+
     def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, preparer, conn):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
@@ -344,6 +342,7 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
         parser.add_option("-a", "--aggregationMethod",  dest="aggregationMethod",  help="Aggregation method to use for recommendations based off multiple query items.  Options: %s." % list(AGGREGATOR_OPTIONS) );
         parser.add_option("-p", "--countPrefix",  dest="countPrefix",  help="Prefix for how to do counts.  Blank for default item counting allowing repeats, otherwise ignore repeats for patient_ or encounter_");
         parser.add_option("-m", "--maxRecommendedId",  dest="maxRecommendedId",  help="Specify a maximum ID value to accept for recommended items.  More used to limit output in test cases");
+        parser.add_option("-j", "--numProcesses",  dest="numProcesses",  help="Number of worker processes to evaluate test patients in parallel with.  Defaults to 1 for serial evaluation.");
 
         (options, args) = parser.parse_args(argv[1:])
 
@@ -357,7 +356,7 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
 
             if options.preparedPatientItemFile:
                 # Don't reconstruct validation data through database, just read off validation file
-                query.preparedPatientItemFile = stdOpen(args[0]);
+                query.preparedPatientItemFile = openPreparedPatientItemFile(args[0]);
             else:
                 patientIdsParam = args[0];
                 try:
@@ -412,6 +411,8 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
                 query.numRecommendations = query.numVerifyItems;
             query.numRecsByOrderSet = options.numRecsByOrderSet;
 
+            if options.numProcesses is not None:
+                self.numProcesses = int(options.numProcesses);
 
             # Run the actual analysis
             analysisResults = self(query);
@@ -91,6 +91,9 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
             # Start building basic recommendation query to use for testing
             recQuery = analysisQuery.baseRecQuery;
 
+            # Incrementally maintain recommendation scores as each patient's query items accumulate, if the recommender supports it
+            scorer = recommender.incrementalScorer(recQuery, conn=conn);
+
             # Start building results data
             resultsTable = list();
             progress = ProgressDots(50,1,"Item Recommendations");
@@ -108,7 +111,8 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
                         recommender,
                         categoryIdByItemId,
                         progress=progress,
-                        conn=conn
+                        conn=conn,
+                        scorer=scorer
                     );
 
                 for (clinicalItemId, iItem, iRecItem, recRank, recScore) in serialRecDataGen:
@@ -180,12 +184,19 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
         cursor.close();
 
 
-    def reviewSerialRecommendations(self, patientId, clinicalItemIdList, analysisQuery,  recQuery,  recommender,  categoryIdByItemId, progress, conn ):
+    def reviewSerialRecommendations(self, patientId, clinicalItemIdList, analysisQuery,  recQuery,  recommender,  categoryIdByItemId, progress, conn, scorer=None ):
         """Serially and cumulatively go through the
         clinical items and perform recommendation queries using the accumulated keyset
         to determine the relative rank and score for each successive item.
         Account for / skip redundant and otherwise excluded items.
+
+        If an incremental scorer from the recommender is provided, add each item to it as the keyset accumulates
+        and look up each successive item's rank from it, rather than rerunning the full recommender query.
+        Only fall back to the recommender when there are no association results to score (e.g., empty keyset).
         """
+        if scorer is not None:
+            scorer.reset();
+
         clinicalItemIdSet = set(clinicalItemIdList);
         numPatientItems = len(clinicalItemIdSet);
 
@@ -195,22 +206,10 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
         iRecItem = 0;   # Separately track number of items that can actually be recommended (skip repeats and other exclusions)
         for (iItem, clinicalItemId) in enumerate(clinicalItemIdList):
             if self.isItemRecommendable(clinicalItemId, queryItemIds, recQuery, categoryIdByItemId):
-                # Query based on accumulated key data thus far,
-                #   to see how well able to predict / rank / score this next clinical item
-                recQuery.queryItemIds = queryItemIds;
-                recQuery.limit = None;  # No limitation because trying to find the next item whereever it may be in the list
-
-                recommendedData = recommender( recQuery, conn=conn );
-
-                # Find the next clinical item in the recommended list
-                recRank = 0;
-                recScore = None;
-                for iRec, recommendationModel in enumerate(recommendedData):
-                    recRank = iRec+1;   # Start rankings at 1, not 0
-                    if recommendationModel["clinical_item_id"] == clinicalItemId:
-                        # Found the match, note the respective recommendation statistics
-                        recScore = recommendationModel["score"];
-                        break;  # Don't need to look anymore
+                if scorer is not None and scorer.hasResults():
+                    (recRank, recScore) = scorer.itemRank(clinicalItemId);
+                else:
+                    (recRank, recScore) = self.queryItemRank(clinicalItemId, queryItemIds, recQuery, recommender, conn);
 
                 yield (clinicalItemId, iItem, iRecItem, recRank, recScore);
 
@@ -218,12 +217,44 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
                 progress.Update();
 
             queryItemIds.add(clinicalItemId);   # Accumulate initial query set as progress
+            if scorer is not None:
+                scorer.addQueryItem(clinicalItemId);
 
             if analysisQuery.queryItemMax is not None and iRecItem >= analysisQuery.queryItemMax:
                 # Option to break early if wish to avoid excessive analysis that is unnecessary
                 #   or even potentially damaging to execution memory
                 break;
 
+    def queryItemRank(self, clinicalItemId, queryItemIds, recQuery, recommender, conn):
+        """Query the recommender based on accumulated key data thus far,
+        to see how well able to predict / rank / score this next clinical item.
+        Return 2-ple (recRank, recScore)
+        Items tied in score with the clinical item do not count against its rank
+        (same as IncrementalAssociationScorer.itemRank), so the rank is
+        the position of the first item in the list with the same score.
+        """
+        recQuery.queryItemIds = queryItemIds;
+        recQuery.limit = None;  # No limitation because trying to find the next item whereever it may be in the list
+
+        recommendedData = recommender( recQuery, conn=conn );
+
+        # Find the next clinical item in the recommended list
+        recRank = 0;
+        recScore = None;
+        tieRank = None; # Rank of the first item with the same score as the current one
+        lastScore = None;
+        for iRec, recommendationModel in enumerate(recommendedData):
+            recRank = iRec+1;   # Start rankings at 1, not 0
+            if tieRank is None or recommendationModel["score"] != lastScore:
+                tieRank = recRank;
+                lastScore = recommendationModel["score"];
+            if recommendationModel["clinical_item_id"] == clinicalItemId:
+                # Found the match, note the respective recommendation statistics
+                recRank = tieRank;
+                recScore = recommendationModel["score"];
+                break;  # Don't need to look anymore
+        return (recRank, recScore);
+
     def isItemRecommendable(self, clinicalItemId, queryItemIds, recQuery, categoryIdByItemId):
         """Decide if the next clinical item could even possibly appear
         in the recommendation list.  (Because if not, no point in trying to
@@ -22,11 +22,13 @@ from medinfo.db.Model import SQLQuery, RowItemModel;
 from medinfo.db.Model import modelListFromTable, modelDictFromList;
 from medinfo.cpoe.ItemRecommender import RecommenderQuery;
 from medinfo.cpoe.TopicModelRecommender import TopicModelRecommender;
+from medinfo.cpoe.TopicModel import ItemIdVocabulary;
 from Util import log;
 
 from RecommendationClassificationAnalysis import RecommendationClassificationAnalysis;
 from BaseCPOEAnalysis import AnalysisQuery;
 from PreparePatientItems import PreparePatientItems;
+from PreparedPatientItemStore import openPreparedPatientItemFile;
 from RecommendationClassificationAnalysis import RecommendationClassificationAnalysis;
 
 DEFAULT_TOPIC_ITEM_COUNT = 1000; # When using or printing out topic information, number of top scored items to consider
@@ -41,40 +43,41 @@ class TopicModelAnalysis(RecommendationClassificationAnalysis):
     def __call__(self, analysisQuery):
         """Go through the validation file to test use of the model towards predicting verify items.
         """
-        preparer = PreparePatientItems();
+        self.preparer = PreparePatientItems();
 
         # Keep ID indexes for simplicity for now
         id2word = analysisQuery.recommender.model.id2word;
-        id2id = dict();
-        for id in id2word:
-            id2id[id] = id;
-        analysisQuery.recommender.model.id2word = id2id;
+        analysisQuery.recommender.model.id2word = ItemIdVocabulary(len(id2word));
 
         # progress = ProgressDots(50,1,"Patients");
-        for patientItemData in preparer.loadPatientItemData(analysisQuery):
-            patientId = patientItemData["patient_id"];
-            analysisResults = \
-                self.analyzePatientItems \
-                (   patientItemData,
-                    analysisQuery,
-                    analysisQuery.baseRecQuery,
-                    patientId,
-                    analysisQuery.recommender,
-                    preparer
-                );
-
-            if analysisResults is not None:
-                (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
-                # Start aggregating and calculating result stats
-                resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, analysisQuery.recommender.docCountByWordId, analysisQuery.baseRecQuery, recommendedData );
+        patientItemDataIter = self.preparer.loadPatientItemData(analysisQuery);
+        for patientItemData, resultsStatData in self.evaluatePatients(patientItemDataIter, analysisQuery):
+            if resultsStatData is not None:
                 if "baseItemId" in patientItemData:
                     analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
                 yield resultsStatData;
 
-            # progress.Update();
-
         # progress.PrintStatus();
 
+    def analyzePatient(self, patientItemData, analysisQuery, conn):
+        """Query the topic model for one test patient and calculate the comparison stats
+        against the patient's verify items.  Returns None if no relevant data for the patient.
+        """
+        analysisResults = \
+            self.analyzePatientItems \
+            (   patientItemData,
+                analysisQuery,
+                analysisQuery.baseRecQuery,
+                patientItemData["patient_id"],
+                analysisQuery.recommender,
+                self.preparer
+            );
+        if analysisResults is None:
+            return None;
+        (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
+        # Start aggregating and calculating result stats
+        return self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, analysisQuery.recommender.docCountByWordId, analysisQuery.baseRecQuery, recommendedData );
+
     def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, preparer):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
@@ -129,13 +132,14 @@ class TopicModelAnalysis(RecommendationClassificationAnalysis):
         parser.add_option("-s", "--sortField",  dest="sortField", default=DEFAULT_SORT_FIELD, help="Score field to sort top recommendations by.  Default to posterior probabilty 'totelItemWeight', but can also select 'lift' = 'tfidf' = 'interest' for TF*IDF style score weighting.");
         parser.add_option("-r", "--numRecs",   dest="numRecs",  default=DEFAULT_RECOMMENDED_ITEM_COUNT, help="Number of orders / items to recommend for comparison against the verification set. Alternative set option numRecsByOrderSet to look for key order set usage and size.");
         parser.add_option("-O", "--numRecsByOrderSet",   dest="numRecsByOrderSet", action="store_true", help="If set, then look for an order_set_id column to find the key order set that triggered the evaluation time point to determine number of recommendations to consider.");
+        parser.add_option("-j", "--numProcesses",  dest="numProcesses",  help="Number of worker processes to evaluate test patients in parallel with.  Defaults to 1 for serial evaluation.");
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
         if len(args) >= 1:
             query = AnalysisQuery();
-            query.preparedPatientItemFile = stdOpen(args[0]);
+            query.preparedPatientItemFile = openPreparedPatientItemFile(args[0]);
             query.recommender = TopicModelRecommender(options.modelFile);
             query.baseRecQuery = RecommenderQuery();
             if options.excludeCategoryIds is not None:
@@ -152,6 +156,9 @@ class TopicModelAnalysis(RecommendationClassificationAnalysis):
             query.numRecommendations = int(options.numRecs);
             query.numRecsByOrderSet = options.numRecsByOrderSet;
 
+            if options.numProcesses is not None:
+                self.numProcesses = int(options.numProcesses);
+
             # Run the actual analysis
             analysisResults = self(query);
 
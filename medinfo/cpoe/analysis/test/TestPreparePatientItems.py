@@ -5,6 +5,8 @@ import sys, os;
 from cStringIO import StringIO;
 import json;
 from datetime import datetime, timedelta;
+import shutil
+import tempfile
 import unittest
 
 from Const import RUNNER_VERBOSITY;
@@ -19,6 +21,7 @@ from medinfo.db.Model import SQLQuery, RowItemModel;
 
 from medinfo.cpoe.ItemRecommender import RecommenderQuery;
 from medinfo.cpoe.analysis.PreparePatientItems import PreparePatientItems, AnalysisQuery;
+from medinfo.cpoe.analysis.PreparedPatientItemStore import PreparedPatientItemStore, isPreparedPatientItemStore, openPreparedPatientItemFile;
 
 class TestPreparePatientItems(DBTestCase):
     def setUp(self):
@@ -226,8 +229,11 @@ class TestPreparePatientItems(DBTestCase):
         # Instance to test on
         self.analyzer = PreparePatientItems();
 
+        self.tempDir = tempfile.mkdtemp();
+
     def tearDown(self):
         """Restore state from any setUp or test steps"""
+        shutil.rmtree(self.tempDir);
         self.purgeTestRecords();
         DBTestCase.tearDown(self);
 
@@ -415,6 +421,148 @@ class TestPreparePatientItems(DBTestCase):
         self.assertEqualResultDicts( directResults, textBasedResults, colNames );
 
 
+    def test_preparedPatientItemStore(self):
+        # Run the analysis preparer into the binary store format and verify can read back the original object form.
+        colNames = \
+            [   "patient_id",
+                "baseItemId",
+                "baseItemDate",
+                "queryStartTime",
+                "queryEndTime",
+                "verifyEndTime",
+                "queryItemCountById",
+                "verifyItemCountById",
+                "outcome.-33","outcome.-32", "outcome.-31","outcome.-30",
+                "existsByOutcomeId",
+            ];
+
+        analysisQuery = AnalysisQuery();
+        analysisQuery.patientIds = set([-11111,-44444]);
+        analysisQuery.baseCategoryId = -7;
+        analysisQuery.queryTimeSpan = timedelta(0,86400);
+        analysisQuery.verifyTimeSpan = timedelta(0,604800);
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.baseRecQuery.targetItemIds = set([-33,-32,-31,-30]);
+        analysisQuery.baseRecQuery.excludeItemIds = [-13];
+        analysisQuery.baseRecQuery.excludeCategoryIds = [-5];
+        analysisQuery.baseRecQuery.maxRecommendedId = 0; # Restrict to test data
+        directResults = list(self.analyzer(analysisQuery));
+        self.assertTrue(len(directResults) > 1);
+
+        storeDir = os.path.join(self.tempDir, "prepared");
+        argv = ["PreparePatientItems.py","-c","-7","-Q","86400","-V","604800","-o","-33,-32,-31,-30","-F",'0,-11111,-44444',storeDir];
+        self.analyzer.main(argv);
+        self.assertTrue(isPreparedPatientItemStore(storeDir));
+
+        store = openPreparedPatientItemFile(storeDir);
+        self.assertEqual(len(directResults), store.nRows);
+        storeResults = list(store.iterPatientItemData());
+        self.assertEqualResultDicts( directResults, storeResults, colNames );
+
+        # Random access by patient
+        for patientId in (-11111,-44444):
+            patientRows = store.patientRows(patientId);
+            self.assertEqual([i for i, result in enumerate(directResults) if result["patient_id"] == patientId], patientRows.tolist());
+        self.assertEqual([], store.patientRows(-99999).tolist());
+
+        # Sparse matrix of combined query and verify item counts, read in chunks
+        itemIds = store.itemIds();
+        for rows in store.iterRowChunks(1):
+            (matrix, matrixItemIds) = store.itemMatrix(rows=rows, itemIds=itemIds);
+            for i, row in enumerate(rows):
+                expectedCountById = dict(directResults[row]["queryItemCountById"]);
+                for itemId, count in directResults[row]["verifyItemCountById"].iteritems():
+                    expectedCountById[itemId] = expectedCountById.get(itemId,0) + count;
+                rowCountById = dict([(itemId, count) for itemId, count in zip(matrixItemIds.tolist(), matrix[i].toarray()[0].tolist()) if count != 0]);
+                self.assertEqualDict(expectedCountById, rowCountById);
+
+        # Analysis load from store, rather than text file
+        analysisQuery = AnalysisQuery();
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.preparedPatientItemFile = store;
+        loadedResults = list(self.analyzer.loadPatientItemData(analysisQuery));
+        self.assertEqualResultDicts( directResults, loadedResults, colNames );
+        self.assertEqual(set([-33,-32,-31,-30]), analysisQuery.baseRecQuery.targetItemIds);
+
+    def test_convertPreparedPatientItemStore(self):
+        inputFileStr = \
+"""# {"argv": ["medinfo\\cpoe\\analysis\\PreparePatientItems.py", "-c", "2", "-Q", "14400", "-V", "86401", "-o", "27427", "-t", "2592000", "temp\\patientIds.test.tab", "test.out"]}
+patient_id\tbaseItemId\tbaseItemDate\tqueryStartTime\tqueryEndTime\tverifyEndTime\tqueryItemCountByIdJSON\tverifyItemCountByIdJSON\toutcome.-1
+50559\t-21\t2010-02-04 00:00:00\t2010-02-04 00:00:00\t2010-02-04 04:00:00\t2010-02-05 00:00:01\t{"20449":1, "132":2, "133":3}\t{"19596":1, "19694":1}\t0
+52137\t-21\t2013-03-18 00:00:00\t2013-03-18 00:00:00\t2013-03-18 04:00:00\t2013-03-19 00:00:01\t{"20388":1, "19766":10}\t{"19622":4, "19766":7}\t1
+35141\t-21\t2012-07-17 00:00:00\t2012-07-17 00:00:00\t2012-07-17 04:00:00\t2012-07-18 00:00:01\t{"13326":1, "5778":1, "13589":1}\t{"19810":1, "19724":1, "13474":1}\t0
+19347\t-21\t2010-11-26 00:00:00\t2010-11-26 00:00:00\t2010-11-26 04:00:00\t2010-11-27 00:00:01\t{"13312":1, "19840":1, "13318":1}\t{}\t0
+""";
+        # Convert existing text file into binary store
+        inputFilename = os.path.join(self.tempDir, "prepared.tab");
+        inputFile = open(inputFilename, "w");
+        inputFile.write(inputFileStr);
+        inputFile.close();
+        storeDir = os.path.join(self.tempDir, "prepared");
+        PreparedPatientItemStore(None).main(["PreparedPatientItemStore.py", inputFilename, storeDir]);
+
+        # Same records as parsed from the text file, including the JSON columns (same content, though not formatting)
+        expectedResults = list(self.analyzer.parsePreparedResultFile(StringIO(inputFileStr)));
+        results = list(PreparedPatientItemStore(storeDir).iterPatientItemData());
+        self.assertEqual(len(expectedResults), len(results));
+        for expectedResult, result in zip(expectedResults, results):
+            self.assertEqual(set(expectedResult.keys()), set(result.keys()));
+            for key, expectedValue in expectedResult.iteritems():
+                if key.endswith("JSON"):
+                    self.assertEqual(json.loads(expectedValue), json.loads(result[key]));
+                else:
+                    self.assertEqual(expectedValue, result[key]);
+
+        # Same feature matrix as from the text file
+        expectedResults = list(self.analyzer.convertResultsFileToFeatureMatrix(StringIO(inputFileStr),incHeaders=True) );
+        results = list(self.analyzer.convertResultsFileToFeatureMatrix(storeDir,incHeaders=True) );
+        self.assertEqual(expectedResults[0], results[0]);
+        for expectedRow, resultRow in zip(expectedResults[1:], results[1:]):
+            self.assertEqual(expectedRow, [str(value) for value in resultRow[:7]] + resultRow[7:]);
+        self.assertEqual(len(expectedResults), len(results));
+
+        # Same bag of words corpus as from the text file
+        for (queryItems, verifyItems, outcomeItems) in [(True,True,True), (True,False,False), (False,True,False)]:
+            expectedResults = list(self.analyzer.convertResultsFileToBagOfWordsCorpus(StringIO(inputFileStr),queryItems,verifyItems,outcomeItems) );
+            results = list(self.analyzer.convertResultsFileToBagOfWordsCorpus(PreparedPatientItemStore(storeDir),queryItems,verifyItems,outcomeItems) );
+            self.assertEqualBagOfWordsList(expectedResults,results);
+
+        # Unfiltered gensim style corpus directly from the store
+        expectedResults = \
+            [   [(20449,1),(132,2),(133,3)],
+                [(20388,1),(19766,10)],
+                [(13326,1),(5778,1),(13589,1)],
+                [(13312,1),(19840,1),(13318,1)],
+            ];
+        store = PreparedPatientItemStore(storeDir);
+        results = list(store.bagOfWordsCorpus(sections=["queryItemCountById"], chunkSize=3));
+        self.assertEqualBagOfWordsList(expectedResults,results);
+
+    def test_preparedPatientItemStoreNulls(self):
+        # Null values in integer, date and text columns, saved a few records at a time
+        records = \
+            [   {"patient_id": 3, "baseItemDate": datetime(2010,1,1), "order_set_id": 10, "note": "first\tline\n", "queryItemCountById": {1:2, 3:4}, "outcome.-1": 1},
+                {"patient_id": 1, "baseItemDate": None, "order_set_id": None, "note": None, "queryItemCountById": {}, "outcome.-1": 0},
+                {"patient_id": 2, "baseItemDate": datetime(2011,2,3,4,5,6), "order_set_id": 0, "note": "", "queryItemCountById": {5:1}, "outcome.-1": None},
+                {"patient_id": 1, "baseItemDate": datetime(2012,1,1), "order_set_id": None, "note": "None", "queryItemCountById": {1:1, 2:1, 6:3}, "outcome.-1": 1},
+                {"patient_id": 4, "baseItemDate": None, "order_set_id": 7, "note": "last", "queryItemCountById": {}, "outcome.-1": 0},
+            ];
+        storeDir = os.path.join(self.tempDir, "prepared");
+        store = PreparedPatientItemStore(storeDir);
+        store.save(iter(records), chunkSize=2);
+        self.assertEqual([], [filename for filename in os.listdir(storeDir) if filename.endswith(".part")]);
+
+        store = PreparedPatientItemStore(storeDir);
+        self.assertEqual(len(records), store.nRows);
+        for record, result in zip(records, store.iterPatientItemData()):
+            for key, value in record.iteritems():
+                self.assertEqual(value, result[key]);
+            self.assertEqual(record["queryItemCountById"], loadJSONDict(result["queryItemCountByIdJSON"], int, int));
+        self.assertEqual([1,3], store.patientRows(1).tolist());
+        (matrix, itemIds) = store.itemMatrix();
+        self.assertEqual([1,2,3,5,6], itemIds.tolist());
+        self.assertEqual([[2,0,4,0,0],[0,0,0,0,0],[0,0,0,1,0],[1,1,0,0,3],[0,0,0,0,0]], matrix.toarray().tolist());
+
     def test_convertResultsFileToFeatureMatrix(self):
         inputFile = StringIO ( \
 """# {"argv": ["medinfo\\cpoe\\analysis\\PreparePatientItems.py", "-c", "2", "-Q", "14400", "-V", "86401", "-o", "27427", "-t", "2592000", "temp\\patientIds.test.tab", "test.out"]}
@@ -525,6 +525,32 @@ class TestRecommendationClassificationAnalysis(DBTestCase):
         self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
 
 
+    def test_parallelEvaluation(self):
+        # Evaluate multiple patients across worker processes and verify same results, in same order, as serial evaluation
+        analysisQuery = AnalysisQuery();
+        analysisQuery.patientIds = set([-11111,-22222,-33333]);
+        analysisQuery.numQueryItems = 1;
+        analysisQuery.numVerifyItems = 2;
+        analysisQuery.numRecommendations = 4;
+        analysisQuery.recommender = ItemAssociationRecommender();
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.baseRecQuery.maxRecommendedId = 0; # Restrict to test data
+
+        colNames = ["patient_id", "TP", "FN", "FP",  "recall", "precision", "F1-score", "weightRecall","weightPrecision", "ROC-AUC"];
+        expectedResults = self.analyzer(analysisQuery);
+        self.assertTrue(len(expectedResults) > 1);
+
+        self.analyzer.numProcesses = 2;
+        analysisResults = self.analyzer(analysisQuery);
+        self.assertEqualStatResults(expectedResults, analysisResults, colNames);
+
+        # Redo with command-line interface
+        sys.stdout = StringIO();    # Redirect stdout output to collect test results
+        argv = ["RecommendationClassificationAnalysis.py","-q","1","-v","2","-r","4","-m","0","-j","2","-R","ItemAssociationRecommender",'0,-11111,-22222,-33333',"-"];
+        self.analyzer.main(argv);
+        textOutput = StringIO(sys.stdout.getvalue());
+        self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
+
     def test_numRecsByOrderSet(self):
         # Designate number of recommendations indirectly via linked order set id 
 
@@ -10,6 +10,7 @@ from Const import RUNNER_VERBOSITY;
 from Util import log;
 
 from medinfo.common.test.Const import SENTINEL_ANY_FLOAT;
+from medinfo.common.Util import ProgressDots;
 from medinfo.db.test.Util import DBTestCase;
 
 from medinfo.db import DBUtil
@@ -185,6 +186,86 @@ class TestRecommendationRankingTrendAnalysis(DBTestCase):
         analysisResults = self.analyzer(analysisQuery);
         self.assertEqualTable(expectedResults, analysisResults, 3);
 
+    def test_incrementalScorer(self):
+        # Ranks from incrementally maintained scores should match rerunning the full recommender for each item
+        analysisQuery = AnalysisQuery();
+        analysisQuery.patientIds = set([-11111, -22222, -33333]);
+        analysisQuery.recommender = ItemAssociationRecommender();
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.baseRecQuery.maxRecommendedId = 0; # Restrict to test data
+
+        conn = DBUtil.connection();
+        try:
+            categoryIdByItemId = dict(DBUtil.execute("select clinical_item_id, clinical_item_category_id from clinical_item", conn=conn));
+            progress = ProgressDots(50,1,"Item Recommendations");
+            for aggregationMethod in ("weighted","unweighted","NaiveBayes","SerialBayes"):
+                for (sortField, sortReverse) in [("PPV",True),("RR",True),("P-Fisher",False)]:
+                    recQuery = analysisQuery.baseRecQuery;
+                    recQuery.aggregationMethod = aggregationMethod;
+                    recQuery.sortField = sortField;
+                    recQuery.sortReverse = sortReverse;
+                    scorer = analysisQuery.recommender.incrementalScorer(recQuery, conn=conn);
+                    for (patientId, clinicalItemIdList) in self.analyzer.queryPatientClinicalItemData(analysisQuery, conn=conn):
+                        expectedResults = self.serialRecommendationRanks(clinicalItemIdList, recQuery, analysisQuery.recommender, categoryIdByItemId, conn);
+                        analysisResults = list(self.analyzer.reviewSerialRecommendations(patientId, clinicalItemIdList, analysisQuery, recQuery, analysisQuery.recommender, categoryIdByItemId, progress, conn, scorer=scorer));
+                        self.assertEqualTable(expectedResults, analysisResults, 5);
+        finally:
+            conn.close();
+
+    def serialRecommendationRanks(self, clinicalItemIdList, recQuery, recommender, categoryIdByItemId, conn):
+        """Reference ranks by rerunning the full recommender for each item,
+        with items tied in score ranked at the first position amongst them
+        """
+        results = list();
+        queryItemIds = set();
+        iRecItem = 0;
+        for (iItem, clinicalItemId) in enumerate(clinicalItemIdList):
+            if self.analyzer.isItemRecommendable(clinicalItemId, queryItemIds, recQuery, categoryIdByItemId):
+                recQuery.queryItemIds = set(queryItemIds);
+                recQuery.limit = None;
+                recommendedData = recommender( recQuery, conn=conn );
+                (recRank, recScore) = self.analyzer.queryItemRank(clinicalItemId, queryItemIds, recQuery, recommender, conn);
+                if recScore is not None:
+                    recRank = 1;
+                    for recModel in recommendedData:
+                        if (recQuery.sortReverse and recModel["score"] > recScore) or (not recQuery.sortReverse and recModel["score"] < recScore):
+                            recRank += 1;
+                results.append( (clinicalItemId, iItem, iRecItem, recRank, recScore) );
+                iRecItem += 1;
+            queryItemIds.add(clinicalItemId);
+        return results;
+
+    def test_tiedScores(self):
+        # Items tied in score should get the same rank whether incrementally scored or from the full recommender list
+        # Same association counts from -10 to -7 as to -8, with the same baseline counts for -7 and -8, so they tie on every score
+        headers = \
+            [   "clinical_item_id","subsequent_item_id",
+                "count_0","count_3600","count_86400","count_604800","count_any",
+                "time_diff_sum", "time_diff_sum_squares",
+            ];
+        DBUtil.findOrInsertItem("clinical_item_association", RowItemModel( [-10, -7,   2,  4,  6,  8, 10,   47.0, 5420.0], headers ) );
+
+        analysisQuery = AnalysisQuery();
+        analysisQuery.recommender = ItemAssociationRecommender();
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.baseRecQuery.maxRecommendedId = 0; # Restrict to test data
+        recQuery = analysisQuery.baseRecQuery;
+        recQuery.sortField = "PPV";
+
+        # -12 scores best from query item -10, then -7 and -8 tied for second
+        conn = DBUtil.connection();
+        try:
+            categoryIdByItemId = dict(DBUtil.execute("select clinical_item_id, clinical_item_category_id from clinical_item", conn=conn));
+            progress = ProgressDots(50,1,"Item Recommendations");
+            scorer = analysisQuery.recommender.incrementalScorer(recQuery, conn=conn);
+            for itemScorer in (None, scorer):
+                for tiedItemId in (-7, -8):
+                    analysisResults = list(self.analyzer.reviewSerialRecommendations(-44444, [-10, tiedItemId], analysisQuery, recQuery, analysisQuery.recommender, categoryIdByItemId, progress, conn, scorer=itemScorer));
+                    (clinicalItemId, iItem, iRecItem, recRank, recScore) = analysisResults[-1];
+                    self.assertEqual(tiedItemId, clinicalItemId);
+                    self.assertEqual(2, recRank);
+        finally:
+            conn.close();
 
 def suite():
     """Returns the suite of tests to run for this test class / module.
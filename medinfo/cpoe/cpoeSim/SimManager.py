@@ -21,6 +21,8 @@ class SimManager:
 
     def __init__(self):
         self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
+        self.stateCache = None; # If set, SimStateCache to answer patient state, order and result queries from memory instead of the database
+        self.searchIndex = None;    # If set, SimSearchIndex to answer clinical item and order set searches from memory instead of database table scans
 
     def getSchemaFilepath(self):
         """Find the file path for the schema definition for for simulation data."""
@@ -120,6 +122,7 @@ class SimManager:
             query.addWhereEqual("sps.sim_patient_id", templatePatientId );
             query.addWhereOp("relative_time_start","<=", 0 );
             query.addOrderBy("relative_time_start");
+            query.addOrderBy("sim_patient_state_id");   # Consistent order for ties
             dataTable = DBUtil.execute(query,includeColumnNames=True,conn=conn);
             dataModels = modelListFromTable(dataTable);
             nStates = len(dataModels);
@@ -137,6 +140,7 @@ class SimManager:
             query.addWhereEqual("sim_patient_id", templatePatientId );
             query.addWhereOp("relative_time_start","<=", 0 );
             query.addOrderBy("relative_time_start");
+            query.addOrderBy("sim_patient_order_id");
             dataTable = DBUtil.execute(query,includeColumnNames=True,conn=conn);
             dataModels = modelListFromTable(dataTable);
             for dataModel in dataModels:
@@ -150,6 +154,101 @@ class SimManager:
             if not extConn:
                 conn.close();
 
+    def copyPatientTemplates(self, patientDataList, templatePatientIds, conn=None):
+        """Bulk version of copyPatientTemplate, creating a new patient record for each of the patientData
+        based on the respective template patient ID, all in a single transaction.
+        Patient states and orders are copied for all of the new patients together
+        with set-based insert-select statements, rather than row by row.
+        Patient records are still inserted one at a time, as each new patient ID is needed
+        to map its template rows, and identityQuery only reports the last inserted ID.
+        The copy is committed on success and rolled back on any error, including when given an external conn
+        (so any other uncommitted changes on that connection go with it).
+        Return list of the new patient IDs.
+        """
+        if len(patientDataList) != len(templatePatientIds):
+            raise ValueError("Expected a template patient ID for each of %d patients, but found %d" % (len(patientDataList), len(templatePatientIds)) );
+        if len(patientDataList) < 1:
+            return [];
+
+        extConn = True;
+        if conn is None:
+            conn = self.connFactory.connection();
+            extConn = False;
+        try:
+            # Load templates before any inserts, as loadRecordModelById commits on the connection
+            templatePatientDataById = dict();
+            for templatePatientId in templatePatientIds:
+                if templatePatientId not in templatePatientDataById:
+                    templatePatientData = DBUtil.loadRecordModelById("sim_patient", templatePatientId, conn=conn);
+                    del templatePatientData["sim_patient_id"];  # Remove prior ID to allow for new one
+                    templatePatientDataById[templatePatientId] = templatePatientData;
+
+            patientIds = list();
+            for patientData, templatePatientId in zip(patientDataList, templatePatientIds):
+                newPatientData = dict(templatePatientDataById[templatePatientId]);
+                newPatientData.update( patientData );  # Override with new content (if exists)
+                DBUtil.insertRow("sim_patient", newPatientData, conn=conn);    # Create new patient record
+                patientIds.append( DBUtil.execute(DBUtil.identityQuery("sim_patient"),conn=conn, autoCommit=False)[0][0] );
+
+            # Inline table mapping each new patient ID to its template patient ID
+            templateMapQuery = str.join(" union all ", ["select %(p)s as sim_patient_id, %(p)s as template_patient_id" % {"p": DBUtil.SQL_PLACEHOLDER}] * len(patientIds));
+            templateMapParams = list();
+            for patientId, templatePatientId in zip(patientIds, templatePatientIds):
+                templateMapParams.extend( (patientId, templatePatientId) );
+
+            # Copy initial template patient states, with the last state's end time blanked out to reflect open ended for simulation
+            lastStateQuery = \
+                """select lps.sim_patient_state_id
+                from sim_patient_state as lps
+                where lps.sim_patient_id = sps.sim_patient_id
+                and lps.relative_time_start <= 0
+                order by lps.relative_time_start desc, lps.sim_patient_state_id desc
+                limit 1
+                """;
+            columnExprByName = \
+                {   "sim_patient_id": "tm.sim_patient_id",
+                    "relative_time_end": "case when sps.sim_patient_state_id = (%s) then null else sps.relative_time_end end" % lastStateQuery,
+                };
+            self.copyTemplateRows("sim_patient_state", "sps", columnExprByName, templateMapQuery, templateMapParams, conn);
+
+            # Copy initial template orders
+            columnExprByName = {"sim_patient_id": "tm.sim_patient_id"};
+            self.copyTemplateRows("sim_patient_order", "spo", columnExprByName, templateMapQuery, templateMapParams, conn);
+
+            conn.commit();  # Transactional commit for multi-step process
+            return patientIds;
+        except Exception, err:
+            conn.rollback();    # Don't leave partial copies behind
+            raise;
+        finally:
+            if not extConn:
+                conn.close();
+
+    def copyTemplateRows(self, tableName, tableAlias, columnExprByName, templateMapQuery, templateMapParams, conn):
+        """Copy all columns (except the ID) of the table's rows for template patients
+        up to (and including) relative time zero, for each of the new patients in the template map query.
+        """
+        idCol = DBUtil.defaultIDColumn(tableName);
+        colNames = DBUtil.execute("select * from %s where 1=0" % tableName, includeColumnNames=True, conn=conn, autoCommit=False)[0];
+        colNames = [colName for colName in colNames if colName != idCol];
+        selectExprs = [columnExprByName.get(colName, "%s.%s" % (tableAlias, colName)) for colName in colNames];
+        insertQuery = \
+            """insert into %(tableName)s (%(colNames)s)
+            select %(selectExprs)s
+            from %(tableName)s as %(tableAlias)s, (%(templateMapQuery)s) as tm
+            where %(tableAlias)s.sim_patient_id = tm.template_patient_id
+            and %(tableAlias)s.relative_time_start <= 0
+            order by tm.sim_patient_id, %(tableAlias)s.relative_time_start, %(tableAlias)s.%(idCol)s
+            """ % \
+            {   "tableName": tableName,
+                "tableAlias": tableAlias,
+                "colNames": str.join(", ", colNames),
+                "selectExprs": str.join(", ", selectExprs),
+                "templateMapQuery": templateMapQuery,
+                "idCol": idCol,
+            };
+        DBUtil.execute(insertQuery, tuple(templateMapParams), conn=conn, autoCommit=False);
+
     def loadPatientInfo(self, patientIds=None, relativeTime=None, conn=None):
         """Load basic information about the specified patients.
         Report patient state at given time, or default to time zero
@@ -162,6 +261,13 @@ class SimManager:
             conn = self.connFactory.connection();
             extConn = False;
         try:
+            if self.stateCache is not None and patientIds is not None and len(patientIds) == 1:
+                # Single patient, as for interactive steps, can answer from the state cache
+                dataModels = self.stateCache.patientInfoModels(patientIds[0], relativeTime, conn);
+                for dataModel in dataModels:
+                    self.addStateTransitionOptions(dataModel, self.stateCache.postStateIdByItemIdByPreStateId, self.stateCache.postStateIdTimeTriggerByPreStateId);
+                return self.checkTimeTriggers(patientIds, dataModels, relativeTime, conn);
+
             query = SQLQuery();
             query.addSelect("sp.sim_patient_id");
             query.addSelect("sp.name");
@@ -216,32 +322,138 @@ class SimManager:
             
                 
                 # Record in patient result models for retrieval
-                for i, dataModel in enumerate(dataModels):
-                    patientId = dataModel["sim_patient_id"];
-                    stateId = dataModel["sim_state_id"];
-                    
-                    dataModel["postStateIdByItemId"] = dict();
-                    if stateId in postStateIdByItemIdByPreStateId:
-                        dataModel["postStateIdByItemId"] = postStateIdByItemIdByPreStateId[stateId];
-                    dataModel["postStateIdTimeTriggerByPreStateId"] = dict();
-                    if stateId in postStateIdTimeTriggerByPreStateId:
-                        dataModel["postStateIdTimeTrigger"] = postStateIdTimeTriggerByPreStateId[stateId];
-                    
-                    if dataModel["relative_time_end"] is None and "postStateIdTimeTrigger" in dataModel:
-                        # Check that we haven't passed (and should thus trigger) a time-based state transition
-                        (postStateId, timeTrigger) = dataModel["postStateIdTimeTrigger"];
-                        preStateTime = dataModel["relative_time_start"];
-                        postStateTriggerTime = (preStateTime + timeTrigger);
-                        
-                        if postStateTriggerTime <= relativeTime:    # Trigger state transition just by time elapsed
-                            #print >> sys.stderr, relativeTime, preStateTime, stateId, postStateTriggerTime, postStateId
-                            self.recordStateTransition(patientId, stateId, postStateId, postStateTriggerTime, conn=conn);
-                            # State change which can yield new triggers, so recursively reload.
-                            # Small risk of infinite recusion if timeTriggers are zero. Otherwise, should converge as each recursion will update the preState relativeTimeStart
-                            dataModels[i] = self.loadPatientInfo([patientId], relativeTime, conn=conn)[0];
+                for dataModel in dataModels:
+                    self.addStateTransitionOptions(dataModel, postStateIdByItemIdByPreStateId, postStateIdTimeTriggerByPreStateId);
             
+            return self.checkTimeTriggers(patientIds, dataModels, relativeTime, conn);
+        finally:
+            if not extConn:
+                conn.close();
+
+    def addStateTransitionOptions(self, dataModel, postStateIdByItemIdByPreStateId, postStateIdTimeTriggerByPreStateId):
+        """Record in the patient model which clinical items or times trigger which post-states from its current state"""
+        stateId = dataModel["sim_state_id"];
+        dataModel["postStateIdByItemId"] = dict();
+        if stateId in postStateIdByItemIdByPreStateId:
+            dataModel["postStateIdByItemId"] = dict(postStateIdByItemIdByPreStateId[stateId]);
+        dataModel["postStateIdTimeTriggerByPreStateId"] = dict();
+        if stateId in postStateIdTimeTriggerByPreStateId:
+            dataModel["postStateIdTimeTrigger"] = postStateIdTimeTriggerByPreStateId[stateId];
+
+    def checkTimeTriggers(self, patientIds, dataModels, relativeTime, conn):
+        """Record any time-based state transitions the patients should have triggered by the relativeTime,
+        and if so, reload the patient models (once, as they will then be in states with no elapsed time triggers).
+        """
+        advanceModels = list();
+        for dataModel in dataModels:
+            if dataModel["relative_time_end"] is None and "postStateIdTimeTrigger" in dataModel:
+                # Check that we haven't passed (and should thus trigger) a time-based state transition
+                (postStateId, timeTrigger) = dataModel["postStateIdTimeTrigger"];
+                if dataModel["relative_time_start"] + timeTrigger <= relativeTime:
+                    advanceModels.append(dataModel);
+
+        if len(advanceModels) < 1:
             return dataModels;
+
+        if self.stateCache is not None:
+            postStateIdTimeTriggerByPreStateId = self.stateCache.postStateIdTimeTriggerByPreStateId;
+        else:
+            postStateIdTimeTriggerByPreStateId = self.loadTimeTriggers(conn=conn);
+        transitions = self.advanceTimeTriggers(advanceModels, relativeTime, postStateIdTimeTriggerByPreStateId);
+        self.recordStateTransitions(transitions, conn=conn);
+        return self.loadPatientInfo(patientIds, relativeTime, conn=conn);
+
+    def loadTimeTriggers(self, conn=None):
+        """Load lookup table of (postStateId, timeTrigger) time-based state transitions by pre-state ID"""
+        extConn = True;
+        if conn is None:
+            conn = self.connFactory.connection();
+            extConn = False;
+        try:
+            query = SQLQuery();
+            query.addSelect("pre_state_id");
+            query.addSelect("post_state_id");
+            query.addSelect("time_trigger");
+            query.addFrom("sim_state_transition");
+            query.addWhere("time_trigger is not null");
+
+            postStateIdTimeTriggerByPreStateId = dict();
+            for preStateId, postStateId, timeTrigger in DBUtil.execute(query, conn=conn):
+                postStateIdTimeTriggerByPreStateId[preStateId] = (postStateId, timeTrigger);
+            return postStateIdTimeTriggerByPreStateId;
+        finally:
+            if not extConn:
+                conn.close();
+
+    def advanceTimeTriggers(self, dataModels, relativeTime, postStateIdTimeTriggerByPreStateId):
+        """Walk the time-based state transition graph forward from each patient's current state
+        (sim_patient_id, sim_state_id, relative_time_start) through to the state they should be in by the relativeTime.
+        Return list of (patientId, preStateId, postStateId, transitionTime) for every transition passed along the way.
+        Raise ValueError if a cycle of zero-duration time triggers would never reach a stable state.
+        """
+        transitions = list();
+        for dataModel in dataModels:
+            patientId = dataModel["sim_patient_id"];
+            stateId = dataModel["sim_state_id"];
+            stateTime = dataModel["relative_time_start"];
+            sameTimeStateIds = set([stateId]);  # States passed through without any time elapsing
+            while stateId in postStateIdTimeTriggerByPreStateId:
+                (postStateId, timeTrigger) = postStateIdTimeTriggerByPreStateId[stateId];
+                postStateTime = stateTime + timeTrigger;
+                if postStateTime > relativeTime:
+                    break;
+                if postStateTime > stateTime:
+                    sameTimeStateIds.clear();
+                elif postStateId in sameTimeStateIds:
+                    raise ValueError("Cycle of zero-duration time triggered state transitions from state %s for patient %s at time %s" % (postStateId, patientId, postStateTime) );
+                sameTimeStateIds.add(postStateId);
+                transitions.append( (patientId, stateId, postStateId, postStateTime) );
+                (stateId, stateTime) = (postStateId, postStateTime);
+        return transitions;
+
+    def recordStateTransitions(self, transitions, conn=None):
+        """Record a batch of patient state transitions, in sequence per patient, as from advanceTimeTriggers.
+        End each patient's starting state, then insert all of the subsequent states together,
+        with all but the last state for each patient already ended by the next transition.
+        """
+        if len(transitions) < 1:
+            return;
+        extConn = True;
+        if conn is None:
+            conn = self.connFactory.connection();
+            extConn = False;
+        try:
+            updateQuery = \
+                """update sim_patient_state 
+                set relative_time_end = %(p)s
+                where sim_patient_id = %(p)s
+                and sim_state_id = %(p)s
+                and relative_time_start <= %(p)s
+                and relative_time_end is null
+                """ % {"p": DBUtil.SQL_PLACEHOLDER};
+
+            insertParams = list();
+            for i, (patientId, preStateId, postStateId, currentTime) in enumerate(transitions):
+                if i == 0 or transitions[i-1][0] != patientId or transitions[i-1][2] != preStateId:
+                    # Ending of the patient's starting pre-state
+                    DBUtil.execute(updateQuery, (currentTime, patientId, preStateId, currentTime), conn=conn);
+                endTime = None;
+                if i+1 < len(transitions) and transitions[i+1][0] == patientId and transitions[i+1][1] == postStateId:
+                    endTime = transitions[i+1][3];  # Passing straight through to the next state
+                insertParams.extend( (patientId, postStateId, currentTime, endTime) );
+
+            # Beginning of all post-states
+            insertQuery = \
+                """insert into sim_patient_state (sim_patient_id, sim_state_id, relative_time_start, relative_time_end)
+                values %s
+                """ % str.join(",", ["(%(p)s,%(p)s,%(p)s,%(p)s)" % {"p": DBUtil.SQL_PLACEHOLDER}] * len(transitions));
+            DBUtil.execute(insertQuery, tuple(insertParams), conn=conn);
+
+            if self.stateCache is not None:
+                for (patientId, preStateId, postStateId, currentTime) in transitions:
+                    self.stateCache.recordStateTransition(patientId, preStateId, postStateId, currentTime);
         finally:
+            conn.commit();
             if not extConn:
                 conn.close();
 
@@ -289,6 +501,10 @@ class SimManager:
             for itemId in orderItemIdSet:
                 insertDict["clinical_item_id"] = itemId;
                 DBUtil.insertRow("sim_patient_order", insertDict, conn=conn);
+                if self.stateCache is not None:
+                    insertDict["sim_patient_order_id"] = DBUtil.execute(DBUtil.identityQuery("sim_patient_order"),conn=conn)[0][0];
+                    self.stateCache.addOrder(insertDict, conn);
+                    del insertDict["sim_patient_order_id"];
 
             # See if any of these new orders triggered state transitions
             triggerItemIds = postStateIdByItemId.viewkeys() & orderItemIdSet;
@@ -319,6 +535,8 @@ class SimManager:
                 updateDict = {"relative_time_end": currentTime };
                 for patientOrderId in discontinuePatientOrderIds:
                     DBUtil.updateRow("sim_patient_order", updateDict, patientOrderId, conn=conn);
+                    if self.stateCache is not None:
+                        self.stateCache.discontinueOrder(patientOrderId, currentTime);
                 # If order is discontinued/cancelled at the same (or before) time of entry, 
                 #   take that as a signal to cleanup and delete the record altogether 
                 #   (effectively there was no time at which the order was ever allowed to exist)
@@ -328,6 +546,8 @@ class SimManager:
                 deleteQuery.addWhereEqual("sim_patient_id", patientId);
                 deleteQuery.addWhere("relative_time_end <= relative_time_start");
                 DBUtil.execute(deleteQuery, conn=conn);
+                if self.stateCache is not None:
+                    self.stateCache.deleteCancelledOrders(patientId);
         finally:
             conn.commit();
             if not extConn:
@@ -356,6 +576,9 @@ class SimManager:
             # Beginning of post-state
             insertDict = {"sim_patient_id": patientId, "sim_state_id": postStateId, "relative_time_start": currentTime};
             DBUtil.insertRow("sim_patient_state", insertDict, conn=conn);
+
+            if self.stateCache is not None:
+                self.stateCache.recordStateTransition(patientId, preStateId, postStateId, currentTime);
         finally:
             conn.commit();
             if not extConn:
@@ -393,6 +616,9 @@ class SimManager:
             conn = self.connFactory.connection();
             extConn = False;
         try:
+            if self.stateCache is not None:
+                return self.stateCache.patientOrderModels(patientId, currentTime, loadActive, conn);
+
             query = SQLQuery();
             query.addSelect("po.sim_patient_order_id");
             query.addSelect("po.sim_user_id");
@@ -430,6 +656,7 @@ class SimManager:
                 query.addOrderBy("relative_time_start");
                 query.addOrderBy("cic.description");
                 query.addOrderBy("ci.description");
+            query.addOrderBy("po.sim_patient_order_id");   # Consistent order for ties
 
             dataTable = DBUtil.execute( query, includeColumnNames=True, conn=conn);
             dataModels = modelListFromTable(dataTable);
@@ -449,6 +676,10 @@ class SimManager:
             conn = self.connFactory.connection();
             extConn = False;
         try:
+            if self.stateCache is not None:
+                resultModels = self.stateCache.resultModels(patientId, relativeTime, conn);
+                return self.joinResultValues(resultModels, self.stateCache.valueModelByStateIdByResultId);
+
             # First query for all expected result labels and states, without state-specific values as 
             #   may want outer join behvaior against default state values
             query = SQLQuery();
@@ -511,36 +742,39 @@ class SimManager:
                     valueModelByStateIdByResultId[resultId] = dict();
                 valueModelByStateIdByResultId[resultId][stateId] = valueModel;
 
-            # Now go back through original results and join up state-specific values, or use default values if needed
-            resultValueModels = list();
-            for resultModel in resultModels:
-                resultId = resultModel["sim_result_id"];
-                stateId = resultModel["sim_state_id"];
-                if resultId in valueModelByStateIdByResultId:
-                    valueModelByStateId = valueModelByStateIdByResultId[resultId];
-                    if stateId in valueModelByStateId:
-                        # Have a state-specific value, populate that
-                        valueModel = valueModelByStateId[stateId];
-                        resultModel.update(valueModel);
-                    elif DEFAULT_STATE_ID in valueModelByStateId:
-                        # No state-specific value, but have a default one to populate instead
-                        valueModel = valueModelByStateId[DEFAULT_STATE_ID];
-                        resultModel.update(valueModel);
-                    resultValueModels.append(resultModel);
-                else:
-                    # No result information available, even in default state. Skip these
-                    #resultModel["num_value"] = None;
-                    #resultModel["num_value_noise"] = None;
-                    #resultModel["text_value"] = None;
-                    #resultModel["result_flag"] = None;
-                    #resultModel["clinical_item_id"] = None;
-                    pass;
-
-            return resultValueModels;
+            return self.joinResultValues(resultModels, valueModelByStateIdByResultId);
         finally:
             if not extConn:
                 conn.close();
 
+    def joinResultValues(self, resultModels, valueModelByStateIdByResultId):
+        """Go back through result models and join up state-specific values, or use default values if needed"""
+        resultValueModels = list();
+        for resultModel in resultModels:
+            resultId = resultModel["sim_result_id"];
+            stateId = resultModel["sim_state_id"];
+            if resultId in valueModelByStateIdByResultId:
+                valueModelByStateId = valueModelByStateIdByResultId[resultId];
+                if stateId in valueModelByStateId:
+                    # Have a state-specific value, populate that
+                    valueModel = valueModelByStateId[stateId];
+                    resultModel.update(valueModel);
+                elif DEFAULT_STATE_ID in valueModelByStateId:
+                    # No state-specific value, but have a default one to populate instead
+                    valueModel = valueModelByStateId[DEFAULT_STATE_ID];
+                    resultModel.update(valueModel);
+                resultValueModels.append(resultModel);
+            else:
+                # No result information available, even in default state. Skip these
+                #resultModel["num_value"] = None;
+                #resultModel["num_value_noise"] = None;
+                #resultModel["text_value"] = None;
+                #resultModel["result_flag"] = None;
+                #resultModel["clinical_item_id"] = None;
+                pass;
+
+        return resultValueModels;
+
     def loadNotes(self, patientId, currentTime, conn=None):
         """Load notes committed up to the given simulation time.
         """
@@ -615,6 +849,11 @@ class SimManager:
             conn = self.connFactory.connection();
             extConn = False;
         try:
+            if self.searchIndex is not None:
+                dataModels = self.searchIndex.clinicalItemSearch(itemQuery, conn);
+                if dataModels is not None:
+                    return dataModels;
+
             query = SQLQuery();
             query.addSelect("ci.clinical_item_id");
             query.addSelect("ci.name");
@@ -642,6 +881,7 @@ class SimManager:
             query.addOrderBy("cic.description");
             query.addOrderBy("ci.name");
             query.addOrderBy("ci.description");
+            query.addOrderBy("ci.clinical_item_id");   # Consistent order for ties
             if itemQuery.resultCount is not None:
                 query.limit = itemQuery.resultCount;
             dataTable = DBUtil.execute( query, includeColumnNames=True, conn=conn);
@@ -659,36 +899,11 @@ class SimManager:
             conn = self.connFactory.connection();
             extConn = False;
         try:
-            query = SQLQuery();
-            query.addSelect("ic.item_collection_id");
-            query.addSelect("ic.external_id");
-            query.addSelect("ic.name as collection_name");
-            query.addSelect("ic.section");
-            query.addSelect("ic.subgroup");
-            query.addSelect("ci.clinical_item_category_id");
-            query.addSelect("ci.clinical_item_id");
-            query.addSelect("ci.name");
-            query.addSelect("ci.description");
-            query.addFrom("item_collection as ic");
-            query.addFrom("item_collection_item as ici");
-            query.addFrom("clinical_item as ci");
-            query.addWhere("ic.item_collection_id = ici.item_collection_id");
-            query.addWhere("ici.clinical_item_id = ci.clinical_item_id");
-            query.addWhereNotEqual("ic.section", AD_HOC_SECTION );
-            if itemQuery.searchStr is not None:
-                searchWords = itemQuery.searchStr.split();
-                for searchWord in searchWords:
-                    query.addWhereOp("ic.name","~*","^%(searchWord)s|[^a-z]%(searchWord)s" % {"searchWord": searchWord} ); # Prefix search by regular expression
-            if itemQuery.analysisStatus is not None:
-                query.addWhereEqual("ci.analysis_status", itemQuery.analysisStatus );
-            query.addOrderBy("lower(ic.name)");
-            query.addOrderBy("ic.external_id");
-            query.addOrderBy("lower(ic.section)");
-            query.addOrderBy("lower(ic.subgroup)");
-            query.addOrderBy("ci.clinical_item_id");
-            query.addOrderBy("ci.name");
-            dataTable = DBUtil.execute( query, includeColumnNames=True, conn=conn);
-            dataModels = modelListFromTable(dataTable);
+            dataModels = None;
+            if self.searchIndex is not None:
+                dataModels = self.searchIndex.orderSetRows(itemQuery, conn);
+            if dataModels is None:
+                dataModels = self.orderSetSearchRows(itemQuery, conn);
 
             # Aggregate up into order sets
             orderSetModel = None;
@@ -708,6 +923,40 @@ class SimManager:
             if not extConn:
                 conn.close();
 
+    def orderSetSearchRows(self, itemQuery, conn):
+        """Query for the individual order set items matching the query criteria"""
+        query = SQLQuery();
+        query.addSelect("ic.item_collection_id");
+        query.addSelect("ic.external_id");
+        query.addSelect("ic.name as collection_name");
+        query.addSelect("ic.section");
+        query.addSelect("ic.subgroup");
+        query.addSelect("ci.clinical_item_category_id");
+        query.addSelect("ci.clinical_item_id");
+        query.addSelect("ci.name");
+        query.addSelect("ci.description");
+        query.addFrom("item_collection as ic");
+        query.addFrom("item_collection_item as ici");
+        query.addFrom("clinical_item as ci");
+        query.addWhere("ic.item_collection_id = ici.item_collection_id");
+        query.addWhere("ici.clinical_item_id = ci.clinical_item_id");
+        query.addWhereNotEqual("ic.section", AD_HOC_SECTION );
+        if itemQuery.searchStr is not None:
+            searchWords = itemQuery.searchStr.split();
+            for searchWord in searchWords:
+                query.addWhereOp("ic.name","~*","^%(searchWord)s|[^a-z]%(searchWord)s" % {"searchWord": searchWord} ); # Prefix search by regular expression
+        if itemQuery.analysisStatus is not None:
+            query.addWhereEqual("ci.analysis_status", itemQuery.analysisStatus );
+        query.addOrderBy("lower(ic.name)");
+        query.addOrderBy("ic.external_id");
+        query.addOrderBy("lower(ic.section)");
+        query.addOrderBy("lower(ic.subgroup)");
+        query.addOrderBy("ci.clinical_item_id");
+        query.addOrderBy("ci.name");
+        query.addOrderBy("ici.item_collection_item_id");   # Consistent order for ties
+        dataTable = DBUtil.execute( query, includeColumnNames=True, conn=conn);
+        return modelListFromTable(dataTable);
+
 
 class ClinicalItemQuery:
     """Struct to capture query elements for clinical item / order instances"""
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+In-memory (per process) search index of clinical items and order sets for SimManager.
+
+The order entry search runs on every keystroke, with case-insensitive regular expression
+word prefix predicates (~* '^word|[^a-z]word') that require a full scan of the
+clinical_item (or item_collection) table each time.
+Instead, load the searchable items once, in the database's own sort order,
+with an inverted index from the first (up to 3) characters at every word boundary to the items,
+so searches need only verify a small candidate set.
+
+Loading the index costs more than a single database search, so only use it in long-lived processes.
+The item tables are written by offline data conversion processes rather than by the processes searching them,
+so there is no write to hook a refresh on.  Instead, the index is reloaded after refreshInterval seconds,
+meaning newly added items may not be found for up to that long.  Call clear() to pick up changes immediately.
+"""
+
+import sys, os
+import time;
+import re;
+import random;
+from optparse import OptionParser
+from medinfo.db import DBUtil;
+from medinfo.db.Model import SQLQuery, RowItemModel;
+from medinfo.db.Model import modelListFromTable;
+from medinfo.cpoe.Const import AD_HOC_SECTION;
+
+# Number of leading characters after each word boundary to index by
+INDEX_KEY_LENGTH = 3;
+
+# Search words with regular expression special characters (or non-ASCII characters,
+#   which the database may case-fold differently) are left to the database query
+NON_INDEXED_WORD_REGEXP = re.compile(r"[.^$*+?()\[\]{}|\\]|[^\x00-\x7f]");
+
+# Numeric clinical item fields that searches can sort by
+SORT_FIELDS = ("item_count","patient_count","encounter_count");
+
+class WordPrefixIndex:
+    """Inverted index of text values by the word prefixes they contain,
+    where word boundaries are the start of the text or any position following a non-letter,
+    matching the case-insensitive '^word|[^a-z]word' regular expressions.
+    """
+    def __init__(self, texts):
+        self.lowerTexts = list();
+        self.textIndexesByKey = dict();
+        for iText, text in enumerate(texts):
+            if text is None:
+                self.lowerTexts.append(None);
+                continue;
+            lowerText = text.lower();
+            self.lowerTexts.append(lowerText);
+            for iChar in xrange(len(lowerText)):
+                if iChar == 0 or not ("a" <= lowerText[iChar-1] <= "z"):
+                    for keyLength in xrange(1, INDEX_KEY_LENGTH+1):
+                        if iChar + keyLength > len(lowerText):
+                            break;
+                        key = lowerText[iChar:iChar+keyLength];
+                        if key not in self.textIndexesByKey:
+                            self.textIndexesByKey[key] = set();
+                        self.textIndexesByKey[key].add(iText);
+
+    def search(self, searchWords):
+        """Return sorted list of the indexes of texts that contain every one of the search words as a word prefix"""
+        candidateIndexes = None;
+        wordRegexps = list();
+        for searchWord in searchWords:
+            searchWord = searchWord.lower();
+            textIndexes = self.textIndexesByKey.get(searchWord[:INDEX_KEY_LENGTH], ());
+            if candidateIndexes is None:
+                candidateIndexes = set(textIndexes);
+            else:
+                candidateIndexes.intersection_update(textIndexes);
+            if len(searchWord) > INDEX_KEY_LENGTH:
+                wordRegexps.append( re.compile("(?:^|[^a-z])%s" % re.escape(searchWord)) );
+        if candidateIndexes is None:
+            return range(len(self.lowerTexts));
+
+        textIndexes = list();
+        for iText in sorted(candidateIndexes):
+            lowerText = self.lowerTexts[iText];
+            for wordRegexp in wordRegexps:
+                if wordRegexp.search(lowerText) is None:
+                    break;
+            else:
+                textIndexes.append(iText);
+        return textIndexes;
+
+class SimSearchIndex:
+    def __init__(self):
+        self.refreshInterval = 600;  # Seconds after which to reload the index, to pick up changes to the item tables. Set to None to never reload
+        self.clear();
+
+    def clear(self):
+        """Discard the index, to be reloaded from the database on next use"""
+        self.itemModels = None;
+        self.itemIndex = None;
+        self.itemLoadTime = None;
+        self.orderSetRowModels = None;
+        self.orderSetIndex = None;
+        self.orderSetLoadTime = None;
+
+    def isStale(self, loadTime):
+        return loadTime is None or (self.refreshInterval is not None and time.time() - loadTime > self.refreshInterval);
+
+    def loadItems(self, conn):
+        """Load all clinical items, in the default sort order of SimManager.clinicalItemSearch, if not already loaded"""
+        if not self.isStale(self.itemLoadTime):
+            return;
+        query = SQLQuery();
+        query.addSelect("ci.clinical_item_id");
+        query.addSelect("ci.name");
+        query.addSelect("ci.description");
+        query.addSelect("cic.source_table");
+        query.addSelect("cic.description as category_description");
+        query.addSelect("ci.analysis_status");
+        for sortField in SORT_FIELDS:
+            query.addSelect("ci.%s" % sortField);
+        query.addFrom("clinical_item as ci");
+        query.addFrom("clinical_item_category as cic");
+        query.addWhere("ci.clinical_item_category_id = cic.clinical_item_category_id");
+        query.addOrderBy("cic.description");
+        query.addOrderBy("ci.name");
+        query.addOrderBy("ci.description");
+        query.addOrderBy("ci.clinical_item_id");
+        self.itemModels = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+        self.itemIndex = WordPrefixIndex([itemModel["description"] for itemModel in self.itemModels]);
+        self.itemLoadTime = time.time();
+
+    def loadOrderSets(self, conn):
+        """Load all order set items, in the sort order of SimManager.orderSetSearch, if not already loaded"""
+        if not self.isStale(self.orderSetLoadTime):
+            return;
+        query = SQLQuery();
+        query.addSelect("ic.item_collection_id");
+        query.addSelect("ic.external_id");
+        query.addSelect("ic.name as collection_name");
+        query.addSelect("ic.section");
+        query.addSelect("ic.subgroup");
+        query.addSelect("ci.clinical_item_category_id");
+        query.addSelect("ci.clinical_item_id");
+        query.addSelect("ci.name");
+        query.addSelect("ci.description");
+        query.addSelect("ci.analysis_status");
+        query.addFrom("item_collection as ic");
+        query.addFrom("item_collection_item as ici");
+        query.addFrom("clinical_item as ci");
+        query.addWhere("ic.item_collection_id = ici.item_collection_id");
+        query.addWhere("ici.clinical_item_id = ci.clinical_item_id");
+        query.addWhereNotEqual("ic.section", AD_HOC_SECTION );
+        query.addOrderBy("lower(ic.name)");
+        query.addOrderBy("ic.external_id");
+        query.addOrderBy("lower(ic.section)");
+        query.addOrderBy("lower(ic.subgroup)");
+        query.addOrderBy("ci.clinical_item_id");
+        query.addOrderBy("ci.name");
+        query.addOrderBy("ici.item_collection_item_id");
+        self.orderSetRowModels = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+        self.orderSetIndex = WordPrefixIndex([rowModel["collection_name"] for rowModel in self.orderSetRowModels]);
+        self.orderSetLoadTime = time.time();
+
+    def searchWords(self, itemQuery):
+        """Search words of the query, or None if cannot be answered from the index"""
+        if itemQuery.searchStr is None:
+            return [];
+        searchWords = itemQuery.searchStr.split();
+        for searchWord in searchWords:
+            if NON_INDEXED_WORD_REGEXP.search(searchWord) is not None:
+                return None;
+        return searchWords;
+
+    def sortKey(self, sortField):
+        """Function for the sort key of an item by the sort field (and then default sort order),
+        or None if cannot be answered from the index
+        """
+        sortField = sortField.strip().lower();
+        descending = False;
+        if sortField.endswith(" desc"):
+            (sortField, descending) = (sortField[:-len(" desc")].rstrip(), True);
+        elif sortField.endswith(" asc"):
+            sortField = sortField[:-len(" asc")].rstrip();
+        if sortField.startswith("ci."):
+            sortField = sortField[len("ci."):];
+        if sortField not in SORT_FIELDS:
+            return None;
+        # Database sorts nulls as larger than any value
+        def sortKey(matchItem):
+            (iItem, itemModel) = matchItem;
+            value = itemModel[sortField];
+            if descending:
+                return (value is not None, -value if value is not None else None, iItem);
+            return (value is None, value, iItem);
+        return sortKey;
+
+    def clinicalItemSearch(self, itemQuery, conn):
+        """Equivalent of SimManager.clinicalItemSearch, or None if the query cannot be answered from the index"""
+        searchWords = self.searchWords(itemQuery);
+        if searchWords is None:
+            return None;
+        sortKey = None;
+        if itemQuery.sortField:
+            sortKey = self.sortKey(itemQuery.sortField);
+            if sortKey is None:
+                return None;
+        self.loadItems(conn);
+
+        sourceTables = None;
+        if itemQuery.sourceTables:
+            sourceTables = set(itemQuery.sourceTables);
+        analysisStatus = None;
+        if itemQuery.analysisStatus is not None:
+            analysisStatus = int(itemQuery.analysisStatus);
+
+        matchItems = list();
+        for iItem in self.itemIndex.search(searchWords):
+            itemModel = self.itemModels[iItem];
+            if searchWords and itemModel["description"] is None:
+                continue;
+            if sourceTables is not None and itemModel["source_table"] not in sourceTables:
+                continue;
+            if analysisStatus is not None and (itemModel["analysis_status"] != analysisStatus or itemModel["item_count"] is None or itemModel["item_count"] == 0):
+                continue;
+            matchItems.append( (iItem, itemModel) );
+            if sortKey is None and itemQuery.resultCount is not None and len(matchItems) >= itemQuery.resultCount:
+                break;  # Already in sort order, so no need to look further
+        if sortKey is not None:
+            matchItems.sort(key=sortKey);
+        if itemQuery.resultCount is not None:
+            matchItems = matchItems[:itemQuery.resultCount];
+
+        dataModels = list();
+        for (iItem, itemModel) in matchItems:
+            dataModel = RowItemModel();
+            dataModel["clinical_item_id"] = itemModel["clinical_item_id"];
+            dataModel["name"] = itemModel["name"];
+            dataModel["description"] = itemModel["description"];
+            dataModel["source_table"] = itemModel["source_table"];
+            dataModel["category_description"] = itemModel["category_description"];
+            dataModels.append(dataModel);
+        return dataModels;
+
+    def orderSetRows(self, itemQuery, conn):
+        """Equivalent of the SimManager.orderSetSearch query for order set item rows, or None if cannot be answered from the index"""
+        searchWords = self.searchWords(itemQuery);
+        if searchWords is None:
+            return None;
+        self.loadOrderSets(conn);
+
+        analysisStatus = None;
+        if itemQuery.analysisStatus is not None:
+            analysisStatus = int(itemQuery.analysisStatus);
+
+        dataModels = list();
+        for iRow in self.orderSetIndex.search(searchWords):
+            rowModel = self.orderSetRowModels[iRow];
+            if analysisStatus is not None and rowModel["analysis_status"] != analysisStatus:
+                continue;
+            dataModel = RowItemModel(rowModel);
+            del dataModel["analysis_status"];
+            dataModels.append(dataModel);
+        return dataModels;
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues)-1, int(fraction*len(sortedValues)))];
+
+def main(argv):
+    """Benchmark search latency with and without the index, over a corpus of search strings,
+    checking that both give the same results.
+    """
+    from medinfo.cpoe.cpoeSim.SimManager import SimManager, ClinicalItemQuery;
+    usageStr =  "usage: %prog [options] [<searchFile>]\n"+\
+                "   <searchFile>    File with one search string per line.  If not provided, will generate searches from word prefixes of item descriptions and order set names\n";
+    parser = OptionParser(usage=usageStr)
+    parser.add_option("-n", "--numSearches", dest="numSearches", default="500", help="Number of searches to generate");
+    parser.add_option("-s", "--randomSeed", dest="randomSeed", default="1", help="Random seed for generated searches");
+    parser.add_option("-c", "--resultCount", dest="resultCount", default="10", help="Maximum clinical items to return per search, as web interface does.  Set to blank for no limit");
+    parser.add_option("-a", "--analysisStatus", dest="analysisStatus", default="1", help="Analysis status to filter items by, as web interface does.  Set to blank to not filter");
+    (options, args) = parser.parse_args(argv[1:])
+
+    indexManager = SimManager();
+    indexManager.searchIndex = SimSearchIndex();
+    indexManager.searchIndex.refreshInterval = None;
+    sqlManager = SimManager();
+
+    if len(args) > 0:
+        searchStrs = [line.strip() for line in open(args[0]) if line.strip() != ""];
+    else:
+        conn = sqlManager.connFactory.connection();
+        try:
+            indexManager.searchIndex.loadItems(conn);
+            indexManager.searchIndex.loadOrderSets(conn);
+        finally:
+            conn.close();
+        texts = [itemModel["description"] for itemModel in indexManager.searchIndex.itemModels];
+        texts.extend([rowModel["collection_name"] for rowModel in indexManager.searchIndex.orderSetRowModels]);
+        words = list();
+        for text in texts:
+            if text is not None:
+                words.extend([word for word in re.split("[^a-z0-9]+", text.lower()) if word != ""]);
+        if len(words) < 1:
+            print >> sys.stderr, "No item descriptions to generate searches from";
+            sys.exit(-1);
+        randomizer = random.Random(int(options.randomSeed));
+        searchStrs = list();
+        for iSearch in xrange(int(options.numSearches)):
+            searchWords = list();
+            for iWord in xrange(randomizer.choice((1,1,1,2))):
+                word = randomizer.choice(words);
+                searchWords.append(word[:randomizer.randint(1, max(1,min(len(word),6)))]);
+            searchStrs.append(str.join(" ", searchWords));
+
+    analysisStatus = None;
+    if options.analysisStatus != "":
+        analysisStatus = options.analysisStatus;
+
+    for (searchName, searchFunc) in (("clinicalItemSearch", lambda manager, query: manager.clinicalItemSearch(query)), ("orderSetSearch", lambda manager, query: list(manager.orderSetSearch(query)))):
+        searchTimesByMethod = {"sql": list(), "index": list()};
+        numMismatch = 0;
+        # Warm up index load first, so not included in search times
+        searchFunc(indexManager, ClinicalItemQuery());
+        for searchStr in searchStrs:
+            query = ClinicalItemQuery();
+            query.searchStr = searchStr;
+            query.analysisStatus = analysisStatus;
+            if searchName == "clinicalItemSearch" and options.resultCount != "":
+                query.resultCount = int(options.resultCount);
+            results = dict();
+            for (method, manager) in (("sql", sqlManager), ("index", indexManager)):
+                timer = time.time();
+                results[method] = searchFunc(manager, query);
+                searchTimesByMethod[method].append(time.time() - timer);
+            if results["sql"] != results["index"]:
+                numMismatch += 1;
+                print >> sys.stderr, "%s results differ for search: %s" % (searchName, searchStr);
+        for method in ("sql","index"):
+            searchTimes = sorted(searchTimesByMethod[method]);
+            print >> sys.stdout, "%s %s: %d searches, %d mismatches, mean %.2f ms, median %.2f ms, p99 %.2f ms" % \
+                (searchName, method, len(searchTimes), numMismatch, 1000*sum(searchTimes)/len(searchTimes), 1000*percentile(searchTimes,0.5), 1000*percentile(searchTimes,0.99));
+
+if __name__ == "__main__":
+    main(sys.argv);
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+"""
+In-memory (per process) cache of simulation state for SimManager.
+
+Each interactive simulation step asks for the patient's current state, active orders
+and unlocked results, each re-querying the same state, transition and result tables.
+Instead, preload the (static) state graph, transitions, state results and order-result mappings once,
+and keep a timeline of each patient's states and orders, updated in place as SimManager
+records new orders and state transitions, so these steps can be answered without the database.
+
+Before answering from a cached patient timeline, check it against a single aggregate query of the
+patient's order and state rows (counts, ID and end time sums).  If another process (e.g., another
+WebServer worker) recorded orders or state transitions since, the patient's timelines are reloaded.
+The static state graph and result tables are not rechecked, so restart the processes (or call clear)
+after editing the simulation case definitions.
+"""
+
+import sys, os
+import time;
+from optparse import OptionParser
+from medinfo.db import DBUtil;
+from medinfo.db.Model import SQLQuery, RowItemModel;
+from medinfo.db.Model import modelListFromTable;
+
+class SimStateCache:
+    def __init__(self):
+        self.clear();
+
+    def clear(self):
+        """Discard all cached data, to be reloaded from the database on next use"""
+        self.staticLoaded = False;
+        self.stateModelById = None;
+        self.postStateIdByItemIdByPreStateId = None;
+        self.postStateIdTimeTriggerByPreStateId = None;
+        self.valueModelByStateIdByResultId = None;
+        self.resultMapModelsByItemId = None;
+        self.itemModelById = dict();    # Clinical item information (and sort rank) for patient orders
+        self.patientById = dict();  # Patient information with timelines of patient states and orders
+        self.orderModelById = dict();
+
+    def clearPatient(self, patientId):
+        """Discard cached timelines for the patient, to be reloaded from the database on next use"""
+        if patientId in self.patientById:
+            for orderModel in self.patientById[patientId]["orderModels"]:
+                del self.orderModelById[orderModel["sim_patient_order_id"]];
+            del self.patientById[patientId];
+
+    def loadStatic(self, conn):
+        """Load the simulation state graph, state transitions, state results and order to result mappings,
+        if not already loaded.
+        """
+        if self.staticLoaded:
+            return;
+
+        query = SQLQuery();
+        query.addSelect("s.sim_state_id");
+        query.addSelect("s.name");
+        query.addSelect("s.description");
+        query.addFrom("sim_state as s");
+        self.stateModelById = dict();
+        for stateModel in modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn)):
+            self.stateModelById[stateModel["sim_state_id"]] = stateModel;
+
+        # For each pre-state, track which clinical items or times trigger which post-states
+        query = SQLQuery();
+        query.addSelect("pre_state_id");
+        query.addSelect("post_state_id");
+        query.addSelect("clinical_item_id");
+        query.addSelect("time_trigger");
+        query.addFrom("sim_state_transition as sst");
+        self.postStateIdByItemIdByPreStateId = dict();
+        self.postStateIdTimeTriggerByPreStateId = dict();
+        for preStateId, postStateId, itemId, timeTrigger in DBUtil.execute(query, conn=conn):
+            if preStateId not in self.postStateIdByItemIdByPreStateId:
+                self.postStateIdByItemIdByPreStateId[preStateId] = dict();
+            self.postStateIdByItemIdByPreStateId[preStateId][itemId] = postStateId;
+
+            if timeTrigger is not None:
+                self.postStateIdTimeTriggerByPreStateId[preStateId] = (postStateId, timeTrigger);
+
+        query = SQLQuery();
+        query.addSelect("ssr.sim_state_id");
+        query.addSelect("ssr.sim_result_id");
+        query.addSelect("ssr.num_value");
+        query.addSelect("ssr.num_value_noise");
+        query.addSelect("ssr.text_value");
+        query.addSelect("ssr.result_flag");
+        query.addSelect("ssr.clinical_item_id");
+        query.addFrom("sim_state_result as ssr");
+        self.valueModelByStateIdByResultId = dict();
+        for valueModel in modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn)):
+            resultId = valueModel["sim_result_id"];
+            if resultId not in self.valueModelByStateIdByResultId:
+                self.valueModelByStateIdByResultId[resultId] = dict();
+            self.valueModelByStateIdByResultId[resultId][valueModel["sim_state_id"]] = valueModel;
+
+        query = SQLQuery();
+        query.addSelect("sorm.clinical_item_id");
+        query.addSelect("sr.sim_result_id");
+        query.addSelect("sr.name");
+        query.addSelect("sr.description");
+        query.addSelect("sr.priority");
+        query.addSelect("sr.group_string");
+        query.addSelect("sorm.turnaround_time");
+        query.addFrom("sim_order_result_map as sorm");
+        query.addFrom("sim_result as sr");
+        query.addWhere("sorm.sim_result_id = sr.sim_result_id");
+        self.resultMapModelsByItemId = dict();
+        for resultMapModel in modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn)):
+            itemId = resultMapModel.pop("clinical_item_id");
+            if itemId not in self.resultMapModelsByItemId:
+                self.resultMapModelsByItemId[itemId] = list();
+            self.resultMapModelsByItemId[itemId].append(resultMapModel);
+
+        self.staticLoaded = True;
+
+    def loadPatient(self, patientId, conn):
+        """Load the patient's information and timelines of states and orders, if not already loaded.
+        Return None if no such patient.
+        """
+        self.loadStatic(conn);
+        if patientId in self.patientById:
+            if self.patientSignature(self.patientById[patientId]) == self.databaseSignature(patientId, conn):
+                return self.patientById[patientId];
+            self.clearPatient(patientId);   # Changed by another process, reload
+
+        query = SQLQuery();
+        query.addSelect("sp.sim_patient_id");
+        query.addSelect("sp.name");
+        query.addSelect("sp.age_years");
+        query.addSelect("sp.gender");
+        query.addFrom("sim_patient as sp");
+        query.addWhereEqual("sp.sim_patient_id", patientId );
+        patientModels = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+        if len(patientModels) < 1:
+            return None;
+        patient = {"patientModel": patientModels[0]};
+
+        query = SQLQuery();
+        query.addSelect("sps.sim_state_id");
+        query.addSelect("sps.relative_time_start");
+        query.addSelect("sps.relative_time_end");
+        query.addFrom("sim_patient_state as sps");
+        query.addWhereEqual("sps.sim_patient_id", patientId );
+        query.addOrderBy("sps.sim_patient_state_id");
+        patient["stateModels"] = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+
+        query = SQLQuery();
+        query.addSelect("po.sim_patient_order_id");
+        query.addSelect("po.sim_user_id");
+        query.addSelect("po.sim_patient_id");
+        query.addSelect("po.sim_state_id");
+        query.addSelect("po.clinical_item_id");
+        query.addSelect("po.relative_time_start");
+        query.addSelect("po.relative_time_end");
+        query.addFrom("sim_patient_order as po");
+        query.addWhereEqual("po.sim_patient_id", patientId );
+        query.addOrderBy("po.sim_patient_order_id");
+        patient["orderModels"] = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+        for orderModel in patient["orderModels"]:
+            self.orderModelById[orderModel["sim_patient_order_id"]] = orderModel;
+        self.loadItems([orderModel["clinical_item_id"] for orderModel in patient["orderModels"]], conn);
+
+        self.patientById[patientId] = patient;
+        return patient;
+
+    def patientSignature(self, patient):
+        """Summary of the cached patient timelines, to compare against databaseSignature"""
+        orderEndTimes = [orderModel["relative_time_end"] for orderModel in patient["orderModels"] if orderModel["relative_time_end"] is not None];
+        stateEndTimes = [stateModel["relative_time_end"] for stateModel in patient["stateModels"] if stateModel["relative_time_end"] is not None];
+        return \
+            (   len(patient["orderModels"]),
+                sum(orderModel["sim_patient_order_id"] for orderModel in patient["orderModels"]),
+                len(orderEndTimes),
+                sum(orderEndTimes),
+                len(patient["stateModels"]),
+                sum(stateModel["sim_state_id"] for stateModel in patient["stateModels"]),
+                len(stateEndTimes),
+                sum(stateEndTimes),
+            );
+
+    def databaseSignature(self, patientId, conn):
+        """Same summary as patientSignature, of the patient's current order and state rows in the database.
+        Any order or state transition recorded, discontinued or deleted since the timelines were loaded will change it.
+        """
+        query = \
+            """select 0, count(*), coalesce(sum(sim_patient_order_id),0), count(relative_time_end), coalesce(sum(relative_time_end),0)
+            from sim_patient_order where sim_patient_id = %(p)s
+            union all
+            select 1, count(*), coalesce(sum(sim_state_id),0), count(relative_time_end), coalesce(sum(relative_time_end),0)
+            from sim_patient_state where sim_patient_id = %(p)s
+            order by 1
+            """ % {"p": DBUtil.SQL_PLACEHOLDER};
+        (orderRow, stateRow) = DBUtil.execute(query, (patientId, patientId), conn=conn);
+        return tuple(int(value) for value in list(orderRow[1:]) + list(stateRow[1:]));
+
+    def loadItems(self, itemIds, conn):
+        """Load clinical item information for any of the items not already loaded.
+        Also rank all loaded items in the (category description, item description) order the database sorts them in,
+        so orders can be sorted the same as by the database, collation and null handling included.
+        """
+        newItemIds = set(itemIds).difference(self.itemModelById);
+        if len(newItemIds) < 1:
+            return;
+
+        query = SQLQuery();
+        query.addSelect("ci.clinical_item_id");
+        query.addSelect("ci.name");
+        query.addSelect("ci.description");
+        query.addSelect("cic.source_table");
+        query.addSelect("cic.description as category_description");
+        query.addFrom("clinical_item as ci");
+        query.addFrom("clinical_item_category as cic");
+        query.addWhere("ci.clinical_item_category_id = cic.clinical_item_category_id");
+        query.addWhereIn("ci.clinical_item_id", newItemIds.union(self.itemModelById) );
+        query.addOrderBy("cic.description");
+        query.addOrderBy("ci.description");
+        itemModels = modelListFromTable(DBUtil.execute(query, includeColumnNames=True, conn=conn));
+
+        rank = -1;
+        lastItemModel = None;
+        for itemModel in itemModels:
+            # Items the database can't tell apart by the sort columns share a rank
+            if lastItemModel is None or (itemModel["category_description"], itemModel["description"]) != (lastItemModel["category_description"], lastItemModel["description"]):
+                rank += 1;
+            itemModel["rank"] = rank;
+            self.itemModelById[itemModel.pop("clinical_item_id")] = itemModel;
+            lastItemModel = itemModel;
+
+    def patientInfoModels(self, patientId, relativeTime, conn):
+        """Equivalent of the SimManager.loadPatientInfo query for a single patient,
+        before any state transition triggers are checked.
+        """
+        patient = self.loadPatient(patientId, conn);
+        dataModels = list();
+        if patient is None:
+            return dataModels;
+        for stateModel in patient["stateModels"]:
+            stateId = stateModel["sim_state_id"];
+            if stateModel["relative_time_start"] <= relativeTime and \
+                (stateModel["relative_time_end"] is None or stateModel["relative_time_end"] > relativeTime) and \
+                stateId in self.stateModelById:
+                dataModel = RowItemModel(patient["patientModel"]);
+                dataModel["sim_state_id"] = stateId;
+                dataModel["state_name"] = self.stateModelById[stateId]["name"];
+                dataModel["state_description"] = self.stateModelById[stateId]["description"];
+                dataModel["relative_time_start"] = stateModel["relative_time_start"];
+                dataModel["relative_time_end"] = stateModel["relative_time_end"];
+                dataModels.append(dataModel);
+        return dataModels;
+
+    def patientOrderModels(self, patientId, currentTime, loadActive, conn):
+        """Equivalent of the SimManager.loadPatientOrders query"""
+        patient = self.loadPatient(patientId, conn);
+        dataModels = list();
+        if patient is None:
+            return dataModels;
+        for orderModel in patient["orderModels"]:
+            itemModel = self.itemModelById.get(orderModel["clinical_item_id"]);
+            if itemModel is None:   # Not a clinical item the database query would join to
+                continue;
+            if orderModel["relative_time_start"] > currentTime:
+                continue;
+            if loadActive and not (orderModel["relative_time_end"] is None or orderModel["relative_time_end"] > currentTime):
+                continue;
+            dataModel = RowItemModel(orderModel);
+            dataModel["name"] = itemModel["name"];
+            dataModel["description"] = itemModel["description"];
+            dataModel["source_table"] = itemModel["source_table"];
+            dataModel["category_description"] = itemModel["category_description"];
+            dataModels.append(dataModel);
+
+        itemModelById = self.itemModelById;
+        if loadActive:  # Organize currently active orders by category
+            dataModels.sort(key=lambda dataModel: (itemModelById[dataModel["clinical_item_id"]]["rank"], dataModel["relative_time_start"], dataModel["sim_patient_order_id"]));
+        else:   # Otherwise chronologic order
+            dataModels.sort(key=lambda dataModel: (dataModel["relative_time_start"], itemModelById[dataModel["clinical_item_id"]]["rank"], dataModel["sim_patient_order_id"]));
+        return dataModels;
+
+    def resultModels(self, patientId, relativeTime, conn):
+        """Equivalent of the SimManager.loadResults query for results unlocked by patient orders,
+        before joining state-specific values.
+        """
+        patient = self.loadPatient(patientId, conn);
+        resultModels = list();
+        if patient is None:
+            return resultModels;
+        resultKeys = set();   # Distinct results
+        for orderModel in patient["orderModels"]:
+            for resultMapModel in self.resultMapModelsByItemId.get(orderModel["clinical_item_id"], ()):
+                if resultMapModel["turnaround_time"] is None:
+                    continue;
+                resultTime = orderModel["relative_time_start"] + resultMapModel["turnaround_time"];
+                # Only unlock results if appropiate prereq orders were placed in the past (and longer than the turnaround time)
+                #   and the triggering order was not cancelled before the completion of the turnaround time
+                if resultTime <= relativeTime and (orderModel["relative_time_end"] is None or resultTime <= orderModel["relative_time_end"]):
+                    resultModel = RowItemModel(resultMapModel);
+                    resultModel["sim_state_id"] = orderModel["sim_state_id"];
+                    resultModel["relative_time_start"] = orderModel["relative_time_start"];
+                    resultModel["result_relative_time"] = resultTime;
+                    resultKey = tuple(sorted(resultModel.iteritems()));
+                    if resultKey not in resultKeys:
+                        resultKeys.add(resultKey);
+                        resultModels.append(resultModel);
+        # Null priorities last, as database sorts them
+        resultModels.sort(key=lambda resultModel: (resultModel["result_relative_time"], resultModel["priority"] is None, resultModel["priority"]));
+        return resultModels;
+
+    def addOrder(self, orderModel, conn):
+        """Record a new patient order, if the patient is cached"""
+        patientId = orderModel["sim_patient_id"];
+        if patientId in self.patientById:
+            orderModel = RowItemModel(orderModel);
+            if "relative_time_end" not in orderModel:
+                orderModel["relative_time_end"] = None;
+            self.patientById[patientId]["orderModels"].append(orderModel);
+            self.orderModelById[orderModel["sim_patient_order_id"]] = orderModel;
+            self.loadItems([orderModel["clinical_item_id"]], conn);
+
+    def discontinueOrder(self, patientOrderId, currentTime):
+        """Record the end time of a patient order, if the patient is cached"""
+        if patientOrderId in self.orderModelById:
+            self.orderModelById[patientOrderId]["relative_time_end"] = currentTime;
+
+    def deleteCancelledOrders(self, patientId):
+        """Remove patient orders that were discontinued at the same (or before) time of entry,
+        same as SimManager.signOrders deletes them from the database.
+        """
+        if patientId in self.patientById:
+            keepOrderModels = list();
+            for orderModel in self.patientById[patientId]["orderModels"]:
+                if orderModel["relative_time_end"] is not None and orderModel["relative_time_end"] <= orderModel["relative_time_start"]:
+                    del self.orderModelById[orderModel["sim_patient_order_id"]];
+                else:
+                    keepOrderModels.append(orderModel);
+            self.patientById[patientId]["orderModels"] = keepOrderModels;
+
+    def recordStateTransition(self, patientId, preStateId, postStateId, currentTime):
+        """Record a patient state transition, if the patient is cached, same as SimManager.recordStateTransition does in the database"""
+        if patientId in self.patientById:
+            stateModels = self.patientById[patientId]["stateModels"];
+            # Ending of pre-state
+            for stateModel in stateModels:
+                if stateModel["sim_state_id"] == preStateId and stateModel["relative_time_start"] <= currentTime and stateModel["relative_time_end"] is None:
+                    stateModel["relative_time_end"] = currentTime;
+            # Beginning of post-state
+            stateModels.append(RowItemModel({"sim_state_id": postStateId, "relative_time_start": currentTime, "relative_time_end": None}));
+
+def runScriptedCase(manager, patientId, userId, orderItemIds, numSteps, startTime=0, timeStep=300):
+    """Run a scripted simulation case through the manager, with each step the requests of an interactive step:
+    current patient state, active orders, results and recent items, then signing the next order item
+    (and discontinuing the oldest active order every few steps).
+    Return list of the seconds each step took.
+    """
+    stepTimes = list();
+    for iStep in xrange(numSteps):
+        simTime = startTime + iStep * timeStep;
+        timer = time.time();
+        manager.loadPatientInfo([patientId], simTime);
+        patientOrders = manager.loadPatientOrders(patientId, simTime);
+        manager.loadResults(patientId, simTime);
+        manager.recentItemIds(patientId, simTime);
+        discontinuePatientOrderIds = None;
+        if iStep % 5 == 4 and len(patientOrders) > 0:
+            discontinuePatientOrderIds = [min(patientOrders, key=lambda patientOrder: patientOrder["relative_time_start"])["sim_patient_order_id"]];
+        manager.signOrders(userId, patientId, simTime, [orderItemIds[iStep % len(orderItemIds)]], discontinuePatientOrderIds);
+        stepTimes.append(time.time() - timer);
+    return stepTimes;
+
+def main(argv):
+    """Benchmark request latency for a scripted simulation case, with and without the state cache"""
+    from medinfo.cpoe.cpoeSim.SimManager import SimManager;
+    usageStr =  "usage: %prog [options] <templatePatientId> <userId> <orderItemIds>\n"+\
+                "   <templatePatientId> Simulated patient to copy for each scripted case\n"+\
+                "   <userId>            Simulation user to record orders for\n"+\
+                "   <orderItemIds>      Comma-separated clinical item IDs to order over the scripted steps\n";
+    parser = OptionParser(usage=usageStr)
+    parser.add_option("-n", "--numSteps", dest="numSteps", default="50", help="Number of scripted simulation steps");
+    parser.add_option("-t", "--timeStep", dest="timeStep", default="300", help="Simulated seconds between steps");
+    (options, args) = parser.parse_args(argv[1:])
+    if len(args) < 3:
+        parser.print_help()
+        sys.exit(-1)
+
+    templatePatientId = int(args[0]);
+    userId = int(args[1]);
+    orderItemIds = [int(itemIdStr) for itemIdStr in args[2].split(",")];
+    for useCache in (False, True):
+        manager = SimManager();
+        if useCache:
+            manager.stateCache = SimStateCache();
+        patientId = manager.copyPatientTemplate({"name": "Benchmark Case"}, templatePatientId);
+        try:
+            stepTimes = runScriptedCase(manager, patientId, userId, orderItemIds, int(options.numSteps), timeStep=int(options.timeStep));
+        finally:
+            DBUtil.execute("delete from sim_patient_order where sim_patient_id = %s" % DBUtil.SQL_PLACEHOLDER, (patientId,) );
+            DBUtil.execute("delete from sim_patient_state where sim_patient_id = %s" % DBUtil.SQL_PLACEHOLDER, (patientId,) );
+            DBUtil.execute("delete from sim_patient where sim_patient_id = %s" % DBUtil.SQL_PLACEHOLDER, (patientId,) );
+        stepTimes.sort();
+        print >> sys.stdout, "stateCache=%s: %d steps, mean %.1f ms, median %.1f ms, max %.1f ms per step" % \
+            (useCache, len(stepTimes), 1000*sum(stepTimes)/len(stepTimes), 1000*stepTimes[len(stepTimes)/2], 1000*stepTimes[-1]);
+
+if __name__ == "__main__":
+    main(sys.argv);
@@ -2,6 +2,7 @@
 """Test case for respective module in application package"""
 
 import sys, os
+import shutil, tempfile;
 from cStringIO import StringIO
 from datetime import datetime;
 import unittest
@@ -9,12 +10,17 @@ import unittest
 from Const import RUNNER_VERBOSITY;
 from Util import log;
 
+from medinfo.common.test.Util import MedInfoTestCase;
 from medinfo.db.test.Util import DBTestCase;
 
 from medinfo.db import DBUtil
+from medinfo.db import Env;
 from medinfo.db.Model import SQLQuery, RowItemModel, modelListFromTable;
 
 from medinfo.cpoe.cpoeSim.SimManager import SimManager;
+from medinfo.cpoe.cpoeSim.SimStateCache import SimStateCache, runScriptedCase;
+from medinfo.cpoe.cpoeSim.SimManager import ClinicalItemQuery;
+from medinfo.cpoe.cpoeSim.SimSearchIndex import SimSearchIndex;
 
 class TestSimManager(DBTestCase):
     def setUp(self):
@@ -28,6 +34,7 @@ class TestSimManager(DBTestCase):
         self.manager.buildCPOESimSchema();
 
         self.testPatientId = None;
+        self.testPatientIds = list();
 
         self.purgeTestRecords();
 
@@ -244,10 +251,12 @@ class TestSimManager(DBTestCase):
     def purgeTestRecords(self):
         log.info("Purge test records from the database")
         if self.testPatientId is not None:
+            self.testPatientIds.append(self.testPatientId);
+        for testPatientId in self.testPatientIds:
             # Delete test generated data
-            DBUtil.execute("delete from sim_patient_order where sim_patient_id = %s", (self.testPatientId,) );
-            DBUtil.execute("delete from sim_patient_state where sim_patient_id = %s", (self.testPatientId,) );
-            DBUtil.execute("delete from sim_patient where sim_patient_id = %s", (self.testPatientId,) );
+            DBUtil.execute("delete from sim_patient_order where sim_patient_id = %s", (testPatientId,) );
+            DBUtil.execute("delete from sim_patient_state where sim_patient_id = %s", (testPatientId,) );
+            DBUtil.execute("delete from sim_patient where sim_patient_id = %s", (testPatientId,) );
 
         DBUtil.execute("delete from sim_note where sim_note_id < 0");
         DBUtil.execute("delete from sim_state_result where sim_state_result_id < 0");
@@ -259,6 +268,8 @@ class TestSimManager(DBTestCase):
         DBUtil.execute("delete from sim_state where sim_state_id <= 0");
         DBUtil.execute("delete from sim_user where sim_user_id < 0");
         DBUtil.execute("delete from sim_patient where sim_patient_id < 0");
+        DBUtil.execute("delete from item_collection_item where item_collection_id < 0");
+        DBUtil.execute("delete from item_collection where item_collection_id < 0");
         DBUtil.execute("delete from clinical_item where clinical_item_id < 0");
 
     def tearDown(self):
@@ -692,6 +703,244 @@ class TestSimManager(DBTestCase):
         verifyPatient = RowItemModel([-4], colNames);
         self.assertEqualDict(samplePatient, verifyPatient, colNames);
 
+    def test_advanceTimeTriggers(self):
+        # Pass through multiple time triggered state transitions for a batch of patients at once
+        userId = -1;
+        patientId = -1;
+        self.testPatientId = self.manager.copyPatientTemplate({"name":"Template Copy"}, patientId);   # In state 1 from time zero
+
+        # Order to transition patient -1 from state 2 to 3, which then passively returns to state 1 and further to state 2
+        self.manager.signOrders(userId, patientId, 2100, [-11]);
+
+        colNames = ["sim_patient_id","sim_state_id","relative_time_start"];
+        samplePatients = self.manager.loadPatientInfo([patientId, self.testPatientId], 30000);
+        samplePatients.sort(key=lambda patientModel: patientModel["sim_patient_id"]);
+        verifyPatients = \
+            [   RowItemModel([self.testPatientId,-2,9000], colNames),
+                RowItemModel([patientId,-2,20100], colNames),
+            ];
+        verifyPatients.sort(key=lambda patientModel: patientModel["sim_patient_id"]);
+        self.assertEqualDictList(verifyPatients, samplePatients, colNames);
+
+        # Every intermediate state recorded
+        dataCols = ["sim_state_id","relative_time_start","relative_time_end"];
+        query = SQLQuery();
+        for dataCol in dataCols:
+            query.addSelect(dataCol);
+        query.addFrom("sim_patient_state");
+        query.addWhereEqual("sim_patient_id", patientId );
+        query.addWhereOp("relative_time_start",">=", 1800 );
+        query.addOrderBy("relative_time_start");
+        sampleData = modelListFromTable(DBUtil.execute(query,includeColumnNames=True));
+        verifyData = \
+            [   RowItemModel([-2,1800,2100], dataCols),
+                RowItemModel([-3,2100,11100], dataCols),
+                RowItemModel([-1,11100,20100], dataCols),
+                RowItemModel([-2,20100,None], dataCols),
+            ];
+        self.assertEqualDictList(verifyData, sampleData, dataCols);
+
+        # Zero-duration time triggers that cycle back to a prior state would never settle
+        postStateIdTimeTriggerByPreStateId = {-1: (-2, 0), -2: (-3, 0), -3: (-2, 0)};
+        patientModels = [RowItemModel([patientId,-1,100], colNames)];
+        self.assertRaises(ValueError, self.manager.advanceTimeTriggers, patientModels, 200, postStateIdTimeTriggerByPreStateId);
+
+        # Fine if time elapses within cycle
+        postStateIdTimeTriggerByPreStateId[-3] = (-1, 50);
+        sampleTransitions = self.manager.advanceTimeTriggers(patientModels, 200, postStateIdTimeTriggerByPreStateId);
+        verifyTransitions = \
+            [   (patientId,-1,-2,100), (patientId,-2,-3,100), (patientId,-3,-1,150),
+                (patientId,-1,-2,150), (patientId,-2,-3,150), (patientId,-3,-1,200),
+                (patientId,-1,-2,200), (patientId,-2,-3,200),
+            ];
+        self.assertEqual(verifyTransitions, sampleTransitions);
+
+    def test_copyPatientTemplates(self):
+        # Bulk copy of multiple patients from multiple templates should match copying each one at a time
+        #   Second template patient states and orders
+        dataTextStr = \
+"""sim_patient_state_id;sim_patient_id;sim_state_id;relative_time_start;relative_time_end
+-11;-2;-1;-100;-50
+-12;-2;-2;-50;0
+-13;-2;-3;0;500
+-14;-2;-1;500;None
+"""     # Parse into DB insertion object
+        DBUtil.insertFile( StringIO(dataTextStr), "sim_patient_state", delim=";");
+        dataTextStr = \
+"""sim_patient_order_id;sim_user_id;sim_patient_id;sim_state_id;clinical_item_id;relative_time_start;relative_time_end
+-11;-1;-2;-2;-9;-10;None
+-12;-1;-2;-2;-10;-10;0
+-13;-1;-2;-3;-11;0;None
+-14;-1;-2;-1;-12;100;None
+"""     # Parse into DB insertion object
+        DBUtil.insertFile( StringIO(dataTextStr), "sim_patient_order", delim=";");
+
+        templatePatientIds = [-1,-2,-1,-2,-1];
+        patientDataList = [{"name":"Bulk Copy %d" % i} for i in xrange(len(templatePatientIds))];
+        patientDataList[1]["age_years"] = 30;
+        (patientIds, verifyPatientIds) = assertCopyPatientTemplates(self, self.manager, patientDataList, templatePatientIds);
+        self.testPatientIds.extend(patientIds);
+        self.testPatientIds.extend(verifyPatientIds);
+
+        # Only states up to time zero, with the last one left open ended
+        query = SQLQuery();
+        query.addSelect("sim_state_id");
+        query.addSelect("relative_time_start");
+        query.addSelect("relative_time_end");
+        query.addFrom("sim_patient_state");
+        query.addWhereEqual("sim_patient_id", patientIds[1] );
+        query.addOrderBy("relative_time_start");
+        self.assertEqual([[-1,-100,-50],[-2,-50,0],[-3,0,None]], DBUtil.execute(query));
+
+        self.assertRaises(ValueError, self.manager.copyPatientTemplates, patientDataList, templatePatientIds[:2]);
+        self.assertEqual([], self.manager.copyPatientTemplates([], []));
+
+    def test_searchIndex(self):
+        # Clinical item and order set searches answered from the in-memory index should match the database regular expression searches
+        itemDescriptions = \
+            {   -1: "CBC with Differential",
+                -2: "Basic Metabolic Panel (BMP)",
+                -3: "Hepatic Function Panel",
+                -5: "XR Chest 2V",
+                -7: "CT Abdomen/Pelvis with Contrast",
+                -8: "CT Angio Chest PE-Protocol",
+                -9: "Acetaminophen 500mg Tab",
+                -11: "Enoxaparin 40mg SC",
+                -12: "Warfarin 5mg Tab",
+                -13: "CefTRIAXone 1g IV",
+                -15: "Vital Signs q4h",
+            };
+        for itemId, description in itemDescriptions.iteritems():
+            DBUtil.execute("update clinical_item set description = %s, item_count = %s where clinical_item_id = %s", (description, -itemId % 3, itemId) );
+        DBUtil.execute("update clinical_item set analysis_status = 0 where clinical_item_id = -12");
+
+        dataTextStr = \
+"""item_collection_id;external_id;name;section;subgroup
+-1;-100;Chest Pain Admission;Labs;None
+-2;-100;Chest Pain Admission;Imaging;CT
+-3;-200;ED Abdominal Pain;Imaging;None
+-4;-300;Anticoagulation (Warfarin/Enoxaparin);Meds;None
+-5;-400;Ad-hoc Chest;Ad-hoc Orders;None
+"""     # Parse into DB insertion object
+        DBUtil.insertFile( StringIO(dataTextStr), "item_collection", delim=";");
+        dataTextStr = \
+"""item_collection_item_id;item_collection_id;clinical_item_id
+-1;-1;-1
+-2;-1;-4
+-3;-2;-8
+-4;-2;-5
+-5;-3;-7
+-6;-3;-2
+-7;-4;-12
+-8;-4;-11
+-9;-5;-5
+"""     # Parse into DB insertion object
+        DBUtil.insertFile( StringIO(dataTextStr), "item_collection_item", delim=";");
+
+        indexManager = SimManager();
+        indexManager.searchIndex = SimSearchIndex();
+
+        searchStrs = \
+            [   None, "", "c", "C", "ch", "CHE", "chest", "chest x", "ct che", "pe", "protocol", "pelv", "contrast abd",
+                "2", "5mg", "mg", "g", "tab", "x", "bmp", "warf", "enox", "anti", "pain", "admission pain", "zzz",
+                "ceftriaxone", "IV", "q4", "ad-", "e", "o",
+            ];
+        for searchStr in searchStrs:
+            for analysisStatus in (None, "1"):
+                for sourceTables in (None, ["Labs","Imaging"]):
+                    for resultCount in (None, 3):
+                        for sortField in (None, "item_count", "ci.item_count desc"):
+                            query = ClinicalItemQuery();
+                            query.searchStr = searchStr;
+                            query.analysisStatus = analysisStatus;
+                            query.sourceTables = sourceTables;
+                            query.resultCount = resultCount;
+                            query.sortField = sortField;
+                            sampleResults = indexManager.clinicalItemSearch(query);
+                            verifyResults = self.manager.clinicalItemSearch(query);
+                            self.assertEqual(verifyResults, sampleResults, searchStr);
+
+                query = ClinicalItemQuery();
+                query.searchStr = searchStr;
+                query.analysisStatus = analysisStatus;
+                sampleResults = list(indexManager.orderSetSearch(query));
+                verifyResults = list(self.manager.orderSetSearch(query));
+                self.assertEqual(verifyResults, sampleResults, searchStr);
+
+        # Spot check expected results
+        query = ClinicalItemQuery();
+        query.searchStr = "ch ct";
+        sampleItemIds = [dataModel["clinical_item_id"] for dataModel in indexManager.clinicalItemSearch(query)];
+        self.assertEqual([-8], sampleItemIds);
+        query.searchStr = "pai";
+        sampleNames = [dataModel["name"] for dataModel in indexManager.orderSetSearch(query)];
+        self.assertEqual(["Chest Pain Admission","ED Abdominal Pain"], sampleNames);
+
+    def test_stateCache(self):
+        # Simulation steps answered from the in-memory state cache should match the database queries,
+        #   including after orders, discontinues and (time triggered) state transitions recorded through the cached manager
+        userId = -1;
+        patientId = -1;
+
+        cacheManager = SimManager();
+        cacheManager.stateCache = SimStateCache();
+
+        # (relativeTime, orderItemIds, discontinuePatientOrderIds) for each step. See setUp for test data
+        steps = \
+            [   (0, None, None),
+                (120, [], [-1]),    # Discontinue vital signs before results come back
+                (2000, [-4,-5], None),
+                (2100, [-11,-6], None),
+                (2100, [-15], None),
+                (2400, [], None),
+                (22000, [-12,-10], None),
+                (22100, [-15,-7], None),
+                (22100, [], None),  # Cancel order at time of entry
+                (32200, [-13,-11,-12], None),
+                (32500, None, None),
+            ];
+        for (relativeTime, orderItemIds, discontinuePatientOrderIds) in steps:
+            if relativeTime == 22100 and orderItemIds == []:
+                discontinuePatientOrderIds = [cacheManager.loadPatientOrders(patientId, relativeTime)[-1]["sim_patient_order_id"]];
+            if orderItemIds is not None:
+                cacheManager.signOrders(userId, patientId, relativeTime, orderItemIds, discontinuePatientOrderIds);
+            # Query cached manager first, so any time triggered state transitions are recorded through the cache
+            for checkTime in (relativeTime, relativeTime+300):
+                self.assertEqualCachedSteps(cacheManager, patientId, checkTime);
+
+        # Scripted case on a copied patient
+        self.testPatientId = cacheManager.copyPatientTemplate({"name":"Cached Copy"}, patientId);
+        stepTimes = runScriptedCase(cacheManager, self.testPatientId, userId, [-15,-4,-11,-10,-13], 12, timeStep=1000);
+        self.assertEqual(12, len(stepTimes));
+        self.assertEqualCachedSteps(cacheManager, self.testPatientId, 12000);
+
+    def test_stateCacheExternalChanges(self):
+        # Orders and state transitions recorded by another process (without the cache)
+        #   should be picked up by the cached manager, as with multiple web server workers
+        userId = -1;
+        patientId = -1;
+
+        cacheManager = SimManager();
+        cacheManager.stateCache = SimStateCache();
+        self.assertEqualCachedSteps(cacheManager, patientId, 2000);
+
+        self.manager.signOrders(userId, patientId, 2000, [-4,-5]);  # New orders
+        self.assertEqualCachedSteps(cacheManager, patientId, 2100);
+
+        patientOrders = self.manager.loadPatientOrders(patientId, 2100);
+        self.manager.signOrders(userId, patientId, 2100, [], [patientOrders[0]["sim_patient_order_id"]]);  # Discontinue
+        self.assertEqualCachedSteps(cacheManager, patientId, 2200);
+
+        self.manager.loadPatientInfo([patientId], 32500);   # Time triggered state transition recorded
+        self.assertEqualCachedSteps(cacheManager, patientId, 32500);
+
+    def assertEqualCachedSteps(self, cacheManager, patientId, relativeTime):
+        self.assertEqual(cacheManager.loadPatientInfo([patientId], relativeTime), self.manager.loadPatientInfo([patientId], relativeTime));
+        for loadActive in (True, None):
+            self.assertEqual(cacheManager.loadPatientOrders(patientId, relativeTime, loadActive), self.manager.loadPatientOrders(patientId, relativeTime, loadActive));
+        self.assertEqual(cacheManager.loadResults(patientId, relativeTime), self.manager.loadResults(patientId, relativeTime));
+        self.assertEqual(cacheManager.recentItemIds(patientId, relativeTime), self.manager.recentItemIds(patientId, relativeTime));
+
     def test_loadPatientLastEventTime(self):
         # Query for last time have a record of a patient order start or cancellation
         #   as natural point to resume a simulated case
@@ -739,6 +988,115 @@ class TestSimManager(DBTestCase):
         self.assertEqual(verifyValue, sampleValue);
 
 
+class TestSimManagerSqlite(MedInfoTestCase):
+    """Bulk patient template copies against a (temporary file) SQLite database,
+    where new IDs come from last_insert_rowid instead of sequences.
+    """
+    def setUp(self):
+        """Prepare state for test cases"""
+        MedInfoTestCase.setUp(self);
+
+        # Switch database connector settings, but retain links to original
+        self.origDBSettings = (Env.DATABASE_CONNECTOR_NAME, Env.SQL_PLACEHOLDER, DBUtil.SQL_PLACEHOLDER);
+        Env.DATABASE_CONNECTOR_NAME = "sqlite3";
+        Env.SQL_PLACEHOLDER = DBUtil.SQL_PLACEHOLDER = "?";
+
+        self.tempDir = tempfile.mkdtemp();
+        connParams = {"DATAPATH": self.tempDir, "DSN": "TestSimManager.sqlite", "HOST": "localhost", "UID": None, "PWD": None};
+        self.manager = SimManager();
+        self.manager.connFactory = DBUtil.ConnectionFactory(connParams);
+
+        self.conn = self.manager.connFactory.connection();
+        DBUtil.execute("create table sim_patient (sim_patient_id integer primary key, name text not null, age_years integer not null, gender text not null)", conn=self.conn);
+        DBUtil.execute("create table sim_patient_state (sim_patient_state_id integer primary key, sim_patient_id integer not null, sim_state_id integer not null, relative_time_start integer not null, relative_time_end integer)", conn=self.conn);
+        DBUtil.execute("create table sim_patient_order (sim_patient_order_id integer primary key, sim_user_id integer not null, sim_patient_id integer not null, sim_state_id integer, clinical_item_id integer not null, relative_time_start integer not null, relative_time_end integer)", conn=self.conn);
+
+        dataTextStr = \
+"""sim_patient_id;name;age_years;gender
+-1;Template 1;60;Female
+-2;Template 2;40;Male
+"""
+        DBUtil.insertFile( StringIO(dataTextStr), "sim_patient", delim=";", connFactory=self.manager.connFactory);
+        dataTextStr = \
+"""sim_patient_state_id;sim_patient_id;sim_state_id;relative_time_start;relative_time_end
+-1;-1;-1;-7200;0
+-2;-1;-2;0;1800
+-3;-1;-3;1800;None
+-11;-2;-1;-100;-50
+-12;-2;-2;-50;0
+-13;-2;-3;0;500
+-14;-2;-1;500;None
+"""
+        DBUtil.insertFile( StringIO(dataTextStr), "sim_patient_state", delim=";", connFactory=self.manager.connFactory);
+        dataTextStr = \
+"""sim_patient_order_id;sim_user_id;sim_patient_id;sim_state_id;clinical_item_id;relative_time_start;relative_time_end
+-1;-1;-1;-1;-1;-7200;None
+-2;-1;-1;-2;-2;0;None
+-3;-1;-1;-3;-3;1800;None
+-11;-1;-2;-2;-9;-10;None
+-12;-1;-2;-2;-10;-10;0
+-13;-1;-2;-3;-11;0;None
+-14;-1;-2;-1;-12;100;None
+"""
+        DBUtil.insertFile( StringIO(dataTextStr), "sim_patient_order", delim=";", connFactory=self.manager.connFactory);
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        self.conn.close();
+        shutil.rmtree(self.tempDir);
+        (Env.DATABASE_CONNECTOR_NAME, Env.SQL_PLACEHOLDER, DBUtil.SQL_PLACEHOLDER) = self.origDBSettings;
+        MedInfoTestCase.tearDown(self);
+
+    def test_copyPatientTemplates(self):
+        templatePatientIds = [-2,-1,-2];
+        patientDataList = [{"name":"Bulk Copy %d" % i} for i in xrange(len(templatePatientIds))];
+        patientDataList[2]["gender"] = "Female";
+        (patientIds, verifyPatientIds) = assertCopyPatientTemplates(self, self.manager, patientDataList, templatePatientIds, conn=self.conn);
+        self.assertEqual(len(patientIds + verifyPatientIds), len(set(patientIds + verifyPatientIds)));
+
+        self.assertEqual([[-1,-100,-50],[-2,-50,0],[-3,0,None]], DBUtil.execute("select sim_state_id, relative_time_start, relative_time_end from sim_patient_state where sim_patient_id = ? order by relative_time_start", (patientIds[0],), conn=self.conn));
+        self.assertEqual([[-1,-7200,0],[-2,0,None]], DBUtil.execute("select sim_state_id, relative_time_start, relative_time_end from sim_patient_state where sim_patient_id = ? order by relative_time_start", (patientIds[1],), conn=self.conn));
+
+def assertCopyPatientTemplates(testCase, manager, patientDataList, templatePatientIds, conn=None):
+    """Bulk copy of multiple patients from multiple templates should match copying each one at a time,
+    and a failed bulk copy should leave nothing behind, even on an external connection.
+    Return the bulk copied and the respective one at a time copied patient IDs.
+    """
+    patientIds = manager.copyPatientTemplates(patientDataList, templatePatientIds);
+    testCase.assertEqual(len(templatePatientIds), len(set(patientIds)));
+
+    verifyPatientIds = list();
+    for patientId, patientData, templatePatientId in zip(patientIds, patientDataList, templatePatientIds):
+        verifyPatientId = manager.copyPatientTemplate(patientData, templatePatientId);
+        verifyPatientIds.append(verifyPatientId);
+
+        patientCols = ["name","age_years","gender"];
+        samplePatient = DBUtil.loadRecordModelById("sim_patient", patientId, conn=conn);
+        verifyPatient = DBUtil.loadRecordModelById("sim_patient", verifyPatientId, conn=conn);
+        testCase.assertEqualDict(verifyPatient, samplePatient, patientCols);
+
+        for tableName, dataCols in \
+            (   ("sim_patient_state", ["sim_state_id","relative_time_start","relative_time_end"]),
+                ("sim_patient_order", ["sim_user_id","sim_state_id","clinical_item_id","relative_time_start","relative_time_end"]),
+            ):
+            (verifyData, sampleData) = \
+                [   modelListFromTable(DBUtil.execute("select %s from %s where sim_patient_id = %s order by %s_id" % (str.join(",",dataCols), tableName, DBUtil.SQL_PLACEHOLDER, tableName), (queryPatientId,), includeColumnNames=True, conn=conn))
+                    for queryPatientId in (verifyPatientId, patientId)
+                ];
+            testCase.assertTrue(len(verifyData) > 0);
+            testCase.assertEqualDictList(verifyData, sampleData, dataCols);
+
+    # Error part way through (invalid column for the second patient) rolls back the earlier patients too
+    extConn = manager.connFactory.connection();
+    try:
+        countQuery = "select count(*) from sim_patient";
+        patientCount = DBUtil.execute(countQuery, conn=extConn)[0][0];
+        testCase.assertRaises(Exception, manager.copyPatientTemplates, [{"name":"Failed Copy"}, {"no_such_column": 1}], templatePatientIds[:2], conn=extConn);
+        testCase.assertEqual(patientCount, DBUtil.execute(countQuery, conn=extConn)[0][0]);
+    finally:
+        extConn.close();
+
+    return (patientIds, verifyPatientIds);
 
 def suite():
     """Returns the suite of tests to run for this test class / module.
@@ -752,6 +1110,7 @@ def suite():
     #suite.addTest(TestSimManager('test_stateTransition'));
     #suite.addTest(TestSimManager('test_discontinueOrders'));
     suite.addTest(unittest.makeSuite(TestSimManager));
+    suite.addTest(unittest.makeSuite(TestSimManagerSqlite));
 
     return suite;
 
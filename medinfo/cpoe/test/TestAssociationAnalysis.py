@@ -4,6 +4,7 @@
 import sys, os
 from cStringIO import StringIO
 from datetime import datetime;
+from random import Random;
 import unittest
 
 from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
@@ -591,6 +592,99 @@ class TestAssociationAnalysis(DBTestCase):
         associationStats = DBUtil.execute(encounterAssociationQuery);
         self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
 
+    def test_updateNewItemAssociationsBuffer(self):
+        # Pair enumeration restricted to new items should yield exactly the same increments
+        #   as visiting every pair in the patient timelines, for random timelines with ties, repeats,
+        #   multiple encounters, linked items, and a random mix of previously analyzed items.
+        linkedItemIdsByBaseId = {-6: set([-4,-2]), -4: set([-2])};
+        random = Random(123456789);
+        for iPatient in xrange(50):
+            nItems = random.randint(1,12);
+            patientItemList = list();
+            for iItem in xrange(nItems):
+                analyzeDate = None;
+                if random.random() < 0.6:
+                    analyzeDate = datetime(2001,1,1);
+                itemDate = datetime(2000,1,random.randint(1,4),random.choice([0,0,12]));
+                patientItemList.append( RowItemModel( [-iItem-1, iPatient, random.randint(1,2), -random.randint(1,7), itemDate, analyzeDate], ["patient_item_id","patient_id","encounter_id","clinical_item_id","item_date","analyze_date"] ) );
+            patientItemList.sort(key=lambda patientItem: (patientItem["item_date"], patientItem["clinical_item_id"]));
+
+            analysisOptions = AnalysisOptions();
+            expectedBuffer = self.analyzer.makeUpdateBuffer();
+            self.analyzer.updateItemAssociationsBuffer(patientItemList, expectedBuffer, analysisOptions, linkedItemIdsByBaseId);
+            updateBuffer = self.analyzer.makeUpdateBuffer();
+            self.analyzer.updateNewItemAssociationsBuffer(patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId);
+
+            self.assertEqual(expectedBuffer["incrementDataByItemIdPair"], updateBuffer["incrementDataByItemIdPair"]);
+            self.assertEqual(expectedBuffer["analyzedPatientItemIds"], updateBuffer["analyzedPatientItemIds"]);
+            isNewPatient = all([patientItem["analyze_date"] is None for patientItem in patientItemList]);
+            self.assertEqual(int(isNewPatient), updateBuffer["newPatientCount"]);
+
+    def test_analyzePatientItems_incremental(self):
+        # Incremental refresh after new items arrive should produce the same model
+        #   as analyzing all of the data, with item and patient counts maintained by deltas.
+        associationQuery = \
+            """
+            select
+                clinical_item_id, subsequent_item_id,
+                count_0, count_3600, count_86400, count_any, time_diff_sum, time_diff_sum_squares,
+                patient_count_0, patient_count_86400, patient_count_any, patient_time_diff_sum,
+                encounter_count_0, encounter_count_86400, encounter_count_any, encounter_time_diff_sum
+            from
+                clinical_item_association
+            where
+                clinical_item_id < 0
+                and count_any > 0   -- Baseline zero records depend on which item pairs were committed together
+            order by
+                clinical_item_id, subsequent_item_id
+            """;
+        itemCountQuery = "select clinical_item_id, item_count, patient_count, encounter_count from clinical_item where clinical_item_id < 0 order by clinical_item_id";
+        patientIds = [-11111, -22222, -33333, -44444];
+        self.analyzer.dataManager.maxClinicalItemId = 0;
+
+        # Initial model on part of the data, with item and patient count caches current
+        analysisOptions = AnalysisOptions();
+        analysisOptions.patientIds = [-11111, -22222];
+        self.analyzer.analyzePatientItems( analysisOptions );
+        self.analyzer.dataManager.updateClinicalItemCounts();
+        self.analyzer.dataManager.setCacheData("analyzedPatientCount", "2.0");
+
+        # New items for an existing patient (including some dated before already analyzed ones) and for a new patient
+        headers = ["patient_item_id","encounter_id","patient_id","clinical_item_id","item_date"];
+        dataModels = \
+            [
+                RowItemModel( [-6,  -112,   -11111, -10, datetime(2000, 2, 1, 0)], headers ),
+                RowItemModel( [-7,  -112,   -11111, -9,  datetime(2000, 2, 1, 1)], headers ),
+                RowItemModel( [-8,  -111,   -11111, -9,  datetime(2000, 1, 1, 1)], headers ),
+                RowItemModel( [-20, -444,   -44444, -9,  datetime(2000, 3, 1, 0)], headers ),
+                RowItemModel( [-21, -444,   -44444, -10, datetime(2000, 3, 2, 0)], headers ),
+            ];
+        for dataModel in dataModels:
+            DBUtil.findOrInsertItem("patient_item", dataModel);
+
+        analysisOptions = AnalysisOptions();
+        analysisOptions.patientIds = patientIds;
+        analysisOptions.incremental = True;
+        self.analyzer.analyzePatientItems( analysisOptions );
+        self.assertEqual([], self.analyzer.queryNewPatientIds(analysisOptions));
+
+        incrementalAssociationStats = DBUtil.execute(associationQuery);
+        incrementalItemCounts = DBUtil.execute(itemCountQuery);
+        self.assertTrue(len(incrementalAssociationStats) > 0);
+        self.assertEqual("4.0", self.analyzer.dataManager.getCacheData("analyzedPatientCount"));
+        self.assertTrue(self.analyzer.dataManager.getCacheData("clinicalItemCountsUpdated") is not None);
+
+        # Compare against a model rebuilt from scratch on all of the data
+        DBUtil.execute("delete from clinical_item_association where clinical_item_id < 0");
+        DBUtil.execute("update patient_item set analyze_date = null where patient_item_id < 0");
+        analysisOptions = AnalysisOptions();
+        analysisOptions.patientIds = patientIds;
+        self.analyzer.analyzePatientItems( analysisOptions );
+        self.analyzer.dataManager.updateClinicalItemCounts();
+
+        self.assertEqualTable( DBUtil.execute(associationQuery), incrementalAssociationStats, precision=3 );
+        self.assertEqualTable( DBUtil.execute(itemCountQuery), incrementalItemCounts );
+
 def suite():
     """Returns the suite of tests to run for this test class / module.
     Use unittest.makeSuite methods which simply extracts all of the
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+import unittest
+
+from Const import RUNNER_VERBOSITY;
+from Util import log;
+
+from medinfo.common.test.Util import MedInfoTestCase;
+
+from medinfo.cpoe import DecayingCountBuffer as DecayingCountBufferModule;
+from medinfo.cpoe.DecayingCountBuffer import DecayingCountBuffer;
+
+class TestDecayingCountBuffer(MedInfoTestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        MedInfoTestCase.setUp(self);
+        self.origMaxDecayScale = DecayingCountBufferModule.MAX_DECAY_SCALE;
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        DecayingCountBufferModule.MAX_DECAY_SCALE = self.origMaxDecayScale;
+        MedInfoTestCase.tearDown(self);
+
+    def makeDeltaBuffer(self, iDelta):
+        """Simulated AssociationAnalysis updateBuffer for one delta"""
+        incrementDataByItemIdPair = \
+            {   str((-1,-2)): {"count_0": 1, "count_any": 2, "time_diff_sum": 100},
+            };
+        if iDelta % 2 == 0:
+            incrementDataByItemIdPair[str((-2,-3))] = {"patient_count_any": 1, "patient_time_diff_sum": 10};
+        return {"nAssociations": len(incrementDataByItemIdPair), "incrementDataByItemIdPair": incrementDataByItemIdPair, "analyzedPatientItemIds": set([-iDelta])};
+
+    def expectedValues(self, nDeltas, decay, decayAllFields):
+        """Straightforward decay of every value on every step, as in AssociationAnalysis.bufferDecay"""
+        expected = dict();
+        for iDelta in xrange(nDeltas):
+            for itemIdPair, incrementData in expected.iteritems():
+                for field in incrementData:
+                    if decayAllFields or "count_" in field:
+                        incrementData[field] *= decay;
+            for itemIdPair, incrementData in self.makeDeltaBuffer(iDelta)["incrementDataByItemIdPair"].iteritems():
+                if itemIdPair not in expected:
+                    expected[itemIdPair] = dict();
+                for field, increment in incrementData.iteritems():
+                    expected[itemIdPair][field] = expected[itemIdPair].get(field,0) + increment;
+        return expected;
+
+    def test_decayedCounts(self):
+        # Small max scale to force several rescales along the way
+        DecayingCountBufferModule.MAX_DECAY_SCALE = 10.0;
+        for decayAllFields in (True, False):
+            countBuffer = DecayingCountBuffer(0.5, decayAllFields);
+            for iDelta in xrange(25):
+                countBuffer.decayStep();
+                countBuffer.addUpdateBuffer(self.makeDeltaBuffer(iDelta));
+
+            updateBuffer = countBuffer.materializeUpdateBuffer();
+            expected = self.expectedValues(25, 0.5, decayAllFields);
+            self.assertEqual(2, updateBuffer["nAssociations"]);
+            self.assertEqual(set(range(-24,1)), updateBuffer["analyzedPatientItemIds"]);
+            self.assertEqual(set(expected.keys()), set(updateBuffer["incrementDataByItemIdPair"].keys()));
+            for itemIdPair, expectedData in expected.iteritems():
+                self.assertEqualDict(expectedData, updateBuffer["incrementDataByItemIdPair"][itemIdPair]);
+
+            countBuffer.clear();
+            self.assertEqual(0, countBuffer.nAssociations());
+            self.assertEqual({}, countBuffer.materializeUpdateBuffer()["incrementDataByItemIdPair"]);
+
+    def test_zeroDecay(self):
+        # Window length of 1, so each decay step discards all prior (decayed) counts
+        for decayAllFields in (True, False):
+            countBuffer = DecayingCountBuffer(0.0, decayAllFields);
+            for iDelta in xrange(5):
+                countBuffer.decayStep();
+                countBuffer.addUpdateBuffer(self.makeDeltaBuffer(iDelta));
+
+            updateBuffer = countBuffer.materializeUpdateBuffer();
+            expected = self.expectedValues(5, 0.0, decayAllFields);
+            for itemIdPair, expectedData in expected.iteritems():
+                self.assertEqualDict(expectedData, updateBuffer["incrementDataByItemIdPair"][itemIdPair]);
+
+def suite():
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestDecayingCountBuffer));
+
+    return suite;
+
+if __name__=="__main__":
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
@@ -371,6 +371,57 @@ class TestDecayingWindows(DBTestCase):
         self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
 
 
+    def test_decayingWindowsCommitBatches(self):
+        # Committing the accrued counts after every delta should yield the same results as committing them all at the end
+        associationQuery = \
+            """
+            select
+                clinical_item_id, subsequent_item_id,
+                patient_count_0, patient_count_3600, patient_count_86400, patient_count_604800,
+                patient_count_2592000, patient_count_7776000, patient_count_31536000,
+                patient_count_any
+            from
+                clinical_item_association
+            where
+                clinical_item_id < 0
+            order by
+                clinical_item_id, subsequent_item_id
+            """;
+
+        decayAnalysisOptions = DecayAnalysisOptions()
+        decayAnalysisOptions.startD = datetime(2000,1,9)
+        decayAnalysisOptions.endD = datetime(2000,2,11)
+        decayAnalysisOptions.windowLength = 10
+        decayAnalysisOptions.decay = 0.9
+        decayAnalysisOptions.delta = timedelta(weeks=4)
+        decayAnalysisOptions.patientIds = [-22222, -33333]
+        decayAnalysisOptions.associationsPerCommit = 1
+
+        self.decayAnalyzer.decayAnalyzePatientItems (decayAnalysisOptions)
+
+        expectedAssociationStats = \
+            [
+                [-11,-11,   1.9, 1.9, 1.9, 1.9, 1.9, 0, 0, 1.9],
+                [-11, -9,   0.0, 0.0, 0.9, 0.9, 0.9, 0, 0, 0.9],
+                [-11, -8,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [-11, -6,   0.9, 0.9, 0.9, 0.9, 0.9, 0, 0, 0.9],
+                [ -9,-11,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -9, -9,   0.9, 0.9, 0.9, 0.9, 0.9, 0, 0, 0.9],
+                [ -9, -8,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -9, -6,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -8,-11,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -8, -9,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -8, -8,   0.9, 0.9, 0.9, 0.9, 0.9, 0, 0, 0.9],
+                [ -8, -6,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -6,-11,   0.9, 0.9, 0.9, 1.9, 1.9, 0, 0, 1.9],
+                [ -6, -9,   0.0, 0.0, 0.9, 0.9, 0.9, 0, 0, 0.9],
+                [ -6, -8,   0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0.0],
+                [ -6, -6,   1.9, 1.9, 1.9, 1.9, 1.9, 0, 0, 1.9],
+            ];
+
+        associationStats = DBUtil.execute(associationQuery)
+        self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
+
     def test_resetModel(self):
         associationQuery = \
             """
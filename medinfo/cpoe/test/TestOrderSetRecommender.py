@@ -335,6 +335,37 @@ class TestOrderSetRecommender(DBTestCase):
         recommendedData = self.recommender( query );
         self.assertEqualRecommendedData( expectedData, recommendedData, query );
 
+    def test_recommendBatch(self):
+        # Score several patients' query sets at once, consistent with separate queries
+        # and with the direct order set intersection estimates
+        queries = list();
+        for queryItemIds, excludeCategoryIds in [ ([],[]), ([-2,-5,-100],[]), ([-100],[]), ([-6],[-3]), ([-10,-12],[-1,-4]) ]:
+            query = RecommenderQuery();
+            query.queryItemIds = set(queryItemIds);
+            query.excludeCategoryIds = set(excludeCategoryIds);
+            query.sortField = "lift";
+            query.maxRecommendedId = 0; # Artificial constraint to focus only on test data
+            queries.append(query);
+
+        recommendedDataList = self.recommender.recommendBatch(queries);
+        self.assertEqual(len(queries), len(recommendedDataList));
+        for query, recommendedData in zip(queries, recommendedDataList):
+            separateData = self.recommender(query);
+            self.assertEqual([itemModel["clinical_item_id"] for itemModel in separateData], [itemModel["clinical_item_id"] for itemModel in recommendedData]);
+
+            weightByOrderSetId = self.recommender.estimateOrderSetWeights(query.queryItemIds, self.recommender.itemIdsByOrderSetId, self.recommender.orderSetIdsByItemId);
+            self.assertEqualDict(weightByOrderSetId, recommendedData[0]["weightByOrderSetId"]);
+            for itemModel in recommendedData:
+                itemId = itemModel["clinical_item_id"];
+                self.assertTrue(itemId not in query.queryItemIds);
+                self.assertTrue(self.recommender.categoryIdByItemId[itemId] not in query.excludeCategoryIds);
+                expectedWeight = 0.0;
+                for orderSetId, orderSetWeight in weightByOrderSetId.iteritems():
+                    expectedWeight += orderSetWeight * self.recommender.itemOrderSetWeight(itemId, orderSetId, self.recommender.itemIdsByOrderSetId);
+                self.assertAlmostEquals(expectedWeight, itemModel["P(item|query)"], 5);
+
+        self.assertEqual([], self.recommender.recommendBatch([]));
+
     def assertEqualRecommendedData(self, expectedData, recommendedData, query):
         """Run assertEqualGeneral on the key components of the contents of the recommendation data.
         Don't necessarily care about the specific numbers that come out of the recommendations,
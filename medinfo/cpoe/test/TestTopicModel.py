@@ -16,7 +16,9 @@ from medinfo.db import DBUtil
 from medinfo.db.Model import SQLQuery, RowItemModel;
 from medinfo.db.ResultsFormatter import TabDictReader;
 
-from medinfo.cpoe.TopicModel import TopicModel;
+from medinfo.cpoe.TopicModel import TopicModel, CORPUS_FILE_EXT;
+from medinfo.cpoe.TopicModelRecommender import TopicModelRecommender;
+from medinfo.cpoe.ItemRecommender import RecommenderQuery;
 
 TEST_FILE_PREFIX = "TestTopicModel.model";
 ITEMS_PER_TOPIC = 5;
@@ -120,6 +122,103 @@ class TestTopicModel(DBTestCase):
                 {1:3, 2:3, 3:3, 4:4, 5:3, None:5, 9:3, 10:3, 11:2, 12:4, 13:4, 14:1, 15:2, 16:4, 8:3}
         self.assertExpectedTopItems( expectedDocCountByWordId, model, topTopicFile );
 
+    def test_multicoreTopicModel(self):
+        # Multiple worker processes streaming from a serialized corpus file, rather than in memory document buffers
+        expectedDocCountByWordId = \
+                {1:3, 2:3, 3:3, 4:4, 5:3, None:5, 9:3, 10:3, 11:2, 12:4, 13:4, 14:1, 15:2, 16:4, 8:3}
+
+        sys.stdin = StringIO(self.inputBOWFileStr);
+        subargv = ["TopicModel", "-n", "3", "-i",str(ITEMS_PER_TOPIC), "-w", "2", "-", TEST_FILE_PREFIX];
+        self.instance.main(subargv);
+        self.assertEqualDict(expectedDocCountByWordId, self.instance.docCountByWordId);
+
+        model = self.instance.loadModel(TEST_FILE_PREFIX);
+        topTopicFile = open(self.instance.topTopicFilename(TEST_FILE_PREFIX));
+        self.assertExpectedTopItems( expectedDocCountByWordId, model, topTopicFile );
+
+        # Vocabulary only stores descriptions for items in the corpus, but still covers the full item ID range
+        self.assertEqual("6", model.id2word[6]);   # Default word for items not in the corpus
+        self.assertEqual(set(), set(model.id2word.keys()) - set(expectedDocCountByWordId.keys()) - set([len(model.id2word)-1]));
+
+        # Recommender works the same off of the model
+        recommender = TopicModelRecommender(TEST_FILE_PREFIX);
+        query = RecommenderQuery();
+        query.queryItemIds = {1: 1, 4: 2, 12: 1};
+        query.itemsPerCluster = ITEMS_PER_TOPIC;
+        recommendedData = recommender(query);
+        self.assertTrue(len(recommendedData) > 0);
+        self.assertEqual(set(), set([itemModel["clinical_item_id"] for itemModel in recommendedData]) & set(query.queryItemIds.keys()));
+
+        # Rebuild directly from the serialized corpus file, with HDP non-parametric model
+        corpusFilename = TEST_FILE_PREFIX + CORPUS_FILE_EXT;
+        self.assertTrue(os.path.isfile(corpusFilename));
+        subargv = ["TopicModel", "-n", "0", "-i",str(ITEMS_PER_TOPIC), "-w", "2", corpusFilename, "HDP"+TEST_FILE_PREFIX];
+        self.instance.main(subargv);
+        self.assertEqualDict(expectedDocCountByWordId, self.instance.docCountByWordId);
+
+        model = self.instance.loadModel("HDP"+TEST_FILE_PREFIX);
+        topTopicFile = open(self.instance.topTopicFilename("HDP"+TEST_FILE_PREFIX));
+        self.assertExpectedTopItems( expectedDocCountByWordId, model, topTopicFile );
+
+    def test_topicModelRecommender(self):
+        # Vectorized recommender scoring should match straightforward weighted sums over the topic items
+        sys.stdin = StringIO(self.inputBOWFileStr);
+        self.instance.main(["TopicModel", "-n", "3", "-i",str(ITEMS_PER_TOPIC), "-", TEST_FILE_PREFIX]);
+        recommender = TopicModelRecommender(TEST_FILE_PREFIX);
+        (model, docCountByWordId) = (recommender.model, recommender.docCountByWordId);
+
+        query = RecommenderQuery();
+        query.queryItemIds = {1: 1, 4: 2, 12: 1};
+        query.itemsPerCluster = ITEMS_PER_TOPIC;
+        query.excludeCategoryIds = set([-4]);
+        query.sortField = "tfidf";
+        recommendedData = recommender(query);
+
+        self.assertExpectedRecommendations(model, docCountByWordId, query, recommendedData, [14, 15, 16]); # Items 14-16 in excluded category
+
+        # Query limit does not truncate the results, callers take the top items after their own filtering
+        query.limit = 3;
+        limitedData = recommender(query);
+        self.assertEqual(len(recommendedData), len(limitedData));
+        self.assertExpectedRecommendations(model, docCountByWordId, query, limitedData, [14, 15, 16]);
+
+        # Batch with different itemsPerCluster and exclusions scores each query by its own parameters
+        otherQuery = RecommenderQuery();
+        otherQuery.queryItemIds = {1: 1, 4: 2, 12: 1};
+        otherQuery.itemsPerCluster = 2;
+        otherQuery.excludeItemIds = set([2]);
+        otherQuery.sortField = "tf";
+        batchData = recommender.recommendBatch([query, otherQuery, query]);
+        self.assertEqual(3, len(batchData));
+        self.assertExpectedRecommendations(model, docCountByWordId, query, batchData[0], [14, 15, 16]);
+        self.assertExpectedRecommendations(model, docCountByWordId, otherQuery, batchData[1], [2]);
+        self.assertExpectedRecommendations(model, docCountByWordId, query, batchData[2], [14, 15, 16]);
+        self.assertEqual([], recommender.recommendBatch([]));
+
+    def assertExpectedRecommendations(self, model, docCountByWordId, query, recommendedData, excludedItemIds):
+        """Compare recommender results against straightforward weighted sums over the topic items"""
+        weightByItemIdByTopicId = self.instance.generateWeightByItemIdByTopicId(model, query.itemsPerCluster);
+        weightByTopicId = recommendedData[0]["weightByTopicId"];    # Model topic inference is randomized, so use the same topic weights
+        expectedScoreByItemId = dict();
+        for itemId in docCountByWordId:
+            if itemId is not None and itemId not in query.queryItemIds and itemId not in excludedItemIds:
+                expectedScoreByItemId[itemId] = 0.0;
+        for (topicId, topicWeight) in weightByTopicId.iteritems():
+            if topicWeight > query.minClusterWeight:
+                for itemId in expectedScoreByItemId:
+                    expectedScoreByItemId[itemId] += topicWeight * weightByItemIdByTopicId[topicId].get(itemId, 0.0);
+        if query.sortField == "tfidf":
+            for itemId in expectedScoreByItemId:
+                expectedScoreByItemId[itemId] *= float(docCountByWordId[None]) / docCountByWordId[itemId];
+
+        self.assertEqual(set(expectedScoreByItemId.keys()), set([itemModel["clinical_item_id"] for itemModel in recommendedData]));
+        lastScore = None;
+        for itemModel in recommendedData:
+            self.assertAlmostEqual(expectedScoreByItemId[itemModel["clinical_item_id"]], itemModel["score"], places=5);
+            self.assertEqual(itemModel[query.sortField], itemModel["score"]);
+            self.assertTrue(lastScore is None or lastScore >= itemModel["score"]);   # Sorted by descending score
+            lastScore = itemModel["score"];
+
     def assertExpectedTopItems(self, expectedDocCountByWordId, model, topTopicFile):
         # With randomized optimization algorithm, cannot depend on stable
         # Test results with each run.  Instead make sure internally consistent,
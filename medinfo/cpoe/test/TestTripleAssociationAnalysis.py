@@ -4,6 +4,7 @@
 import sys, os
 from cStringIO import StringIO
 from datetime import datetime;
+from random import Random;
 import unittest
 
 from Const import RUNNER_VERBOSITY;
@@ -153,6 +154,84 @@ class TestTripleAssociationAnalysis(DBTestCase):
         itemLinks = DBUtil.execute(itemLinkQuery);
         self.assertEqualTable( expectedItemLinks, itemLinks );
 
+    def test_analyzePatientItemsBatch(self):
+        # Several virtual item definitions in one pass should record the same as separate passes for each
+        associationQuery = \
+            """
+            select
+                clinical_item_id, subsequent_item_id,
+                count_0, count_3600, count_86400, count_604800,
+                count_2592000, count_7776000, count_31536000,
+                count_any,
+                time_diff_sum, time_diff_sum_squares,
+                patient_count_any, patient_time_diff_sum, encounter_count_any, encounter_time_diff_sum
+            from
+                clinical_item_association
+            where
+                clinical_item_id < 0 and
+                count_any > 0
+            order by
+                clinical_item_id, subsequent_item_id
+            """;
+        DBUtil.findOrInsertItem("clinical_item", RowItemModel( [-17, -4, "Discharge then CXR",1], ["clinical_item_id","clinical_item_category_id","name","analysis_status"] ) );
+
+        self.analyzer.analyzePatientItems( [-11111], (-15,-14), -16 );
+        self.analyzer.analyzePatientItems( [-11111], (-15,-7), -17 );
+        expectedAssociationStats = DBUtil.execute(associationQuery);
+        self.assertTrue(len(expectedAssociationStats) > 0);
+
+        DBUtil.execute("delete from clinical_item_association where clinical_item_id < 0");
+        self.analyzer.main(["TripleAssociationAnalysis.py","-s","-15,-14","-v","-16","-s","-15,-7","-v","-17","0,-11111"]);
+        associationStats = DBUtil.execute(associationQuery);
+        self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
+
+    def test_updateItemAssociationsBuffer(self):
+        # Triple sequences found by the sorted date indexes should yield exactly the same
+        #   increments as checking every item pair, for random timelines with ties, repeats, and multiple encounters
+        linkedItemIdsByBaseId = {-16: set([-1,-2]), -17: set([-1,-3])};
+        sequenceDefinitions = [((-1,-2), -16), ((-1,-3), -17)];
+        random = Random(123456789);
+        for iPatient in xrange(50):
+            patientItemList = list();
+            for iItem in xrange(random.randint(1,15)):
+                itemDate = datetime(2000,1,random.randint(1,5),random.choice([0,0,12]));
+                patientItemList.append( RowItemModel( [-iItem-1, iPatient, random.randint(1,2), -random.randint(1,5), itemDate], ["patient_item_id","patient_id","encounter_id","clinical_item_id","item_date"] ) );
+            patientItemList.sort(key=lambda patientItem: (patientItem["item_date"], patientItem["clinical_item_id"]));
+
+            expectedBuffer = dict();
+            for (itemIdSequence, virtualItemId) in sequenceDefinitions:
+                self.allPairsTripleBuffer(itemIdSequence, virtualItemId, patientItemList, expectedBuffer, linkedItemIdsByBaseId);
+            updateBuffer = dict();
+            self.analyzer.updateItemAssociationsBufferBatch(sequenceDefinitions, patientItemList, updateBuffer, linkedItemIdsByBaseId);
+            self.assertEqual(expectedBuffer.get("incrementDataByItemIdPair"), updateBuffer.get("incrementDataByItemIdPair"));
+
+    def allPairsTripleBuffer(self, itemIdSequence, virtualItemId, patientItemList, updateBuffer, linkedItemIdsByBaseId):
+        """Reference implementation checking every item pair of the patient timeline for triple sequences"""
+        analyzer = self.analyzer;
+        midSequenceItemDates = set([patientItem["item_date"] for patientItem in patientItemList if patientItem["clinical_item_id"] == itemIdSequence[0]]);
+        encounterIdPairsByItemIdPair = dict();
+        endSequenceItemsByPatientItemId = dict();
+        for patientItem1 in patientItemList:
+            for patientItem2 in patientItemList:
+                itemIdPair = (patientItem1["clinical_item_id"], virtualItemId);
+                encounterIdPair = (patientItem1["encounter_id"], patientItem2["encounter_id"]);
+                isTripleSequence = patientItem2["clinical_item_id"] == itemIdSequence[-1];
+                isTripleSequence = isTripleSequence and any([patientItem1["item_date"] <= midDate <= patientItem2["item_date"] for midDate in midSequenceItemDates]);
+                if analyzer.acceptableClinicalItemPair(patientItem1, patientItem2, linkedItemIdsByBaseId) and isTripleSequence:
+                    isNewPair = itemIdPair not in encounterIdPairsByItemIdPair;
+                    isNewPairWithinEncounter = (encounterIdPair[0]==encounterIdPair[-1]) and (isNewPair or encounterIdPair not in encounterIdPairsByItemIdPair[itemIdPair]);
+                    analyzer.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, True, isNewPair, isNewPairWithinEncounter, updateBuffer, itemIdPair=itemIdPair );
+                    endSequenceItemsByPatientItemId[patientItem2["patient_item_id"]] = patientItem2;
+                    encounterIdPairsByItemIdPair.setdefault(itemIdPair, set()).add(encounterIdPair);
+
+        itemIdPair = (virtualItemId, virtualItemId);
+        for patientItem1 in endSequenceItemsByPatientItemId.itervalues():
+            for patientItem2 in endSequenceItemsByPatientItemId.itervalues():
+                encounterIdPair = (patientItem1["encounter_id"], patientItem2["encounter_id"]);
+                isNewPair = itemIdPair not in encounterIdPairsByItemIdPair;
+                isNewPairWithinEncounter = (encounterIdPair[0]==encounterIdPair[-1]) and (isNewPair or encounterIdPair not in encounterIdPairsByItemIdPair[itemIdPair]);
+                analyzer.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, True, isNewPair, isNewPairWithinEncounter, updateBuffer, itemIdPair=itemIdPair );
+                encounterIdPairsByItemIdPair.setdefault(itemIdPair, set()).add(encounterIdPair);
 
 def suite():
     """Returns the suite of tests to run for this test class / module.
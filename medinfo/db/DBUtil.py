@@ -44,11 +44,19 @@ DOUBLE_TOKEN_END = TOKEN_END+TOKEN_END;
 import Env;
 SQL_PLACEHOLDER = Env.SQL_PLACEHOLDER;
 
+"""Optional ConnectionPool to draw default connections from, for long-running processes (e.g., web server)
+that would otherwise open a new connection for every request.
+"""
+connectionPool = None;
+
 def connection( connParams=None ):
     """Return a connection to the application database.
     Implementation of this method should change depending upon what
     database is being interfaced to.
     """
+    if connParams is None and connectionPool is not None:
+        return connectionPool.connection();
+
     Util.numConnections += 1;
 
     if connParams is None:
@@ -116,6 +124,9 @@ def identityQuery( tableName , pgSeqName=None):
             pgSeqName = sequenceName( tableName );
         return "select currval('%s')" % pgSeqName; #PostgreSQL
 
+    if Env.DATABASE_CONNECTOR_NAME == "sqlite3":
+        return "select last_insert_rowid()";
+
     #return "select @@IDENTITY"  # Access, SQL Server, Sybase
 
 def sequenceName( tableName ):
@@ -176,6 +187,56 @@ def dropDatabase( dbParams ):
 #########  END  Database Specific Stuff ###########
 ###################################################
 
+class ConnectionPool:
+    """Keep connections open for reuse after callers close them, rather than opening a new one each time.
+    Set as the DBUtil.connectionPool so default connections come from here.
+    Only for use within a single process (and thread), such as web server worker processes.
+    """
+    def __init__(self, connParams=None, maxIdle=2):
+        self.connParams = connParams;   # If None, use the default DB_PARAM at the time of connection
+        self.maxIdle = maxIdle; # Most idle connections to keep open
+        self.idleConns = list();
+
+    def connection(self):
+        if len(self.idleConns) > 0:
+            return PooledConnection(self, self.idleConns.pop());
+        connParams = self.connParams;
+        if connParams is None:
+            connParams = DB_PARAM;
+        return PooledConnection(self, connection(connParams));
+
+    def release(self, conn):
+        """Take back a connection when a caller closes it.  Discard any uncommitted changes, as a real close would."""
+        try:
+            conn.rollback();
+        except Exception, err:
+            log.warning("Discarding pooled connection: %s" % err);
+            return;
+        if len(self.idleConns) < self.maxIdle:
+            self.idleConns.append(conn);
+        else:
+            conn.close();
+
+    def clear(self):
+        """Close all idle connections.  For example, after a fork, as connections cannot be shared across processes."""
+        for conn in self.idleConns:
+            conn.close();
+        self.idleConns = list();
+
+class PooledConnection:
+    """Wrapper around a connection from a ConnectionPool, returning it to the pool instead of closing it"""
+    def __init__(self, pool, conn):
+        self.pool = pool;
+        self.conn = conn;
+
+    def close(self):
+        if self.conn is not None:
+            self.pool.release(self.conn);
+            self.conn = None;
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name);
+
 class ConnectionFactory:
     """Simple factory object to encapsulate the primary DBUtil.connection function.
     This way, we can pass around the *means* to produce a connection object,
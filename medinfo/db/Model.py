@@ -1,6 +1,6 @@
 """Common objects / base classes used to support DB interactions.
 """
-from Env import SQL_PLACEHOLDER;
+import Env;
 
 class RowItemModel(dict):
     """Generic object class to model rows from database tables.
@@ -186,9 +186,12 @@ class SQLQuery:
         cursor = conn.cursor();
         cursor.execute( str(query), query.getParams() );
     """
-    def __init__(self, sqlPlaceholder=SQL_PLACEHOLDER):
+    def __init__(self, sqlPlaceholder=None):
         """Allow specification of specific SQL_PLACEHOLDER character. (Different modules use ? vs. %s, etc.)
+        Defaults to the current Env.SQL_PLACEHOLDER.
         """
+        if sqlPlaceholder is None:
+            sqlPlaceholder = Env.SQL_PLACEHOLDER;
         self.prefix = None;
         self.delete = False;    # If set, will ignore the select list and make a delete query instead
         self.select = [];
@@ -374,10 +377,12 @@ class SQLQuery:
         return aTotalQuery
 
 
-def generatePlaceholders(count, sqlPlaceholder=SQL_PLACEHOLDER):
+def generatePlaceholders(count, sqlPlaceholder=None):
     """Returns a comma-separated string of query placeholders (e.g. %s),
     perfect for use in an "in" clause.
     """
+    if sqlPlaceholder is None:
+        sqlPlaceholder = Env.SQL_PLACEHOLDER;
     placeholders = "%s,"%(sqlPlaceholder)          # Use the standard placeholder character
     placeholders = placeholders * count             # Repeat the placeholder (with comma) accordingly
     placeholders = placeholders[:-1]                # Trim the extra comma at the end.
@@ -48,6 +48,7 @@ CREATE INDEX index_patient_item_clinical_item_id_date ON patient_item(clinical_i
 -- ALTER TABLE patient_item ADD CONSTRAINT patient_item_patient_fkey FOREIGN KEY (patient_id) REFERENCES patient(patient_id);	-- No fixed patient (ID) table for now
 CREATE INDEX index_patient_item_patient_id_date ON patient_item(patient_id, item_date);	-- Natural sorting option to order by patient, then in chronological order of clinical items
 CREATE INDEX index_patient_item_external_id ON patient_item(external_id, clinical_item_id);
+CREATE INDEX index_patient_item_unanalyzed_patient_id ON patient_item(patient_id) WHERE analyze_date IS NULL;	-- Find patients with new items to analyze for incremental association updates without a full table scan
 
 ALTER TABLE patient_item ADD COLUMN encounter_id BIGINT;	-- Option to track at the individual encounter level
 CREATE INDEX index_patient_item_encounter_id_date ON patient_item(encounter_id, item_date);	-- Natural sorting option to order by patient encounter, then in chronological order of clinical items
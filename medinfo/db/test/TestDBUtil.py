@@ -408,6 +408,35 @@ class TestDBUtil(DBTestCase):
         finally:
             conn.close()
 
+    def test_connectionPool(self):
+        DBUtil.runDBScript( self.SCRIPT_FILE, False )
+        numRows = DBUtil.execute("select count(*) from TestTypes")[0][0];
+
+        DBUtil.connectionPool = DBUtil.ConnectionPool(maxIdle=1);
+        try:
+            # Closed connections are returned to the pool for reuse, with uncommitted changes discarded
+            conn = DBUtil.connection();
+            rawConn = conn.conn;
+            conn.cursor().execute("insert into TestTypes (MyText,MyInteger,MyYesNo) values ('Uncommitted',255,True)");
+            conn.close();
+            conn.close();   # Redundant close should not release twice
+            self.assertEqual([rawConn], DBUtil.connectionPool.idleConns);
+
+            conn = DBUtil.connection();
+            self.assertTrue(conn.conn is rawConn);
+            self.assertEqual(numRows, DBUtil.execute("select count(*) from TestTypes", conn=conn)[0][0]);
+
+            # Default connections for queries come from the pool as well.  Extra connections opened when needed, but not kept idle beyond limit
+            self.assertEqual(numRows, DBUtil.execute("select count(*) from TestTypes")[0][0]);
+            otherConn = DBUtil.connection();
+            self.assertTrue(otherConn.conn is not rawConn);
+            otherConn.close();
+            conn.close();
+            self.assertEqual(1, len(DBUtil.connectionPool.idleConns));
+        finally:
+            DBUtil.connectionPool.clear();
+            DBUtil.connectionPool = None;
+
     def test_nullCheck(self):
         DBUtil.runDBScript( self.SCRIPT_FILE, False )
 
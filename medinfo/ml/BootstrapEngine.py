@@ -0,0 +1,236 @@
+#!/usr/bin/python
+"""
+Vectorized bootstrap engine for computing confidence intervals of binary
+classifier scores.
+
+Rather than resampling and rescoring in a Python loop for each metric,
+draw the full (n_bootstrap_iter x n_samples) matrix of resample indices once
+and share it across every metric. Samples are sorted by predicted probability
+once up front, so each resample only needs an integer sort of its positions
+in that order, after which AUC, average precision, precision at k and
+percent predictably positive all fall out of cumulative sums (rank statistics
+with tie handling), rather than calls into sklearn per resample.
+
+Resample rows are scored in chunks to bound memory, optionally spread over
+a process pool.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from medinfo.common.Util import log
+
+class BootstrapEngine:
+    # Same names as the ClassifierAnalyzer score metrics.
+    ACCURACY_SCORE = 'accuracy'
+    RECALL_SCORE = 'recall'
+    PRECISION_SCORE = 'precision'
+    F1_SCORE = 'f1'
+    AVERAGE_PRECISION_SCORE = 'average_precision'
+    ROC_AUC_SCORE = 'roc_auc'
+    PRECISION_AT_K_SCORE = 'precision_at_k'
+    PERCENT_PREDICTABLY_POSITIVE = 'percent_predictably_positive'
+    SUPPORTED_SCORES = [ACCURACY_SCORE, RECALL_SCORE, PRECISION_SCORE,
+                        F1_SCORE, AVERAGE_PRECISION_SCORE, ROC_AUC_SCORE,
+                        PRECISION_AT_K_SCORE, PERCENT_PREDICTABLY_POSITIVE]
+
+    DEFAULT_N_BOOTSTRAP_ITER = 1000
+    # Max resample matrix cells (rows x samples) scored at a time.
+    MAX_CHUNK_CELLS = 2**20
+
+    def __init__(self, y_true, y_pred, y_pred_prob, n_bootstrap_iter=None,
+                 random_state=None, n_jobs=1):
+        # y_true and y_pred are binary labels, y_pred_prob the predicted
+        # probability of the positive label. Any array-like (e.g. single
+        # column DataFrames) is accepted.
+        self._y_true = np.asarray(y_true, dtype=float).ravel()
+        self._y_pred = np.asarray(y_pred, dtype=float).ravel()
+        self._y_pred_prob = np.asarray(y_pred_prob, dtype=float).ravel()
+
+        if n_bootstrap_iter is None:
+            n_bootstrap_iter = BootstrapEngine.DEFAULT_N_BOOTSTRAP_ITER
+        self._n_bootstrap_iter = n_bootstrap_iter
+
+        if random_state is None:
+            random_state = np.random.RandomState(123456789)
+        elif isinstance(random_state, int):
+            random_state = np.random.RandomState(random_state)
+        self._random_state = random_state
+        self._n_jobs = n_jobs
+
+        # Sort all samples by descending probability once, breaking ties by
+        # original order, and label runs of tied probabilities.
+        num_samples = len(self._y_true)
+        order = np.argsort(-self._y_pred_prob, kind='mergesort')
+        self._position = np.empty(num_samples, dtype=int)
+        self._position[order] = np.arange(num_samples)
+        self._y_true_sorted = self._y_true[order]
+        self._y_pred_sorted = self._y_pred[order]
+        prob_sorted = self._y_pred_prob[order]
+        self._tie_group_sorted = np.concatenate(([0], np.cumsum(prob_sorted[1:] != prob_sorted[:-1])))
+
+        self._resample_indices = None
+
+    def resample_indices(self):
+        # (n_bootstrap_iter x n_samples) matrix of indices drawn with
+        # replacement, drawn once and shared by all metrics.
+        if self._resample_indices is None:
+            num_samples = len(self._y_true)
+            self._resample_indices = self._random_state.randint(0, num_samples, \
+                (self._n_bootstrap_iter, num_samples))
+        return self._resample_indices
+
+    def bootstrap_scores(self, metrics, k=None, desired_precision=None):
+        # Score every resample for every metric. Returns a dict of
+        # metric -> array of scores, excluding resamples which only contain
+        # one class (same as ClassifierAnalyzer, since AUC is undefined).
+        for metric in metrics:
+            if metric not in BootstrapEngine.SUPPORTED_SCORES:
+                raise ValueError('Score metric %s not supported.' % metric)
+        if BootstrapEngine.PRECISION_AT_K_SCORE in metrics and k is None:
+            raise ValueError('Must specify k for PRECISION_AT_K_SCORE.')
+        if BootstrapEngine.PERCENT_PREDICTABLY_POSITIVE in metrics and desired_precision is None:
+            raise ValueError('Must specify desired_precision for PERCENT_PREDICTABLY_POSITIVE.')
+
+        resample_indices = self.resample_indices()
+        num_samples = resample_indices.shape[1]
+        chunk_size = max(1, BootstrapEngine.MAX_CHUNK_CELLS // max(1, num_samples))
+        chunk_args = list()
+        for start in range(0, len(resample_indices), chunk_size):
+            # Map resampled indices to positions in descending probability order.
+            positions = self._position[resample_indices[start:start + chunk_size]]
+            chunk_args.append((positions, self._y_true_sorted, self._y_pred_sorted,
+                               self._tie_group_sorted, metrics, k, desired_precision))
+
+        if self._n_jobs > 1 and len(chunk_args) > 1:
+            pool = multiprocessing.Pool(min(self._n_jobs, len(chunk_args)))
+            try:
+                chunk_scores = pool.map(score_resample_chunk, chunk_args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunk_scores = [score_resample_chunk(args) for args in chunk_args]
+
+        (valid, scores) = (list(), dict([(metric, list()) for metric in metrics]))
+        for (chunk_valid, chunk_score_by_metric) in chunk_scores:
+            valid.append(chunk_valid)
+            for metric in metrics:
+                scores[metric].append(chunk_score_by_metric[metric])
+        valid = np.concatenate(valid)
+        log.debug('%d of %d bootstrap resamples had both classes' % (valid.sum(), len(valid)))
+        return dict([(metric, np.concatenate(scores[metric])[valid]) for metric in metrics])
+
+    def confidence_intervals(self, metrics, ci, k=None, desired_precision=None):
+        # Returns a dict of metric -> (lower bound, upper bound).
+        score_by_metric = self.bootstrap_scores(metrics, k, desired_precision)
+        ci_by_metric = dict()
+        for metric in metrics:
+            ci_by_metric[metric] = percentile_ci(score_by_metric[metric], ci)
+        return ci_by_metric
+
+def percentile_ci(bootstrap_scores, ci):
+    # Same percentile convention as ClassifierAnalyzer._bootstrap_score_ci.
+    sorted_scores = np.sort(bootstrap_scores)
+    num_bootstraps = len(sorted_scores)
+    ci_lower_bound_float = (1.0 - ci) / 2
+    ci_upper_bound_float = ci + ci_lower_bound_float
+    lower_index = min(int(ci_lower_bound_float * num_bootstraps), num_bootstraps - 1)
+    upper_index = min(int(ci_upper_bound_float * num_bootstraps), num_bootstraps - 1)
+    return sorted_scores[lower_index], sorted_scores[upper_index]
+
+def _safe_divide(numerator, denominator):
+    # sklearn convention: ill-defined ratios (e.g. precision with no
+    # predicted positives) score 0.
+    result = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=result, where=(denominator != 0))
+    return result
+
+def score_resample_chunk(args):
+    # Score a chunk of resamples. Module-level so multiprocessing can pickle it.
+    # positions is a (num_resamples x num_samples) matrix of each resampled
+    # sample's position in descending probability order.
+    (positions, y_true_sorted, y_pred_sorted, tie_group_sorted, metrics, k, desired_precision) = args
+    positions = np.sort(positions, axis=1)
+    (num_resamples, num_samples) = positions.shape
+    rows = np.arange(num_resamples)[:, np.newaxis]
+    cols = np.arange(num_samples)
+
+    y_true = y_true_sorted[positions]
+    y_pred = y_pred_sorted[positions]
+    num_positive = y_true.sum(axis=1)
+    num_negative = num_samples - num_positive
+    valid = (num_positive > 0) & (num_negative > 0)
+
+    tp = (y_true * y_pred).sum(axis=1)
+    fp = ((1 - y_true) * y_pred).sum(axis=1)
+    precision = _safe_divide(tp, tp + fp)
+    recall = _safe_divide(tp, num_positive)
+
+    score_by_metric = dict()
+    for metric in metrics:
+        if metric == BootstrapEngine.ACCURACY_SCORE:
+            score_by_metric[metric] = (y_true == y_pred).mean(axis=1)
+        elif metric == BootstrapEngine.PRECISION_SCORE:
+            score_by_metric[metric] = precision
+        elif metric == BootstrapEngine.RECALL_SCORE:
+            score_by_metric[metric] = recall
+        elif metric == BootstrapEngine.F1_SCORE:
+            score_by_metric[metric] = _safe_divide(2 * precision * recall, precision + recall)
+
+    if BootstrapEngine.ROC_AUC_SCORE in metrics or BootstrapEngine.AVERAGE_PRECISION_SCORE in metrics:
+        # Cumulative true / false positives at the end of each run of tied
+        # probabilities (i.e., each distinct threshold).
+        tie_group = tie_group_sorted[positions]
+        is_group_end = np.ones((num_resamples, num_samples), dtype=bool)
+        is_group_end[:, :-1] = tie_group[:, 1:] != tie_group[:, :-1]
+        is_group_start = np.ones((num_resamples, num_samples), dtype=bool)
+        is_group_start[:, 1:] = is_group_end[:, :-1]
+        group_end = np.minimum.accumulate(np.where(is_group_end, cols, num_samples)[:, ::-1], axis=1)[:, ::-1]
+        group_start = np.maximum.accumulate(np.where(is_group_start, cols, 0), axis=1)
+
+        cum_tp = np.cumsum(y_true, axis=1)
+        cum_fp = np.cumsum(1 - y_true, axis=1)
+        tp_at_end = cum_tp[rows, group_end]
+        fp_at_end = cum_fp[rows, group_end]
+
+        if BootstrapEngine.ROC_AUC_SCORE in metrics:
+            # Mann-Whitney U: each positive beats the negatives with lower
+            # probability, and ties with half the negatives of equal probability.
+            fp_before_start = cum_fp[rows, group_start] - (1 - y_true[rows, group_start])
+            fp_tied = fp_at_end - fp_before_start
+            fp_lower = num_negative[:, np.newaxis] - fp_at_end
+            u_statistic = (y_true * (fp_lower + 0.5 * fp_tied)).sum(axis=1)
+            score_by_metric[BootstrapEngine.ROC_AUC_SCORE] = \
+                _safe_divide(u_statistic, num_positive * num_negative)
+
+        if BootstrapEngine.AVERAGE_PRECISION_SCORE in metrics:
+            # Sum over positives of the precision at their threshold / # positives.
+            precision_at_end = tp_at_end / (tp_at_end + fp_at_end)
+            score_by_metric[BootstrapEngine.AVERAGE_PRECISION_SCORE] = \
+                _safe_divide((y_true * precision_at_end).sum(axis=1), num_positive)
+
+    if BootstrapEngine.PRECISION_AT_K_SCORE in metrics or \
+        BootstrapEngine.PERCENT_PREDICTABLY_POSITIVE in metrics:
+        # Precision of predicted labels among the top k probabilities, for every k.
+        cum_predicted_positive = np.cumsum(y_pred, axis=1)
+        cum_true_positive = np.cumsum(y_true * y_pred, axis=1)
+        precision_at_k = _safe_divide(cum_true_positive, cum_predicted_positive)
+
+        if BootstrapEngine.PRECISION_AT_K_SCORE in metrics:
+            score_by_metric[BootstrapEngine.PRECISION_AT_K_SCORE] = \
+                precision_at_k[:, min(k, num_samples) - 1]
+
+        if BootstrapEngine.PERCENT_PREDICTABLY_POSITIVE in metrics:
+            # Fraction of samples which are positives among the top k, for the
+            # largest k < num_samples whose precision >= desired_precision.
+            meets_precision = precision_at_k[:, :num_samples - 1] >= desired_precision
+            has_k = meets_precision.any(axis=1)
+            last_k_index = (num_samples - 2) - np.argmax(meets_precision[:, ::-1], axis=1)
+            cum_positive = np.cumsum(y_true, axis=1)
+            num_true_positive = cum_positive[np.arange(num_resamples), np.maximum(last_k_index, 0)]
+            score_by_metric[BootstrapEngine.PERCENT_PREDICTABLY_POSITIVE] = \
+                np.where(has_k, num_true_positive / float(num_samples), 0.0)
+
+    return valid, score_by_metric
@@ -12,10 +12,11 @@ from pandas import DataFrame
 import sys
 import numpy as np
 
-from sklearn.metrics import recall_score, precision_score, f1_score
+from sklearn.metrics import accuracy_score, recall_score, precision_score, f1_score
 from sklearn.metrics import average_precision_score, roc_auc_score
 from sklearn.metrics import precision_recall_curve, roc_curve
 
+from medinfo.ml.BootstrapEngine import BootstrapEngine
 from medinfo.ml.PredictorAnalyzer import PredictorAnalyzer
 from medinfo.common.Util import log
 
@@ -62,7 +63,10 @@ class ClassifierAnalyzer(PredictorAnalyzer):
 
 
     def _score_accuracy(self, ci=None, n_bootstrap_iter=None):
-        return PredictorAnalyzer._score_accuracy(self, ci, n_bootstrap_iter)
+        if ci:
+            return self._bootstrap_score_ci(accuracy_score, ci, self._y_test, y_pred=self._y_predicted, n_bootstrap_iter=n_bootstrap_iter)
+        else:
+            return PredictorAnalyzer._score_accuracy(self)
 
     def _score_recall(self, ci=None, n_bootstrap_iter=None):
         if ci:
@@ -107,48 +111,34 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         else:
             sample_score = score_fn(y_test, y_pred)
 
-        if n_bootstrap_iter is None:
-            n_bootstrap_iter = 100
-        # For consistency of results, seed random number generator with
-        # fixed number.
-        rng = self._random_state
-        # Use bootstrap to compute CIs.
-        bootstrap_scores = list()
-        for i in range(0, n_bootstrap_iter):
-            # Sample y_test and y_pred with replacement.
-            indices = rng.randint(0, len(y_test) - 1, len(y_test))
-            sample_y_test = np.array(y_test)[indices]
-            if y_pred is not None: sample_y_pred = np.array(y_pred)[indices]
-            if y_pred_prob is not None: sample_y_pred_prob = np.array(y_pred_prob)[indices]
-            if len(np.unique(sample_y_test)) < 2:
-                # We need at least one positive and one negative sample for ROC AUC
-                # to be defined: reject the sample
-                continue
-            if score_fn == self._score_precision_at_k:
-                score = score_fn(DataFrame(sample_y_test), DataFrame(sample_y_pred), DataFrame(sample_y_pred_prob), k)
-            elif score_fn == self._score_percent_predictably_positive:
-                score = score_fn(DataFrame(sample_y_test), DataFrame(sample_y_pred), DataFrame(sample_y_pred_prob), desired_precision)
-            elif score_fn in [average_precision_score, roc_auc_score]:
-                score = score_fn(sample_y_test, sample_y_pred_prob)
-            else:
-                score = score_fn(sample_y_test, sample_y_pred)
-            bootstrap_scores.append(score)
-
-        # Sort bootstrap scores to get CIs.
-        bootstrap_scores.sort()
-        log.debug('bootstrap_scores: %s' % bootstrap_scores)
-        sorted_scores = np.array(bootstrap_scores)
-        # May not be equal to n_bootstrap_iter if some samples were rejected
-        num_bootstraps = len(sorted_scores)
-        log.debug('sorted_scores: %s' % sorted_scores)
-
-        ci_lower_bound_float = (1.0 - ci) / 2
-        ci_lower_bound = sorted_scores[int(ci_lower_bound_float * num_bootstraps)]
-        ci_upper_bound_float = ci + ci_lower_bound_float
-        ci_upper_bound = sorted_scores[int(ci_upper_bound_float * num_bootstraps)]
+        # Resample and score with the same BootstrapEngine as
+        # bootstrap_score_cis, so score(ci=...) and build_report(ci=...)
+        # give the same CIs for the same random state. The random state is
+        # shared, so consecutive calls still draw different resamples.
+        if y_pred is None: y_pred = self._y_predicted
+        if y_pred_prob is None: y_pred_prob = self._y_pred_prob
+        metric = self._bootstrap_metric(score_fn)
+        engine = BootstrapEngine(y_test, y_pred, y_pred_prob, n_bootstrap_iter, self._random_state)
+        ci_lower_bound, ci_upper_bound = engine.confidence_intervals([metric], ci, k, desired_precision)[metric]
 
         return sample_score, ci_lower_bound, ci_upper_bound
 
+    def _bootstrap_metric(self, score_fn):
+        # BootstrapEngine metric name for a score function.
+        if score_fn == self._score_precision_at_k:
+            return BootstrapEngine.PRECISION_AT_K_SCORE
+        elif score_fn == self._score_percent_predictably_positive:
+            return BootstrapEngine.PERCENT_PREDICTABLY_POSITIVE
+        metric_by_score_fn = {
+            accuracy_score: BootstrapEngine.ACCURACY_SCORE,
+            recall_score: BootstrapEngine.RECALL_SCORE,
+            precision_score: BootstrapEngine.PRECISION_SCORE,
+            f1_score: BootstrapEngine.F1_SCORE,
+            average_precision_score: BootstrapEngine.AVERAGE_PRECISION_SCORE,
+            roc_auc_score: BootstrapEngine.ROC_AUC_SCORE
+        }
+        return metric_by_score_fn[score_fn]
+
     def _score_precision_at_k(self, y_true, y_pred, y_pred_prob, k, ci=None, n_bootstrap_iter=None, desired_precision=None):
         if ci:
             return self._bootstrap_score_ci(self._score_precision_at_k, ci, y_true, y_pred=y_pred, y_pred_prob=y_pred_prob, n_bootstrap_iter=n_bootstrap_iter, k=k)
@@ -207,6 +197,31 @@ class ClassifierAnalyzer(PredictorAnalyzer):
 
             return float(num_true_positive) / float(n_bootstrap_iter)
 
+    def bootstrap_score_cis(self, ci, metrics=None, n_bootstrap_iter=None, k=None, desired_precision=0.99, n_jobs=1):
+        # Score several metrics with bootstrapped CIs, sharing one set of
+        # vectorized resamples (BootstrapEngine) across all of them.
+        # Returns a dict of metric -> (score, lower_ci, upper_ci).
+        # n_bootstrap_iter of None is left to BootstrapEngine.DEFAULT_N_BOOTSTRAP_ITER,
+        # same as score(ci=...).
+        if metrics is None:
+            metrics = [metric for metric in ClassifierAnalyzer.SUPPORTED_SCORES \
+                       if metric in BootstrapEngine.SUPPORTED_SCORES]
+            if k is None:
+                metrics.remove(ClassifierAnalyzer.PRECISION_AT_K_SCORE)
+        engine = BootstrapEngine(self._y_test, self._y_predicted, self._y_pred_prob,
+                                 n_bootstrap_iter, self._random_state, n_jobs)
+        ci_by_metric = engine.confidence_intervals(metrics, ci, k, desired_precision)
+
+        score_cis = dict()
+        for metric in metrics:
+            if metric == ClassifierAnalyzer.PERCENT_PREDICTABLY_POSITIVE:
+                sample_score = self._score_percent_predictably_positive(self._y_test, self._y_predicted, self._y_pred_prob, desired_precision)
+            else:
+                sample_score = self.score(metric, k=k)
+            lower_ci, upper_ci = ci_by_metric[metric]
+            score_cis[metric] = (sample_score, lower_ci, upper_ci)
+        return score_cis
+
     def score(self, metric=None, k=None, ci=None, n_bootstrap_iter=None):
         # ci defines confidence interval as float.
         # Also defines whether score returns score or (-ci, score, +ci)
@@ -356,7 +371,7 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         plt.savefig(dest_path)
         plt.close()
 
-    def build_report(self, ci=None):
+    def build_report(self, ci=None, n_bootstrap_iter=None, n_jobs=1):
         column_names = ['model', 'test_size']
         report_dict = {
             'model': [self._predictor.description()],
@@ -368,6 +383,10 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         report_dict.update({'y_test.value_counts()': [str(y_test_counts.to_dict())]})
         column_names.append('y_test.value_counts()')
 
+        # Bootstrap CIs for all metrics from one shared set of resamples.
+        if ci:
+            score_cis = self.bootstrap_score_cis(ci, n_bootstrap_iter=n_bootstrap_iter, n_jobs=n_jobs)
+
         # Add scores.
         for score_metric in ClassifierAnalyzer.SUPPORTED_SCORES:
             # Hack to avoid breaking tests.
@@ -389,7 +408,7 @@ class ClassifierAnalyzer(PredictorAnalyzer):
             else:
                 score_label = score_metric
                 if ci:
-                    score_value, lower_ci, upper_ci = self.score(metric=score_metric, ci=ci)
+                    score_value, lower_ci, upper_ci = score_cis[score_metric]
                 else:
                     score_value = self.score(metric=score_metric)
             column_names.append(score_label)
@@ -408,7 +427,7 @@ class ClassifierAnalyzer(PredictorAnalyzer):
 
         return DataFrame(report_dict, columns=column_names), column_names
 
-    def write_report(self, dest_path, ci=None):
-        report, column_names = self.build_report(ci)
+    def write_report(self, dest_path, ci=None, n_bootstrap_iter=None, n_jobs=1):
+        report, column_names = self.build_report(ci, n_bootstrap_iter, n_jobs)
 
         PredictorAnalyzer.write_report(self, report, dest_path, column_names)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+"""
+Content-addressed checkpoint store for the stages of a SupervisedLearningPipeline.
+
+Each stage output is saved under a key built from the stage name, the stage
+parameters, and the keys of the upstream stages (or the signature of an
+input file: its path, size and modification time). Stages form a chain / DAG through those upstream keys, so
+changing a parameter of one stage only changes the keys of that stage and
+its downstream stages, and only those need to be recomputed.
+
+e.g., for a lab pipeline
+    raw matrix file --> impute --> select_features --> train
+tweaking a training hyperparameter reuses the imputed and feature selected
+matrices from disk and only retrains the model.
+"""
+
+import cPickle as pickle
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+from pandas.util import hash_pandas_object
+
+from medinfo.common.Util import log
+
+class PipelineStageCache:
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_dir(self):
+        return self._cache_dir
+
+    def build_key(self, stage, params, upstream_keys=None):
+        # Hash of everything which determines the stage's output.
+        if upstream_keys is None:
+            upstream_keys = list()
+        key_source = json.dumps([stage, params, list(upstream_keys)], \
+            sort_keys=True, default=_json_default)
+        return hashlib.sha1(key_source).hexdigest()
+
+    def file_key(self, file_path):
+        # Signature of an input file (e.g., the raw feature matrix), rather
+        # than a hash of its (possibly very large) content. Rewriting the
+        # file changes its modification time, so downstream stages rerun
+        # even if the content happens to be the same.
+        file_stat = os.stat(file_path)
+        signature = [os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime]
+        return hashlib.sha1(json.dumps(signature)).hexdigest()
+
+    def data_frame_key(self, *data_frames):
+        # Content hash of in-memory data frames, for stages whose upstream
+        # stages were not checkpointed.
+        data_hash = hashlib.sha1()
+        for data_frame in data_frames:
+            data_hash.update(json.dumps([str(column) for column in data_frame.columns]))
+            data_hash.update(hash_pandas_object(data_frame, index=True).values.tobytes())
+        return data_hash.hexdigest()
+
+    def _build_path(self, stage, key):
+        return os.path.join(self._cache_dir, '%s-%s.pkl' % (stage, key))
+
+    def has(self, stage, key):
+        return os.path.exists(self._build_path(stage, key))
+
+    def load(self, stage, key):
+        with open(self._build_path(stage, key), 'rb') as checkpoint_file:
+            return pickle.load(checkpoint_file)
+
+    def save(self, stage, key, output):
+        # Write to a temp file then rename, so concurrent pipelines never
+        # read a partially written checkpoint.
+        checkpoint_path = self._build_path(stage, key)
+        (temp_fd, temp_path) = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        with os.fdopen(temp_fd, 'wb') as temp_file:
+            pickle.dump(output, temp_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, checkpoint_path)
+        log.debug('Saved %s checkpoint: %s' % (stage, checkpoint_path))
+
+def _json_default(value):
+    # Sets (e.g., imputation strategies) have no defined order.
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    # Anything else (e.g., repr with a memory address) would not give a
+    # stable key across runs.
+    raise TypeError('Cannot build a stage key from %s: %r' % (type(value).__name__, value))
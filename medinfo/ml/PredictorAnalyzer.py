@@ -42,13 +42,17 @@ class PredictorAnalyzer:
             # For consistency of results, seed random number generator with
             # fixed number.
             rng = self._random_state
+            # Sample y_test and y_pred with replacement, drawing all samples
+            # at once. Any sample may be drawn (randint excludes the upper
+            # bound), same as BootstrapEngine.
+            all_indices = rng.randint(0, len(self._y_predicted), (n_bootstrap_iter, len(self._y_predicted)))
+            y_test_array = np.array(self._y_test)
+            y_pred_array = np.array(self._y_predicted)
             # Use bootstrap to compute cis.
             bootstrap_scores = list()
-            for i in range(0, n_bootstrap_iter):
-                # Sample y_test and y_pred with replacement.
-                indices = rng.randint(0, len(self._y_predicted) - 1, len(self._y_predicted))
-                sample_y_test = np.array(self._y_test)[indices]
-                sample_y_pred = np.array(self._y_predicted)[indices]
+            for indices in all_indices:
+                sample_y_test = y_test_array[indices]
+                sample_y_pred = y_pred_array[indices]
                 log.debug('sample_y_pred: %s' % sample_y_pred)
                 if len(np.unique(sample_y_test)) < 2:
                     # We need at least one positive and one negative sample for ROC AUC
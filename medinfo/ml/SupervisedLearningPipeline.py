@@ -14,13 +14,26 @@ SubClasses will be expected to override the following functions:
 * _remove_features()
 * _select_features()
 * summarize()
+
+Each of the major stages (raw matrix, processed matrix, feature selection,
+training, analysis) records its wall time and its own peak memory,
+available to clients through stage_stats().
+
+If a checkpoint_dir is given, the impute, select_features and train stage
+outputs are checkpointed by PipelineStageCache, keyed on their params and
+their inputs, so only stages whose inputs changed are recomputed. The raw
+matrix is keyed on the arguments it was built from, or on its file signature
+if an existing file was reused.
 """
 
 import datetime
+import functools
 import inspect
 import os
 import pandas as pd
+import re
 import sys
+import time
 
 from sklearn.model_selection import train_test_split
 from sklearn.utils.validation import column_or_1d
@@ -33,17 +46,100 @@ from medinfo.ml.BifurcatedSupervisedClassifier import BifurcatedSupervisedClassi
 from medinfo.ml.Regressor import Regressor
 from medinfo.ml.SupervisedClassifier import SupervisedClassifier
 from medinfo.ml.ClassifierAnalyzer import ClassifierAnalyzer
+from medinfo.ml.PipelineStageCache import PipelineStageCache
 
 import LocalEnv
 
 
+# Peak resident memory (KB) observed so far by each measurement in progress,
+# outermost first, from before any nested measurement reset the high water mark.
+_peak_memory_stack = list()
+
+def _resident_peak_kb():
+    # High water mark of the process's resident memory, since the last reset.
+    # None where not available (Linux only).
+    try:
+        with open('/proc/self/status') as status_file:
+            match = re.search(r'VmHWM:\s+(\d+) kB', status_file.read())
+    except (IOError, OSError):
+        return None
+    if match is None:
+        return None
+    return int(match.group(1))
+
+def _reset_resident_peak():
+    # Reset the high water mark to the current resident memory (Linux 4.0+).
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def start_peak_memory():
+    # Start measuring the peak resident memory of a (possibly nested) stage.
+    # The process's lifetime peak (ru_maxrss) would just repeat the peak of
+    # any earlier stage, so reset the high water mark instead, after noting
+    # the peak so far of any enclosing measurement.
+    peak_kb = _resident_peak_kb()
+    if _peak_memory_stack and peak_kb is not None and _peak_memory_stack[-1] is not None:
+        _peak_memory_stack[-1] = max(_peak_memory_stack[-1], peak_kb)
+    if _reset_resident_peak():
+        _peak_memory_stack.append(0)
+    else:
+        _peak_memory_stack.append(None)
+
+def stop_peak_memory():
+    # Peak resident memory in MB since the matching start_peak_memory(),
+    # or None if the platform cannot measure it.
+    peak_kb = _peak_memory_stack.pop()
+    current_peak_kb = _resident_peak_kb()
+    if peak_kb is None or current_peak_kb is None:
+        return None
+    return max(peak_kb, current_peak_kb) / 1024.0
+
+def pipeline_stage(stage_name):
+    # Decorator to record wall time and peak memory of a pipeline stage
+    # in the owning pipeline's stage stats.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start_time = time.time()
+            start_peak_memory()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._record_stage(stage_name, time.time() - start_time,
+                                   stop_peak_memory())
+        return wrapper
+    return decorator
+
+
 class SupervisedLearningPipeline:
     CLASSIFICATION = 'classification'
     REGRESSION = 'regression'
 
+    # Raw matrix paths which were already built by another pipeline in the
+    # same batch (see SupervisedLearningPipelineScheduler), so should be
+    # reused even if the client requested to flush the cache.
+    shared_raw_matrix_paths = set()
+
+    # Constructor arguments which determine the content of the raw matrix
+    # (cohort and feature extraction), so SupervisedLearningPipelineScheduler
+    # only shares a raw matrix between runs which agree on all of them.
+    # None means all constructor arguments.
+    RAW_MATRIX_ARGS = None
+
+    # Pipeline attributes which make up the output of each checkpointed stage.
+    IMPUTE_STAGE_STATE = ['_X_train', '_y_train', '_X_test', '_y_test',
+                          '_patIds_df', 'feat2imputed_dict', '_num_rows',
+                          '_added_features', '_removed_features']
+    SELECT_FEATURES_STAGE_STATE = ['_X_train', '_X_test', '_eliminated_features']
+    TRAIN_STAGE_STATE = ['_predictor', '_train_status']
+
     def __init__(self, variable, num_data_points, use_cache=None, random_state=None,
                  isLabPanel=True, timeLimit=None, holdOut=False,
-                 isLabNormalityPredictionPipeline=False):
+                 isLabNormalityPredictionPipeline=False, checkpoint_dir=None):
         # Process arguments.
         self._var = variable
         self._num_rows = num_data_points
@@ -52,6 +148,8 @@ class SupervisedLearningPipeline:
         self._raw_matrix = None
         self._processed_matrix = None
         self._predictor = None
+        self._train_status = None
+        self._patIds_df = None
         self._eliminated_features = list()
         self._removed_features = list()
         self._added_features = list()
@@ -73,9 +171,59 @@ class SupervisedLearningPipeline:
         '''
         self._patIds_test = []
 
+        # List of {'stage', 'wall_time', 'peak_memory_mb'} dicts, in the
+        # order the stages completed.
+        self._stage_stats = list()
+        self._raw_matrix_path = None
+        # Arguments the raw matrix was built from, if built by this pipeline.
+        self._raw_matrix_source = None
+
+        # Checkpoint key of each stage, by stage name.
+        self._stage_keys = dict()
+        self._stage_cache = None
+        if checkpoint_dir is not None:
+            self._stage_cache = PipelineStageCache(checkpoint_dir)
+
     def predictor(self):
         return self._predictor
 
+    def stage_stats(self):
+        return self._stage_stats
+
+    def raw_matrix_path(self):
+        return self._raw_matrix_path
+
+    def _record_stage(self, stage_name, wall_time, peak_memory_mb):
+        stats = {
+            'stage': stage_name,
+            'wall_time': wall_time,
+            'peak_memory_mb': peak_memory_mb
+        }
+        self._stage_stats.append(stats)
+        log.debug('stage stats: %s' % stats)
+
+    def _run_checkpointed_stage(self, stage, params, upstream_keys, state_attrs, compute_stage):
+        # Load the stage's state attributes from a checkpoint if one exists
+        # for these params and upstream keys. Otherwise, call compute_stage()
+        # and checkpoint the attributes it set.
+        # Without a stage cache, just compute the stage every time.
+        if self._stage_cache is None or None in upstream_keys:
+            compute_stage()
+            return None
+
+        key = self._stage_cache.build_key(stage, params, upstream_keys)
+        if self._stage_cache.has(stage, key):
+            log.debug('Loading %s stage from checkpoint %s' % (stage, key))
+            state = self._stage_cache.load(stage, key)
+            for attr in state_attrs:
+                setattr(self, attr, state[attr])
+        else:
+            compute_stage()
+            state = dict([(attr, getattr(self, attr)) for attr in state_attrs])
+            self._stage_cache.save(stage, key, state)
+        self._stage_keys[stage] = key
+        return key
+
     def _build_model_dump_path(self, file_name_template, pipeline_module_path):
         # Build model file name.
         slugified_var = '-'.join(self._var.split())
@@ -132,6 +280,7 @@ class SupervisedLearningPipeline:
 
         return data_dir
 
+    @pipeline_stage('raw_matrix')
     def _build_raw_feature_matrix(self, matrix_class, raw_matrix_path, params=None):
         # If raw matrix exists, and client has not requested to flush the cache,
         # just use the matrix that already exists and return.
@@ -139,8 +288,14 @@ class SupervisedLearningPipeline:
             self._raw_matrix_params = {}
         else:
             self._raw_matrix_params = params
+        self._raw_matrix_path = raw_matrix_path
+        self._raw_matrix_source = None
         if os.path.exists(raw_matrix_path) and not self._flush_cache:
             pass
+        elif os.path.exists(raw_matrix_path) and \
+            os.path.abspath(raw_matrix_path) in SupervisedLearningPipeline.shared_raw_matrix_paths:
+            # Already (re)built in this batch by another pipeline.
+            pass
         else:
             # Each matrix class may have a custom set of parameters which should
             # be passed on directly to matrix_class, but we expect them to have
@@ -148,13 +303,21 @@ class SupervisedLearningPipeline:
             # Ensure that random_state is [-1, 1]
             random_state = float(self._random_state)/float(sys.maxint)
             if self._isLabNormalityPredictionPipeline:
-                matrix = matrix_class(self._var, self._num_rows, random_state=random_state,
-                                  isLabPanel=self._isLabPanel, timeLimit=self._timeLimit,
-                                      notUsePatIds=self.notUsePatIds)
+                matrix_kwargs = {'isLabPanel': self._isLabPanel,
+                    'timeLimit': self._timeLimit, 'notUsePatIds': self.notUsePatIds}
             else:
-                matrix = matrix_class(self._var, self._num_rows, random_state=random_state)
+                matrix_kwargs = {}
+            matrix = matrix_class(self._var, self._num_rows, random_state=random_state, **matrix_kwargs)
             matrix.write_matrix(raw_matrix_path)
-
+            self._raw_matrix_source = {
+                'matrix_class': '%s.%s' % (matrix_class.__module__, matrix_class.__name__),
+                'variable': self._var,
+                'num_rows': self._num_rows,
+                'random_state': random_state,
+                'kwargs': matrix_kwargs
+            }
+
+    @pipeline_stage('processed_matrix')
     def _build_processed_feature_matrix(self, params):
         # params is a dict defining the details of how the raw feature matrix
         # should be transformed into the processed matrix. Given the sequence
@@ -191,89 +354,43 @@ class SupervisedLearningPipeline:
             '''
             # processed_matrix['pat_id'] = processed_matrix['pat_id'].apply(lambda x: str(x))
         else:
-            # Read raw matrix.
-            raw_matrix = fm_io.read_file_to_data_frame(params['raw_matrix_path'])
-
-            # Initialize FMT.
-
-            # Divide processed_matrix into training and test data.
-            # This must happen before feature selection so that we don't
-            # accidentally learn information from the test data.
-
-            patIds_df = raw_matrix['pat_id'].copy()
-
-            self._train_test_split(raw_matrix, params['outcome_label'])
-
-            fmt = FeatureMatrixTransform()
-            train_df = self._X_train.join(self._y_train)
-            fmt.set_input_matrix(train_df)
-
-            # Add features.
-            self._add_features(fmt, params['features_to_add'])
-
-            # Filter on features
-            if 'features_to_filter_on' in params:
-                self._filter_on_features(fmt, params['features_to_filter_on'])
-
-            # HACK: When read_csv encounters duplicate columns, it deduplicates
-            # them by appending '.1, ..., .N' to the column names.
-            # In future versions of pandas, simply pass mangle_dupe_cols=True
-            # to read_csv, but not ready as of pandas 0.22.0.
-            for feature in raw_matrix.columns.values:
-                if feature[-2:] == ".1":
-                    fmt.remove_feature(feature)
-                    self._removed_features.append(feature)
-
-            # Impute data.
-            if params['imputation_strategies'] == {'sxu_new_imputation'}:
-                train_df = fmt.fetch_matrix()
-                means = {}
-                for column in train_df.columns.values.tolist():
-                    # column_tail = column.split('.')[-1].strip()
-                    if train_df[column].dtype == 'float64':
-                        means[column] = train_df[column].mean()
-
-                train_df = fmt.do_impute_sx(train_df, means)
-                fmt.set_input_matrix(train_df)
-                self._X_test = fmt.do_impute_sx(self._X_test, means)
-
-                self._remove_features(fmt, params['features_to_remove'])
-
-            else:
-                self._remove_features(fmt, params['features_to_remove'])
-                self._impute_data(fmt, train_df, params['imputation_strategies'])
-
-
-            # Remove features.
-            '''
-            Moved here, since still need pat_id for imputation!
-            '''
-            # self._remove_features(fmt, params['features_to_remove'])
-
-            # In case any all-null features were created in preprocessing,
-            # drop them now so feature selection will work
-            fmt.drop_null_features()
-
-            # Build interim matrix.
-            train_df = fmt.fetch_matrix()
-
-            self._y_train = pd.DataFrame(train_df.pop(params['outcome_label']))
-            self._X_train = train_df
-
-            '''
-            Select X_test columns according to processed X_train
-            '''
-            self._X_test = self._X_test[self._X_train.columns]
-
-            if not params['imputation_strategies'] == {'sxu_new_imputation'}:
-                for feat in self._X_test.columns:
-                    self._X_test[feat] = self._X_test[feat].fillna(self.feat2imputed_dict[feat])
-
-
-            self._select_features(params['selection_problem'],
-                params['percent_features_to_select'],
-                params['selection_algorithm'],
-                params['features_to_keep'])
+            # Impute, then select features, reusing checkpoints for either
+            # stage if their inputs and params have not changed.
+            # Key the raw matrix on what it was built from, rather than
+            # hashing its (possibly very large) content. Fall back on the
+            # file signature if an existing matrix file was reused.
+            raw_matrix_key = None
+            if self._stage_cache is not None and self._raw_matrix_source is not None \
+                    and params['raw_matrix_path'] == self._raw_matrix_path:
+                raw_matrix_key = self._stage_cache.build_key('raw_matrix', self._raw_matrix_source)
+            elif self._stage_cache is not None:
+                raw_matrix_key = self._stage_cache.file_key(params['raw_matrix_path'])
+            impute_params = {
+                'outcome_label': params['outcome_label'],
+                'features_to_add': params['features_to_add'],
+                'features_to_filter_on': params.get('features_to_filter_on'),
+                'imputation_strategies': params['imputation_strategies'],
+                'features_to_remove': params['features_to_remove'],
+                'random_state': self._random_state
+            }
+            impute_key = self._run_checkpointed_stage('impute', impute_params, \
+                [raw_matrix_key], self.IMPUTE_STAGE_STATE, \
+                lambda: self._impute_raw_matrix(params))
+
+            select_features_params = {
+                'selection_problem': params['selection_problem'],
+                'percent_features_to_select': params['percent_features_to_select'],
+                'selection_algorithm': params['selection_algorithm'],
+                'features_to_keep': params['features_to_keep'],
+                'random_state': self._random_state
+            }
+            self._run_checkpointed_stage('select_features', select_features_params, \
+                [impute_key], self.SELECT_FEATURES_STAGE_STATE, \
+                lambda: self._select_features(params['selection_problem'],
+                    params['percent_features_to_select'],
+                    params['selection_algorithm'],
+                    params['features_to_keep']))
+            patIds_df = self._patIds_df
 
             '''
             The join is based on index by default.
@@ -313,6 +430,86 @@ class SupervisedLearningPipeline:
         self._patIds_test = self._X_test.pop('pat_id').values.tolist()
         assert not (set(self._patIds_train) & set(self._patIds_test))
 
+    @pipeline_stage('impute')
+    def _impute_raw_matrix(self, params):
+        # Read raw matrix.
+        raw_matrix = FeatureMatrixIO().read_file_to_data_frame(params['raw_matrix_path'])
+
+        # Initialize FMT.
+
+        # Divide processed_matrix into training and test data.
+        # This must happen before feature selection so that we don't
+        # accidentally learn information from the test data.
+
+        self._patIds_df = raw_matrix['pat_id'].copy()
+
+        self._train_test_split(raw_matrix, params['outcome_label'])
+
+        fmt = FeatureMatrixTransform()
+        train_df = self._X_train.join(self._y_train)
+        fmt.set_input_matrix(train_df)
+
+        # Add features.
+        self._add_features(fmt, params['features_to_add'])
+
+        # Filter on features
+        if 'features_to_filter_on' in params:
+            self._filter_on_features(fmt, params['features_to_filter_on'])
+
+        # HACK: When read_csv encounters duplicate columns, it deduplicates
+        # them by appending '.1, ..., .N' to the column names.
+        # In future versions of pandas, simply pass mangle_dupe_cols=True
+        # to read_csv, but not ready as of pandas 0.22.0.
+        for feature in raw_matrix.columns.values:
+            if feature[-2:] == ".1":
+                fmt.remove_feature(feature)
+                self._removed_features.append(feature)
+
+        # Impute data.
+        if params['imputation_strategies'] == {'sxu_new_imputation'}:
+            train_df = fmt.fetch_matrix()
+            means = {}
+            for column in train_df.columns.values.tolist():
+                # column_tail = column.split('.')[-1].strip()
+                if train_df[column].dtype == 'float64':
+                    means[column] = train_df[column].mean()
+
+            train_df = fmt.do_impute_sx(train_df, means)
+            fmt.set_input_matrix(train_df)
+            self._X_test = fmt.do_impute_sx(self._X_test, means)
+
+            self._remove_features(fmt, params['features_to_remove'])
+
+        else:
+            self._remove_features(fmt, params['features_to_remove'])
+            self._impute_data(fmt, train_df, params['imputation_strategies'])
+
+
+        # Remove features.
+        '''
+        Moved here, since still need pat_id for imputation!
+        '''
+        # self._remove_features(fmt, params['features_to_remove'])
+
+        # In case any all-null features were created in preprocessing,
+        # drop them now so feature selection will work
+        fmt.drop_null_features()
+
+        # Build interim matrix.
+        train_df = fmt.fetch_matrix()
+
+        self._y_train = pd.DataFrame(train_df.pop(params['outcome_label']))
+        self._X_train = train_df
+
+        '''
+        Select X_test columns according to processed X_train
+        '''
+        self._X_test = self._X_test[self._X_train.columns]
+
+        if not params['imputation_strategies'] == {'sxu_new_imputation'}:
+            for feat in self._X_test.columns:
+                self._X_test[feat] = self._X_test[feat].fillna(self.feat2imputed_dict[feat])
+
     def _add_features(self, fmt, features_to_add):
         # Expected format for features_to_add:
         # {
@@ -432,6 +629,7 @@ class SupervisedLearningPipeline:
         self._X_test = test_matrix
 
 
+    @pipeline_stage('select_features')
     def _select_features(self, problem, percent_features_to_select, algorithm, features_to_keep=None):
         # Initialize FeatureSelector.
         fs = FeatureSelector(problem=problem, algorithm=algorithm, random_state=self._random_state)
@@ -564,7 +762,14 @@ class SupervisedLearningPipeline:
 
         return summary
 
+    @pipeline_stage('train')
     def _train_predictor(self, problem, classes=None, hyperparams=None):
+        # Checkpoint key uses hyperparams as given, before any are rewritten.
+        train_params = {
+            'problem': problem,
+            'classes': classes,
+            'hyperparams': dict(hyperparams) if hyperparams else hyperparams
+        }
         if problem == SupervisedLearningPipeline.CLASSIFICATION:
             if 'bifurcated' in hyperparams['algorithm']:
                 learning_class = BifurcatedSupervisedClassifier
@@ -577,11 +782,22 @@ class SupervisedLearningPipeline:
         elif problem == SupervisedLearningPipeline.REGRESSION:
             learning_class = Regressor
             self._predictor = learning_class(algorithm=algorithm)
-        status = self._predictor.train(self._X_train, column_or_1d(self._y_train),
-                                       groups = self._patIds_train)
 
-        return status
+        upstream_key = self._stage_keys.get('select_features')
+        if upstream_key is None and self._stage_cache is not None:
+            # Processed matrix was not built by checkpointed stages
+            # (e.g., subclass builds its own), so key on the data itself.
+            upstream_key = self._stage_cache.data_frame_key(self._X_train, self._y_train)
+        self._run_checkpointed_stage('train', train_params, [upstream_key], \
+            self.TRAIN_STAGE_STATE, self._fit_predictor)
+
+        return self._train_status
+
+    def _fit_predictor(self):
+        self._train_status = self._predictor.train(self._X_train,
+            column_or_1d(self._y_train), groups = self._patIds_train)
 
+    @pipeline_stage('analyze')
     def _analyze_predictor(self, dest_dir, pipeline_prefix):
         analyzer = ClassifierAnalyzer(self._predictor, self._X_test, self._y_test)
 
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+"""
+Scheduler for running many independent SupervisedLearningPipeline instances
+(e.g., one per lab outcome) across a pool of worker processes.
+
+Usage:
+    scheduler = SupervisedLearningPipelineScheduler(num_processes=8,
+        memory_budget_mb=64000, memory_per_run_mb=6000)
+    scheduler.add_outcomes(LabNormalityPredictionPipeline, labs, 10000,
+        random_state=123456789)
+    results = scheduler.run()
+    scheduler.write_report('pipeline-run-stats.tab')
+
+Pipelines which share a raw_matrix_key are split into waves. The first
+pipeline in each group builds the raw matrix, and the rest reuse that file
+instead of rebuilding it, even if they asked to flush the cache. The key is
+built from the constructor arguments which determine the raw matrix content
+(see SupervisedLearningPipeline.RAW_MATRIX_ARGS), keyword arguments included,
+so runs only share a raw matrix when they would build the same one.
+
+Peak memory is measured for each run and stage alone, by resetting the
+process's resident memory high water mark when each one starts (Linux only,
+otherwise reported as None), so in-process runs (one process) do not repeat
+the peak of an earlier run or stage.
+"""
+
+import inspect
+import multiprocessing
+import os
+import time
+import traceback
+
+from pandas import DataFrame
+
+from medinfo.common.Util import log
+from medinfo.ml.SupervisedLearningPipeline import SupervisedLearningPipeline
+from medinfo.ml.SupervisedLearningPipeline import start_peak_memory
+from medinfo.ml.SupervisedLearningPipeline import stop_peak_memory
+
+class SupervisedLearningPipelineScheduler:
+    SUCCESS = 'success'
+    ERROR = 'error'
+    REPORT_COLUMNS = ['run_id', 'outcome', 'status', 'stage', 'wall_time',
+                      'peak_memory_mb']
+
+    def __init__(self, num_processes=None, memory_budget_mb=None,
+                 memory_per_run_mb=None):
+        # Resource budget. Number of concurrent pipelines is the lesser of
+        # num_processes and memory_budget_mb / memory_per_run_mb.
+        # If memory_per_run_mb is not specified, it is estimated from the
+        # peak memory of the first wave of runs.
+        if num_processes is None:
+            num_processes = multiprocessing.cpu_count()
+        self._num_processes = num_processes
+        self._memory_budget_mb = memory_budget_mb
+        self._memory_per_run_mb = memory_per_run_mb
+
+        self._runs = list()
+        self._results = list()
+
+    def add_run(self, pipeline_class, outcome, args=None, kwargs=None,
+                raw_matrix_key=None):
+        # Queue up pipeline_class(*args, **kwargs). Pipeline classes do all
+        # their work on instantiation, so that is all a worker needs to do.
+        # outcome is only used to label the run.
+        run = {
+            'run_id': len(self._runs),
+            'pipeline_class': pipeline_class,
+            'outcome': outcome,
+            'args': tuple(args) if args is not None else tuple(),
+            'kwargs': dict(kwargs) if kwargs is not None else dict(),
+            'raw_matrix_key': raw_matrix_key,
+            'shared_raw_matrix_paths': list()
+        }
+        self._runs.append(run)
+        return run['run_id']
+
+    def add_outcomes(self, pipeline_class, outcomes, *args, **kwargs):
+        # Convenience function to queue up pipeline_class(outcome, *args, **kwargs)
+        # for each outcome. Runs with the same raw matrix inputs share a raw matrix.
+        run_ids = list()
+        for outcome in outcomes:
+            run_args = (outcome,) + args
+            run_id = self.add_run(pipeline_class, outcome, run_args, kwargs,
+                                  raw_matrix_key(pipeline_class, run_args, kwargs))
+            run_ids.append(run_id)
+        return run_ids
+
+    def results(self):
+        return self._results
+
+    def run(self):
+        # Split runs into waves, so that only the first run for each
+        # raw_matrix_key builds the raw matrix.
+        first_wave = list()
+        second_wave = list()
+        seen_raw_matrix_keys = set()
+        for run in self._runs:
+            key = run['raw_matrix_key']
+            if key is not None and key in seen_raw_matrix_keys:
+                second_wave.append(run)
+            else:
+                seen_raw_matrix_keys.add(key)
+                first_wave.append(run)
+
+        log.info('Scheduling %d pipeline runs (%d sharing raw matrices)' % \
+            (len(self._runs), len(second_wave)))
+        results = self._run_wave(first_wave, self._memory_per_run_mb)
+
+        if second_wave:
+            # Pass along the raw matrices the first wave built.
+            raw_matrix_path_by_key = dict()
+            for run, result in zip(first_wave, results):
+                if result['status'] == self.SUCCESS and result['raw_matrix_path']:
+                    raw_matrix_path_by_key[run['raw_matrix_key']] = result['raw_matrix_path']
+            for run in second_wave:
+                if run['raw_matrix_key'] in raw_matrix_path_by_key:
+                    run['shared_raw_matrix_paths'] = [raw_matrix_path_by_key[run['raw_matrix_key']]]
+
+            memory_per_run_mb = self._memory_per_run_mb
+            if memory_per_run_mb is None:
+                observed = [result['peak_memory_mb'] for result in results \
+                            if result['peak_memory_mb'] is not None]
+                if observed:
+                    memory_per_run_mb = max(observed)
+            results.extend(self._run_wave(second_wave, memory_per_run_mb))
+
+        results.sort(key=lambda result: result['run_id'])
+        self._results = results
+        return results
+
+    def _pool_size(self, num_runs, memory_per_run_mb):
+        pool_size = min(self._num_processes, num_runs)
+        if self._memory_budget_mb is not None and memory_per_run_mb:
+            max_by_memory = int(self._memory_budget_mb // memory_per_run_mb)
+            pool_size = min(pool_size, max_by_memory)
+        return max(1, pool_size)
+
+    def _run_wave(self, runs, memory_per_run_mb):
+        if not runs:
+            return list()
+        pool_size = self._pool_size(len(runs), memory_per_run_mb)
+        log.info('Running %d pipelines with %d processes' % (len(runs), pool_size))
+
+        results = list()
+        if pool_size <= 1:
+            # Run in process. Simpler to debug, and avoids pickling.
+            for run in runs:
+                results.append(run_pipeline(run))
+                self._log_progress(results[-1], len(results), len(runs))
+        else:
+            pool = multiprocessing.Pool(pool_size, maxtasksperchild=1)
+            try:
+                for result in pool.imap_unordered(run_pipeline, runs):
+                    results.append(result)
+                    self._log_progress(result, len(results), len(runs))
+            finally:
+                pool.close()
+                pool.join()
+        results.sort(key=lambda result: result['run_id'])
+        return results
+
+    def _log_progress(self, result, num_completed, num_runs):
+        log.info('[%d/%d] %s %s in %.1f seconds' % (num_completed, num_runs, \
+            result['outcome'], result['status'], result['wall_time']))
+        if result['status'] == self.ERROR:
+            log.info(result['error'])
+
+    def report_rows(self):
+        # One row per completed stage of each run, plus a 'total' row per run.
+        rows = list()
+        for result in self._results:
+            for stats in result['stage_stats']:
+                row = {
+                    'run_id': result['run_id'],
+                    'outcome': result['outcome'],
+                    'status': result['status']
+                }
+                row.update(stats)
+                rows.append(row)
+            rows.append({
+                'run_id': result['run_id'],
+                'outcome': result['outcome'],
+                'status': result['status'],
+                'stage': 'total',
+                'wall_time': result['wall_time'],
+                'peak_memory_mb': result['peak_memory_mb']
+            })
+        return rows
+
+    def write_report(self, dest_path):
+        report = DataFrame(self.report_rows(), columns=self.REPORT_COLUMNS)
+        report.to_csv(dest_path, sep='\t', index=False)
+
+def raw_matrix_key(pipeline_class, args, kwargs):
+    # Key of the constructor arguments (positional or keyword, with defaults
+    # filled in) which determine the content of pipeline_class's raw matrix.
+    call_args = inspect.getcallargs(pipeline_class.__init__, None, *args, **kwargs)
+    del call_args['self']
+    arg_names = pipeline_class.RAW_MATRIX_ARGS
+    if arg_names is None:
+        arg_names = sorted(call_args.keys())
+    key = [pipeline_class.__name__]
+    for arg_name in arg_names:
+        key.append((arg_name, _hashable_arg(call_args[arg_name])))
+    return tuple(key)
+
+def _hashable_arg(value):
+    # Hashable equivalent of a constructor argument (e.g., a set of patient ids).
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable_arg(item)) for key, item in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_hashable_arg(item) for item in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable_arg(item) for item in value)
+    hash(value) # TypeError for anything else that cannot be keyed on
+    return value
+
+def run_pipeline(run):
+    # Worker function, module-level so multiprocessing can pickle it.
+    SupervisedLearningPipeline.shared_raw_matrix_paths = \
+        set([os.path.abspath(path) for path in run['shared_raw_matrix_paths']])
+    result = {
+        'run_id': run['run_id'],
+        'outcome': run['outcome'],
+        'status': SupervisedLearningPipelineScheduler.SUCCESS,
+        'error': None,
+        'stage_stats': list(),
+        'raw_matrix_path': None
+    }
+    start_time = time.time()
+    start_peak_memory()
+    try:
+        pipeline = run['pipeline_class'](*run['args'], **run['kwargs'])
+        result['stage_stats'] = pipeline.stage_stats()
+        result['raw_matrix_path'] = pipeline.raw_matrix_path()
+    except (Exception, SystemExit):
+        # ClassifierAnalyzer calls sys.exit for single class test sets,
+        # which should not take down the rest of the batch.
+        result['status'] = SupervisedLearningPipelineScheduler.ERROR
+        result['error'] = traceback.format_exc()
+    finally:
+        SupervisedLearningPipeline.shared_raw_matrix_paths = set()
+        result['peak_memory_mb'] = stop_peak_memory()
+    result['wall_time'] = time.time() - start_time
+    return result
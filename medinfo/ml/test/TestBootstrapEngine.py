@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import unittest
+
+import numpy as np
+from pandas import DataFrame
+from sklearn.metrics import accuracy_score, recall_score, precision_score, f1_score
+from sklearn.metrics import average_precision_score, roc_auc_score
+
+from LocalEnv import TEST_RUNNER_VERBOSITY
+from medinfo.common.test.Util import make_test_suite, MedInfoTestCase
+from medinfo.ml.BootstrapEngine import BootstrapEngine, percentile_ci
+from medinfo.ml.ClassifierAnalyzer import ClassifierAnalyzer
+
+class FixedPredictor:
+    # Predictor with fixed outputs, so ClassifierAnalyzer can be tested without training.
+    def __init__(self, y_pred, y_pred_prob):
+        self._y_pred = y_pred
+        self._y_pred_prob = y_pred_prob
+
+    def predict(self, X):
+        return self._y_pred
+
+    def predict_probability(self, X):
+        return np.column_stack((1 - self._y_pred_prob, self._y_pred_prob))
+
+class TestBootstrapEngine(MedInfoTestCase):
+    def setUp(self):
+        MedInfoTestCase.setUp(self)
+        # Small test set with lots of tied probabilities, to exercise the
+        # tie handling of the rank statistics.
+        random = np.random.RandomState(123456789)
+        self.y_true = random.randint(0, 2, 40)
+        self.y_pred_prob = np.round(0.5 * self.y_true + 0.7 * random.rand(40), 1)
+        self.y_pred = (self.y_pred_prob >= 0.5).astype(int)
+
+    def _expected_scores(self, indices, k, desired_precision):
+        # Straightforward per resample scoring, for comparison.
+        expected = dict([(metric, list()) for metric in BootstrapEngine.SUPPORTED_SCORES])
+        for sample in indices:
+            y_true = self.y_true[sample]
+            y_pred = self.y_pred[sample]
+            y_pred_prob = self.y_pred_prob[sample]
+            if len(np.unique(y_true)) < 2:
+                continue
+            expected['accuracy'].append(accuracy_score(y_true, y_pred))
+            expected['recall'].append(recall_score(y_true, y_pred))
+            expected['precision'].append(precision_score(y_true, y_pred))
+            expected['f1'].append(f1_score(y_true, y_pred))
+            expected['average_precision'].append(average_precision_score(y_true, y_pred_prob))
+            expected['roc_auc'].append(roc_auc_score(y_true, y_pred_prob))
+
+            # Top k with ties broken by original position in the resample.
+            order = sorted(range(len(sample)), key=lambda i: (-y_pred_prob[i], sample[i]))
+            top_k = order[:k]
+            expected['precision_at_k'].append(precision_score(y_true[top_k], y_pred[top_k]))
+
+            num_true_positive = 0
+            for top in range(1, len(sample)):
+                top_k = order[:top]
+                if precision_score(y_true[top_k], y_pred[top_k]) >= desired_precision:
+                    num_true_positive = y_true[top_k].sum()
+            expected['percent_predictably_positive'].append(float(num_true_positive) / len(sample))
+        return expected
+
+    def test_bootstrap_scores(self):
+        for n_jobs in [1, 2]:
+            engine = BootstrapEngine(self.y_true, self.y_pred, self.y_pred_prob,
+                n_bootstrap_iter=200, random_state=123456789, n_jobs=n_jobs)
+            # Force several chunks.
+            BootstrapEngine.MAX_CHUNK_CELLS = 40 * 30
+            try:
+                actual = engine.bootstrap_scores(BootstrapEngine.SUPPORTED_SCORES,
+                                                 k=10, desired_precision=0.9)
+            finally:
+                BootstrapEngine.MAX_CHUNK_CELLS = 2**20
+
+            expected = self._expected_scores(engine.resample_indices(), 10, 0.9)
+            for metric in BootstrapEngine.SUPPORTED_SCORES:
+                self.assertEqual(len(expected[metric]), len(actual[metric]))
+                self.assertTrue(np.allclose(expected[metric], actual[metric]), metric)
+
+    def test_shared_resamples(self):
+        # Same resamples regardless of which metrics are asked for or when.
+        engine = BootstrapEngine(self.y_true, self.y_pred, self.y_pred_prob,
+            n_bootstrap_iter=50, random_state=123456789)
+        roc_auc_scores = engine.bootstrap_scores([BootstrapEngine.ROC_AUC_SCORE])
+        all_scores = engine.bootstrap_scores([BootstrapEngine.ACCURACY_SCORE, BootstrapEngine.ROC_AUC_SCORE])
+        self.assertTrue(np.array_equal(roc_auc_scores['roc_auc'], all_scores['roc_auc']))
+
+        same_seed = BootstrapEngine(self.y_true, self.y_pred, self.y_pred_prob,
+            n_bootstrap_iter=50, random_state=123456789)
+        self.assertTrue(np.array_equal(engine.resample_indices(), same_seed.resample_indices()))
+
+    def test_confidence_intervals(self):
+        engine = BootstrapEngine(self.y_true, self.y_pred, self.y_pred_prob,
+            random_state=123456789)
+        ci_by_metric = engine.confidence_intervals(
+            [BootstrapEngine.ROC_AUC_SCORE, BootstrapEngine.F1_SCORE], 0.95)
+        score = roc_auc_score(self.y_true, self.y_pred_prob)
+        (lower, upper) = ci_by_metric[BootstrapEngine.ROC_AUC_SCORE]
+        self.assertTrue(lower <= score <= upper)
+
+        self.assertEqual((2, 8), percentile_ci(np.arange(10), 0.6))
+
+        self.assertRaises(ValueError, engine.bootstrap_scores, ['bogus'])
+        self.assertRaises(ValueError, engine.bootstrap_scores, [BootstrapEngine.PRECISION_AT_K_SCORE])
+
+    def test_classifier_analyzer_cis(self):
+        # score(ci=...) and bootstrap_score_cis draw and score resamples the
+        # same way, so give the same CIs from the same random state.
+        predictor = FixedPredictor(self.y_pred, self.y_pred_prob)
+        X_test = DataFrame(np.zeros((len(self.y_true), 1)))
+        y_test = DataFrame(self.y_true)
+        for metric in [ClassifierAnalyzer.ACCURACY_SCORE, ClassifierAnalyzer.PRECISION_SCORE,
+                       ClassifierAnalyzer.ROC_AUC_SCORE, ClassifierAnalyzer.PRECISION_AT_K_SCORE]:
+            analyzer = ClassifierAnalyzer(predictor, X_test, y_test, random_state=123456789)
+            (score, lower, upper) = analyzer.score(metric, k=10, ci=0.95, n_bootstrap_iter=50)
+            analyzer = ClassifierAnalyzer(predictor, X_test, y_test, random_state=123456789)
+            score_cis = analyzer.bootstrap_score_cis(0.95, [metric], n_bootstrap_iter=50, k=10)
+            self.assertEqual((score, lower, upper), score_cis[metric])
+            self.assertTrue(lower <= score <= upper)
+
+if __name__=="__main__":
+    suite = make_test_suite(TestBootstrapEngine)
+    unittest.TextTestRunner(verbosity=TEST_RUNNER_VERBOSITY).run(suite)
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from pandas import DataFrame
+
+from LocalEnv import TEST_RUNNER_VERBOSITY
+from medinfo.common.test.Util import make_test_suite, MedInfoTestCase
+from medinfo.ml.FeatureSelector import FeatureSelector
+from medinfo.ml.PipelineStageCache import PipelineStageCache
+from medinfo.ml.SupervisedLearningPipeline import SupervisedLearningPipeline
+
+class StubMatrix:
+    def __init__(self, variable, num_rows, random_state=None):
+        self._num_rows = num_rows
+
+    def write_matrix(self, dest_path):
+        random = np.random.RandomState(123456789)
+        matrix = DataFrame(random.normal(size=(self._num_rows, 6)),
+                           columns=['x%d' % i for i in range(6)])
+        matrix['x5'][::7] = np.nan
+        matrix.insert(0, 'pat_id', range(self._num_rows))
+        matrix.insert(1, 'order_time', '2018-01-01 00:00:00')
+        matrix['outcome'] = (matrix['x0'] + matrix['x1'] > 0).astype(int)
+        matrix.to_csv(dest_path, sep='\t', index=False, na_rep='None')
+
+class StubPipeline(SupervisedLearningPipeline):
+    def __init__(self, data_dir, percent_features_to_select, use_cache=None):
+        SupervisedLearningPipeline.__init__(self, 'LABSTUB', 200, use_cache,
+            random_state=123456789, checkpoint_dir=os.path.join(data_dir, 'checkpoints'))
+        raw_matrix_path = os.path.join(data_dir, 'stub-matrix-raw.tab')
+        SupervisedLearningPipeline._build_raw_feature_matrix(self, StubMatrix, raw_matrix_path)
+
+        params = {
+            'raw_matrix_path': raw_matrix_path,
+            'processed_matrix_path': os.path.join(data_dir, 'stub-matrix-processed.tab'),
+            'features_to_add': {},
+            'imputation_strategies': {},
+            'features_to_remove': ['pat_id', 'order_time'],
+            'features_to_keep': ['x0'],
+            'outcome_label': 'outcome',
+            'selection_problem': FeatureSelector.CLASSIFICATION,
+            'selection_algorithm': FeatureSelector.SELECT_K_BEST,
+            'percent_features_to_select': percent_features_to_select,
+            'pipeline_file_path': __file__,
+            'data_overview': []
+        }
+        SupervisedLearningPipeline._build_processed_feature_matrix(self, params)
+
+    def stages(self):
+        return [stats['stage'] for stats in self.stage_stats()]
+
+class TestPipelineStageCache(MedInfoTestCase):
+    def setUp(self):
+        MedInfoTestCase.setUp(self)
+        self.data_dir = tempfile.mkdtemp()
+        self.cache = PipelineStageCache(os.path.join(self.data_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        MedInfoTestCase.tearDown(self)
+
+    def test_build_key(self):
+        params = {'imputation_strategies': set(['a', 'b', 'c']), 'k': 10}
+        key = self.cache.build_key('impute', params, ['upstream'])
+
+        # Same content in a different order gives the same key.
+        same_params = {'k': 10, 'imputation_strategies': set(['c', 'b', 'a'])}
+        self.assertEqual(key, self.cache.build_key('impute', same_params, ['upstream']))
+
+        # Any change to stage, params, or upstream gives a new key.
+        self.assertNotEqual(key, self.cache.build_key('select', params, ['upstream']))
+        self.assertNotEqual(key, self.cache.build_key('impute', {'k': 10}, ['upstream']))
+        self.assertNotEqual(key, self.cache.build_key('impute', params, ['other']))
+
+        # NumPy scalars key on their values, anything without a stable
+        # serialization is rejected rather than keyed on its repr.
+        self.assertEqual(self.cache.build_key('train', {'C': 0.5}), \
+            self.cache.build_key('train', {'C': np.float32(0.5)}))
+        self.assertRaises(TypeError, self.cache.build_key, 'train', {'model': object()})
+
+    def test_file_and_data_frame_keys(self):
+        file_path = os.path.join(self.data_dir, 'input.tab')
+        with open(file_path, 'w') as input_file:
+            input_file.write('a\tb\n1\t2\n')
+        key = self.cache.file_key(file_path)
+        self.assertEqual(key, self.cache.file_key(file_path))
+        with open(file_path, 'a') as input_file:
+            input_file.write('3\t4\n')
+        self.assertNotEqual(key, self.cache.file_key(file_path))
+
+        # Keyed on the file signature, so rewriting the file (same size)
+        # changes the key too.
+        key = self.cache.file_key(file_path)
+        file_stat = os.stat(file_path)
+        os.utime(file_path, (file_stat.st_atime, file_stat.st_mtime + 1))
+        self.assertNotEqual(key, self.cache.file_key(file_path))
+
+        X = DataFrame({'a': [1.0, 2.0], 'b': [3.0, 4.0]})
+        key = self.cache.data_frame_key(X)
+        self.assertEqual(key, self.cache.data_frame_key(X.copy()))
+        X.iloc[0, 0] = 5.0
+        self.assertNotEqual(key, self.cache.data_frame_key(X))
+
+    def test_save_load(self):
+        key = self.cache.build_key('train', {}, [])
+        self.assertFalse(self.cache.has('train', key))
+        self.cache.save('train', key, {'_predictor': [1, 2, 3]})
+        self.assertTrue(self.cache.has('train', key))
+        self.assertEqual({'_predictor': [1, 2, 3]}, self.cache.load('train', key))
+
+    def test_incremental_recompute(self):
+        # First run computes every stage.
+        first = StubPipeline(self.data_dir, 0.5)
+        self.assertEqual(['raw_matrix', 'impute', 'select_features', 'processed_matrix'], first.stages())
+
+        # Changing a feature selection param reuses the imputed matrix.
+        second = StubPipeline(self.data_dir, 0.34)
+        self.assertEqual(['raw_matrix', 'select_features', 'processed_matrix'], second.stages())
+        self.assertEqual(2, len(second._X_train.columns))
+
+        # Nothing changed, so nothing recomputed, and same results as before.
+        third = StubPipeline(self.data_dir, 0.5)
+        self.assertEqual(['raw_matrix', 'processed_matrix'], third.stages())
+        self.assertEqual(list(first._X_train.columns), list(third._X_train.columns))
+        self.assertTrue((first._X_test.values == third._X_test.values).all())
+        self.assertEqual(first._patIds_train, third._patIds_train)
+        self.assertEqual(first.feat2imputed_dict, third.feat2imputed_dict)
+
+if __name__=="__main__":
+    suite = make_test_suite(TestPipelineStageCache)
+    unittest.TextTestRunner(verbosity=TEST_RUNNER_VERBOSITY).run(suite)
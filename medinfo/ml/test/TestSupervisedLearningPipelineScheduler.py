@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from LocalEnv import TEST_RUNNER_VERBOSITY
+from medinfo.common.test.Util import make_test_suite, MedInfoTestCase
+from medinfo.ml.SupervisedLearningPipeline import SupervisedLearningPipeline
+from medinfo.ml.SupervisedLearningPipeline import pipeline_stage
+from medinfo.ml.SupervisedLearningPipeline import start_peak_memory
+from medinfo.ml.SupervisedLearningPipeline import stop_peak_memory
+from medinfo.ml.SupervisedLearningPipelineScheduler import SupervisedLearningPipelineScheduler
+from medinfo.ml.SupervisedLearningPipelineScheduler import raw_matrix_key
+
+class StubMatrix:
+    # Stands in for a FeatureMatrix class. Logs each build so the test can
+    # count how many times each raw matrix was built across processes.
+    def __init__(self, variable, num_rows, random_state=None):
+        self._var = variable
+        self._num_rows = num_rows
+
+    def write_matrix(self, dest_path):
+        if self._var == 'LABBIG':
+            # Temporarily use a lot of memory, to check it is only reported
+            # for this stage.
+            buffer = bytearray(200 * 1024 * 1024)
+            del buffer
+        with open(dest_path, 'w') as matrix_file:
+            matrix_file.write('%s\t%d\n' % (self._var, self._num_rows))
+        build_log_path = os.path.join(os.path.dirname(dest_path), 'build.log')
+        with open(build_log_path, 'a') as build_log:
+            build_log.write('%s\n' % self._var)
+
+class StubPipeline(SupervisedLearningPipeline):
+    RAW_MATRIX_ARGS = ['variable', 'num_data_points', 'data_dir', 'random_state']
+
+    def __init__(self, variable, num_data_points, data_dir, use_cache=None, random_state=None):
+        SupervisedLearningPipeline.__init__(self, variable, num_data_points,
+                                            use_cache, random_state)
+        if variable == 'LABFAIL':
+            raise ValueError('Cannot build %s' % variable)
+        raw_matrix_path = os.path.join(data_dir, '%s-matrix-raw.tab' % variable)
+        SupervisedLearningPipeline._build_raw_feature_matrix(self, StubMatrix, raw_matrix_path)
+        self._train_stub_predictor()
+
+    @pipeline_stage('train')
+    def _train_stub_predictor(self):
+        return sum(range(1000))
+
+class TestSupervisedLearningPipelineScheduler(MedInfoTestCase):
+    def setUp(self):
+        MedInfoTestCase.setUp(self)
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        MedInfoTestCase.tearDown(self)
+
+    def _read_build_log(self):
+        build_log_path = os.path.join(self.data_dir, 'build.log')
+        with open(build_log_path) as build_log:
+            return sorted(build_log.read().split())
+
+    def test_run_outcomes(self):
+        for num_processes in [1, 2]:
+            scheduler = SupervisedLearningPipelineScheduler(num_processes=num_processes)
+            outcomes = ['LABA', 'LABB', 'LABFAIL', 'LABA', 'LABA']
+            scheduler.add_outcomes(StubPipeline, outcomes, 100, self.data_dir,
+                                   random_state=123456789)
+            results = scheduler.run()
+
+            # Results come back in submission order regardless of scheduling.
+            self.assertEqual(outcomes, [result['outcome'] for result in results])
+            self.assertEqual(range(len(outcomes)), [result['run_id'] for result in results])
+
+            # Failed run is reported, but does not stop the others.
+            statuses = [result['status'] for result in results]
+            expected_statuses = [SupervisedLearningPipelineScheduler.SUCCESS] * len(outcomes)
+            expected_statuses[2] = SupervisedLearningPipelineScheduler.ERROR
+            self.assertEqual(expected_statuses, statuses)
+            self.assertTrue('Cannot build LABFAIL' in results[2]['error'])
+
+            # Repeated outcomes reuse the raw matrix instead of rebuilding it.
+            self.assertEqual(['LABA', 'LABB'], self._read_build_log())
+            os.remove(os.path.join(self.data_dir, 'build.log'))
+
+            # Every stage is timed.
+            for result in [results[0], results[1], results[3]]:
+                stages = [stats['stage'] for stats in result['stage_stats']]
+                self.assertEqual(['raw_matrix', 'train'], stages)
+                for stats in result['stage_stats']:
+                    self.assertTrue(stats['wall_time'] >= 0)
+                    self.assertTrue(stats['peak_memory_mb'] > 0)
+
+    def test_raw_matrix_key(self):
+        # Keyed on the raw matrix args however they are passed, and nothing else.
+        key = raw_matrix_key(StubPipeline, ('LABA', 100, self.data_dir), {'random_state': 1})
+        self.assertEqual(key, raw_matrix_key(StubPipeline, ('LABA',),
+            {'num_data_points': 100, 'data_dir': self.data_dir, 'random_state': 1}))
+        self.assertEqual(key, raw_matrix_key(StubPipeline, ('LABA', 100, self.data_dir),
+            {'random_state': 1, 'use_cache': True}))
+        self.assertNotEqual(key, raw_matrix_key(StubPipeline, ('LABA', 100, self.data_dir),
+            {'random_state': 2}))
+        self.assertNotEqual(key, raw_matrix_key(StubPipeline, ('LABB', 100, self.data_dir),
+            {'random_state': 1}))
+
+        # Runs which differ only in kwargs outside the raw matrix args share one.
+        scheduler = SupervisedLearningPipelineScheduler(num_processes=1)
+        scheduler.add_outcomes(StubPipeline, ['LABA'], 100, self.data_dir, random_state=1)
+        scheduler.add_outcomes(StubPipeline, ['LABA'], 100, self.data_dir, random_state=1,
+                               use_cache=True)
+        scheduler.add_outcomes(StubPipeline, ['LABA'], 100, self.data_dir, random_state=2)
+        scheduler.run()
+        self.assertEqual(['LABA', 'LABA'], self._read_build_log())
+
+        # Without RAW_MATRIX_ARGS, every argument is part of the key.
+        self.assertNotEqual(raw_matrix_key(SupervisedLearningPipeline, ('LABA', 100), {}),
+            raw_matrix_key(SupervisedLearningPipeline, ('LABA', 100), {'timeLimit': 10}))
+
+    def test_stage_peak_memory(self):
+        start_peak_memory()
+        if stop_peak_memory() is None:
+            self.skipTest('Peak memory not measurable on this platform')
+
+        # In process, later runs and stages should not report an earlier peak.
+        scheduler = SupervisedLearningPipelineScheduler(num_processes=1)
+        scheduler.add_outcomes(StubPipeline, ['LABBIG', 'LABA'], 100, self.data_dir,
+                               random_state=123456789)
+        results = scheduler.run()
+        big_stats, small_stats = [result['stage_stats'] for result in results]
+        self.assertEqual(['raw_matrix', 'train'], [stats['stage'] for stats in big_stats])
+        self.assertTrue(big_stats[0]['peak_memory_mb'] > big_stats[1]['peak_memory_mb'] + 150)
+        self.assertTrue(results[0]['peak_memory_mb'] >= big_stats[0]['peak_memory_mb'])
+        self.assertTrue(results[0]['peak_memory_mb'] > results[1]['peak_memory_mb'] + 150)
+        for stats in small_stats:
+            self.assertTrue(big_stats[0]['peak_memory_mb'] > stats['peak_memory_mb'] + 150)
+
+    def test_pool_size(self):
+        scheduler = SupervisedLearningPipelineScheduler(num_processes=8,
+            memory_budget_mb=1000)
+        self.assertEqual(8, scheduler._pool_size(20, None))
+        self.assertEqual(3, scheduler._pool_size(20, 300))
+        self.assertEqual(1, scheduler._pool_size(20, 5000))
+        self.assertEqual(2, scheduler._pool_size(2, 10))
+
+    def test_write_report(self):
+        scheduler = SupervisedLearningPipelineScheduler(num_processes=1)
+        scheduler.add_outcomes(StubPipeline, ['LABA', 'LABFAIL'], 100, self.data_dir,
+                               random_state=123456789)
+        scheduler.run()
+        report_path = os.path.join(self.data_dir, 'report.tab')
+        scheduler.write_report(report_path)
+
+        with open(report_path) as report_file:
+            lines = report_file.read().splitlines()
+        self.assertEqual(SupervisedLearningPipelineScheduler.REPORT_COLUMNS,
+                         lines[0].split('\t'))
+        stages = [(line.split('\t')[1], line.split('\t')[3]) for line in lines[1:]]
+        expected_stages = [('LABA', 'raw_matrix'), ('LABA', 'train'),
+                           ('LABA', 'total'), ('LABFAIL', 'total')]
+        self.assertEqual(expected_stages, stages)
+
+if __name__=="__main__":
+    suite = make_test_suite(TestSupervisedLearningPipelineScheduler)
+    unittest.TextTestRunner(verbosity=TEST_RUNNER_VERBOSITY).run(suite)
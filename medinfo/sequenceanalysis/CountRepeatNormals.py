@@ -1,11 +1,25 @@
+import sys
+import time
+import datetime
 from collections import defaultdict
 import numpy as np
 
 from SequenceAnalyzer import SequenceAnalyzer
 
+# Default max number of rows for the array engine to process at a time (extended to the next patient boundary)
+DEFAULT_CHUNK_SIZE = 1000000
+
+MICROSECONDS_PER_DAY = 86400 * 1000000
+
+def timedelta_microseconds(delta):
+  return delta.days * MICROSECONDS_PER_DAY + delta.seconds * 1000000 + delta.microseconds
+
 class CountRepeatNormals(object):
   def __init__(self, patient_col, labresult_col, datetime_col, window_sizes):
     self.window_sizes = window_sizes
+    self.patient_col = patient_col
+    self.labresult_col = labresult_col
+    self.datetime_col = datetime_col
     self.global_stats = defaultdict(lambda: defaultdict(lambda: np.array([0, 0])))
 
     # Extract the patient_id from a row, where patient_id is in column 0
@@ -71,7 +85,10 @@ class CountRepeatNormals(object):
       counts[key][0] += value
       if row_added:
         counts[key][1] += value
+    self.add_counts(base_name, counts)
 
+  def add_counts(self, base_name, counts):
+    """Add the counts of one run into global_stats"""
     # switch (window_size, 0) to mean no priors,
     # and switch (window_size, None) to be the total count
     total_counts = defaultdict(lambda: np.array([0, 0]))
@@ -86,3 +103,158 @@ class CountRepeatNormals(object):
 
     for k, v in counts.iteritems():
       self.global_stats[base_name][k] += v
+
+  def run_vectorized(self, base_name, results, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Drop-in alternative to run with identical results, using the array engine (count_chunk)
+    rather than queues per row and window.  Results can be a generator,
+    read chunk_size rows at a time (extended to the next patient boundary) to bound memory use.
+    Expects the results of each patient together and in datetime order.
+    """
+    counts = defaultdict(lambda: np.array([0, 0]))
+    for chunk_rows in self.iter_patient_row_chunks(results, chunk_size):
+      patient_ids = [row[self.patient_col] for row in chunk_rows]
+      datetimes = [row[self.datetime_col] for row in chunk_rows]
+      normal_flags = np.array(['InRange' in row[self.labresult_col] for row in chunk_rows], dtype=bool)
+      self.count_chunk(patient_ids, datetimes, normal_flags, counts)
+    self.add_counts(base_name, counts)
+
+  def run_arrays(self, base_name, patient_ids, datetimes, normal_flags, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Same as run_vectorized, but on parallel arrays (e.g., memory mapped) of the patient ids,
+    datetimes (datetime64 or datetime objects) and normal (in range) flags of the results,
+    sorted by patient and then datetime.
+    """
+    counts = defaultdict(lambda: np.array([0, 0]))
+    for start, end in self.iter_patient_chunk_bounds(patient_ids, chunk_size):
+      self.count_chunk(patient_ids[start:end], datetimes[start:end], normal_flags[start:end], counts)
+    self.add_counts(base_name, counts)
+
+  def iter_patient_row_chunks(self, results, chunk_size):
+    """Generate lists of about chunk_size rows, only splitting between patients"""
+    chunk_rows = []
+    for row in results:
+      if len(chunk_rows) >= chunk_size and row[self.patient_col] != chunk_rows[-1][self.patient_col]:
+        yield chunk_rows
+        chunk_rows = []
+      chunk_rows.append(row)
+    if chunk_rows:
+      yield chunk_rows
+
+  def iter_patient_chunk_bounds(self, patient_ids, chunk_size):
+    """Generate (start, end) index bounds of about chunk_size rows, only splitting between patients"""
+    num_rows = len(patient_ids)
+    start = 0
+    while start < num_rows:
+      end = start + chunk_size
+      while end < num_rows:
+        # Extend to the next patient boundary, looking ahead in chunk_size blocks
+        block = np.asarray(patient_ids[end-1:end+chunk_size])
+        changes = np.flatnonzero(block[1:] != block[:-1])
+        if len(changes) > 0:
+          end += changes[0]
+          break
+        end += chunk_size
+      end = min(end, num_rows)
+      yield start, end
+      start = end
+
+  def count_chunk(self, patient_ids, datetimes, normal_flags, counts):
+    """Array engine.  Add into counts the same (window_days, number_consecutive_normals) keys
+    as the sequence_analyzer pipeline produces for each result and window, for a chunk of whole patients.
+
+    Per window W, for each result of a patient:
+      - The first result, or results more than W after the previous result, have no prior history (None).
+      - Otherwise, count the consecutive normal results (since the last abnormal result) within W before it.
+    Finds the start of each window with searchsorted over the result times, and the start of each run of normals
+    with a cumulative max of the abnormal result positions, segmented by patient.
+    """
+    patient_ids = np.asarray(patient_ids)
+    normal_flags = np.asarray(normal_flags, dtype=bool)
+    times = np.asarray(datetimes, dtype='datetime64[us]').astype(np.int64)
+    num_rows = len(times)
+    if num_rows == 0:
+      return
+    window_lengths = [timedelta_microseconds(window_size) for window_size in self.window_sizes]
+    max_window = max(window_lengths)
+
+    indices = np.arange(num_rows)
+    is_patient_start = np.ones(num_rows, dtype=bool)
+    is_patient_start[1:] = (patient_ids[1:] != patient_ids[:-1])
+    patient_starts = np.maximum.accumulate(np.where(is_patient_start, indices, 0))
+
+    gaps = np.zeros(num_rows, dtype=np.int64)
+    gaps[1:] = times[1:] - times[:-1]
+    if (gaps[~is_patient_start] < 0).any():
+      raise ValueError('Expected results in datetime order within each patient')
+
+    # Cumulative times, with gaps longer than any window (and between patients) clipped to just over the longest window.
+    # Preserves whether any two results of a patient are within a window, while keeping a sorted array
+    # to searchsorted through that cannot overflow from large spans of time.
+    assert num_rows < (2**63 - 1) // (max_window + 1)
+    clipped_gaps = np.minimum(gaps, max_window + 1)
+    clipped_gaps[is_patient_start] = max_window + 1
+    clipped_times = np.cumsum(clipped_gaps)
+
+    # Start of the current run of normal results, before each result
+    after_abnormals = np.where(normal_flags, 0, indices + 1)
+    run_starts = np.empty(num_rows, dtype=np.int64)
+    run_starts[0] = 0
+    run_starts[1:] = np.maximum.accumulate(after_abnormals)[:-1]
+    run_starts = np.maximum(run_starts, patient_starts)
+
+    normal_weights = normal_flags.astype(np.int64)
+    for window_size, window_length in zip(self.window_sizes, window_lengths):
+      window_starts = np.searchsorted(clipped_times, clipped_times - window_length, side='left')
+      number_consecutive_normals = indices - np.maximum(run_starts, window_starts)
+      # -1 for no prior history (None)
+      has_prior_history = ~is_patient_start & (gaps <= window_length)
+      number_consecutive_normals[~has_prior_history] = -1
+
+      total_counts = np.bincount(number_consecutive_normals + 1)
+      normal_counts = np.bincount(number_consecutive_normals + 1, weights=normal_weights, minlength=len(total_counts)).astype(np.int64)
+      for value in np.flatnonzero(total_counts):
+        key = (window_size.days, None if value == 0 else int(value - 1))
+        counts[key][0] += total_counts[value]
+        counts[key][1] += normal_counts[value]
+
+def synthetic_lab_stream(num_patients, results_per_patient, base_name='LABTEST', random_state=None):
+  """Synthetic lab results sorted by patient then time, [patient_id, result, datetime] rows like CountRepeatNormals expects,
+  with about 3/4 of the results in range and random 0 to 10 day gaps between results.
+  """
+  if random_state is None:
+    random_state = np.random.RandomState(0)
+  start = datetime.datetime(2014, 1, 1)
+  rows = []
+  for patient_id in xrange(num_patients):
+    result_datetime = start
+    for _ in xrange(results_per_patient):
+      result_datetime += datetime.timedelta(minutes=int(random_state.randint(0, 10 * 24 * 60)))
+      flag = 'InRange' if random_state.random_sample() < 0.75 else 'High'
+      rows.append([patient_id, '%s(%s)' % (base_name, flag), result_datetime])
+  return rows
+
+def benchmark(num_patients=1000, results_per_patient=100, window_days=(1, 2, 4, 7, 30, 90)):
+  """Print rows/sec of the interpreted (run) and compiled (run_compiled) SequenceAnalyzer executions
+  of CountRepeatNormals over a synthetic multi-patient lab stream, and of the array engine (run_arrays).
+  """
+  window_sizes = [datetime.timedelta(days=days) for days in window_days]
+  rows = synthetic_lab_stream(num_patients, results_per_patient)
+  counter = CountRepeatNormals(0, 1, 2, window_sizes)
+  for run_name in ('run', 'run_compiled'):
+    run_fn = getattr(counter.sequence_analyzer, run_name)
+    timer = time.time()
+    for return_values in run_fn(rows, window_sizes):
+      pass
+    timer = time.time() - timer
+    print '%s: %d rows x %d windows in %.2f sec (%.0f rows/sec)' % (run_name, len(rows), len(window_sizes), timer, len(rows) / timer)
+
+  patient_ids = np.array([row[0] for row in rows])
+  datetimes = np.array([row[2] for row in rows], dtype='datetime64[us]')
+  normal_flags = np.array(['InRange' in row[1] for row in rows])
+  timer = time.time()
+  counter.run_arrays('LABTEST', patient_ids, datetimes, normal_flags)
+  timer = time.time() - timer
+  print '%s: %d rows x %d windows in %.2f sec (%.0f rows/sec)' % ('run_arrays', len(rows), len(window_sizes), timer, len(rows) / timer)
+
+if __name__ == '__main__':
+  # Usage: CountRepeatNormals.py [num_patients] [results_per_patient]
+  benchmark(*[int(arg) for arg in sys.argv[1:3]])
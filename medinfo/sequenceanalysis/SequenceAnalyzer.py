@@ -9,6 +9,8 @@ class SequenceAnalyzer(object):
     self.num_return_values = 0
     self.built = False
     self.pipeline = []
+    # Raw arguments of each pipeline stage, for run_compiled to compile the stages from
+    self.stage_args = []
 
   #TODO: do something cool where each function's input variables can change / are fluid
   def split_data_on_key(self, extract_split_key_fn):
@@ -36,6 +38,7 @@ class SequenceAnalyzer(object):
         handle_sentinel_queue_fn(window_size, vars_dict, queue[0][1], row)
         queue.clear()
     self.pipeline.append(('handle_sentinel_queue', func))
+    self.stage_args.append(('handle_sentinel_queue', (handle_sentinel_queue_fn,)))
 
   def pop_queue(self, extract_datetime_fn, emptied_queue_handler_fn=None):
     def func(window_size, queue, vars_dict, row):
@@ -47,10 +50,13 @@ class SequenceAnalyzer(object):
       if emptied_queue_handler_fn is not None and popped_queue and not queue:
         emptied_queue_handler_fn(window_size, vars_dict, row)
     self.initialized_pop_queue = True
+    self.extract_datetime_fn = extract_datetime_fn
     self.pipeline.append(('pop_queue', func))
+    self.stage_args.append(('pop_queue', (extract_datetime_fn, emptied_queue_handler_fn)))
 
   def extract_key_value(self, extract_key_value_fn):
     self.pipeline.append(('extract_key_value', extract_key_value_fn))
+    self.stage_args.append(('extract_key_value', (extract_key_value_fn,)))
     self.initialized_extract_key_value = True
     self.num_return_values += 1
 
@@ -58,6 +64,7 @@ class SequenceAnalyzer(object):
     def func(window_size, queue, vars_dict, row):
       vars_dict[var_name] = set_value_fn(window_size, queue, vars_dict, row)
     self.pipeline.append(('set_var', func))
+    self.stage_args.append(('set_var', (var_name, set_value_fn)))
 
   def add_row(self, condition_fn):
     def func(window_size, queue, vars_dict, row):
@@ -68,6 +75,7 @@ class SequenceAnalyzer(object):
       return vars_dict['row_added']
 
     self.pipeline.append(('add_row', func))
+    self.stage_args.append(('add_row', (condition_fn,)))
     self.initialized_add_row = True
     self.num_return_values += 1
 
@@ -78,6 +86,7 @@ class SequenceAnalyzer(object):
         if add_sentinel:
           queue.append((None, row))
     self.pipeline.append(('clear_queue', func))
+    self.stage_args.append(('clear_queue', (condition_fn, add_sentinel)))
 
   def build(self, num_return_values):
     # Ensure that extract_key_value, pop_queue, and add_row are all called,
@@ -90,6 +99,63 @@ class SequenceAnalyzer(object):
     assert num_return_values == self.num_return_values
     self.built = True
 
+  def compile_stage(self, name, args, datetime_cache):
+    """Pre-bind a pipeline stage into a callable for run_compiled,
+    so there is no dispatch on stage names per row and bin.
+    All compiled stages take the same arguments, including the row datetime
+    (extracted once per row rather than once per bin) and the list of return values to append to.
+    datetime_cache - (row, datetime) by id(row) of the rows processed so far in the calling run_compiled.
+    """
+    if name == 'handle_sentinel_queue':
+      handle_sentinel_queue_fn, = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        if queue and queue[0][0] is None:
+          handle_sentinel_queue_fn(window_size, vars_dict, queue[0][1], row)
+          queue.clear()
+    elif name == 'pop_queue':
+      extract_datetime_fn, emptied_queue_handler_fn = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        popped_queue = False
+        if queue and queue[0][0] is not None:
+          while queue:
+            # Queued rows were all processed before, so reuse their datetimes rather than extracting again
+            (cached_row, queued_datetime) = datetime_cache.get(id(queue[0]), (None, None))
+            if cached_row is not queue[0]:
+              queued_datetime = extract_datetime_fn(queue[0])
+            if row_datetime - queued_datetime <= window_size:
+              break
+            popped_queue = True
+            queue.popleft()
+        if emptied_queue_handler_fn is not None and popped_queue and not queue:
+          emptied_queue_handler_fn(window_size, vars_dict, row)
+    elif name == 'extract_key_value':
+      extract_key_value_fn, = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        return_values.append(extract_key_value_fn(window_size, queue, vars_dict))
+    elif name == 'set_var':
+      var_name, set_value_fn = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        vars_dict[var_name] = set_value_fn(window_size, queue, vars_dict, row)
+    elif name == 'add_row':
+      condition_fn, = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        row_added = bool(condition_fn(window_size, queue, vars_dict, row))
+        if row_added:
+          queue.append(row)
+        vars_dict['row_added'] = row_added
+        return_values.append(row_added)
+    elif name == 'clear_queue':
+      condition_fn, add_sentinel = args
+      def stage(window_size, queue, vars_dict, row, row_datetime, return_values):
+        if condition_fn(window_size, queue, vars_dict, row):
+          queue.clear()
+          if add_sentinel:
+            queue.append((None, row))
+    else:
+      # Split data stage is applied to the whole data set by run_compiled, not per row
+      stage = None
+    return stage
+
   def run(self, data, bins):
     # check if built
     assert self.built
@@ -121,6 +187,35 @@ class SequenceAnalyzer(object):
               func(window_size, queue, vars_dict, row)
           yield return_values
 
+  def run_compiled(self, data, bins):
+    """Same results as run, but executing the stages compiled by build.
+    Extracts each row's datetime once for all bins, and keeps the queue and vars of each bin together,
+    rather than zipping parallel lists for every row.
+    Stages are compiled for each call, with their own datetime cache, so separate calls are independent.
+    """
+    assert self.built
+    data_split_generator = data
+    if self.pipeline[0][0] == 'split_data':
+      data_split_generator = self.pipeline[0][1](data)
+    datetime_cache = {}
+    stages = [self.compile_stage(name, args, datetime_cache) for name, args in self.stage_args]
+    stages = [stage for stage in stages if stage is not None]
+    extract_datetime_fn = self.extract_datetime_fn
+
+    for data_split in data_split_generator:
+      datetime_cache.clear()
+      bin_states = [(window_size, deque(), dict(self.vars)) for window_size in bins]
+      for row in data_split:
+        row_datetime = extract_datetime_fn(row)
+        # Keep the row with its datetime, so a reused id of a since freed row is never mistaken for it
+        datetime_cache[id(row)] = (row, row_datetime)
+        for window_size, queue, vars_dict in bin_states:
+          vars_dict['row_added'] = False
+          return_values = []
+          for stage in stages:
+            stage(window_size, queue, vars_dict, row, row_datetime, return_values)
+          yield return_values
+
 
 class utils(object):
   NUMBER_SECONDS_IN_A_DAY = 86400
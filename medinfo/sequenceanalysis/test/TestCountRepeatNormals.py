@@ -237,6 +237,48 @@ class TestCountRepeatNormals(unittest.TestCase):
       }
     self.assertEqual(expectedResults, global_stats)
 
+    # Array engine produces identical results
+    vectorized_analyzer = CountRepeatNormals(patient_col=0, labresult_col=1, datetime_col=2, window_sizes=window_sizes)
+    for base_name, results in data:
+      vectorized_analyzer.run_vectorized(base_name, results, chunk_size=3)
+    self.assertEqual(expectedResults, normalize_dict(vectorized_analyzer.global_stats))
+
+  def testCountRepeatNormalsArrays(self):
+    """Array engine matches the sequence analyzer pipeline over a larger stream, however chunked"""
+    from medinfo.sequenceanalysis.CountRepeatNormals import synthetic_lab_stream
+
+    def normalize_dict(d):
+      return dict([(k1, dict([(k2, list(v2)) for k2, v2 in v1.iteritems()])) for k1, v1 in d.iteritems()])
+
+    rows = synthetic_lab_stream(40, 60, random_state=np.random.RandomState(1))
+    rows += synthetic_lab_stream(1, 5)  # Another patient with results at the same time
+    rows[-1][2] = rows[-2][2]
+    # Windows with fractional days, and multiple windows with the same number of days
+    window_sizes = [datetime.timedelta(days=1), datetime.timedelta(days=1, hours=12), datetime.timedelta(days=7), datetime.timedelta(days=30)]
+
+    expected_analyzer = CountRepeatNormals(0, 1, 2, window_sizes)
+    expected_analyzer.run('LABTEST', rows)
+    expected = normalize_dict(expected_analyzer.global_stats)
+
+    patient_ids = np.array([row[0] for row in rows])
+    datetimes = np.array([row[2] for row in rows], dtype='datetime64[us]')
+    normal_flags = np.array(['InRange' in row[1] for row in rows])
+    for chunk_size in [1, 7, 100, 10000]:
+      vectorized_analyzer = CountRepeatNormals(0, 1, 2, window_sizes)
+      vectorized_analyzer.run_vectorized('LABTEST', iter(rows), chunk_size=chunk_size)
+      self.assertEqual(expected, normalize_dict(vectorized_analyzer.global_stats))
+
+      array_analyzer = CountRepeatNormals(0, 1, 2, window_sizes)
+      array_analyzer.run_arrays('LABTEST', patient_ids, datetimes, normal_flags, chunk_size=chunk_size)
+      self.assertEqual(expected, normalize_dict(array_analyzer.global_stats))
+
+    # Chunks only split between patients
+    bounds = list(array_analyzer.iter_patient_chunk_bounds(patient_ids, 100))
+    self.assertEqual(0, bounds[0][0])
+    self.assertEqual(len(rows), bounds[-1][1])
+    for (start, end) in bounds[1:]:
+      self.assertNotEqual(patient_ids[start-1], patient_ids[start])
+
 def suite():
   """Returns the suite of tests to run for this test class / module.
   Use unittest.makeSuite methods which simply extracts all of the
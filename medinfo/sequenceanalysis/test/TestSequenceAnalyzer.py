@@ -312,6 +312,36 @@ class TestSequenceAnalyzer(unittest.TestCase):
       }
     self.assertEqual(expectedResults, global_stats)
 
+  def testRunCompiled(self):
+    """Compiled execution yields exactly the same return values as the interpreted run"""
+    from medinfo.sequenceanalysis.CountRepeatNormals import CountRepeatNormals, synthetic_lab_stream
+    window_sizes = [datetime.timedelta(days=size) for size in [1, 2, 4, 7, 30, 90]]
+    rows = synthetic_lab_stream(50, 40)
+
+    sequence_analyzer = CountRepeatNormals(0, 1, 2, window_sizes).sequence_analyzer
+    expected = list(sequence_analyzer.run(rows, window_sizes))
+    self.assertEqual(len(rows) * len(window_sizes), len(expected))
+    self.assertEqual(expected, list(sequence_analyzer.run_compiled(rows, window_sizes)))
+    # Streamed input, with row objects freed as they go
+    self.assertEqual(expected, list(sequence_analyzer.run_compiled((list(row) for row in rows), window_sizes)))
+    # Interleaved calls on the same analyzer do not share any state
+    interleaved = zip(sequence_analyzer.run_compiled(rows, window_sizes), sequence_analyzer.run_compiled(rows[::-1], window_sizes))
+    self.assertEqual(expected, [first for first, second in interleaved])
+    self.assertEqual(list(sequence_analyzer.run(rows[::-1], window_sizes)), [second for first, second in interleaved])
+
+    # Different stage order, no sentinels or emptied queue handler, and returning the queued row count
+    sequence_analyzer = SequenceAnalyzer()
+    sequence_analyzer.split_data_on_key(lambda row: row[0])
+    sequence_analyzer.initialize_vars({'num_added': 0})
+    sequence_analyzer.add_row(lambda window_size, queue, vars_dict, row: 'InRange' in row[1])
+    sequence_analyzer.pop_queue(lambda row: row[2])
+    sequence_analyzer.set_var('num_added', lambda window_size, queue, vars_dict, row: vars_dict['num_added'] + vars_dict['row_added'])
+    sequence_analyzer.extract_key_value(lambda window_size, queue, vars_dict: ((window_size.days, len(queue)), vars_dict['num_added']))
+    sequence_analyzer.clear_queue(lambda window_size, queue, vars_dict, row: len(queue) > 3)
+    sequence_analyzer.build(2)
+    expected = list(sequence_analyzer.run(rows, window_sizes))
+    self.assertEqual(expected, list(sequence_analyzer.run_compiled(rows, window_sizes)))
+
 def suite():
   """Returns the suite of tests to run for this test class / module.
   Use unittest.makeSuite methods which simply extracts all of the
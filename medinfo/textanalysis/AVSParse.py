@@ -8,6 +8,9 @@ import sys, os;
 import time;
 import json;
 import re, string;
+import random;
+import resource;
+import multiprocessing;
 from datetime import datetime;
 from optparse import OptionParser
 from cStringIO import StringIO;
@@ -74,6 +77,7 @@ SECTION_HEADER_PREFIXES = \
     ];
 
 PAGER_NUM_DIGITS = 5;
+PAGER_PREFIX_REGEXP = re.compile("(?i)pager");  # Token that indicates the next is a pager number (as opposed to say, a zip code)
 
 # Accumulate list of key questions to search for / answer by default
 DEFAULT_QUESTION_MODULES = list();
@@ -98,15 +102,14 @@ class FollowupPhoneQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         phoneNumbers = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                tokenModels = lineModel["tokenModels"];
-                for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
-                    (phoneStr, phoneTokenModels) = self.extractPhoneTokenModels(iToken, tokenModels);
-                    if len(phoneTokenModels) > 0:
-                        for phoneTokenModel in phoneTokenModels:
-                            phoneTokenModel[self.getName()] = True;
-                        phoneNumbers.append(phoneStr);
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            tokenModels = lineModel["tokenModels"];
+            for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
+                (phoneStr, phoneTokenModels) = self.extractPhoneTokenModels(iToken, tokenModels);
+                if len(phoneTokenModels) > 0:
+                    for phoneTokenModel in phoneTokenModels:
+                        phoneTokenModel[self.getName()] = True;
+                    phoneNumbers.append(phoneStr);
         return set(phoneNumbers);   # Ensure a unique set
 DEFAULT_QUESTION_MODULES.append(FollowupPhoneQuestion());
 
@@ -124,20 +127,19 @@ class TeamPagerQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         pagerNumbers = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                tokenModels = lineModel["tokenModels"];
-                for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
-                    pagerPrefix = (iToken-1 >= 0 and re.match("(?i)pager", tokenModels[iToken-1]["rawToken"]) );    # Check if a prefix that indicates this is a 5 digit pager number (as opposed to say, a zip code)
-
-                    strippedToken = tokenModel["noPunctuationToken"];
-                    if len(strippedToken) > 0 and strippedToken[0] == "p": # Drop leading p for possible text pager prefix
-                        pagerPrefix = True;
-                        strippedToken = strippedToken[1:];
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            tokenModels = lineModel["tokenModels"];
+            for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
+                pagerPrefix = (iToken-1 >= 0 and PAGER_PREFIX_REGEXP.match(tokenModels[iToken-1]["rawToken"]) );    # Check if a prefix that indicates this is a 5 digit pager number (as opposed to say, a zip code)
+
+                strippedToken = tokenModel["noPunctuationToken"];
+                if len(strippedToken) > 0 and strippedToken[0] == "p": # Drop leading p for possible text pager prefix
+                    pagerPrefix = True;
+                    strippedToken = strippedToken[1:];
                     
-                    if pagerPrefix and strippedToken.isdigit() and len(strippedToken) == self.expectedNumDigits:
-                        tokenModel[self.getName()] = True;
-                        pagerNumbers.append(strippedToken);
+                if pagerPrefix and strippedToken.isdigit() and len(strippedToken) == self.expectedNumDigits:
+                    tokenModel[self.getName()] = True;
+                    pagerNumbers.append(strippedToken);
         return set(pagerNumbers);   # Ensure a unique set
 DEFAULT_QUESTION_MODULES.append(TeamPagerQuestion());
 
@@ -167,16 +169,15 @@ class PrimaryDxQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         diagnosisList = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                line = lineModel["stripLine"];
-                if line.startswith("Your primary diagnosis was:"):
-                    diagnosisStr = line[line.find(":")+1:].strip(); # Pull out string after colon
-                    if diagnosisStr != "Not on File":   # Default value if not populated.  Ignore this as blank / empty
-                        diagnosisList.append(diagnosisStr);
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            line = lineModel["stripLine"];
+            if line.startswith("Your primary diagnosis was:"):
+                diagnosisStr = line[line.find(":")+1:].strip(); # Pull out string after colon
+                if diagnosisStr != "Not on File":   # Default value if not populated.  Ignore this as blank / empty
+                    diagnosisList.append(diagnosisStr);
                     
-                    for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
-                        tokenModel[self.getName()] = True;  # Highlight the entire line, even if a valid diagnosis not found, so reviewer knows where to look
+                for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
+                    tokenModel[self.getName()] = True;  # Highlight the entire line, even if a valid diagnosis not found, so reviewer knows where to look
 
         return set(diagnosisList);   # Ensure a unique set
 DEFAULT_QUESTION_MODULES.append(PrimaryDxQuestion());
@@ -189,36 +190,35 @@ class NewRxQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         medNames = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                tokenModels = lineModel["tokenModels"];
-                for iToken, tokenModel in enumerate(tokenModels):   
-                    if iToken-1 >= 0 and tokenModels[iToken-1]["rawToken"] == "-":  # Previous token was "-" symbol
-                        if tokenModel["firstAlpha"]:    # Make sure not a number, probably pharmacy address
-                            tokenModel[self.getName()] = True;
-                            medNames.append(tokenModel["rawToken"]);
-                    if iToken-1 >= 0 and self.getName() in tokenModels[iToken-1]:  # Previous word was counted
-                        # If still an alphabetic word, probably extended drug name
-                        if tokenModel["firstAlpha"]:
-                            tokenModel[self.getName()] = True;
-                            medNames[-1] += " "+tokenModel["rawToken"];   # Append to last answer
-                        elif tokenModel["rawToken"] == "-": 
-                            # Ran into another delimiter but still looks like prior text.  
-                            # Prior must not have been a drug.  Was a city name or something.  Go back and undo label
-                            iPriorToken = iToken-1;
-                            while iPriorToken >= 0 and self.getName() in tokenModels[iPriorToken]:
-                                del tokenModels[iPriorToken][self.getName()];
-                                iPriorToken -= 1;
-                            medNames.pop();
-                nTokens = len(tokenModels);
-                if nTokens-1 >= 0 and self.getName() in tokenModels[nTokens-1]:  # Last word was counted
-                    # But ran into end of line.  
-                    # Last must not have been a drug.  Was a city name or something.  Go back and undo labels
-                    iPriorToken = nTokens-1;
-                    while iPriorToken >= 0 and self.getName() in tokenModels[iPriorToken]:
-                        del tokenModels[iPriorToken][self.getName()];
-                        iPriorToken -= 1;
-                    medNames.pop();
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            tokenModels = lineModel["tokenModels"];
+            for iToken, tokenModel in enumerate(tokenModels):   
+                if iToken-1 >= 0 and tokenModels[iToken-1]["rawToken"] == "-":  # Previous token was "-" symbol
+                    if tokenModel["firstAlpha"]:    # Make sure not a number, probably pharmacy address
+                        tokenModel[self.getName()] = True;
+                        medNames.append(tokenModel["rawToken"]);
+                if iToken-1 >= 0 and self.getName() in tokenModels[iToken-1]:  # Previous word was counted
+                    # If still an alphabetic word, probably extended drug name
+                    if tokenModel["firstAlpha"]:
+                        tokenModel[self.getName()] = True;
+                        medNames[-1] += " "+tokenModel["rawToken"];   # Append to last answer
+                    elif tokenModel["rawToken"] == "-": 
+                        # Ran into another delimiter but still looks like prior text.  
+                        # Prior must not have been a drug.  Was a city name or something.  Go back and undo label
+                        iPriorToken = iToken-1;
+                        while iPriorToken >= 0 and self.getName() in tokenModels[iPriorToken]:
+                            del tokenModels[iPriorToken][self.getName()];
+                            iPriorToken -= 1;
+                        medNames.pop();
+            nTokens = len(tokenModels);
+            if nTokens-1 >= 0 and self.getName() in tokenModels[nTokens-1]:  # Last word was counted
+                # But ran into end of line.  
+                # Last must not have been a drug.  Was a city name or something.  Go back and undo labels
+                iPriorToken = nTokens-1;
+                while iPriorToken >= 0 and self.getName() in tokenModels[iPriorToken]:
+                    del tokenModels[iPriorToken][self.getName()];
+                    iPriorToken -= 1;
+                medNames.pop();
         return set(medNames);   # Ensure a unique set
 DEFAULT_QUESTION_MODULES.append(NewRxQuestion());
 
@@ -230,19 +230,18 @@ class StopRxQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         medNames = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                tokenModels = lineModel["tokenModels"];
-                for iToken, tokenModel in enumerate(tokenModels):   
-                    if iToken == 0 and tokenModel["isalnum"]:  # First tokens of non-blank lines should be med names
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            tokenModels = lineModel["tokenModels"];
+            for iToken, tokenModel in enumerate(tokenModels):   
+                if iToken == 0 and tokenModel["isalnum"]:  # First tokens of non-blank lines should be med names
+                    tokenModel[self.getName()] = True;
+                    medNames.append(tokenModel["rawToken"]);
+                if iToken-1 >= 0 and self.getName() in tokenModels[iToken-1]:  # Previous word was counted
+                    # If still an alphabetic word, probably extended drug name
+                    if tokenModel["firstAlpha"]:
                         tokenModel[self.getName()] = True;
-                        medNames.append(tokenModel["rawToken"]);
-                    if iToken-1 >= 0 and self.getName() in tokenModels[iToken-1]:  # Previous word was counted
-                        # If still an alphabetic word, probably extended drug name
-                        if tokenModel["firstAlpha"]:
-                            tokenModel[self.getName()] = True;
-                            medNames[-1] += " "+tokenModel["rawToken"];   # Append to last answer
-                nTokens = len(tokenModels);
+                        medNames[-1] += " "+tokenModel["rawToken"];   # Append to last answer
+            nTokens = len(tokenModels);
         return set(medNames);   # Ensure a unique set
 DEFAULT_QUESTION_MODULES.append(StopRxQuestion());
 
@@ -258,21 +257,20 @@ class FollowupScheduleQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         scheduleDates = list();
     
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                line = lineModel["stripLine"];
-                endDateTimePos = max( line.find(" AM "), line.find(" PM ") );   # Expect the datetime string to end with AM or PM
-                if endDateTimePos > 0:
-                    candidateStr = line[:endDateTimePos+3]; # +3 to include the space and AM or PM
-                    parsedValue = parseDateValue(candidateStr);
-                    if isinstance(parsedValue,datetime):    # Valid date parsed out
-                        scheduleDates.append(candidateStr);  # For consistency, should only be storing string values???
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            line = lineModel["stripLine"];
+            endDateTimePos = max( line.find(" AM "), line.find(" PM ") );   # Expect the datetime string to end with AM or PM
+            if endDateTimePos > 0:
+                candidateStr = line[:endDateTimePos+3]; # +3 to include the space and AM or PM
+                parsedValue = parseDateValue(candidateStr);
+                if isinstance(parsedValue,datetime):    # Valid date parsed out
+                    scheduleDates.append(candidateStr);  # For consistency, should only be storing string values???
                         
-                        # Label all tokens up to the AM / PM
-                        for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
-                            tokenModel[self.getName()] = True;
-                            if tokenModel["rawToken"] in ("AM","PM"):
-                                break;  # Don't label beyond the date string
+                    # Label all tokens up to the AM / PM
+                    for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
+                        tokenModel[self.getName()] = True;
+                        if tokenModel["rawToken"] in ("AM","PM"):
+                            break;  # Don't label beyond the date string
 
         return set(scheduleDates);
 DEFAULT_QUESTION_MODULES.append(FollowupScheduleQuestion());
@@ -310,11 +308,18 @@ class AVSParse(BaseTextAnalysis):
                     "                       Leave blank or specify \"-\" to send to stdout.\n"
         parser = OptionParser(usage=usageStr)
         BaseTextAnalysis.addParserOptions(self, parser);
+        parser.add_option("-b", "--benchmark", dest="benchmark", help="Instead of processing a source file, report docs/sec and peak memory processing a generated corpus of this many notes, with compact vs. dict document models.");
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
-        if len(args) > 0:
+        if options.benchmark:
+            BaseTextAnalysis.parseOptions(self, options);
+            for compactDocModel in (False, True):
+                self.compactDocModel = compactDocModel;
+                (docsPerSec, peakMemoryMB) = self.benchmark(int(options.benchmark));
+                print >> sys.stdout, "compactDocModel=%s: %.1f docs/sec, %.1f MB peak memory" % (compactDocModel, docsPerSec, peakMemoryMB);
+        elif len(args) > 0:
             BaseTextAnalysis.parseOptions(self, options);
             
             sourceFile = stdOpen(args[0]);
@@ -338,6 +343,74 @@ class AVSParse(BaseTextAnalysis):
         timer = time.time() - timer;
         log.info("%.3f seconds to complete",timer);
 
+    def benchmark(self, numNotes, randomSeed=0):
+        """Process a generated corpus of numNotes notes, discarding the detail output.
+        Run in a separate process, so peak memory (max resident set size) is for this run alone.
+        Return (docs/sec, peak memory MB) where peak memory is measured above that before processing.
+        """
+        pool = multiprocessing.Pool(1);
+        try:
+            return pool.apply(_benchmarkWorker, (self, numNotes, randomSeed));
+        finally:
+            pool.terminate();
+            pool.join();
+
+def _benchmarkWorker(instance, numNotes, randomSeed):
+    sourceFile = StringIO(generateNotes(numNotes, randomSeed));
+    outputFile = open(os.devnull, "w");
+    startMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    timer = time.time();
+    summaryRecords = instance(sourceFile, outputFile);    # Keep summary records (with their document models) until done, as a full run does
+    timer = time.time() - timer;
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - startMemory;   # Kilobytes on Linux
+    outputFile.close();
+    return (len(summaryRecords) / timer, peakMemory / 1024.0);
+
+# Made up text lines to fill out generated note sections
+GENERATED_NOTE_LINES = \
+    [   "Complete by:  As directed",
+        "Call (650) %(phone)s if you have any questions about your care.",
+        "Team pager %(pager)s or unit phone number:  650-%(phone)s",
+        "- Lisinopril 10 mg tablet Take 1 tablet by mouth daily.",
+        "- Metoprolol Tartrate 25 mg tablet Take 0.5 tablets by mouth 2 times daily.",
+        "Aspirin 81 mg chewable tablet Take 1 tablet by mouth daily.",
+        "Diet: Low sodium (2 gm), heart healthy.  Fluid restriction 1.5 L per day.",
+        "Your primary diagnosis was:  Acute Chest Pain",
+        "You were admitted to the hospital because you were having frequent abdominal and chest pain.",
+        "Please weigh yourself every morning and call if you gain more than 3 lbs in a day or 5 lbs in a week.",
+        "Follow up with Dr. Smith on 8/%(day)d/2014 at 10:30 AM",
+        "Walk as tolerated, no heavy lifting over 10 lbs for 6 weeks.",
+    ];
+
+# Sections to fill generated notes with
+GENERATED_NOTE_SECTIONS = \
+    [   "Summary of Hospitalization",
+        "Your primary diagnosis was:",
+        "Your Diet Orders",
+        "Additional Instructions",
+        "TAKE these medications",
+        "STOP TAKING these medications",
+        "These are your currently scheduled appointments",
+        "Physical Activity",
+    ];
+
+def generateNotes(numNotes, randomSeed=0, linesPerSection=6):
+    """Generate source file text of numNotes made up AVS notes, in the format AVSParse expects,
+    for benchmarking.
+    """
+    randomizer = random.Random(randomSeed);
+    noteLines = ["pat_mrn_id\tpat_enc_csn_id\tCONTACT_DATE\tnote_id\tavs_summary"];
+    for iNote in xrange(numNotes):
+        noteLines.append("%d\t%d\t01-JUL-14\t%d" % (100000+iNote, 200000+iNote, 500000+iNote));
+        noteLines.append("This is your After Visit Summary");
+        for section in GENERATED_NOTE_SECTIONS:
+            noteLines.append(section);
+            for iLine in xrange(linesPerSection):
+                lineData = {"phone": "%03d-%04d" % (randomizer.randint(200,999), randomizer.randint(0,9999)), "pager": "%05d" % randomizer.randint(10000,99999), "day": randomizer.randint(1,28)};
+                noteLines.append(randomizer.choice(GENERATED_NOTE_LINES) % lineData);
+    noteLines.append("");
+    return str.join("\n", noteLines);
+
 if __name__ == "__main__":
     instance = AVSParse();
     instance.main(sys.argv);
@@ -8,6 +8,10 @@ Facilitate generate of interactive HTML webpage to review results.
 import sys, os
 import time;
 import re, string;
+import tempfile;
+import threading;
+import multiprocessing;
+import cPickle as pickle;
 from optparse import OptionParser
 from cStringIO import StringIO;
 from math import sqrt;
@@ -37,6 +41,71 @@ for styleFilename in HTML_STYLE_FILES:
 # Maximum number of characters to present in question-answer note summaries
 DEFAULT_MAX_NOTE_LENGTH = 25;
 
+# Basic token annotations that may be useful to several different parsing questions.
+#   Function of the raw token string for each annotation name
+TOKEN_ANNOTATIONS = \
+    {   "length": len,
+        "isalnum": lambda token: token.isalnum(),
+        "isalpha": lambda token: token.isalpha(),
+        "isdigit": lambda token: token.isdigit(),
+        "firstAlnum": lambda token: (len(token) > 0 and token[0].isalnum()),
+        "firstAlpha": lambda token: (len(token) > 0 and token[0].isalpha()),
+        "firstDigit": lambda token: (len(token) > 0 and token[0].isdigit()),
+        "lastAlnum": lambda token: (len(token) > 0 and token[-1].isalnum()),
+        "lastAlpha": lambda token: (len(token) > 0 and token[-1].isalpha()),
+        "lastDigit": lambda token: (len(token) > 0 and token[-1].isdigit()),
+        "noPunctuationToken": lambda token: token.translate(None, string.punctuation),  # Token after discarding any punctuation characters.  Should not need to discard whitespace characters, since token splitting already separates them
+    };
+
+# Number of records to hand to a worker process at a time when processing records in parallel
+PARALLEL_CHUNK_SIZE = 4;
+
+# Analysis instance for the current parallel run.
+#   Set before forking worker processes, so each worker inherits the question modules (copy-on-write)
+#   rather than having them pickled and sent for every record.
+_workerAnalysis = None;
+
+def _processRecordWorker(recordData):
+    """Worker function, module-level so multiprocessing can pickle it.
+    Process one record and return its rendered detail output and summary record,
+    rather than the whole (large) record and document model.
+    """
+    (iRecord, record) = recordData;
+    _workerAnalysis.processRecord(record, iRecord);
+    detailFile = StringIO();
+    _workerAnalysis.outputRecordDetail(record, detailFile);
+    summaryRecord = _workerAnalysis.extractSummaryRecord(record);
+    del summaryRecord["docModel"];
+    return (detailFile.getvalue(), summaryRecord);
+
+class SummaryRecordSpool:
+    """Temporary file of summary records to iterate through (repeatedly) after processing,
+    instead of keeping all of them in a list in memory.
+    """
+    def __init__(self):
+        self.spoolFile = tempfile.TemporaryFile();
+        self.nRecords = 0;
+
+    def append(self, summaryRecord):
+        pickle.dump(summaryRecord, self.spoolFile, pickle.HIGHEST_PROTOCOL);
+        self.nRecords += 1;
+
+    def __len__(self):
+        return self.nRecords;
+
+    def __iter__(self):
+        self.spoolFile.flush();
+        self.spoolFile.seek(0);
+        for i in xrange(self.nRecords):
+            summaryRecord = pickle.load(self.spoolFile);
+            nextPosition = self.spoolFile.tell();
+            yield summaryRecord;
+            self.spoolFile.seek(nextPosition);  # In case of interleaved iterations
+        self.spoolFile.seek(0, os.SEEK_END);    # Ready for any further appends
+
+    def close(self):
+        self.spoolFile.close();
+
 class BaseTextAnalysis:
     connFactory = None;
 
@@ -51,21 +120,57 @@ class BaseTextAnalysis:
         self.sampleInterval = 1;    # How many records to traverse before processing one.  Set to a value > 1 to for an evenly spaced sample of the source data
         self.skipDetail = False;    # If set, will skip output of full detailed records (thus only outputting summary table)
 
+        self.numProcesses = 1;  # If > 1, number of worker processes to tokenize and answer questions for records in parallel
+        self.preserveOrder = True;  # If set, parallel processing still outputs records in input order, identical to serial output.  Otherwise in order of completion.
+        self.spillSummary = False;  # If set, spool summary records to a temporary file rather than keeping them in memory.  Always done when processing in parallel.
+        self.compactDocModel = True;    # If set, tokenize into compact line and token models that only compute annotations when asked for, rather than a dict per line and token
+        self.tokenizeOps = None;    # Tokenize options built from the section headers on the first record, so the section header matcher is only compiled once
+
     def __call__(self, sourceFile, outputFile):
         headers = sourceFile.readline().split();
         for i, header in enumerate(headers):
             headers[i] = header.lower();
 
         prog = ProgressDots(50,1);
-        summaryRecords = list();
+        if self.spillSummary or self.numProcesses > 1:
+            # Add just summary information to display later, without keeping whole text file in memory.
+            #   Even that can be 2GB RAM per 1000 records, so route to a temporary file instead
+            summaryRecords = SummaryRecordSpool();
+        else:
+            summaryRecords = list();
 
         headerData = {"script": HTML_SCRIPT, "style": HTML_STYLE}
 
         print >> outputFile, HTML_START % headerData;
-        nextRecord = None;
-        lastLine = None;
 
         print >> outputFile, '''<table class="dataTable" cellspacing=0 cellpadding=4>''';
+        if self.numProcesses > 1:
+            self.processRecordsParallel(sourceFile, headers, outputFile, summaryRecords, prog);
+        else:
+            for (iRecord, record) in self.iterRecords(sourceFile, headers, prog):
+                self.processRecord(record, iRecord);
+                self.outputRecordDetail(record, outputFile);
+                summaryRecord = self.extractSummaryRecord(record);
+                if self.spillSummary:
+                    del summaryRecord["docModel"];
+                summaryRecords.append(summaryRecord);
+        # prog.printStatus();
+
+        print >> outputFile, '''</table>''';
+
+        self.outputSummaryRecords(summaryRecords, outputFile);
+
+        print >> outputFile, HTML_END;
+
+        #for header in headerSet:
+        #    print >> sys.stdout, header;
+        return summaryRecords;
+
+    def iterRecords(self, sourceFile, headers, prog=None):
+        """Generator over the (iRecord, record) pairs of the source file to process (per the sampleInterval),
+        splitting out records by lines that start a new record.
+        """
+        nextRecord = None;
         iRecord = 0;
         for line in sourceFile:
             if self.isNewRecordLine(line):
@@ -73,11 +178,10 @@ class BaseTextAnalysis:
                 if nextRecord is not None:
                     # Process the prior record
                     if iRecord % self.sampleInterval == 0:
-                        self.processRecord(nextRecord, iRecord);
-                        self.outputRecordDetail(nextRecord, outputFile);
-                        summaryRecords.append(self.extractSummaryRecord(nextRecord));  # Add just summary information to display later, without keeping whole text file in memory. This can still 2GB RAM per 1000 records, so may be better to route to temporary file instead
+                        yield (iRecord, nextRecord);
                     iRecord += 1;
-                    prog.update();
+                    if prog is not None:
+                        prog.update();
 
                 # Prepare a new record
                 nextRecord = dict();
@@ -93,23 +197,44 @@ class BaseTextAnalysis:
                 nextRecord[self.documentHeader] += line;
 
         # Process the last record
-        if iRecord % self.sampleInterval == 0:
-            self.processRecord(nextRecord, iRecord);
-            self.outputRecordDetail(nextRecord, outputFile);
-            summaryRecords.append(self.extractSummaryRecord(nextRecord));  # Add just summary information to display later, without keeping whole text file in memory
-        iRecord += 1;
-        prog.update();
-        # prog.printStatus();
-
-        print >> outputFile, '''</table>''';
-
-        self.outputSummaryRecords(summaryRecords, outputFile);
-
-        print >> outputFile, HTML_END;
-
-        #for header in headerSet:
-        #    print >> sys.stdout, header;
-        return summaryRecords;
+        if nextRecord is not None:
+            if iRecord % self.sampleInterval == 0:
+                yield (iRecord, nextRecord);
+            iRecord += 1;
+            if prog is not None:
+                prog.update();
+
+    def processRecordsParallel(self, sourceFile, headers, outputFile, summaryRecords, prog):
+        """Process records with a pool of worker processes.
+        The pool's task handler thread reads and splits out records from the source file (iterRecords)
+        while workers tokenize and answer questions.  Detail output and summary records are written
+        back as results return, in input order if preserveOrder is set.
+        Bound the number of records read ahead of the written results, so memory use does not grow with the source file.
+        """
+        maxPendingRecords = 2 * self.numProcesses * PARALLEL_CHUNK_SIZE;
+        pendingRecords = threading.BoundedSemaphore(maxPendingRecords);
+        def produceRecords():
+            for recordData in self.iterRecords(sourceFile, headers, prog):
+                pendingRecords.acquire();
+                yield recordData;
+
+        global _workerAnalysis;
+        _workerAnalysis = self;
+        pool = multiprocessing.Pool(self.numProcesses);
+        try:
+            if self.preserveOrder:
+                results = pool.imap(_processRecordWorker, produceRecords(), PARALLEL_CHUNK_SIZE);
+            else:
+                results = pool.imap_unordered(_processRecordWorker, produceRecords(), PARALLEL_CHUNK_SIZE);
+            for (recordDetail, summaryRecord) in results:
+                outputFile.write(recordDetail);
+                summaryRecords.append(summaryRecord);
+                pendingRecords.release();
+            pool.close();
+        finally:
+            pool.terminate();
+            pool.join();
+            _workerAnalysis = None;
 
 
     def isNewRecordLine(self, line):
@@ -125,10 +250,11 @@ class BaseTextAnalysis:
         # Try to spot new lines by several spaces
         docTextLines = docText.replace("    ","\n");
 
-        tokenizeOps = TokenizeOptions();
-        tokenizeOps.sectionHeaders = self.sectionHeaders;
-        tokenizeOps.sectionHeaderPrefixes = self.sectionHeaderPrefixes;
-        docModel = self.tokenizeDocument(docTextLines, tokenizeOps);
+        if self.tokenizeOps is None:
+            self.tokenizeOps = TokenizeOptions();
+            self.tokenizeOps.sectionHeaders = self.sectionHeaders;
+            self.tokenizeOps.sectionHeaderPrefixes = self.sectionHeaderPrefixes;
+        docModel = self.tokenizeDocument(docTextLines, self.tokenizeOps);
 
         for questionModule in self.questionModules:
             answer = questionModule(docModel);
@@ -137,14 +263,26 @@ class BaseTextAnalysis:
         record["docModel"] = docModel;
 
         # Add token level question annotations
+        moduleNames = [questionModule.getName() for questionModule in self.questionModules];
         for lineModel in record["docModel"]["lineModels"]:
+            if self.compactDocModel:
+                # Fill in the line's question names array directly, rather than through a view of each token.
+                #   Only tokens with other items (tags) can have any
+                lineModel.questionNames = [""] * len(lineModel.tokens);
+                if lineModel.tokenTags is not None:
+                    for iToken, tags in lineModel.tokenTags.iteritems():
+                        questionTagsFound = set();
+                        for moduleName in moduleNames: # Look for question module tags
+                            if moduleName in tags:
+                                questionTagsFound.add(moduleName);
+                        lineModel.questionNames[iToken] = str.join(",", questionTagsFound );
+                lineModel.iRecord = iRecord;
+                continue;
             for tokenModel in lineModel["tokenModels"]:
                 questionTagsFound = set();
-                for questionModule in self.questionModules: # Look for question module tags
-                    moduleName = questionModule.getName();
+                for moduleName in moduleNames: # Look for question module tags
                     if moduleName in tokenModel:
                         questionTagsFound.add(moduleName);
-                    record[moduleName] = questionModule.formatAnswer(record["docModel"]);  # Store at record level for summary retrieval later
                 tokenModel["questionNames"] = str.join(",", questionTagsFound );
                 tokenModel["iRecord"] = iRecord;
 
@@ -181,13 +319,18 @@ class BaseTextAnalysis:
             if isSectionHeader:
                 print >> outputFile, "<u>",;
 
-            for tokenModel in lineModel["tokenModels"]:
-                if len(tokenModel["questionNames"]) > 0:
-                    print >> outputFile, '<a name="%(iRecord)d.%(questionNames)s" href="javascript:setQuestionsByName(\'%(questionNames)s\', %(iRecord)d)">' % tokenModel,;
+            if self.compactDocModel:
+                # Read the line's token arrays directly, rather than through a view of each token
+                tokenItems = zip(lineModel.tokens, lineModel.questionNames);
+            else:
+                tokenItems = [(tokenModel["rawToken"], tokenModel["questionNames"]) for tokenModel in lineModel["tokenModels"]];
+            for (rawToken, questionNames) in tokenItems:
+                if len(questionNames) > 0:
+                    print >> outputFile, '<a name="%(iRecord)d.%(questionNames)s" href="javascript:setQuestionsByName(\'%(questionNames)s\', %(iRecord)d)">' % {"iRecord": record["iRecord"], "questionNames": questionNames},;
 
-                print >> outputFile, tokenModel["rawToken"],;
+                print >> outputFile, rawToken,;
 
-                if len(tokenModel["questionNames"]) > 0:
+                if len(questionNames) > 0:
                     print >> outputFile, "</a>",;
 
             if isSectionHeader:
@@ -268,40 +411,45 @@ class BaseTextAnalysis:
                     List of word/token data
                         Each word/token data item another dict with annotation information and
                             Source raw word/token
+        and an index of the lines in each section (sectionLineIndexes), so question modules
+        only need to visit the lines of the sections they expect.
         """
         docModel = dict();
         docModel["rawText"] = rawText;
         docModel["lineModels"] = list();
+        docModel["sectionLineIndexes"] = dict();
+        sectionMatcher = tokenizeOps.getSectionMatcher();
         rawTextIO = StringIO(rawText);
         for iLine, rawLine in enumerate(rawTextIO):
             line = rawLine.strip();
-            lineModel = dict();
-            lineModel["rawLine"] = rawLine;
-            lineModel["stripLine"] = line;
-            lineModel["tokenModels"] = list();
             tokens = line.split();
-            for token in tokens:
-                tokenModel = dict();
-                tokenModel["rawToken"] = token;
-                self.annotateTokenModel(tokenModel);    # Do some basic annotations
-                lineModel["tokenModels"].append(tokenModel);
-
-            lineModel["section"] = None;
-            if tokenizeOps.sectionHeaderPrefixes is not None:
-                for sectionHeaderPrefix in tokenizeOps.sectionHeaderPrefixes:
-                    if line.startswith(sectionHeaderPrefix):
-                        lineModel["section"] = sectionHeaderPrefix;
-            if tokenizeOps.sectionHeaders is not None:
-                if line in tokenizeOps.sectionHeaders:
-                    lineModel["section"] = line;
+            if self.compactDocModel:
+                lineModel = CompactLineModel(rawLine, line, tokens);
+            else:
+                lineModel = dict();
+                lineModel["rawLine"] = rawLine;
+                lineModel["stripLine"] = line;
+                lineModel["tokenModels"] = list();
+                for token in tokens:
+                    tokenModel = dict();
+                    tokenModel["rawToken"] = token;
+                    self.annotateTokenModel(tokenModel);    # Do some basic annotations
+                    lineModel["tokenModels"].append(tokenModel);
+
+            lineModel["section"] = sectionMatcher.match(line);  # Section header line, exact or by prefix, if any
             if lineModel["section"] is None and iLine > 0:    # No new section found, copy last one if available
                 lineModel["section"] = docModel["lineModels"][-1]["section"];
 
             docModel["lineModels"].append(lineModel);
+            if lineModel["section"] not in docModel["sectionLineIndexes"]:
+                docModel["sectionLineIndexes"][lineModel["section"]] = list();
+            docModel["sectionLineIndexes"][lineModel["section"]].append(iLine);
         return docModel;
 
     def annotateTokenModel(self, tokenModel):
-        """Basic annotations that may be useful to several different parsing questions"""
+        """Basic annotations that may be useful to several different parsing questions.
+        Only for dict token models.  Compact token models compute the same TOKEN_ANNOTATIONS when asked for them.
+        """
         token = tokenModel["rawToken"];
         tokenModel["length"] = len(token);
         tokenModel["isalnum"] = token.isalnum();
@@ -320,6 +468,9 @@ class BaseTextAnalysis:
         """
         parser.add_option("-i", "--sampleInterval", dest="sampleInterval", help="Set to a value >1 to only process a sample of the records based on the specified interval spacing.");
         parser.add_option("-s", "--skipDetail", dest="skipDetail", action="store_true", help="If set, will not output the full record details, just the main summary table.");
+        parser.add_option("-j", "--numProcesses", dest="numProcesses", help="If set >1, number of worker processes to tokenize and answer questions for records in parallel.");
+        parser.add_option("-u", "--unordered", dest="unordered", action="store_true", help="If set, when processing in parallel, output records in order of completion rather than input order.  Output is only identical to serial processing if not set.");
+        parser.add_option("-t", "--spillSummary", dest="spillSummary", action="store_true", help="If set, spool summary records to a temporary file rather than keeping them in memory (always done when processing in parallel).");
 
     def parseOptions(self, options):
         """Base command-line option parsing
@@ -327,6 +478,10 @@ class BaseTextAnalysis:
         if options.sampleInterval:
             self.sampleInterval = int(options.sampleInterval);
         self.skipDetail = options.skipDetail;
+        if options.numProcesses:
+            self.numProcesses = int(options.numProcesses);
+        self.preserveOrder = not options.unordered;
+        self.spillSummary = bool(options.spillSummary);
 
 class BaseQuestionModule:
     """Base class for question annotation modules"""
@@ -339,17 +494,37 @@ class BaseQuestionModule:
         Return best guess for answer to this module's question.
         Annotate document token data based on areas of apparent relevance
         """
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
-            if self.isLineInExpectedSection(lineModel):
-                for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
-                    #tokenModel[self.getName()] = True;
-                    pass;
+        for iLine, lineModel in self.iterExpectedLines(docModel):
+            for iToken, tokenModel in enumerate(lineModel["tokenModels"]):
+                #tokenModel[self.getName()] = True;
+                pass;
 
         raise NotImplementedError();
 
     def isLineInExpectedSection(self, lineModel):
         return (lineModel["section"] in self.expectedSections and lineModel["stripLine"] != lineModel["section"]);  # Ignore the section header line itself
 
+    def iterExpectedLines(self, docModel):
+        """Generate (iLine, lineModel) pairs for the lines of the document in expected sections (per isLineInExpectedSection),
+        in document order.  Looks up the lines by the document's section index,
+        rather than checking every line of the document for every question module.
+        """
+        lineModels = docModel["lineModels"];
+        if "sectionLineIndexes" not in docModel:    # No index, check every line
+            for iLine, lineModel in enumerate(lineModels):
+                if self.isLineInExpectedSection(lineModel):
+                    yield (iLine, lineModel);
+            return;
+
+        lineIndexes = list();
+        for section in set(self.expectedSections):
+            lineIndexes.extend(docModel["sectionLineIndexes"].get(section, ()));
+        lineIndexes.sort(); # Back in document order, if from multiple sections
+        for iLine in lineIndexes:
+            lineModel = lineModels[iLine];
+            if lineModel["stripLine"] != lineModel["section"]:  # Ignore the section header line itself
+                yield (iLine, lineModel);
+
     def getName(self):
         questionName = self.__class__.__name__;
         if questionName.endswith("Question"):
@@ -423,14 +598,13 @@ class SectionLineCountQuestion(BaseQuestionModule):
     def __call__(self, docModel):
         lines = list();
 
-        for iLine, lineModel in enumerate(docModel["lineModels"]):
+        for iLine, lineModel in self.iterExpectedLines(docModel):
             line = lineModel["stripLine"];
-            if self.isLineInExpectedSection(lineModel):
-                if not line.startswith("Complete by:") and line != "":  # Ignore lines without much meaning
-                    lines.append(line);
-                    tokenModels = lineModel["tokenModels"];
-                    for iToken, tokenModel in enumerate(tokenModels):
-                        tokenModel[self.getName()] = True;
+            if not line.startswith("Complete by:") and line != "":  # Ignore lines without much meaning
+                lines.append(line);
+                tokenModels = lineModel["tokenModels"];
+                for iToken, tokenModel in enumerate(tokenModels):
+                    tokenModel[self.getName()] = True;
         return lines;
 
 
@@ -440,3 +614,160 @@ class TokenizeOptions:
     def __init__(self):
         self.sectionHeaders = None; # Line values expected to represent section headers
         self.sectionHeaderPrefixes = None;  # Prefixes of lines expected to represent section headers
+        self.sectionMatcher = None; # PhraseMatcher for the above, compiled when first needed
+
+    def getSectionMatcher(self):
+        """PhraseMatcher with the section headers and header prefixes registered.
+        Compiled on first use, so set the section headers before tokenizing with these options.
+        """
+        if self.sectionMatcher is None:
+            self.sectionMatcher = PhraseMatcher();
+            if self.sectionHeaderPrefixes is not None:
+                for sectionHeaderPrefix in self.sectionHeaderPrefixes:
+                    self.sectionMatcher.addPrefix(sectionHeaderPrefix);
+            if self.sectionHeaders is not None:
+                for sectionHeader in self.sectionHeaders:
+                    self.sectionMatcher.addPhrase(sectionHeader);
+        return self.sectionMatcher;
+
+class PhraseMatcher:
+    """Match text against many registered phrases at once, rather than testing each phrase in turn.
+    Exact phrases are looked up in a set, and prefixes combined into one compiled regular expression,
+    so matching a line costs about the length of the line, regardless of how many phrases are registered.
+    """
+    def __init__(self):
+        self.phrases = set();
+        self.prefixes = list();
+        self.prefixRegExp = None;   # Compiled on first match after any prefixes added
+
+    def addPhrase(self, phrase):
+        """Register a phrase for text to match exactly"""
+        self.phrases.add(phrase);
+
+    def addPrefix(self, prefix):
+        """Register a phrase for text to start with"""
+        self.prefixes.append(prefix);
+        self.prefixRegExp = None;
+
+    def match(self, text):
+        """Return the registered phrase the text equals, else the last registered prefix the text starts with,
+        else None if neither.  Same as testing every prefix in turn, then every phrase.
+        """
+        if text in self.phrases:
+            return text;
+        if len(self.prefixes) > 0:
+            if self.prefixRegExp is None:
+                # Alternatives are tried in order, so list later registered prefixes first
+                self.prefixRegExp = re.compile(str.join("|", [re.escape(prefix) for prefix in reversed(self.prefixes)]));
+            prefixMatch = self.prefixRegExp.match(text);
+            if prefixMatch:
+                return prefixMatch.group(0);
+        return None;
+
+class CompactLineModel(object):
+    """Compact line model, in place of a dict per line and another per token.
+    Keeps the line's tokens as parallel arrays (raw token strings, and question names once annotated),
+    with any other token items (e.g., question tags) only in a dict for the tokens that have them.
+    Supports the dict-style access that question modules use, with lineModel["tokenModels"] a list of
+    CompactTokenModel views onto the line's arrays, and TOKEN_ANNOTATIONS computed only when asked for.
+    """
+    __slots__ = ("rawLine","stripLine","section","tokens","tokenTags","questionNames","iRecord");
+    fields = frozenset(("rawLine","stripLine","section"));
+
+    def __init__(self, rawLine, stripLine, tokens):
+        self.rawLine = rawLine;
+        self.stripLine = stripLine;
+        self.section = None;
+        self.tokens = tokens;
+        self.tokenTags = None;  # Dict of any other items by token index, only for tokens that have them
+        self.questionNames = None;  # List of question names by token index, once annotated
+        self.iRecord = None;
+
+    def getTokenTags(self, iToken, create=False):
+        """Dict of other items for the token at index iToken.  None if there are none (and not asked to create)"""
+        if self.tokenTags is None:
+            if not create:
+                return None;
+            self.tokenTags = dict();
+        tags = self.tokenTags.get(iToken);
+        if tags is None and create:
+            tags = self.tokenTags[iToken] = dict();
+        return tags;
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return getattr(self, key);
+        elif key == "tokenModels":
+            return [CompactTokenModel(self, iToken) for iToken in xrange(len(self.tokens))];
+        raise KeyError(key);
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key);
+        setattr(self, key, value);
+
+    def __contains__(self, key):
+        return key in self.fields or key == "tokenModels";
+
+    def get(self, key, default=None):
+        try:
+            return self[key];
+        except KeyError:
+            return default;
+
+    def keys(self):
+        return list(self.fields) + ["tokenModels"];
+
+class CompactTokenModel(object):
+    """View of one token of a CompactLineModel, with the same dict-style access as a token model dict.
+    Items set on the view are stored in the line model, so separate views of the same token share them.
+    """
+    __slots__ = ("lineModel","iToken");
+
+    def __init__(self, lineModel, iToken):
+        self.lineModel = lineModel;
+        self.iToken = iToken;
+
+    def __getitem__(self, key):
+        lineModel = self.lineModel;
+        if key == "rawToken":
+            return lineModel.tokens[self.iToken];
+        tokenTags = lineModel.tokenTags;
+        if tokenTags is not None and self.iToken in tokenTags and key in tokenTags[self.iToken]:
+            return tokenTags[self.iToken][key];
+        elif key == "questionNames" and lineModel.questionNames is not None:
+            return lineModel.questionNames[self.iToken];
+        elif key == "iRecord" and lineModel.iRecord is not None:
+            return lineModel.iRecord;
+        elif key in TOKEN_ANNOTATIONS:
+            return TOKEN_ANNOTATIONS[key](lineModel.tokens[self.iToken]);
+        raise KeyError(key);
+
+    def __setitem__(self, key, value):
+        if key == "rawToken":
+            self.lineModel.tokens[self.iToken] = value;
+        else:
+            self.lineModel.getTokenTags(self.iToken, create=True)[key] = value;
+
+    def __delitem__(self, key):
+        tags = self.lineModel.getTokenTags(self.iToken);
+        if tags is None or key not in tags:
+            raise KeyError(key);
+        del tags[key];
+
+    def __contains__(self, key):
+        try:
+            self[key];
+            return True;
+        except KeyError:
+            return False;
+
+    def get(self, key, default=None):
+        try:
+            return self[key];
+        except KeyError:
+            return default;
+
+    def keys(self):
+        return [key for key in ["rawToken","questionNames","iRecord"] + TOKEN_ANNOTATIONS.keys() if key in self] + \
+            [key for key in (self.lineModel.getTokenTags(self.iToken) or ()) if key not in TOKEN_ANNOTATIONS];
@@ -13,6 +13,7 @@ from medinfo.db.test.Util import MedInfoTestCase;
 
 from medinfo.db.Model import SQLQuery, RowItemModel;
 
+from medinfo.textanalysis.BaseTextAnalysis import TokenizeOptions, PhraseMatcher;
 from medinfo.textanalysis.AVSParse import AVSParse;
 
 class TestAVSParse(MedInfoTestCase):
@@ -63,6 +64,102 @@ class TestAVSParse(MedInfoTestCase):
         """
         self.assertEqualDictList( expectedData, actualData, headers );
 
+    def test_documentParseParallel(self):
+        # Parallel processing should give the same output as serial processing
+        headers = ["note_id","pat_mrn_id","contact_date","FollowupPhone","TeamPager","DietOrders","PrimaryDx","FollowupSchedule","NewRx","StopRx","AddnInstr"];
+
+        sourceFile = StringIO(self.testFileStr);
+        serialOutputFile = StringIO();
+        expectedData = self.parser(sourceFile, serialOutputFile);
+
+        # Summary records spooled to temporary file.  Iterable repeatedly
+        self.parser.spillSummary = True;
+        sourceFile = StringIO(self.testFileStr);
+        outputFile = StringIO();
+        actualData = self.parser(sourceFile, outputFile);
+        self.assertEqual( 3, len(actualData) );
+        self.assertEqualDictList( expectedData, list(actualData), headers );
+        self.assertEqualDictList( expectedData, list(actualData), headers );
+        self.assertEqual( serialOutputFile.getvalue(), outputFile.getvalue() );
+
+        # Worker processes, preserving input order, so identical output
+        self.parser.spillSummary = False;
+        self.parser.numProcesses = 2;
+        sourceFile = StringIO(self.testFileStr);
+        outputFile = StringIO();
+        actualData = self.parser(sourceFile, outputFile);
+        self.assertEqualDictList( expectedData, list(actualData), headers );
+        self.assertEqual( serialOutputFile.getvalue(), outputFile.getvalue() );
+
+        # Order of completion.  Same records, in whatever order
+        self.parser.preserveOrder = False;
+        sourceFile = StringIO(self.testFileStr);
+        outputFile = StringIO();
+        actualData = self.parser(sourceFile, outputFile);
+        actualData = sorted(actualData, key=lambda record: record["note_id"]);
+        self.assertEqualDictList( expectedData, actualData, headers );
+
+
+    def test_compactDocModel(self):
+        # Compact document model should give the same output as dict line and token models
+        headers = ["note_id","pat_mrn_id","contact_date","FollowupPhone","TeamPager","DietOrders","PrimaryDx","FollowupSchedule","NewRx","StopRx","AddnInstr"];
+
+        self.parser.compactDocModel = False;
+        sourceFile = StringIO(self.testFileStr);
+        dictOutputFile = StringIO();
+        expectedData = self.parser(sourceFile, dictOutputFile);
+
+        self.parser.compactDocModel = True;
+        sourceFile = StringIO(self.testFileStr);
+        outputFile = StringIO();
+        actualData = self.parser(sourceFile, outputFile);
+        self.assertEqualDictList( expectedData, actualData, headers );
+        self.assertEqual( dictOutputFile.getvalue(), outputFile.getvalue() );
+
+        # Same dict-style access to token models that question modules use
+        tokenizeOps = TokenizeOptions();
+        tokenizeOps.sectionHeaders = ["Your Diet Orders"];
+        docModel = self.parser.tokenizeDocument("Your Diet Orders\n  Low sodium, (2 gm).\n", tokenizeOps);
+        lineModel = docModel["lineModels"][1];
+        self.assertEqual( "Your Diet Orders", lineModel["section"] );
+        self.assertEqual( "Low sodium, (2 gm).", lineModel["stripLine"] );
+        tokenModels = lineModel["tokenModels"];
+        self.assertEqual( ["Low","sodium,","(2","gm)."], [tokenModel["rawToken"] for tokenModel in tokenModels] );
+        self.assertEqual( 7, tokenModels[1]["length"] );
+        self.assertEqual( "sodium", tokenModels[1]["noPunctuationToken"] );
+        self.assertTrue( tokenModels[1]["firstAlpha"] );
+        self.assertFalse( tokenModels[1]["lastAlpha"] );
+        self.assertTrue( tokenModels[2]["lastDigit"] );
+
+        self.assertFalse( "DietOrders" in tokenModels[0] );
+        tokenModels[0]["DietOrders"] = True;
+        self.assertTrue( "DietOrders" in lineModel["tokenModels"][0] );   # Shared by separate views of the same token
+        self.assertFalse( "DietOrders" in tokenModels[1] );
+        del tokenModels[0]["DietOrders"];
+        self.assertFalse( "DietOrders" in lineModel["tokenModels"][0] );
+        self.assertRaises( KeyError, tokenModels[0].__getitem__, "DietOrders" );
+
+    def test_sectionMatcher(self):
+        # Same section as testing each exact header and header prefix in turn
+        matcher = PhraseMatcher();
+        matcher.addPrefix("Notify MD");
+        matcher.addPrefix("Notify MD Of");
+        matcher.addPrefix("Immunization History (");
+        matcher.addPhrase("Notify MD Of Weight Gain");
+        self.assertEqual( "Notify MD Of Weight Gain", matcher.match("Notify MD Of Weight Gain") );   # Exact phrase first
+        self.assertEqual( "Notify MD Of", matcher.match("Notify MD Of Fever") );    # Last registered prefix that matches
+        self.assertEqual( "Notify MD", matcher.match("Notify MDs") );
+        self.assertEqual( "Immunization History (", matcher.match("Immunization History (as of 1/2/2014)") );  # Special characters escaped
+        self.assertEqual( None, matcher.match("Please Notify MD") );
+
+        # Question modules visit the same lines by section index as by checking every line
+        sourceFile = StringIO(self.testFileStr);
+        outputFile = StringIO();
+        for summaryRecord in self.parser(sourceFile, outputFile):
+            docModel = summaryRecord["docModel"];
+            for questionModule in self.parser.questionModules:
+                expectedLines = [(iLine, lineModel) for (iLine, lineModel) in enumerate(docModel["lineModels"]) if questionModule.isLineInExpectedSection(lineModel)];
+                self.assertEqual( expectedLines, list(questionModule.iterExpectedLines(docModel)) );
 
 def suite():
     """Returns the suite of tests to run for this test class / module.
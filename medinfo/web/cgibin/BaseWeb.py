@@ -173,6 +173,8 @@ class BaseWeb:
         
         #Assign output/headers        
         output = handlerInstance.populatedTemplate()        
+        if isinstance(output, unicode):
+            output = output.encode('utf-8');    # Response body (and its Content-length) must be bytes, not characters
         response_headers = handlerInstance.returnHeaders(output) 
         status = '200 OK'
         start_response(status, response_headers);
@@ -184,7 +186,7 @@ class BaseWeb:
 
         del handlerInstance;    # Ensure garbage collection
         
-        return output    
+        return [output];    # Single chunk, rather than a string the server would write out character by character
     
     def maintainParams(self):
         """Normal behavior, store all request parameters
@@ -452,8 +454,8 @@ class BaseWeb:
         print self.populatedTemplate();
 
     def returnHeaders(self, output):
-        """Return HTTP headers for WSGI"""        
-        headers = [('Content-type', "text/html"),];     # ("Content-length", str(len(output)))]
+        """Return HTTP headers for WSGI, given the (encoded byte string) output"""        
+        headers = [('Content-type', "text/html"), ("Content-length", str(len(output)))];
         # for cookie in self.getCookies():
         #     headers.append((cookie))        
         return headers
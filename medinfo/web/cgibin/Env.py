@@ -45,3 +45,12 @@ CGI_TEXT_RESPONSE = False;
 # Whether to use a local memory data cache to reduce DB hits for web queries.  If left unchecked, this will result
 #   in excessive memory use / leak by the webserver
 USE_DATA_CACHE = True;
+
+# Whether to answer order searches from an in-memory index (SimSearchIndex) instead of database table scans.
+#   Only worthwhile for long-lived server processes (e.g., mod_wsgi), as loading the index costs more than a single search,
+#   so leave off for plain CGI where every request is a new process.  WebServer workers enable it themselves.
+USE_SEARCH_INDEX = False;
+
+# Whether to answer simulated patient state, order and result lookups from an in-memory cache (SimStateCache).
+#   Likewise only worthwhile for long-lived server processes, so leave off for plain CGI.  WebServer workers enable it themselves.
+USE_STATE_CACHE = False;
@@ -6,6 +6,9 @@ import Const
 import sys, os
 import logging
 
+from medinfo.cpoe.cpoeSim.SimSearchIndex import SimSearchIndex;
+from medinfo.cpoe.cpoeSim.SimStateCache import SimStateCache;
+
 log = logging.getLogger("CDSS")
 log.setLevel(Const.LOGGER_LEVEL)
 
@@ -19,3 +22,18 @@ log.addHandler(handler)
 webDataCache = None;
 if Env.USE_DATA_CACHE:
     webDataCache = dict();
+
+"""Persistent search index of clinical items and order sets, to avoid table scans for every search keystroke.
+Handlers should look this up at request time (Util.webSearchIndex), as long-lived servers may install it after import.
+"""
+webSearchIndex = None;
+if Env.USE_SEARCH_INDEX:
+    webSearchIndex = SimSearchIndex();
+
+"""Persistent cache of simulated patient states and orders, so interactive simulation steps avoid re-querying them.
+Checked against the database on every use, so safe to keep in each of multiple server processes.
+Handlers should look this up at request time (Util.webStateCache), as long-lived servers may install it after import.
+"""
+webStateCache = None;
+if Env.USE_STATE_CACHE:
+    webStateCache = SimStateCache();
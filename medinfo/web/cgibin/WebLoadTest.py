@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Local load test for the web interface, such as served by WebServer.
+Issues concurrent requests for a URL (by default, rendering a recommendation table)
+and reports throughput (requests/sec) and latency.
+"""
+
+import sys, os
+import time;
+import threading;
+import urllib2;
+from optparse import OptionParser
+
+DEFAULT_URL = "http://localhost:8000/cgibin/cpoe/dynamicdata/ItemRecommendationTable.py?queryItemIds=&resultCount=10&sortField=item_count&sortReverse=True&countPrefix=patient_&aggregationMethod=weighted";
+
+class LoadTest:
+    def __init__(self, url, numRequests, concurrency):
+        self.url = url;
+        self.numRequests = numRequests;
+        self.concurrency = concurrency;
+        self.requestTimes = list();
+        self.numErrors = 0;
+        self.numRemaining = numRequests;
+        self.lock = threading.Lock();
+
+    def run(self):
+        """Run all requests across concurrency threads.  Return the total elapsed time."""
+        threads = [threading.Thread(target=self.worker) for iThread in xrange(self.concurrency)];
+        timer = time.time();
+        for thread in threads:
+            thread.start();
+        for thread in threads:
+            thread.join();
+        return time.time() - timer;
+
+    def worker(self):
+        while True:
+            self.lock.acquire();
+            try:
+                if self.numRemaining <= 0:
+                    return;
+                self.numRemaining -= 1;
+            finally:
+                self.lock.release();
+
+            timer = time.time();
+            success = True;
+            try:
+                response = urllib2.urlopen(self.url);
+                response.read();
+                response.close();
+            except Exception, err:
+                print >> sys.stderr, err;
+                success = False;
+            requestTime = time.time() - timer;
+
+            self.lock.acquire();
+            try:
+                if success:
+                    self.requestTimes.append(requestTime);
+                else:
+                    self.numErrors += 1;
+            finally:
+                self.lock.release();
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues)-1, int(fraction*len(sortedValues)))];
+
+def main(argv):
+    usageStr =  "usage: %prog [options] [<url>]\n"+\
+                "   <url>   URL to request.  Defaults to a recommendation table on a local WebServer:\n"+\
+                "           %s\n" % DEFAULT_URL;
+    parser = OptionParser(usage=usageStr)
+    parser.add_option("-n", "--numRequests", dest="numRequests", default="200", help="Total number of requests to issue");
+    parser.add_option("-c", "--concurrency", dest="concurrency", default="4", help="Number of requests to issue at a time");
+    parser.add_option("-w", "--warmup", dest="warmup", default="1", help="Number of requests to issue before timing, so first time module loading and caching is not counted");
+    (options, args) = parser.parse_args(argv[1:])
+
+    url = DEFAULT_URL;
+    if len(args) > 0:
+        url = args[0];
+
+    LoadTest(url, int(options.warmup), 1).run();
+
+    loadTest = LoadTest(url, int(options.numRequests), int(options.concurrency));
+    elapsed = loadTest.run();
+
+    requestTimes = sorted(loadTest.requestTimes);
+    print "URL: %s" % url;
+    print "Requests: %d (%d errors), Concurrency: %d" % (len(requestTimes), loadTest.numErrors, loadTest.concurrency);
+    print "Requests/sec: %.1f" % (len(requestTimes) / elapsed);
+    if len(requestTimes) > 0:
+        print "Latency (ms) mean: %.1f, median: %.1f, 90%%: %.1f, 99%%: %.1f, max: %.1f" % \
+            (   1000 * sum(requestTimes) / len(requestTimes),
+                1000 * percentile(requestTimes, 0.5),
+                1000 * percentile(requestTimes, 0.9),
+                1000 * percentile(requestTimes, 0.99),
+                1000 * requestTimes[-1],
+            );
+
+if __name__ == "__main__":
+    main(sys.argv);
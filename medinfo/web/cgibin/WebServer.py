@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Persistent WSGI application server for the web interface.
+
+Running each request as a separate CGI process (or re-importing its script) pays
+for interpreter startup, module imports, a new database connection, and empty caches
+(recommender association data in webDataCache, the webSearchIndex, the webStateCache) on every request.
+Instead, keep worker processes alive across requests, routing request paths
+to the existing web handler classes (e.g., /cgibin/cpoe/dynamicdata/ItemRecommendationTable.py
+to the ItemRecommendationTable class) and serving static files from the web directory.
+
+Workers are forked from a single listening socket (prefork), each handling one request at a time,
+with its own database connection pool (DBUtil.connectionPool) and caches.
+The same handler scripts still work under CGI or mod_wsgi as before.
+"""
+
+import sys, os
+import time;
+import signal;
+import mimetypes;
+import importlib;
+from optparse import OptionParser
+from wsgiref.simple_server import make_server, WSGIRequestHandler;
+
+from medinfo.db import DBUtil;
+from medinfo.cpoe.cpoeSim.SimSearchIndex import SimSearchIndex;
+from medinfo.cpoe.cpoeSim.SimStateCache import SimStateCache;
+from medinfo.web.cgibin import Env;
+from medinfo.web.cgibin import Util;
+from medinfo.web.cgibin.Util import log;
+
+INDEX_FILENAME = "index.htm";
+WEB_PACKAGE = "medinfo.web";    # Package corresponding to the web directory, to find handler modules by
+
+class WebApplication:
+    """WSGI application routing request paths under the web directory
+    to the web handler classes or static files.
+    """
+    def __init__(self, webDir=None):
+        if webDir is None:
+            webDir = Env.WEB_DIR;
+        self.webDir = os.path.realpath(webDir);
+        self.handlerByPath = dict();    # Cache of WSGI callables, so handler modules only loaded once per process
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO","").lstrip("/");
+        if path == "":
+            path = INDEX_FILENAME;
+
+        filename = self.resolvePath(path);
+        if filename is None:
+            return self.notFound(start_response);
+
+        if filename.endswith(".py"):
+            handler = self.loadHandler(filename);
+            if handler is None:
+                return self.notFound(start_response);
+            return handler(environ, start_response);
+        else:
+            return self.staticFile(filename, start_response);
+
+    def resolvePath(self, path):
+        """Local filename for the request path, or None if it does not exist or would fall outside the web directory"""
+        filename = os.path.realpath(os.path.join(self.webDir, *path.split("/")));
+        if not filename.startswith(self.webDir+os.sep) or not os.path.isfile(filename):
+            return None;
+        return filename;
+
+    def loadHandler(self, filename):
+        """Import the module for the handler script file and return its WSGI callable.
+        Prefer the web controller class named after the script file,
+        as several scripts only expose an application under mod_wsgi.
+        """
+        if filename not in self.handlerByPath:
+            relativePath = os.path.relpath(os.path.splitext(filename)[0], self.webDir);
+            moduleName = str.join(".", [WEB_PACKAGE] + relativePath.split(os.sep));
+            module = importlib.import_module(moduleName);
+
+            className = os.path.basename(relativePath);
+            handler = None;
+            if hasattr(module, className) and hasattr(getattr(module, className), "wsgiHandler"):
+                webController = getattr(module, className)();
+                webController.setFilePath(module.__file__);
+                handler = webController.wsgiHandler;
+            elif hasattr(module, "application"):
+                handler = module.application;
+            self.handlerByPath[filename] = handler;
+        return self.handlerByPath[filename];
+
+    def staticFile(self, filename, start_response):
+        contentType = mimetypes.guess_type(filename)[0];
+        if contentType is None:
+            contentType = "application/octet-stream";
+        ifile = open(filename, "rb");
+        try:
+            output = ifile.read();
+        finally:
+            ifile.close();
+        start_response("200 OK", [("Content-type", contentType), ("Content-length", str(len(output)))]);
+        return [output];
+
+    def notFound(self, start_response):
+        output = "Not Found";
+        start_response("404 Not Found", [("Content-type", "text/plain"), ("Content-length", str(len(output)))]);
+        return [output];
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Skip the per request access log line to stderr"""
+    def log_message(self, format, *args):
+        pass;
+
+class WebServer:
+    """Prefork server, with numProcesses worker processes accepting requests from a shared listening socket"""
+    def __init__(self, application, host="localhost", port=8000, numProcesses=1, quiet=True):
+        self.application = application;
+        self.host = host;
+        self.port = port;
+        self.numProcesses = numProcesses;
+        self.quiet = quiet;
+        self.childPids = list();
+
+    def serve(self):
+        handlerClass = WSGIRequestHandler;
+        if self.quiet:
+            handlerClass = QuietRequestHandler;
+        httpd = make_server(self.host, self.port, self.application, handler_class=handlerClass);
+        log.info("Serving %s on %s:%s with %d process(es)" % (self.application.webDir, self.host, self.port, self.numProcesses) );
+
+        if self.numProcesses <= 1:
+            self.serveWorker(httpd);
+            return;
+
+        for iProcess in xrange(self.numProcesses):
+            pid = os.fork();
+            if pid == 0:
+                try:
+                    self.serveWorker(httpd);
+                finally:
+                    os._exit(0);
+            self.childPids.append(pid);
+
+        # Parent just waits on the workers, stopping them all when interrupted
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0));
+        try:
+            while len(self.childPids) > 0:
+                (pid, status) = os.wait();
+                if pid in self.childPids:
+                    self.childPids.remove(pid);
+                    log.warning("Worker process %s exited with status %s" % (pid, status) );
+        finally:
+            for pid in self.childPids:
+                try:
+                    os.kill(pid, signal.SIGTERM);
+                except OSError:
+                    pass;   # Already gone
+            httpd.server_close();
+
+    def serveWorker(self, httpd):
+        """Run in each worker process.  Connections cannot be shared across processes, so start a separate pool for each.
+        Workers are long-lived, so worth loading a search index and simulation state cache to reuse across requests,
+        even if not enabled for CGI.  The state cache checks each patient against the database before use,
+        so workers still see orders recorded by each other.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL);
+        DBUtil.connectionPool = DBUtil.ConnectionPool();
+        if Util.webSearchIndex is None and Env.USE_DATA_CACHE:
+            Util.webSearchIndex = SimSearchIndex();
+        if Util.webStateCache is None and Env.USE_DATA_CACHE:
+            Util.webStateCache = SimStateCache();
+        try:
+            httpd.serve_forever();
+        except KeyboardInterrupt:
+            pass;
+        finally:
+            DBUtil.connectionPool.clear();
+
+def main(argv):
+    usageStr =  "usage: %prog [options] [<handlerPath1>] [<handlerPath2>] ...\n"+\
+                "   <handlerPath>   Request paths of web handler scripts to load before starting workers,\n"+\
+                "                   so the imports are shared across processes rather than repeated in each.\n"+\
+                "                   For example: cgibin/cpoe/dynamicdata/ItemRecommendationTable.py\n";
+    parser = OptionParser(usage=usageStr)
+    parser.add_option("-H", "--host", dest="host", default="localhost", help="Host name or address to listen on");
+    parser.add_option("-P", "--port", dest="port", default="8000", help="Port to listen on");
+    parser.add_option("-p", "--processes", dest="processes", default="1", help="Number of worker processes to handle requests");
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", help="Log every request to stderr");
+    (options, args) = parser.parse_args(argv[1:])
+
+    application = WebApplication();
+    for path in args:
+        filename = application.resolvePath(path.lstrip("/"));
+        if filename is None:
+            print >> sys.stderr, "Handler script not found: %s" % path;
+            parser.print_help();
+            sys.exit(-1);
+        application.loadHandler(filename);
+
+    server = WebServer(application, options.host, int(options.port), int(options.processes), not options.verbose);
+    server.serve();
+
+if __name__ == "__main__":
+    main(sys.argv);
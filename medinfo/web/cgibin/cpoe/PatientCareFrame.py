@@ -19,6 +19,7 @@ from medinfo.cpoe.cpoeSim.SimManager import SimManager;
 from medinfo.web.cgibin.cpoe.BaseCPOEWeb import BaseCPOEWeb
 
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 from medinfo.web.cgibin.cpoe.dynamicdata.ActiveOrders import ActiveOrders;
 from medinfo.web.cgibin.cpoe.dynamicdata.NotesReview import NotesReview;
 from medinfo.web.cgibin.cpoe.dynamicdata.ResultsReview import ResultsReview;
@@ -82,6 +83,7 @@ class PatientCareFrame(BaseCPOEWeb):
         simTime = None;
 
         manager = SimManager();
+        manager.stateCache = Util.webStateCache;
         userModel = manager.loadUserInfo([userId])[0];  # Assume found good single match
         try:
             simTime = int(self.requestData["sim_time"]);
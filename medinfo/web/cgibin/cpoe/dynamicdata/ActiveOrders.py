@@ -17,6 +17,7 @@ from medinfo.cpoe.cpoeSim.SimManager import SimManager;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 
 CATEGORY_HEADER_TEMPLATE = \
     """
@@ -73,6 +74,7 @@ class ActiveOrders(BaseDynamicData):
             self.requestData["historyTime"] = "Time";
 
         manager = SimManager();
+        manager.stateCache = Util.webStateCache;
         patientOrders = manager.loadPatientOrders(patientId, simTime, loadActive=loadActive);
         
         lastPatientOrder = None;
@@ -14,6 +14,7 @@ from medinfo.cpoe.cpoeSim.SimManager import SimManager;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 
 class NewOrders(BaseDynamicData):
     """Simple script to (dynamically) relay query and result data
@@ -53,6 +54,7 @@ class NewOrders(BaseDynamicData):
         discontinuePatientOrderIds = [int(itemIdStr) for itemIdStr in self.requestData["discontinuePatientOrderId"]];
         
         manager = SimManager();
+        manager.stateCache = Util.webStateCache;
         manager.signOrders(userId, patientId, simTime, orderItemIds, discontinuePatientOrderIds);
 
         
@@ -22,6 +22,7 @@ from medinfo.cpoe.cpoeSim.SimManager import SimManager, ClinicalItemQuery;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 
 CONTROLS_TEMPLATE = \
     """
@@ -51,6 +52,7 @@ class OrderSetSearch(BaseDynamicData):
     def action_orderSetSearch(self):
         """Look for pre-defined order sets"""
         manager = SimManager();
+        manager.searchIndex = Util.webSearchIndex;
         query = ClinicalItemQuery();
         query.parseParams(self.requestData);
         resultIter = manager.orderSetSearch(query);
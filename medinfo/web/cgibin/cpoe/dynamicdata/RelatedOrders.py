@@ -22,6 +22,7 @@ from medinfo.cpoe.cpoeSim.SimManager import SimManager, ClinicalItemQuery;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 from medinfo.web.cgibin.Util import webDataCache;
 
 CONTROLS_TEMPLATE = \
@@ -76,6 +77,7 @@ class RelatedOrders(BaseDynamicData):
     def action_orderSearch(self):
         """Search for orders by query string"""
         manager = SimManager();
+        manager.searchIndex = Util.webSearchIndex;
         query = ClinicalItemQuery();
         query.parseParams(self.requestData);
         query.sourceTables = self.requestData["sourceTables"].split(",");
@@ -17,6 +17,7 @@ from medinfo.cpoe.cpoeSim.Const import BASE_TIME, TIME_FORMAT;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin import Util;
 
 GROUP_HEADER_TEMPLATE = \
     """
@@ -54,6 +55,7 @@ class ResultsReview(BaseDynamicData):
         simTime = int(self.requestData["sim_time"]);
         
         manager = SimManager();
+        manager.stateCache = Util.webStateCache;
         results = manager.loadResults(patientId, simTime);
         
         lastGroupStrings = ['New']; # Sentinel value that will be different than first real data row
@@ -0,0 +1,240 @@
+'''
+Statistical resampling shared by the lab reports (stats_utils, stats_sx).
+
+Rather than calling sklearn metrics once per resample (1000 times per lab and alg),
+draw a batch of resamples at a time as a matrix of row indices (one resample per row),
+and evaluate AUROC / average precision for every resample in the batch together from ranks.
+Only one batch of indices is held in memory at a time.
+
+Random states are seeded per lab / alg (lab_alg_seed),
+so reports regenerate identically regardless of which process or in what order labs are handled.
+'''
+
+import zlib
+import numpy as np
+from scipy import stats
+
+DEFAULT_NUM_REPEATS = 1000
+
+# Max number of resamples to evaluate together, to bound memory use with large test sets
+DEFAULT_BATCH_SIZE = 100
+
+def lab_alg_seed(lab, alg=None):
+    '''
+    Deterministic random seed for a lab (and alg).
+    Use a checksum of the names rather than hash(), which can differ across platforms / Python builds.
+    '''
+    key = str(lab) if alg is None else '%s/%s' % (lab, alg)
+    return zlib.crc32(key) & 0xffffffff
+
+def get_random_state(random_state=None):
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+def bootstrap_indices(num_rows, num_repeats, random_state=None):
+    '''
+    Matrix of (num_repeats x num_rows) row indices,
+    each row a bootstrap resample (with replacement) of range(num_rows).
+    '''
+    random_state = get_random_state(random_state)
+    return random_state.randint(0, num_rows, size=(num_repeats, num_rows))
+
+def permutation_indices(num_rows, num_repeats, random_state=None, num_cols=None):
+    '''
+    Matrix of (num_repeats x num_cols) row indices,
+    each row the first num_cols (default all) of a random permutation of range(num_rows).
+    '''
+    random_state = get_random_state(random_state)
+    if num_cols is None:
+        num_cols = num_rows
+    indices = np.empty((num_repeats, num_cols), dtype=np.int64)
+    for i in range(num_repeats):
+        indices[i] = random_state.permutation(num_rows)[:num_cols]
+    return indices
+
+def bootstrap_index_batches(num_rows, num_repeats, batch_size=DEFAULT_BATCH_SIZE, random_state=None):
+    '''
+    Generate bootstrap_indices batch_size resamples at a time.
+    Drawn in sequence from a single random state, so the resamples are the same regardless of batch_size.
+    '''
+    random_state = get_random_state(random_state)
+    for start in range(0, num_repeats, batch_size):
+        yield bootstrap_indices(num_rows, min(batch_size, num_repeats - start), random_state)
+
+def permutation_index_batches(num_rows, num_repeats, batch_size=DEFAULT_BATCH_SIZE, random_state=None, num_cols=None):
+    '''
+    Generate permutation_indices batch_size resamples at a time.
+    Drawn in sequence from a single random state, so the resamples are the same regardless of batch_size.
+    '''
+    random_state = get_random_state(random_state)
+    for start in range(0, num_repeats, batch_size):
+        yield permutation_indices(num_rows, min(batch_size, num_repeats - start), random_state, num_cols)
+
+def _rank_counts(actual_matrix, predict_matrix):
+    '''
+    For every element of the (resamples x rows) matrices, count within its own resample (row):
+        num_less: Number of predictions less than its prediction
+        num_ties: Number of predictions equal to its prediction (including itself)
+        num_pos_ge: Number of actual positives with prediction >= its prediction
+
+    Vectorized across all resamples at once by replacing predictions with integer codes
+    (their rank among all distinct prediction values), offset by resample so that
+    every resample occupies a separate range of a single sorted key array.
+    '''
+    num_repeats, num_rows = predict_matrix.shape
+    _, codes = np.unique(predict_matrix, return_inverse=True)
+    num_codes = codes.max() + 1 if codes.size > 0 else 1
+    keys = codes.reshape(num_repeats, num_rows).astype(np.int64) + np.arange(num_repeats, dtype=np.int64)[:,np.newaxis] * num_codes
+    keys = keys.ravel()
+
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    left = np.searchsorted(sorted_keys, keys, side='left')
+    right = np.searchsorted(sorted_keys, keys, side='right')
+
+    row_starts = (np.arange(num_repeats, dtype=np.int64) * num_rows).repeat(num_rows)
+    row_ends = row_starts + num_rows
+
+    # Cumulative positives in sorted order, with a leading 0 so cum_pos[i] = positives before sorted position i
+    is_pos = (actual_matrix.ravel() == 1)
+    cum_pos = np.concatenate([[0], np.cumsum(is_pos[order])])
+
+    num_less = (left - row_starts).reshape(num_repeats, num_rows)
+    num_ties = (right - left).reshape(num_repeats, num_rows)
+    num_pos_ge = (cum_pos[row_ends] - cum_pos[left]).reshape(num_repeats, num_rows)
+    return num_less, num_ties, num_pos_ge
+
+def batch_roc_auc(actual_matrix, predict_matrix):
+    '''
+    AUROC of each resample (row) of the matrices, by the Mann-Whitney U statistic on (tie averaged) ranks.
+    Equivalent to sklearn roc_auc_score for each row, except NaN rather than an error for rows with a single class.
+    '''
+    actual_matrix = np.asarray(actual_matrix)
+    predict_matrix = np.asarray(predict_matrix)
+    num_less, num_ties, _ = _rank_counts(actual_matrix, predict_matrix)
+    ranks = num_less + (num_ties + 1) / 2.
+
+    is_pos = (actual_matrix == 1)
+    num_pos = is_pos.sum(axis=1).astype(float)
+    num_neg = actual_matrix.shape[1] - num_pos
+    rank_sums = np.where(is_pos, ranks, 0.).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aucs = (rank_sums - num_pos * (num_pos + 1) / 2.) / (num_pos * num_neg)
+    aucs[(num_pos == 0) | (num_neg == 0)] = float('nan')
+    return aucs
+
+def batch_average_precision(actual_matrix, predict_matrix):
+    '''
+    Average precision of each resample (row) of the matrices.
+    Equivalent to sklearn average_precision_score for each row:
+    sum over thresholds of (increase in recall) x precision,
+    which is the mean over positives of the precision at the threshold of their prediction.
+    NaN for rows without any positives.
+    '''
+    actual_matrix = np.asarray(actual_matrix)
+    predict_matrix = np.asarray(predict_matrix)
+    num_less, num_ties, num_pos_ge = _rank_counts(actual_matrix, predict_matrix)
+    num_ge = actual_matrix.shape[1] - num_less
+    precisions = num_pos_ge / num_ge.astype(float)
+
+    is_pos = (actual_matrix == 1)
+    num_pos = is_pos.sum(axis=1).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aps = np.where(is_pos, precisions, 0.).sum(axis=1) / num_pos
+    aps[num_pos == 0] = float('nan')
+    return aps
+
+STAT_FUNCS = {
+    'roc_auc': batch_roc_auc,
+    'ROC': batch_roc_auc,
+    'average_precision': batch_average_precision,
+    'PRC': batch_average_precision,
+}
+
+def batch_stat(actual_list, predict_list, indices, stat='roc_auc', batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Evaluate stat for each resample of the lists given by the rows of the indices matrix,
+    batch_size resamples at a time.
+    '''
+    index_batches = (indices[start:start+batch_size] for start in range(0, indices.shape[0], batch_size))
+    return index_batches_stat(actual_list, predict_list, index_batches, stat)
+
+def index_batches_stat(actual_list, predict_list, index_batches, stat='roc_auc'):
+    '''
+    Evaluate stat for each resample of the lists given by the rows of each indices matrix
+    from index_batches (e.g., bootstrap_index_batches), one batch at a time.
+    '''
+    stat_func = STAT_FUNCS[stat]
+    actual_list = np.asarray(actual_list)
+    predict_list = np.asarray(predict_list)
+    results = []
+    for batch_indices in index_batches:
+        results.append(stat_func(actual_list[batch_indices], predict_list[batch_indices]))
+    if len(results) == 0:
+        return np.zeros(0)
+    return np.concatenate(results)
+
+def bootstrap_CI(actual_list, predict_list, num_repeats=DEFAULT_NUM_REPEATS, stat='roc_auc',
+                 confident_lvl=0.95, side='two', random_state=0, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Bootstrap confidence interval of stat.
+    Returns (NaN, NaN) if the stat is undefined for any of the resamples (e.g., only one class present).
+    '''
+    assert len(actual_list) == len(predict_list)
+
+    if len(actual_list) == 0:
+        return float('nan'), float('nan')
+
+    index_batches = bootstrap_index_batches(len(actual_list), num_repeats, batch_size, random_state)
+    all_stats = index_batches_stat(actual_list, predict_list, index_batches, stat)
+    if np.isnan(all_stats).any():
+        return float('nan'), float('nan')
+
+    stat_left = np.percentile(all_stats, (1 - confident_lvl) / 2. * 100)
+    stat_right = np.percentile(all_stats, (1 + confident_lvl) / 2. * 100)
+    return stat_left, stat_right
+
+def random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type,
+                            num_permute=DEFAULT_NUM_REPEATS, random_state=0, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Fraction of random permutations of the pooled (base and best) episodes, whose first len(base_actual) episodes
+    score a higher AUROC (curve_type='ROC') or average precision (curve_type='PRC') than the best alg does.
+    Actual labels and predictions are permuted together.
+    '''
+    best_score = STAT_FUNCS[curve_type](np.asarray(best_actual)[np.newaxis,:], np.asarray(best_predict)[np.newaxis,:])[0]
+
+    num_episodes = len(base_actual)
+    all_actual = np.hstack((base_actual, best_actual))
+    all_predict = np.hstack((base_predict, best_predict))
+
+    index_batches = permutation_index_batches(len(all_actual), num_permute, batch_size, random_state, num_episodes)
+    permute_scores = index_batches_stat(all_actual, all_predict, index_batches, curve_type)
+    return float((permute_scores > best_score).sum()) / float(num_permute)
+
+def Hosmer_Lemeshow_Test(predict_probas, actual_labels, num_bins=10):
+    '''
+    Hosmer-Lemeshow goodness of fit p-value, with predictions in num_bins equal width bins.
+    Counts observed outcomes per bin with bincounts rather than per row.
+    '''
+    minor_shift = 0.00001
+    predict_probas_shifted = np.clip(np.asarray(predict_probas, dtype=float), minor_shift, 1 - minor_shift)
+
+    bins = np.linspace(0, 1, num=num_bins+1)
+    inds = np.digitize(predict_probas_shifted, bins)
+    mids = (bins[1:] + bins[:-1]) / 2.
+
+    is_pos = (np.asarray(actual_labels) == 1)
+    # Bins 1 to num_bins (0 and num_bins+1 are out of range, (-inf,0) and (1,+inf))
+    bin_cnts = np.bincount(inds, minlength=num_bins+2)[1:num_bins+1]
+    o1 = np.bincount(inds[is_pos], minlength=num_bins+2)[1:num_bins+1]
+    o0 = bin_cnts - o1
+
+    e1 = bin_cnts * mids
+    e0 = bin_cnts * (1. - mids)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H_stat = ((o1 - e1)**2 / e1 + (o0 - e0)**2 / e0).sum()
+
+    dof = num_bins - 2
+    return 1 - stats.chi2.cdf(H_stat, dof)
@@ -1,6 +1,7 @@
 
 import os
 import stats_utils
+import stats_resampling
 import datetime
 import collections
 import pandas as pd
@@ -60,6 +61,13 @@ STRIDE_COMPONENT_TESTS_common, UMICH_TOP_COMPONENTS_common, UCSF_TOP_COMPONENTS_
 # all_UCSF = UCSF_TOP_COMPONENTS
 all_algs = SupervisedClassifier.SUPPORTED_ALGORITHMS
 
+def _labs2stats_onelab(args):
+    '''
+    Module level wrapper of Stats_Plotter.labs2stats_onelab, so it can be called by multiprocessing Pool workers.
+    '''
+    plotter, lab = args[0], args[1]
+    return plotter.labs2stats_onelab(lab, *args[2:])
+
 class Stats_Plotter():
     def __init__(self, data_source='Stanford', lab_type='panel', curr_version='10000-episodes'):
         self.data_source = data_source
@@ -1659,7 +1667,7 @@ class Stats_Plotter():
     '''
 
     def main_labs2stats(self, train_data_folderpath, ml_results_folderpath, stats_results_folderpath,
-                        targeted_PPVs=train_PPVs, columns=None, thres_mode="fixTrainPPV",verbose=True):
+                        targeted_PPVs=train_PPVs, columns=None, thres_mode="fixTrainPPV",verbose=True, num_processes=1):
         '''
         For each lab at each train_PPV,
         write all stats (e.g. roc_auc, PPV, total cnts) into csv file.
@@ -1708,104 +1716,128 @@ class Stats_Plotter():
         '''
         lab_to_medicare = stats_utils.get_medicare_price_dict()
 
-        for lab in self.all_labs:
-            stats_results_filepath = os.path.join(stats_results_folderpath, 'stats_by_lab_alg', '%s.csv' % lab)
-            if not os.path.exists(os.path.join(stats_results_folderpath, 'stats_by_lab_alg')):
-                os.mkdir(os.path.join(stats_results_folderpath, 'stats_by_lab_alg'))
-            if os.path.exists(stats_results_filepath):
-                if verbose:
-                    print "lab stats for %s exists!" % lab
-                continue
-            else:
-                print "processing lab stats for %s" % lab
+        # Create the output folder up front, rather than racing to within parallel lab workers
+        if not os.path.exists(os.path.join(stats_results_folderpath, 'stats_by_lab_alg')):
+            os.mkdir(os.path.join(stats_results_folderpath, 'stats_by_lab_alg'))
+
+        lab_args = [(self, lab, train_data_folderpath, ml_results_folderpath, stats_results_folderpath,
+                     targeted_PPVs, columns, thres_mode, verbose, lab_to_chargemaster_median, lab_to_medicare)
+                    for lab in self.all_labs]
+        if num_processes > 1:
+            # Labs are independent (and resampling is seeded per lab / alg), so handle them in parallel
+            from multiprocessing import Pool
+            pool = Pool(num_processes)
+            try:
+                pool.map(_labs2stats_onelab, lab_args, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for args in lab_args:
+                _labs2stats_onelab(args)
+
+    def labs2stats_onelab(self, lab, train_data_folderpath, ml_results_folderpath, stats_results_folderpath,
+                          targeted_PPVs, columns, thres_mode, verbose, lab_to_chargemaster_median, lab_to_medicare):
+        '''
+        Write all stats for one lab into its csv file under stats_results_folderpath/stats_by_lab_alg,
+        unless it already exists.
+        '''
+        stats_results_filepath = os.path.join(stats_results_folderpath, 'stats_by_lab_alg', '%s.csv' % lab)
+        if os.path.exists(stats_results_filepath):
+            if verbose:
+                print "lab stats for %s exists!" % lab
+            return
+        else:
+            print "processing lab stats for %s" % lab
 
 
-            df_lab2stats = pd.DataFrame(columns=columns) #
-            '''
-            lab, total_vol_20140701_20170701, medicare, chargemaster, 
-            num_train_episodes, num_train_patients, num_test_episodes, num_test_patients, 
-            AUC_baseline
-            '''
-            lab_vol = stats_utils.get_labvol(lab=lab,
-                                             lab_type=self.lab_type,
-                                             data_source=self.data_source,
-                                             time_limit=DEFAULT_TIMELIMIT)
-
-            chargemaster = lab_to_chargemaster_median.get(lab, float('nan'))
-            medicare = lab_to_medicare.get(lab, float('nan'))
-
-            num_train_episodes, num_train_patient, num_test_episodes, num_test_patient = \
-                stats_utils.describe_lab_train_test_datasets(lab, train_data_folderpath)
-
-            AUC_baseline = stats_utils.get_baseline2_auroc(os.path.join(train_data_folderpath, lab))
-
-            lab_to_stats_meta = {}
-            lab_to_stats_meta['lab'] = lab
-            lab_to_stats_meta['total_vol_20140701_20170701'] = lab_vol
-            lab_to_stats_meta['chargemaster'] = chargemaster
-            lab_to_stats_meta['medicare'] = medicare
-            lab_to_stats_meta['num_train_episodes'] = num_train_episodes
-            lab_to_stats_meta['num_train_patient'] = num_train_patient
-            lab_to_stats_meta['num_test_episodes'] = num_test_episodes
-            lab_to_stats_meta['num_test_patient'] = num_test_patient
-            lab_to_stats_meta['AUC_baseline'] = AUC_baseline
-
-            for targeted_PPV in targeted_PPVs:
-                lab_to_stats = copy.deepcopy(lab_to_stats_meta) #lab_to_stats_meta.copy()
-                lab_to_stats['fixTrainPPV'] = targeted_PPV
-                # try:
-                #stats_results_filename = results_filename_template % (lab, thres_mode, str(targeted_PPV))
-
-
-                for alg in all_algs:
-                    lab_to_stats['alg'] = alg
-
-                    df_direct_compare = pd.read_csv(
-                        ml_results_folderpath + '/' + lab + '/' + alg + '/' + 'direct_comparisons.csv',
+        df_lab2stats = pd.DataFrame(columns=columns) #
+        '''
+        lab, total_vol_20140701_20170701, medicare, chargemaster, 
+        num_train_episodes, num_train_patients, num_test_episodes, num_test_patients, 
+        AUC_baseline
+        '''
+        lab_vol = stats_utils.get_labvol(lab=lab,
+                                         lab_type=self.lab_type,
+                                         data_source=self.data_source,
+                                         time_limit=DEFAULT_TIMELIMIT)
+
+        chargemaster = lab_to_chargemaster_median.get(lab, float('nan'))
+        medicare = lab_to_medicare.get(lab, float('nan'))
+
+        num_train_episodes, num_train_patient, num_test_episodes, num_test_patient = \
+            stats_utils.describe_lab_train_test_datasets(lab, train_data_folderpath)
+
+        AUC_baseline = stats_utils.get_baseline2_auroc(os.path.join(train_data_folderpath, lab))
+
+        lab_to_stats_meta = {}
+        lab_to_stats_meta['lab'] = lab
+        lab_to_stats_meta['total_vol_20140701_20170701'] = lab_vol
+        lab_to_stats_meta['chargemaster'] = chargemaster
+        lab_to_stats_meta['medicare'] = medicare
+        lab_to_stats_meta['num_train_episodes'] = num_train_episodes
+        lab_to_stats_meta['num_train_patient'] = num_train_patient
+        lab_to_stats_meta['num_test_episodes'] = num_test_episodes
+        lab_to_stats_meta['num_test_patient'] = num_test_patient
+        lab_to_stats_meta['AUC_baseline'] = AUC_baseline
+
+        for targeted_PPV in targeted_PPVs:
+            lab_to_stats = copy.deepcopy(lab_to_stats_meta) #lab_to_stats_meta.copy()
+            lab_to_stats['fixTrainPPV'] = targeted_PPV
+            # try:
+            #stats_results_filename = results_filename_template % (lab, thres_mode, str(targeted_PPV))
+
+
+            for alg in all_algs:
+                lab_to_stats['alg'] = alg
+
+                df_direct_compare = pd.read_csv(
+                    ml_results_folderpath + '/' + lab + '/' + alg + '/' + 'direct_comparisons.csv',
+                    # '%s-normality-prediction-%s-direct-compare-results.csv' % (lab, alg),
+                    keep_default_na=False)
+                actual_labels, predict_scores = df_direct_compare['actual'].values, df_direct_compare[
+                    'predict'].values
+
+                lab_to_stats['AUC'] = stats_utils.get_safe(roc_auc_score, actual_labels, predict_scores)
+                AUROC_left, AUROC_right = stats_utils.bootstrap_CI(actual_labels, predict_scores, confident_lvl=0.95,
+                                                                   random_state=stats_resampling.lab_alg_seed(lab, alg))
+                lab_to_stats['AUC_95%_CI'] = '[%f, %f]' % (AUROC_left, AUROC_right)
+
+                if thres_mode == 'fixTestPPV':
+                    score_thres = stats_utils.pick_threshold(actual_labels, predict_scores,
+                                                 target_PPV=targeted_PPV)  # TODO!
+                else:
+                    df_direct_compare_train = pd.read_csv(
+                        ml_results_folderpath + '/' + lab + '/' + alg + '/' + 'direct_comparisons_train.csv',
                         # '%s-normality-prediction-%s-direct-compare-results.csv' % (lab, alg),
                         keep_default_na=False)
-                    actual_labels, predict_scores = df_direct_compare['actual'].values, df_direct_compare[
-                        'predict'].values
-
-                    lab_to_stats['AUC'] = stats_utils.get_safe(roc_auc_score, actual_labels, predict_scores)
-                    AUROC_left, AUROC_right = stats_utils.bootstrap_CI(actual_labels, predict_scores, confident_lvl=0.95)
-                    lab_to_stats['AUC_95%_CI'] = '[%f, %f]' % (AUROC_left, AUROC_right)
-
-                    if thres_mode == 'fixTestPPV':
-                        score_thres = stats_utils.pick_threshold(actual_labels, predict_scores,
-                                                     target_PPV=targeted_PPV)  # TODO!
-                    else:
-                        df_direct_compare_train = pd.read_csv(
-                            ml_results_folderpath + '/' + lab + '/' + alg + '/' + 'direct_comparisons_train.csv',
-                            # '%s-normality-prediction-%s-direct-compare-results.csv' % (lab, alg),
-                            keep_default_na=False)
-                        actual_labels_train, predict_scores_train = df_direct_compare_train['actual'].values, \
-                                                                    df_direct_compare_train['predict'].values
-                        score_thres = stats_utils.pick_threshold(actual_labels_train, predict_scores_train,
-                                                     target_PPV=targeted_PPV)
-
-                    lab_to_stats['score_thres'] = score_thres
-
-                    TP, FP, TN, FN, sens, spec, LR_p, LR_n, PPV, NPV = stats_utils.get_confusion_metrics(actual_labels,
-                                                                                           predict_scores,
-                                                                                           threshold=score_thres,
-                                                                                           also_return_cnts=True)
-
-                    lab_to_stats.update({
-                        'TP': TP / float(num_test_episodes),
-                        'FP': FP / float(num_test_episodes),
-                        'TN': TN / float(num_test_episodes),
-                        'FN': FN / float(num_test_episodes),
-                        'sens': sens,
-                        'spec': spec,
-                        'LR_p': LR_p,
-                        'LR_n': LR_n,
-                        'PPV': PPV,
-                        'NPV': NPV
-                    })
-                    df_lab2stats = df_lab2stats.append(lab_to_stats, ignore_index=True)
-
-                df_lab2stats[columns].to_csv(stats_results_filepath, index=False)
+                    actual_labels_train, predict_scores_train = df_direct_compare_train['actual'].values, \
+                                                                df_direct_compare_train['predict'].values
+                    score_thres = stats_utils.pick_threshold(actual_labels_train, predict_scores_train,
+                                                 target_PPV=targeted_PPV)
+
+                lab_to_stats['score_thres'] = score_thres
+
+                TP, FP, TN, FN, sens, spec, LR_p, LR_n, PPV, NPV = stats_utils.get_confusion_metrics(actual_labels,
+                                                                                       predict_scores,
+                                                                                       threshold=score_thres,
+                                                                                       also_return_cnts=True)
+
+                lab_to_stats.update({
+                    'TP': TP / float(num_test_episodes),
+                    'FP': FP / float(num_test_episodes),
+                    'TN': TN / float(num_test_episodes),
+                    'FN': FN / float(num_test_episodes),
+                    'sens': sens,
+                    'spec': spec,
+                    'LR_p': LR_p,
+                    'LR_n': LR_n,
+                    'PPV': PPV,
+                    'NPV': NPV
+                })
+                df_lab2stats = df_lab2stats.append(lab_to_stats, ignore_index=True)
+
+            df_lab2stats[columns].to_csv(stats_results_filepath, index=False)
 
     def main_stats2summary(self, targeted_PPVs=train_PPVs, columns=None, thres_mode="fixTrainPPV"):
 
@@ -1884,7 +1916,7 @@ class Stats_Plotter():
         print columns
 
     def main_basic_tables(self, train_data_folderpath, ml_results_folderpath, stats_results_folderpath, thres_mode="fixTrainPPV",
-                          verbose=True):
+                          verbose=True, num_processes=1):
         '''
         Performance on test set, by choosing a threshold whether from train or test.
 
@@ -1932,7 +1964,8 @@ class Stats_Plotter():
                         targeted_PPVs=train_PPVs,
                         columns=columns,
                         thres_mode=thres_mode,
-                             verbose=verbose)
+                             verbose=verbose,
+                             num_processes=num_processes)
 
         self.main_stats2summary(targeted_PPVs=train_PPVs,
                            columns=columns,
@@ -1942,7 +1975,7 @@ class Stats_Plotter():
         #                     columns=[x + '_baseline' for x in columns_statsMetrics],
         #                     thres_mode=thres_mode)
 
-    def main_generate_lab_statistics(self, verbose=True):
+    def main_generate_lab_statistics(self, verbose=True, num_processes=1):
         print 'Generating lab-wise tables...'
 
         project_folder = os.path.join(LocalEnv.PATH_TO_CDSS, 'scripts/LabTestAnalysis/')
@@ -1965,7 +1998,8 @@ class Stats_Plotter():
              ml_results_folderpath=ml_results_folderpath,
              stats_results_folderpath=stats_results_folderpath,
              thres_mode="fixTrainPPV",
-                               verbose=verbose)
+                               verbose=verbose,
+                               num_processes=num_processes)
 
     def main_generate_stats_figures_tables(self, figs_to_plot, params={}):
         print 'Generating figures and tables %s...' % str(figs_to_plot)
@@ -2266,7 +2300,7 @@ def main_transfer_model(curr_version, lab_type='component'):
     #                        dst_dataset_folderpath=os.path.join('data', 'LABURIC', 'wi last normality - UCSF'),
     #                        output_folderpath=os.path.join('data', 'LABURIC', 'transfer_Stanford_to_UCSF'))
 
-def main_full_analysis(curr_version):
+def main_full_analysis(curr_version, num_processes=1):
     for data_source in ['Stanford', 'UMich', 'UCSF']:
         for lab_type in ['panel', 'component']:
 
@@ -2277,7 +2311,7 @@ def main_full_analysis(curr_version):
             lab2stats: Getting lab-wise stats tables under lab_statistics/dataset_folder/stats_by_lab_alg/..
             stats2summary: Aggregate all labs' stats under lab_statistics/dataset_folder/..
             '''
-            plotter.main_generate_lab_statistics(verbose=False)
+            plotter.main_generate_lab_statistics(verbose=False, num_processes=num_processes)
 
             if data_source=='Stanford' and lab_type=='panel':
                 plotter.main_generate_stats_figures_tables(figs_to_plot=['Full_Cartoon', # Figure 1
@@ -2396,4 +2430,5 @@ if __name__ == '__main__':
     curr_version = '10000-episodes-lastnormal'
 
     # main_one_analysis(curr_version=curr_version)
-    main_full_analysis(curr_version=curr_version)
+    import multiprocessing
+    main_full_analysis(curr_version=curr_version, num_processes=multiprocessing.cpu_count())
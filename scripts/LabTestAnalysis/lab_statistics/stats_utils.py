@@ -10,6 +10,8 @@ import numpy as np
 from scipy import stats
 import os, sys
 
+import stats_resampling
+
 import LocalEnv
 
 
@@ -573,7 +575,8 @@ def get_curve_onelab(lab, all_algs, data_folder, curve_type, get_pval=False, get
             best_predict = df['predict'].values
 
     if get_pval:
-        p_val = random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type)
+        p_val = random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type,
+                                        random_state=stats_resampling.lab_alg_seed(lab, best_alg))
     else:
         p_val = -1
 
@@ -588,7 +591,7 @@ def get_curve_onelab(lab, all_algs, data_folder, curve_type, get_pval=False, get
 
     return xVal_base, yVal_base, base_score, xVal_best, yVal_best, best_score, p_val
 
-def random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type):
+def random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type, random_state=0):
     '''
     Why: Check statistical significance of our model's AUC compared to baseline AUC.
 
@@ -601,49 +604,13 @@ def random_permutation_test(base_actual, base_predict, best_actual, best_predict
         best_actual:
         best_predict:
         curve_type:
+        random_state: Seed for the permutations, e.g., stats_resampling.lab_alg_seed(lab, alg)
 
     Returns:
 
     '''
-
-    # 1.
-    # auc_base = roc_auc_score(base_actual, base_predict)
-    if curve_type == 'ROC':
-        auc_best = roc_auc_score(best_actual, best_predict)
-    elif curve_type == 'PRC':
-        auc_best = average_precision_score(best_actual, best_predict)
-
-    # 2.
-    num_episodes = base_actual.shape[0] #, base_predict.shape, best_actual.shape, best_predict.shape
-    all_actual =np.hstack((base_actual, best_actual))
-    all_predict = np.hstack((base_predict, best_predict))
-
-    import random
-
-    num_permute = 1000
-    damn = 0
-    for i in range(num_permute):
-        all_actual_i = all_actual
-        all_predict_i = all_predict
-
-
-        random.seed(i)
-        random.shuffle(all_actual_i)
-        actual_i = all_actual_i[:num_episodes]
-
-        random.seed(i)
-        random.shuffle(all_predict_i)
-        predict_i = all_predict_i[:num_episodes]
-
-        if curve_type == 'ROC':
-            auc_i = roc_auc_score(actual_i, predict_i)
-        elif curve_type == 'PRC':
-            auc_i = average_precision_score(actual_i, predict_i)
-
-        if auc_i > auc_best:
-            damn += 1
-    p = float(damn)/float(num_permute)
-    return p
+    return stats_resampling.random_permutation_test(base_actual, base_predict, best_actual, best_predict, curve_type,
+                                                    random_state=random_state)
 
 
 def split_features(feature):
@@ -654,60 +621,7 @@ def split_features(feature):
 
 
 def Hosmer_Lemeshow_Test(predict_probas, actual_labels, num_bins=10):
-    # assert between 0 and 1
-    minor_shift = 0.00001
-    predict_probas_shifted = [max(min(x, 1 - minor_shift), minor_shift) for x in predict_probas]
-
-    bins = np.linspace(0, 1, num=num_bins+1)
-    inds = np.digitize(predict_probas_shifted, bins)
-
-    num_rows = len(predict_probas)
-
-    '''
-    Minor adjust
-    '''
-
-    '''
-    Put data inds into bins
-    TODO: when proba = 1, it is in the 11-th bin
-    '''
-    inds_in_bins = [[] for _ in range(num_bins+2)]
-    # (-inf,0), (0,1), ..., (9,10), (10,+inf)
-    for i in range(num_rows):
-        inds_in_bins[inds[i]].append(i)
-
-
-    mids = (bins[1:] + bins[:-1]) / 2.
-
-    e1_s, o1_s = [], []
-    e0_s, o0_s = [], []
-    H_stat = 0
-    dof = num_bins - 2
-    for i in range(1,len(inds_in_bins)-1):
-        # if not inds_in_bins[i]:
-        #     dof -= 1
-        #     continue
-
-        e1 = len(inds_in_bins[i]) * mids[i-1]
-        e1_s.append(e1)
-
-        e0 = len(inds_in_bins[i]) * (1.-mids[i-1])
-        e0_s.append(e0)
-
-        o1 = 0
-        o0 = 0
-        for j in inds_in_bins[i]:
-            if actual_labels[j] == 1:
-                o1 += 1
-            else:
-                o0 += 1
-        o1_s.append(o1)
-        o0_s.append(o0)
-
-        H_stat += (o1-e1)**2/float(e1) + (o0-e0)**2/float(e0)
-
-
-    return 1 - stats.chi2.cdf(H_stat, dof)
+    return stats_resampling.Hosmer_Lemeshow_Test(predict_probas, actual_labels, num_bins=num_bins)
 
 def map_pval_significance(p_val):
     significance = ''
@@ -773,27 +687,8 @@ def get_thres_by_fixing_PPV(lab, alg, data_folder='', PPV_wanted=0.9, thres_mode
 
 def bootstrap_CI(actual_list, predict_list, num_repeats=1000, stat='roc_auc',
                  confident_lvl=0.95, side='two', random_state=0):
-    assert len(actual_list) == len(predict_list)
-
-    from sklearn.utils import resample
-
-    try:
-
-        all_stats = []
-        for i in range(num_repeats):
-            actual_list_resampled, predict_list_resampled = resample(actual_list, predict_list)
-            if stat == 'roc_auc':
-                cur_roc_auc = roc_auc_score(actual_list_resampled, predict_list_resampled)
-                all_stats.append(cur_roc_auc)
-
-        roc_auc_left = np.percentile(all_stats, (1 - confident_lvl) / 2. * 100)
-        roc_auc_right = np.percentile(all_stats, (1 + confident_lvl) / 2. * 100)
-
-    except Exception as e:
-        # print e
-        roc_auc_left, roc_auc_right = float('nan'), float('nan')
-
-    return roc_auc_left, roc_auc_right
+    return stats_resampling.bootstrap_CI(actual_list, predict_list, num_repeats=num_repeats, stat=stat,
+                                         confident_lvl=confident_lvl, side=side, random_state=random_state)
 
 
 def fill_df_fix_PPV(lab, alg, data_folder='', PPV_wanted=0.9, lab_type=None, thres_mode="from_test"):
@@ -814,7 +709,8 @@ def fill_df_fix_PPV(lab, alg, data_folder='', PPV_wanted=0.9, lab_type=None, thr
         roc_auc = float('nan')
 
     try:
-        roc_auc_left, roc_auc_right = bootstrap_CI(actual_list, df['predict'], confident_lvl=0.95)
+        roc_auc_left, roc_auc_right = bootstrap_CI(actual_list, df['predict'], confident_lvl=0.95,
+                                                   random_state=stats_resampling.lab_alg_seed(lab, alg))
     except Exception as e:
         # print e
         roc_auc_left, roc_auc_right = float('nan'), float('nan')
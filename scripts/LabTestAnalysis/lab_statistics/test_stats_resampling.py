@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+from sklearn.metrics import roc_auc_score, average_precision_score
+
+import stats_resampling
+
+
+class TestStatsResampling(unittest.TestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        random_state = np.random.RandomState(0)
+        self.actual = random_state.randint(0, 2, size=200)
+        # Rounded scores, so plenty of ties
+        self.predict = np.round(0.3 * self.actual + 0.7 * random_state.random_sample(200), 1)
+
+    def test_batch_stats(self):
+        """Rank based stats of every resample match sklearn metrics on each resample"""
+        indices = stats_resampling.bootstrap_indices(len(self.actual), 50, random_state=1)
+        aucs = stats_resampling.batch_stat(self.actual, self.predict, indices, 'roc_auc', batch_size=7)
+        aps = stats_resampling.batch_stat(self.actual, self.predict, indices, 'average_precision', batch_size=7)
+        self.assertEqual((50,), aucs.shape)
+        for i in range(50):
+            actual_i, predict_i = self.actual[indices[i]], self.predict[indices[i]]
+            self.assertAlmostEqual(roc_auc_score(actual_i, predict_i), aucs[i])
+            self.assertAlmostEqual(average_precision_score(actual_i, predict_i), aps[i])
+
+        # Undefined with a single class
+        self.assertTrue(np.isnan(stats_resampling.batch_roc_auc(np.ones((1,5)), np.ones((1,5)))[0]))
+        self.assertTrue(np.isnan(stats_resampling.batch_average_precision(np.zeros((1,5)), np.ones((1,5)))[0]))
+
+    def test_bootstrap_CI(self):
+        auc = roc_auc_score(self.actual, self.predict)
+        seed = stats_resampling.lab_alg_seed('LABK', 'random-forest')
+        (left, right) = stats_resampling.bootstrap_CI(self.actual, self.predict, random_state=seed)
+        self.assertTrue(left < auc < right)
+
+        # Deterministic by seed
+        self.assertEqual((left, right), stats_resampling.bootstrap_CI(self.actual, self.predict, random_state=seed))
+        self.assertEqual(seed, stats_resampling.lab_alg_seed('LABK', 'random-forest'))
+        self.assertNotEqual(seed, stats_resampling.lab_alg_seed('LABK', 'regress-and-round'))
+
+        # Undefined if any resample has only one class
+        (left, right) = stats_resampling.bootstrap_CI(np.array([0,1,1,1]), np.array([0.1,0.2,0.3,0.4]))
+        self.assertTrue(np.isnan(left) and np.isnan(right))
+
+    def test_batch_size(self):
+        """Resamples are drawn a batch at a time, but results should not depend on the batch size"""
+        seed = stats_resampling.lab_alg_seed('LABK', 'random-forest')
+        expected_CI = stats_resampling.bootstrap_CI(self.actual, self.predict, num_repeats=50, random_state=seed, batch_size=50)
+        expected_p_val = stats_resampling.random_permutation_test(self.actual, self.predict, self.actual, self.predict, 'ROC',
+                                                                  num_permute=50, random_state=seed, batch_size=50)
+        for batch_size in (1, 7, 1000):
+            self.assertEqual(expected_CI, stats_resampling.bootstrap_CI(self.actual, self.predict, num_repeats=50,
+                                                                        random_state=seed, batch_size=batch_size))
+            self.assertEqual(expected_p_val, stats_resampling.random_permutation_test(self.actual, self.predict, self.actual, self.predict, 'ROC',
+                                                                                      num_permute=50, random_state=seed, batch_size=batch_size))
+
+        # Same resamples as drawing the whole index matrix at once
+        batches = list(stats_resampling.bootstrap_index_batches(len(self.actual), 50, 7, random_state=seed))
+        self.assertEqual(8, len(batches))
+        self.assertTrue((stats_resampling.bootstrap_indices(len(self.actual), 50, random_state=seed) == np.vstack(batches)).all())
+
+    def test_random_permutation_test(self):
+        # Uninformative baseline vs. informative best alg
+        base_predict = np.zeros(len(self.actual))
+        p_val = stats_resampling.random_permutation_test(self.actual, base_predict, self.actual, self.predict, 'ROC')
+        self.assertEqual(0., p_val)
+
+        # Same predictions as baseline, so about half of permutations score higher
+        p_val = stats_resampling.random_permutation_test(self.actual, self.predict, self.actual, self.predict, 'PRC')
+        self.assertTrue(0.2 < p_val < 0.8)
+
+    def test_Hosmer_Lemeshow_Test(self):
+        """Compare to straightforward binning of each row"""
+        random_state = np.random.RandomState(2)
+        predict_probas = random_state.random_sample(500)
+        actual_labels = (random_state.random_sample(500) < predict_probas).astype(int)
+
+        bins = np.linspace(0, 1, num=11)
+        mids = (bins[1:] + bins[:-1]) / 2.
+        H_stat = 0.
+        for i in range(10):
+            in_bin = [j for j in range(500) if bins[i] <= predict_probas[j] < bins[i+1]]
+            o1 = sum([actual_labels[j] for j in in_bin])
+            o0 = len(in_bin) - o1
+            e1 = len(in_bin) * mids[i]
+            e0 = len(in_bin) * (1. - mids[i])
+            H_stat += (o1-e1)**2/e1 + (o0-e0)**2/e0
+        expected_p_val = 1 - stats_resampling.stats.chi2.cdf(H_stat, 8)
+
+        self.assertAlmostEqual(expected_p_val, stats_resampling.Hosmer_Lemeshow_Test(predict_probas, actual_labels))
+
+
+if __name__ == '__main__':
+    unittest.main()
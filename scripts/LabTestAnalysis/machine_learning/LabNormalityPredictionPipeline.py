@@ -18,6 +18,7 @@ from medinfo.dataconversion.FeatureMatrixIO import FeatureMatrixIO
 from medinfo.ml.BifurcatedSupervisedClassifier import BifurcatedSupervisedClassifier
 from medinfo.ml.SupervisedClassifier import SupervisedClassifier
 from medinfo.ml.SupervisedLearningPipeline import SupervisedLearningPipeline
+from medinfo.ml.SupervisedLearningPipelineScheduler import SupervisedLearningPipelineScheduler
 from extraction.LabNormalityMatrix import LabNormalityMatrix
 
 # Import FMF in order to retrieve all races name dynamically upon accessing the UMich data
@@ -27,14 +28,21 @@ import prepareData_NonSTRIDE
 import pickle
 
 class LabNormalityPredictionPipeline(SupervisedLearningPipeline):
+    # The raw matrix is extracted for the lab's episodes, so only shared
+    # between runs for the same lab. includeLastNormality rewrites it.
+    RAW_MATRIX_ARGS = ['lab_panel', 'num_episodes', 'random_state', 'isLabPanel',
+                       'timeLimit', 'notUsePatIds', 'includeLastNormality']
+
     def __init__(self, lab_panel, num_episodes, use_cache=None, random_state=None, isLabPanel=True,
-                 timeLimit=None, notUsePatIds=None, holdOut=False, pat_batch_ind=None, includeLastNormality=True):
+                 timeLimit=None, notUsePatIds=None, holdOut=False, pat_batch_ind=None, includeLastNormality=True,
+                 checkpoint_dir=None):
         self.notUsePatIds = notUsePatIds
         self.pat_batch_ind = pat_batch_ind
         self.usedPatIds = []
         SupervisedLearningPipeline.__init__(self, lab_panel, num_episodes, use_cache, random_state,
                                             isLabPanel, timeLimit, holdOut,
-                                            isLabNormalityPredictionPipeline=True)
+                                            isLabNormalityPredictionPipeline=True,
+                                            checkpoint_dir=checkpoint_dir)
         # TODO: naming of lab_panel
         self._factory = FeatureMatrixFactory()
         self._build_raw_feature_matrix()
@@ -589,21 +597,23 @@ if __name__ == '__main__':
 
     if LocalEnv.DATASET_SOURCE_NAME == 'STRIDE':
 
+        # Run the independent lab pipelines across a process pool.
+        scheduler = SupervisedLearningPipelineScheduler()
         if LocalEnv.LAB_TYPE == 'panel':
-            for panel in NON_PANEL_TESTS_WITH_GT_500_ORDERS:
-                LabNormalityPredictionPipeline(panel, 10000, use_cache=True, random_state=123456789, isLabPanel=True,
-                                               timeLimit=(None, None), notUsePatIds=None, holdOut=False)
-                # used_patient_set = pickle.load(open('data/used_patient_set_%s.pkl'%panel, 'r'))
-                # LabNormalityPredictionPipeline(panel, 2000, use_cache=True, random_state=123456789, isLabPanel=True,
-                #                                timeLimit=(None, None), notUsePatIds=used_patient_set, holdOut=True)
+            scheduler.add_outcomes(LabNormalityPredictionPipeline, NON_PANEL_TESTS_WITH_GT_500_ORDERS, 10000,
+                                   use_cache=True, random_state=123456789, isLabPanel=True,
+                                   timeLimit=(None, None), notUsePatIds=None, holdOut=False)
+            # used_patient_set = pickle.load(open('data/used_patient_set_%s.pkl'%panel, 'r'))
+            # LabNormalityPredictionPipeline(panel, 2000, use_cache=True, random_state=123456789, isLabPanel=True,
+            #                                timeLimit=(None, None), notUsePatIds=used_patient_set, holdOut=True)
         else:
-            for component in STRIDE_COMPONENT_TESTS:
-                print 'start %s...'%component
-                LabNormalityPredictionPipeline(component, 10000, use_cache=True, random_state=123456789, isLabPanel=False)
-                # used_patient_set = pickle.load(open('data/used_patient_set_%s.pkl' % component, 'r'))
-                # LabNormalityPredictionPipeline(component, 2000, use_cache=True, random_state=123456789, isLabPanel=False,
-                #                            timeLimit=(None, None), notUsePatIds=used_patient_set, holdOut=True)
-            pass
+            scheduler.add_outcomes(LabNormalityPredictionPipeline, STRIDE_COMPONENT_TESTS, 10000,
+                                   use_cache=True, random_state=123456789, isLabPanel=False)
+            # used_patient_set = pickle.load(open('data/used_patient_set_%s.pkl' % component, 'r'))
+            # LabNormalityPredictionPipeline(component, 2000, use_cache=True, random_state=123456789, isLabPanel=False,
+            #                            timeLimit=(None, None), notUsePatIds=used_patient_set, holdOut=True)
+        scheduler.run()
+        scheduler.write_report(os.path.join(folder_debug, 'pipeline-run-stats-%s.tab' % LocalEnv.LAB_TYPE))
 
     elif LocalEnv.DATASET_SOURCE_NAME == 'UMich':
         raw_data_folderpath = LocalEnv.LOCAL_PROD_DB_PARAM["DATAPATH"]
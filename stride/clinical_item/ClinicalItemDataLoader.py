@@ -715,23 +715,34 @@ class ClinicalItemDataLoader:
             """
         results = DBUtil.execute(readmission_ci_id_query)
         readmission_ci_id = results[0][0]
-        # Third, use TripleAssociationAnalysis to build a new virtual item.
-        item_sequence = [discharge_ci_id, admission_ci_id]
-        ClinicalItemDataLoader.build_virtual_clinical_item(item_sequence, readmission_ci_id)
+        # Third, use TripleAssociationAnalysis to build the new virtual items.
+        #   Collect all virtual item definitions, to build in one pass through the patient data.
+        virtual_item_definitions = [([discharge_ci_id, admission_ci_id], readmission_ci_id)]
+        ClinicalItemDataLoader.build_virtual_clinical_items(virtual_item_definitions)
 
     @staticmethod
     def build_virtual_clinical_item(item_sequence, virtual_id):
         """
         Simple wrapper around medinfo/cpoe/TripleAssociationAnalysis.
         """
-        sequence_str = ' -> '.join([str(id) for id in item_sequence])
-        log.debug('(%s) = (%s)' % (sequence_str, virtual_id))
+        ClinicalItemDataLoader.build_virtual_clinical_items([(item_sequence, virtual_id)])
 
+    @staticmethod
+    def build_virtual_clinical_items(virtual_item_definitions):
+        """
+        Wrapper around medinfo/cpoe/TripleAssociationAnalysis to build
+        several (item_sequence, virtual_id) virtual items in a single pass.
+        """
         build_virtual_item_command = [
-            'python', '-m', 'medinfo/cpoe/TripleAssociationAnalysis.py',
-            '-s', ','.join([str(id) for id in item_sequence]),
-            '-v', str(virtual_id)
+            'python', '-m', 'medinfo/cpoe/TripleAssociationAnalysis.py'
             ]
+        for item_sequence, virtual_id in virtual_item_definitions:
+            sequence_str = ' -> '.join([str(id) for id in item_sequence])
+            log.debug('(%s) = (%s)' % (sequence_str, virtual_id))
+            build_virtual_item_command.extend([
+                '-s', ','.join([str(id) for id in item_sequence]),
+                '-v', str(virtual_id)
+                ])
 
         subprocess.call(build_virtual_item_command)
 
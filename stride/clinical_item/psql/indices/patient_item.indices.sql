@@ -5,6 +5,10 @@ CREATE INDEX IF NOT EXISTS index_patient_item_clinical_item_id_date
 -- Natural to sort by patient, then in chronological order of clinical items
 CREATE INDEX IF NOT EXISTS index_patient_item_patient_id_date
                             ON patient_item(patient_id, item_date);
+-- Partial index of the (few) not yet analyzed items, so incremental association
+--  refreshes can find the patients with new items without scanning the whole table
+CREATE INDEX IF NOT EXISTS index_patient_item_unanalyzed_patient_id
+                            ON patient_item(patient_id) WHERE analyze_date IS NULL;
 CREATE INDEX IF NOT EXISTS index_patient_item_external_id
                             ON patient_item(external_id, clinical_item_id);
 -- Natural to sort by patient encounter, then chronologically